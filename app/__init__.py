@@ -5,10 +5,15 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from config import Config
+from app.database import RoutingSession, engine_options, init_database_profile
+from app.passwords import init_passwords
+from app.cache import init_cache
+from app.instrumentation import init_instrumentation
 import os
 
 # 1. Inizializza le estensioni QUI, fuori dalla funzione
-db = SQLAlchemy()
+# (la sessione sa mandare le letture delle view @read_only al pool dedicato)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 csrf = CSRFProtect()
 login_manager.login_view = 'main.login'
@@ -24,9 +29,21 @@ def create_app(config_class=Config):
     os.makedirs(instance_path, exist_ok=True)
 
     # 2. Collega le estensioni all'app QUI
+    # Il profilo del database decide pool, PRAGMA e pool di sola lettura
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
+    init_database_profile(app, db)
     login_manager.init_app(app)
     csrf.init_app(app)
+    # Pool per l'hashing delle password e limiti ai tentativi di login
+    init_passwords(app)
+    # Cache versionata di frammenti e risposte
+    init_cache(app)
+    # Query, tempi e N+1 per richiesta, /metrics e Server-Timing
+    init_instrumentation(app, db)
+    # Template compilati salvati su disco: il prossimo avvio non li ricompila (vedi app/warmup.py)
+    from app.warmup import init_template_cache
+    init_template_cache(app)
 
     # 3. Sposta gli import che dipendono dall'app QUI DENTRO
     with app.app_context():
@@ -34,9 +51,43 @@ def create_app(config_class=Config):
 
         # Registra le rotte (routes)
         app.register_blueprint(routes.bp)
-        
-        @login_manager.user_loader
-        def load_user(user_id):
-            return models.User.query.get(int(user_id))
+
+        # API JSON per il client mobile: niente token CSRF, le scritture vogliono JSON (vedi app/api.py)
+        from app import api
+        csrf.exempt(api.bp)
+        app.register_blueprint(api.bp)
+
+        # File statici con l'impronta nel nome, compressi con gzip (vedi app/assets.py)
+        from app.assets import bp as assets_bp, init_assets
+        init_assets(app)
+        app.register_blueprint(assets_bp)
+
+        # Registra i comandi CLI (flask search-rebuild, ...)
+        from app.commands import register_commands
+        register_commands(app)
+
+        # L'utente autenticato viene caricato passando per la cache in memoria
+        from app.identity_cache import init_identity_cache, load_user
+        init_identity_cache(app)
+        login_manager.user_loader(load_user)
+
+        # Grafo dei rally in memoria (caricato al primo uso)
+        from app.rally_graph import init_rally_graph
+        init_rally_graph(app)
+
+        # Coda dei lavori fuori dalle richieste e worker del processo
+        from app.jobs import init_jobs
+        init_jobs(app)
+
+        # Chat tra giocatori: stream SSE tenuti da un event loop per processo
+        from app.chat import init_chat
+        init_chat(app)
+
+    # Dietro un proxy: IP del client, schema e host dagli header X-Forwarded-*
+    # dei soli proxy fidati (i limiti ai tentativi di login sono per IP)
+    if app.config['TRUSTED_PROXIES']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 
     return app
\ No newline at end of file
@@ -0,0 +1,171 @@
+# app/advisor.py
+
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import delete, select, func
+
+from app import db
+from app.enrollment import _is_enrolled
+from app.geo import within_radius, with_distance
+from app.jobs import _ready
+from app.models import (User, Event, EventoArchiviato, Attivita, Job, Messaggio, partecipanti,
+                        partecipanti_archivio, impegni, lista_attesa, preferenze_orario, rally, timeline)
+from app.schedule import _overlapping, only_when_free
+from app.search import apply_event_search
+from app.timeline import feed_query
+
+
+# ==============================================================================
+# INDEX ADVISOR: PIANI DI ESECUZIONE DELLE QUERY DELL'APPLICAZIONE
+# ==============================================================================
+# Le query che le pagine eseguono davvero, costruite con le stesse funzioni
+# delle route (filtri, distanza, ricerca, bacheca...), passate a EXPLAIN QUERY
+# PLAN. Segnaliamo:
+# - 'SCAN <tabella>': lettura completa della tabella, o di un suo indice
+#   dall'inizio alla fine ('SCAN ... USING INDEX');
+# - 'ANY(colonna)': skip-scan, l'indice è usato senza la sua prima colonna;
+# - 'USE TEMP B-TREE': ordinamento o raggruppamento senza un indice adatto.
+# Alcuni di questi passi sono inevitabili o innocui: la ricerca dei giocatori
+# per parte del nome (LIKE '%...%') legge tutta la tabella, l'ordinamento per
+# distanza o pertinenza è su un valore calcolato, quello degli eventi di un
+# creatore riguarda poche righe già trovate con un indice. Li dichiariamo in
+# 'expected' (inizio della riga del piano), così il report li mostra ma non li
+# conta come problemi.
+# Il piano dipende dalle statistiche (ANALYZE): su un database con pochi dati
+# SQLite preferisce leggere tutto. Va eseguito su dati realistici, es. quelli
+# di benchmarks/seed.py.
+# Quando si aggiunge una query importante alle route, va aggiunta anche qui.
+
+KnownQuery = namedtuple('KnownQuery', 'name statement expected')
+
+# Valori di esempio: al piano di esecuzione basta la forma della query
+_USER_ID = 1
+_EVENT_IDS = [1, 2, 3]
+_CENTER = (45.4642, 9.1900)
+_PAGE = 21
+_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def known_queries():
+    """Le query da analizzare (serve un application context)."""
+    today = date.today()
+    upcoming = Event.query.filter(Event.data_ora >= today)
+    by_date = [Event.data_ora, Event.id]
+    start = datetime.combine(today, datetime.min.time()) + timedelta(hours=18)
+    end = start + timedelta(minutes=Event.DURATA_DEFAULT)
+    queries = [
+        KnownQuery('events', upcoming.order_by(*by_date).limit(_PAGE), ()),
+        KnownQuery('events?data', upcoming.filter(func.date(Event.data_ora) == today)
+                   .order_by(*by_date).limit(_PAGE), ()),
+        KnownQuery('events?tipologia', upcoming.filter(Event.tipologia == 'Lezione')
+                   .order_by(*by_date).limit(_PAGE), ()),
+        KnownQuery('events?creatore', upcoming.filter(Event.user_id == _USER_ID)
+                   .order_by(*by_date).limit(_PAGE), (_SORT,)),
+        KnownQuery('events?distanza', within_radius(upcoming, Event, _CENTER, 5.0)
+                   .order_by(*by_date).limit(_PAGE), (_SORT,)),
+        # Tutti i creatori: legge per forza tutti gli eventi (il risultato è in cache)
+        KnownQuery('events?creatori (menu)', db.session.query(User.id, User.nome)
+                   .filter(User.id.in_(db.session.query(Event.user_id))).order_by(User.nome),
+                   ('SCAN event', _SORT)),
+        KnownQuery('event cards: partecipanti', db.session.query(partecipanti.c.event_id, User.id, User.nome)
+                   .join(User, User.id == partecipanti.c.user_id)
+                   .filter(partecipanti.c.event_id.in_(_EVENT_IDS)), ()),
+        KnownQuery('event cards: lista d\'attesa',
+                   select(func.count(lista_attesa.c.id)).where(lista_attesa.c.event_id == _EVENT_IDS[0]), ()),
+        KnownQuery('join_event: già iscritto', select(_is_enrolled(_EVENT_IDS[0], _USER_ID)), ()),
+        KnownQuery('join_event: impegni sovrapposti', select(impegni.c.event_id).where(
+            impegni.c.user_id == _USER_ID, *_overlapping(impegni.c.inizio, impegni.c.fine, start, end)), ()),
+        KnownQuery('create_event: eventi nello stesso luogo', select(Event.id).where(
+            Event.luogo == 'Tennis Club Milano', *_overlapping(Event.data_ora, Event.fine, start, end)), ()),
+        KnownQuery('events?libero', only_when_free(upcoming, _USER_ID).order_by(*by_date).limit(_PAGE), ()),
+        KnownQuery('user_profile', User.query.filter_by(nome='Luca').limit(1), ()),
+        KnownQuery('players?nome', User.query.filter(User.id != _USER_ID, User.nome.ilike('%luca%'))
+                   .order_by(User.nome, User.id).limit(_PAGE), ('SCAN user',)),
+        KnownQuery('players?distanza', with_distance(
+            within_radius(User.query.filter(User.id != _USER_ID), User, _CENTER, 5.0), User, _CENTER)[0]
+            .order_by('distanza2', User.id).limit(_PAGE), (_SORT,)),
+        KnownQuery('index: bacheca', feed_query(SimpleNamespace(id=_USER_ID))
+                   .order_by(Attivita.id.desc()).limit(_PAGE), (_SORT,)),
+        KnownQuery('rally: follower', select(rally.c.follower_id).where(rally.c.followed_id == _USER_ID), ()),
+        KnownQuery('rally: seguiti', select(rally.c.followed_id).where(rally.c.follower_id == _USER_ID), ()),
+        KnownQuery('eventi di un utente', select(partecipanti.c.event_id)
+                   .where(partecipanti.c.user_id == _USER_ID), ()),
+        KnownQuery('user_history: eventi archiviati', select(EventoArchiviato.id, EventoArchiviato.data_ora)
+                   .join(partecipanti_archivio, partecipanti_archivio.c.event_id == EventoArchiviato.id)
+                   .where(partecipanti_archivio.c.user_id == _USER_ID), ()),
+        KnownQuery('index: consigliati, eventi della zona', within_radius(
+            select(Event.id).where(Event.data_ora >= today, Event.num_iscritti < Event.max_partecipanti),
+            Event, _CENTER, 15.0), ()),
+        # Raggruppa per evento le iscrizioni dei seguiti (poche righe, trovate con gli indici)
+        KnownQuery('index: consigliati, eventi dei compagni', within_radius(
+            select(partecipanti.c.event_id, func.count()).select_from(rally)
+            .join(partecipanti, partecipanti.c.user_id == rally.c.followed_id)
+            .join(Event, Event.id == partecipanti.c.event_id)
+            .where(rally.c.follower_id == _USER_ID, Event.data_ora >= today)
+            .group_by(partecipanti.c.event_id), Event, _CENTER, 15.0), ('USE TEMP B-TREE FOR GROUP BY',)),
+        KnownQuery('index: consigliati, preferenze di orario', select(preferenze_orario.c.iscrizioni)
+                   .where(preferenze_orario.c.user_id == _USER_ID), ()),
+        KnownQuery('players: partite insieme ai suggeriti', select(partecipanti.c.user_id).where(
+            partecipanti.c.event_id.in_(select(partecipanti.c.event_id).where(partecipanti.c.user_id == _USER_ID)),
+            partecipanti.c.user_id.in_(_EVENT_IDS)), ()),
+        KnownQuery('delete_event: attività dalle bacheche',
+                   delete(timeline).where(timeline.c.attivita_id.in_(
+                       select(Attivita.id).where(Attivita.event_id == _EVENT_IDS[0]))), ()),
+        # Coda dei lavori: il prossimo da eseguire (l'indice dà già l'ordine) e i tempi in /metrics
+        KnownQuery('jobs: lavori pronti', select(Job.id).where(_ready(datetime.utcnow()), Job.tipo == 'email')
+                   .order_by(Job.eseguire_dopo, Job.id).limit(_PAGE), ()),
+        KnownQuery('metrics: lavori finiti di recente', select(Job.tipo, Job.creato_il, Job.finito_il)
+                   .where(Job.stato == Job.FATTO, Job.finito_il >= datetime.utcnow()), ()),
+        # Chat: pagina dello storico di una stanza (dal più recente) e messaggi nuovi per l'hub
+        KnownQuery('chat_room', select(Messaggio.id).where(Messaggio.stanza == 'evento-1')
+                   .order_by(Messaggio.id.desc()).limit(_PAGE), ()),
+        KnownQuery('chat: messaggi nuovi', select(Messaggio.id, Messaggio.stanza)
+                   .where(Messaggio.id > 0).order_by(Messaggio.id).limit(_PAGE), ()),
+        # API: le iscrizioni e i rally di un utente (poche righe, trovate con gli indici, poi ordinate)
+        KnownQuery('api: le mie iscrizioni', upcoming.join(partecipanti, partecipanti.c.event_id == Event.id)
+                   .filter(partecipanti.c.user_id == _USER_ID).order_by(*by_date).limit(_PAGE), (_SORT,)),
+        KnownQuery('api: i miei rally', User.query.join(rally, rally.c.followed_id == User.id)
+                   .filter(rally.c.follower_id == _USER_ID).order_by(User.nome, User.id).limit(_PAGE), (_SORT,)),
+    ]
+    search, rank = apply_event_search(upcoming, 'tennis')
+    if rank is not None:
+        queries.append(KnownQuery('events?query', search.order_by(rank, Event.id).limit(_PAGE), (_SORT,)))
+    return queries
+
+
+def explain(statement):
+    """Righe 'detail' di EXPLAIN QUERY PLAN (solo SQLite)."""
+    if hasattr(statement, 'statement'):
+        # Query dell'ORM (Model.query...)
+        statement = statement.statement
+    bind = db.session.get_bind()
+    compiled = statement.compile(bind, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with bind.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params)]
+
+
+def problems_in(plan, expected=()):
+    """(problemi, passi attesi) trovati nelle righe del piano."""
+    problems, accepted = [], []
+    for detail in plan:
+        words = detail.split()
+        full_scan = words[0] == 'SCAN' and not {'VIRTUAL', 'CONSTANT'} & set(words)
+        if full_scan or 'ANY(' in detail or 'TEMP B-TREE' in detail:
+            (accepted if detail.startswith(tuple(expected)) else problems).append(detail)
+    return problems, accepted
+
+
+def advise():
+    """
+    Analizza tutte le query note. Restituisce una lista di dizionari con
+    nome, piano, problemi e passi attesi.
+    """
+    report = []
+    for query in known_queries():
+        plan = explain(query.statement)
+        problems, accepted = problems_in(plan, query.expected)
+        report.append({'name': query.name, 'plan': plan, 'problems': problems, 'accepted': accepted})
+    return report
@@ -0,0 +1,472 @@
+# app/api.py
+
+import hashlib
+from datetime import date, timedelta
+from functools import wraps
+
+from flask import Blueprint, current_app, make_response, request
+from flask_login import current_user, login_user, logout_user
+from sqlalchemy import exists, select
+from werkzeug.exceptions import HTTPException
+
+from app import db, enrollment
+from app.cache import cached, data_version, versioned_key
+from app.database import read_only
+from app.event_cards import build_event_cards_by_id
+from app.geo import distance_km, user_location, within_radius, with_distance
+from app.models import Event, User, partecipanti
+from app.pagination import KeysetPage, paginate_keyset
+from app.passwords import HashingBusy, client_ip, login_retry_after, record_login_failure, record_login_success
+from app.schedule import only_when_free
+from app.search import apply_event_search
+
+
+# ==============================================================================
+# API JSON (v1) PER IL CLIENT MOBILE
+# ==============================================================================
+# Le pagine HTML rispondono a ogni azione (iscrizione, rally) con un redirect
+# e una pagina intera. Il client mobile usa invece queste route sotto
+# /api/v1: ogni azione risponde solo con lo stato aggiornato (posti, iscrizione,
+# rally) e le letture restituiscono solo i campi richiesti.
+# - Autenticazione: lo stesso cookie di sessione del sito (POST /api/v1/login).
+# - CSRF: le route dell'API sono escluse da CSRFProtect. I POST vogliono un
+#   corpo JSON (Content-Type: application/json) e PUT/DELETE un form non li
+#   può mandare: da un altro sito servirebbe una richiesta preflight CORS, che
+#   non accettiamo. Le pagine HTML restano protette dal token come prima.
+# - Campi: ?fields=id,titolo,posti_liberi (i nomi validi sono le chiavi di
+#   EVENT_FIELDS e PLAYER_FIELDS); senza, tutti i campi.
+# - Liste: ?per_page= (fino a API_MAX_PER_PAGE) e ?cursor= con il
+#   'next_cursor' della pagina precedente (vedi app/pagination.py).
+# - ETag: le letture rispondono 304 a If-None-Match se i dati non sono
+#   cambiati. L'ETag viene dalla versione dei dati (vedi app/cache.py), senza
+#   eseguire la view; senza versione (cache 'null') è l'hash della risposta.
+# - Errori: {"errore": "..."} con lo stato HTTP corrispondente.
+# Una modifica incompatibile delle risposte richiede /api/v2: i client già
+# installati continuano a usare la v1.
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+# Campi di un evento (una EventCard, vedi app/event_cards.py)
+EVENT_FIELDS = {
+    'id': lambda card: card.id,
+    'titolo': lambda card: card.titolo,
+    'tipologia': lambda card: card.tipologia,
+    'descrizione': lambda card: card.descrizione,
+    'data_ora': lambda card: _iso(card.data_ora),
+    'fine': lambda card: _iso(card.fine),
+    'luogo': lambda card: card.luogo,
+    'livello_consigliato': lambda card: card.livello_consigliato,
+    'creatore': lambda card: card.creatore_nome,
+    'max_partecipanti': lambda card: card.max_partecipanti,
+    'num_iscritti': lambda card: card.num_iscritti,
+    'posti_liberi': lambda card: max(0, card.max_partecipanti - card.num_iscritti),
+    'iscritti': lambda card: card.iscritti,
+    'is_iscritto': lambda card: card.is_iscritto,
+    'is_creatore': lambda card: card.is_creatore,
+    'posizione_attesa': lambda card: card.posizione_attesa,
+    'distanza_km': lambda card: round(card.distanza_km, 1) if card.distanza_km is not None else None,
+}
+
+# Campi di un giocatore: 'is_rallying' (fai rally con lui) e 'ti_segue' dal grafo dei rally
+PLAYER_FIELDS = {
+    'id': lambda user, ctx: user.id,
+    'nome': lambda user, ctx: user.nome,
+    'cognome': lambda user, ctx: user.cognome,
+    'livello': lambda user, ctx: user.livello,
+    'num_eventi_creati': lambda user, ctx: user.num_eventi_creati,
+    'num_eventi_iscritti': lambda user, ctx: user.num_eventi_iscritti,
+    'num_followers': lambda user, ctx: user.num_followers,
+    'num_followed': lambda user, ctx: user.num_followed,
+    'is_rallying': lambda user, ctx: ctx.is_rallying(user),
+    'ti_segue': lambda user, ctx: ctx.follows_me(user),
+    'distanza_km': lambda user, ctx: ctx.distance(user),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.extra = extra
+
+
+@bp.errorhandler(ApiError)
+def _api_error(error):
+    return {'errore': error.message, **error.extra}, error.status
+
+
+@bp.errorhandler(HTTPException)
+def _http_error(error):
+    return {'errore': error.description}, error.code
+
+
+@bp.before_request
+def _json_writes_only():
+    if request.method == 'POST' and not request.is_json:
+        raise ApiError(415, 'I POST devono avere Content-Type: application/json.')
+
+
+def api_login_required(view):
+    """Come login_required, ma risponde 401 invece di mandare alla pagina di login."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError(401, 'Accesso richiesto.')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def api_conditional(view):
+    """ETag e 304 per le letture (vedi il commento in cima al file)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = data_version()
+        if version is None:
+            response = make_response(view(*args, **kwargs))
+            response.add_etag()
+            response.make_conditional(request)
+        else:
+            etag = hashlib.sha1(repr((
+                'api', version, current_user.get_id(), request.full_path, date.today().isoformat(),
+            )).encode()).hexdigest()
+            if etag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+
+def _fields(available):
+    """Campi richiesti con ?fields=, nell'ordine di 'available'."""
+    requested = request.args.get('fields')
+    if not requested:
+        return list(available)
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = names - set(available)
+    if unknown:
+        raise ApiError(400, f'Campi sconosciuti: {", ".join(sorted(unknown))}.', campi_validi=list(available))
+    return [name for name in available if name in names]
+
+
+def _per_page(default):
+    try:
+        per_page = int(request.args.get('per_page') or default)
+    except ValueError:
+        raise ApiError(400, 'per_page deve essere un numero.')
+    return max(1, min(per_page, current_app.config['API_MAX_PER_PAGE']))
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(400, f'{name} deve essere una data AAAA-MM-GG.')
+
+
+def _page(items, page):
+    return {'items': items, 'next_cursor': page.next_cursor}
+
+
+# ------------------------------------------------------------------------------
+# Sessione
+# ------------------------------------------------------------------------------
+
+@bp.route('/login', methods=['POST'])
+def login():
+    """{"email", "password", "ricordami"}: imposta il cookie di sessione e restituisce l'utente."""
+    data = request.get_json(silent=True) or {}
+    email, password = data.get('email'), data.get('password')
+    if not isinstance(email, str) or not isinstance(password, str):
+        raise ApiError(400, 'Servono email e password.')
+    # Stessi limiti ai tentativi del form di login
+    ip = client_ip()
+    retry_after = login_retry_after(email, ip)
+    if retry_after:
+        response = make_response({'errore': 'Troppi tentativi di accesso.'}, 429)
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    user = User.query.filter_by(email=email).first()
+    try:
+        valid = user is not None and user.check_password(password)
+    except HashingBusy:
+        response = make_response({'errore': 'Servizio momentaneamente sovraccarico.'}, 503)
+        response.headers['Retry-After'] = '5'
+        return response
+    if not valid:
+        record_login_failure(email, ip)
+        raise ApiError(401, 'Email o password non validi.')
+    record_login_success(email)
+    if user.password_needs_rehash():
+        try:
+            user.set_password(password)
+            db.session.commit()
+        except HashingBusy:
+            pass
+    login_user(user, remember=bool(data.get('ricordami')))
+    return _player(user)
+
+
+@bp.route('/logout', methods=['POST'])
+def logout():
+    logout_user()
+    return '', 204
+
+
+# ------------------------------------------------------------------------------
+# Eventi e iscrizioni
+# ------------------------------------------------------------------------------
+
+def _event_items(event_ids):
+    fields = _fields(EVENT_FIELDS)
+    return [{name: EVENT_FIELDS[name](card) for name in fields}
+            for card in build_event_cards_by_id(event_ids, current_user)]
+
+
+@bp.route('/events')
+@api_login_required
+@read_only
+@api_conditional
+def events():
+    """
+    Eventi futuri, per data (o per pertinenza con ?q=). Filtri: q, tipologia,
+    dal, al (date AAAA-MM-GG), creatore (id), distanza (km dal proprio CAP),
+    libero=1 (solo quelli che non si sovrappongono ai propri impegni).
+    """
+    query = Event.query.filter(Event.data_ora >= date.today())
+    filters = {}
+    rank = None
+    if request.args.get('q'):
+        query, rank = apply_event_search(query, request.args['q'])
+        filters['q'] = request.args['q']
+    if request.args.get('tipologia'):
+        query = query.filter(Event.tipologia == request.args['tipologia'])
+        filters['tipologia'] = request.args['tipologia']
+    dal, al = _date_arg('dal'), _date_arg('al')
+    if dal:
+        query = query.filter(Event.data_ora >= dal)
+        filters['dal'] = dal
+    if al:
+        query = query.filter(Event.data_ora < al + timedelta(days=1))
+        filters['al'] = al
+    if request.args.get('creatore'):
+        query = query.filter(Event.user_id == request.args.get('creatore', type=int))
+        filters['creatore'] = request.args.get('creatore', type=int)
+    if request.args.get('distanza'):
+        center = user_location(current_user)
+        if center is None:
+            raise ApiError(400, 'Il tuo CAP non è nel nostro elenco: non possiamo filtrare per distanza.')
+        radius = request.args.get('distanza', type=float)
+        if not radius:
+            raise ApiError(400, 'distanza deve essere un numero di km.')
+        query = within_radius(query, Event, center, radius)
+        filters['distanza'] = (center, radius)
+    if request.args.get('libero'):
+        query = only_when_free(query, current_user.id)
+        filters['libero'] = current_user.id
+
+    sort_key = [rank, Event.id] if rank is not None else [Event.data_ora, Event.id]
+    cursor = request.args.get('cursor')
+    per_page = _per_page(current_app.config['EVENTS_PER_PAGE'])
+
+    # Come /events: in cache gli id della pagina, le card arrivano dalla loro cache
+    def search():
+        page = paginate_keyset(query, sort_key, cursor=cursor, per_page=per_page)
+        return KeysetPage([event.id for event in page.items], page.next_cursor, page.prev_cursor)
+
+    key = versioned_key('api-event-list', date.today(), sorted(filters.items()), cursor, per_page)
+    page = cached(key, search)
+    return _page(_event_items(page.items), page)
+
+
+@bp.route('/events/<int:event_id>')
+@api_login_required
+@read_only
+@api_conditional
+def event(event_id):
+    items = _event_items([event_id])
+    if not items:
+        raise ApiError(404, 'Evento non trovato.')
+    return items[0]
+
+
+def _seat_state(event_id, esito):
+    """Posti dell'evento e stato dell'utente dopo un'iscrizione o una cancellazione."""
+    row = db.session.query(Event.num_iscritti, Event.max_partecipanti).filter(Event.id == event_id).first()
+    is_iscritto = db.session.execute(select(exists().where(
+        partecipanti.c.event_id == event_id, partecipanti.c.user_id == current_user.id))).scalar()
+    return {
+        'esito': esito,
+        'num_iscritti': row.num_iscritti,
+        'max_partecipanti': row.max_partecipanti,
+        'posti_liberi': max(0, row.max_partecipanti - row.num_iscritti),
+        'is_iscritto': is_iscritto,
+        'posizione_attesa': enrollment.waitlist_positions([event_id], current_user.id).get(event_id),
+    }
+
+
+@bp.route('/events/<int:event_id>/iscrizione', methods=['PUT'])
+@api_login_required
+def join_event(event_id):
+    """Iscrizione (o lista d'attesa se l'evento è al completo); 409 se sovrapposto a un altro impegno."""
+    Event.query.get_or_404(event_id, description='Evento non trovato.')
+    waitlist = (request.get_json(silent=True) or {}).get('lista_attesa', True)
+    esito = enrollment.join_event(event_id, current_user.id, waitlist=bool(waitlist))
+    status = 409 if esito in (enrollment.SOVRAPPOSTO, enrollment.COMPLETO) else 200
+    return _seat_state(event_id, esito), status
+
+
+@bp.route('/events/<int:event_id>/iscrizione', methods=['DELETE'])
+@api_login_required
+def leave_event(event_id):
+    """Cancella l'iscrizione (o l'attesa); 409 se l'utente non era né iscritto né in attesa."""
+    Event.query.get_or_404(event_id, description='Evento non trovato.')
+    cancellato, _ = enrollment.leave_event(event_id, current_user.id)
+    if cancellato:
+        return _seat_state(event_id, 'cancellato')
+    if enrollment.leave_waitlist(event_id, current_user.id):
+        return _seat_state(event_id, 'uscito_dalla_lista_attesa')
+    return _seat_state(event_id, 'non_iscritto'), 409
+
+
+@bp.route('/me/iscrizioni')
+@api_login_required
+@read_only
+@api_conditional
+def my_events():
+    """Gli eventi futuri a cui l'utente è iscritto, per data."""
+    query = Event.query.join(partecipanti, partecipanti.c.event_id == Event.id) \
+        .filter(partecipanti.c.user_id == current_user.id, Event.data_ora >= date.today())
+    page = paginate_keyset(query, [Event.data_ora, Event.id], cursor=request.args.get('cursor'),
+                           per_page=_per_page(current_app.config['EVENTS_PER_PAGE']))
+    return _page(_event_items([event.id for event in page.items]), page)
+
+
+# ------------------------------------------------------------------------------
+# Giocatori e rally
+# ------------------------------------------------------------------------------
+
+class _PlayerContext:
+    """Quello che serve ai campi dei giocatori che dipendono da chi guarda."""
+
+    def __init__(self):
+        self.center = user_location(current_user)
+
+    def is_rallying(self, user):
+        return current_user.is_rallying(user)
+
+    def follows_me(self, user):
+        return user.is_rallying(current_user)
+
+    def distance(self, user):
+        if self.center is None or user.lat is None:
+            return None
+        return round(distance_km(self.center[0], self.center[1], user.lat, user.lon), 1)
+
+
+def _player_items(users):
+    fields = _fields(PLAYER_FIELDS)
+    ctx = _PlayerContext()
+    return [{name: PLAYER_FIELDS[name](user, ctx) for name in fields} for user in users]
+
+
+def _player(user):
+    return _player_items([user])[0]
+
+
+@bp.route('/me')
+@api_login_required
+@read_only
+@api_conditional
+def me():
+    return _player(current_user)
+
+
+@bp.route('/players')
+@api_login_required
+@read_only
+@api_conditional
+def players():
+    """Ricerca per nome (?q=) e/o distanza (?distanza= km); per nome, o per distanza con ?ordina=distanza."""
+    query = User.query.filter(User.id != current_user.id)
+    if not request.args.get('q') and not request.args.get('distanza'):
+        raise ApiError(400, 'Serve un nome (q) oppure una distanza.')
+    if request.args.get('q'):
+        query = query.filter(User.nome.ilike(f"%{request.args['q']}%"))
+    sort_key = [User.nome, User.id]
+    center = user_location(current_user)
+    if request.args.get('distanza') or request.args.get('ordina') == 'distanza':
+        if center is None:
+            raise ApiError(400, 'Il tuo CAP non è nel nostro elenco: non possiamo cercare per distanza.')
+        if request.args.get('distanza'):
+            radius = request.args.get('distanza', type=float)
+            if not radius:
+                raise ApiError(400, 'distanza deve essere un numero di km.')
+            query = within_radius(query, User, center, radius)
+        if request.args.get('ordina') == 'distanza':
+            query, distance = with_distance(query, User, center)
+            sort_key = [distance, User.id]
+    page = paginate_keyset(query, sort_key, cursor=request.args.get('cursor'),
+                           per_page=_per_page(current_app.config['PLAYERS_PER_PAGE']))
+    return _page(_player_items(page.items), page)
+
+
+@bp.route('/players/<username>')
+@api_login_required
+@read_only
+@api_conditional
+def player(username):
+    return _player(User.query.filter_by(nome=username).first_or_404(description='Giocatore non trovato.'))
+
+
+@bp.route('/me/rally')
+@api_login_required
+@read_only
+@api_conditional
+def my_rallies():
+    """I giocatori con cui l'utente fa rally, per nome."""
+    page = paginate_keyset(current_user.followed, [User.nome, User.id], cursor=request.args.get('cursor'),
+                           per_page=_per_page(current_app.config['PLAYERS_PER_PAGE']))
+    return _page(_player_items(page.items), page)
+
+
+def _rally_target(username):
+    user = User.query.filter_by(nome=username).first_or_404(description='Giocatore non trovato.')
+    if user == current_user:
+        raise ApiError(400, 'Non puoi fare rally con te stesso.')
+    return user
+
+
+def _rally_state(user):
+    # Dopo il commit i contatori vengono riletti dal database
+    return {'nome': user.nome, 'is_rallying': current_user._rally_in_db(user), 'num_followers': user.num_followers}
+
+
+@bp.route('/players/<username>/rally', methods=['PUT'])
+@api_login_required
+def rally_user(username):
+    user = _rally_target(username)
+    current_user.start_rally(user)
+    db.session.commit()
+    return _rally_state(user)
+
+
+@bp.route('/players/<username>/rally', methods=['DELETE'])
+@api_login_required
+def unrally_user(username):
+    user = _rally_target(username)
+    current_user.stop_rally(user)
+    db.session.commit()
+    return _rally_state(user)
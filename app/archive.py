@@ -0,0 +1,158 @@
+# app/archive.py
+
+import time as _time
+from datetime import datetime, date, time, timedelta
+
+from flask import current_app
+from sqlalchemy import select, insert, delete, func, literal, union_all
+
+from app import db
+from app.database import upsert_add
+from app.models import Event, EventoArchiviato, lista_attesa, partecipanti, partecipanti_archivio, storico_partite
+from app.pagination import paginate_keyset
+from app.schedule import forget_commitments
+from app.search import unindex_events
+from app.timeline import forget_events
+
+
+# ==============================================================================
+# ARCHIVIO DEGLI EVENTI PASSATI (HOT/COLD)
+# ==============================================================================
+# Le pagine leggono solo gli eventi futuri, ma quelli passati restavano nella
+# tabella 'event' per sempre: tabella e indici crescono, la parte utile no.
+# 'flask events-archive' sposta a blocchi gli eventi più vecchi di
+# ARCHIVE_AFTER_DAYS giorni, con i loro iscritti, in 'event_archivio' e
+# 'partecipanti_archivio'. Ogni blocco è una transazione breve:
+# - le partite giocate vengono sommate in 'storico_partite' (per utente,
+#   tipologia e livello), così le statistiche non devono mai rileggere l'archivio;
+# - l'evento esce dall'indice di ricerca, dalle bacheche, dagli impegni degli
+#   iscritti e dalla lista d'attesa;
+# - i contatori degli utenti (eventi creati, eventi a cui ha partecipato) non
+#   cambiano: contano anche gli eventi archiviati (vedi app/counters.py).
+# Lo storico di un utente (history_page) unisce gli eventi passati ancora
+# nella tabella principale e quelli archiviati.
+#
+# Gli eventi archiviati conservano il loro id: la tabella 'event' usa
+# AUTOINCREMENT (migrazione 8), quindi SQLite non riassegna mai a un evento
+# nuovo l'id di uno archiviato o cancellato.
+
+def archive_cutoff(days=None):
+    """Gli eventi prima di questo istante (mezzanotte di 'days' giorni fa) vanno in archivio."""
+    if days is None:
+        days = current_app.config['ARCHIVE_AFTER_DAYS']
+    return datetime.combine(date.today() - timedelta(days=days), time())
+
+
+def _archivable(cutoff):
+    return select(Event.id).where(Event.data_ora < cutoff)
+
+
+def count_archivable(cutoff):
+    return db.session.scalar(select(func.count()).select_from(_archivable(cutoff).subquery()))
+
+
+def archive_batch(cutoff, batch_size):
+    """Archivia i prossimi 'batch_size' eventi più vecchi di 'cutoff' in una transazione. Restituisce quanti."""
+    ids = db.session.scalars(
+        _archivable(cutoff).order_by(Event.data_ora, Event.id).limit(batch_size)).all()
+    if not ids:
+        db.session.rollback()
+        return 0
+
+    # Partite giocate per utente, tipologia e livello dell'evento
+    played = db.session.execute(
+        select(partecipanti.c.user_id, Event.tipologia, Event.livello_consigliato.label('livello'),
+               func.count().label('partite'))
+        .join(Event, Event.id == partecipanti.c.event_id)
+        .where(Event.id.in_(ids))
+        .group_by(partecipanti.c.user_id, Event.tipologia, Event.livello_consigliato)
+    ).mappings().all()
+    upsert_add(db.session, storico_partite, ['user_id', 'tipologia', 'livello'], 'partite',
+               [dict(row) for row in played])
+
+    # Copia in archivio, con INSERT ... SELECT (i dati non passano da Python)
+    columns = [c.name for c in EventoArchiviato.__table__.c if c.name != 'archiviato_il']
+    db.session.execute(insert(EventoArchiviato.__table__).from_select(
+        columns + ['archiviato_il'],
+        select(*[Event.__table__.c[name] for name in columns], literal(datetime.utcnow(), db.DateTime))
+        .where(Event.id.in_(ids))))
+    db.session.execute(insert(partecipanti_archivio).from_select(
+        ['user_id', 'event_id'],
+        select(partecipanti.c.user_id, partecipanti.c.event_id).where(partecipanti.c.event_id.in_(ids))))
+
+    # Via dalla tabella principale e da tutto ciò che vi fa riferimento
+    unindex_events(ids)
+    forget_events(ids)
+    forget_commitments(ids)
+    db.session.execute(delete(lista_attesa).where(lista_attesa.c.event_id.in_(ids)))
+    db.session.execute(delete(partecipanti).where(partecipanti.c.event_id.in_(ids)))
+    db.session.execute(delete(Event).where(Event.id.in_(ids)).execution_options(synchronize_session=False))
+    db.session.commit()
+    return len(ids)
+
+
+def archive_past_events(days=None, batch_size=None, pause=0.0, on_batch=None):
+    """
+    Archivia tutti gli eventi più vecchi di 'days' giorni, un blocco alla volta.
+    'pause' (secondi) tra un blocco e l'altro lascia spazio alle scritture del sito.
+    Restituisce il numero di eventi archiviati.
+    """
+    cutoff = archive_cutoff(days)
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    total = 0
+    while True:
+        n = archive_batch(cutoff, batch_size)
+        if not n:
+            return total
+        total += n
+        if on_batch:
+            on_batch(total)
+        if pause:
+            _time.sleep(pause)
+
+
+# ------------------------------------------------------------------------------
+# Lettura dello storico
+# ------------------------------------------------------------------------------
+
+def history_page(user_id, cursor=None, per_page=20):
+    """
+    Eventi passati a cui l'utente ha partecipato, dal più recente, sia ancora
+    nella tabella principale sia in archivio. Una KeysetPage di Event/EventoArchiviato.
+    """
+    live = select(Event.id, Event.data_ora) \
+        .join(partecipanti, partecipanti.c.event_id == Event.id) \
+        .where(partecipanti.c.user_id == user_id, Event.data_ora < date.today())
+    archived = select(EventoArchiviato.id, EventoArchiviato.data_ora) \
+        .join(partecipanti_archivio, partecipanti_archivio.c.event_id == EventoArchiviato.id) \
+        .where(partecipanti_archivio.c.user_id == user_id)
+    history = union_all(live, archived).subquery('storico')
+    page = paginate_keyset(db.session.query(history.c.id, history.c.data_ora),
+                           [history.c.data_ora, history.c.id],
+                           cursor=cursor, per_page=per_page, descending=True)
+
+    # La pagina contiene gli id: gli eventi arrivano con una query per tabella
+    ids = page.items
+    events = {e.id: e for e in EventoArchiviato.query.filter(EventoArchiviato.id.in_(ids))}
+    events.update({e.id: e for e in Event.query.filter(Event.id.in_(ids))})
+    page.items = [events[i] for i in ids]
+    return page
+
+
+def match_stats(user_id):
+    """
+    Partite giocate dall'utente per (tipologia, livello): quelle in archivio
+    dallo storico precalcolato, più gli eventi passati non ancora archiviati.
+    Lista di (tipologia, livello, partite), dalla più frequente.
+    """
+    stats = {(tipologia, livello): partite for tipologia, livello, partite in db.session.execute(
+        select(storico_partite.c.tipologia, storico_partite.c.livello, storico_partite.c.partite)
+        .where(storico_partite.c.user_id == user_id))}
+    recent = db.session.execute(
+        select(Event.tipologia, Event.livello_consigliato, func.count())
+        .join(partecipanti, partecipanti.c.event_id == Event.id)
+        .where(partecipanti.c.user_id == user_id, Event.data_ora < date.today())
+        .group_by(Event.tipologia, Event.livello_consigliato))
+    for tipologia, livello, partite in recent:
+        stats[(tipologia, livello)] = stats.get((tipologia, livello), 0) + partite
+    return sorted(((t, l, n) for (t, l), n in stats.items()), key=lambda row: (-row[2], row[0], row[1]))
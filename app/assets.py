@@ -0,0 +1,167 @@
+# app/assets.py
+
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import Blueprint, abort, current_app, request, send_from_directory, url_for
+
+
+# ==============================================================================
+# FILE STATICI: FOGLIO DI STILE COMPILATO, IMPRONTE E GZIP
+# ==============================================================================
+# Le pagine non caricano più nulla da CDN esterni e Tailwind non viene più
+# compilato nel browser a ogni pagina:
+# - app/static/src/app.css è il sorgente Tailwind; 'flask assets-build' lo
+#   compila (con l'eseguibile standalone di Tailwind, vedi TAILWINDCSS) in
+#   app/static/css/app.css, con le sole classi usate nei template. Il file
+#   compilato è nel repository, così l'applicazione funziona anche senza.
+# - jQuery e Select2 sono copie delle versioni pubblicate, in app/static/vendor.
+# - 'flask assets-build' copia poi ogni file di ASSETS in app/static/dist con
+#   un'impronta del contenuto nel nome (app.3f2a9c1b7d04.css), ci mette accanto
+#   la versione compressa con gzip (.gz) dei file di testo e scrive
+#   dist/manifest.json (nome originale -> nome con impronta).
+# - asset_url('css/app.css') nei template restituisce /assets/css/app.<impronta>.css:
+#   il nome cambia quando cambia il contenuto, quindi il browser tiene il file
+#   in cache per un anno senza mai chiedere se è cambiato (immutable).
+#   Senza manifest (build mai eseguita) restituisce l'URL di /static, come prima.
+# - /assets manda la versione .gz a chi accetta gzip e risponde alle richieste
+#   Range (206) e If-Range del video; l'ETag è l'impronta del contenuto.
+# I file delle build precedenti restano in dist per una build: le pagine
+# generate da processi non ancora riavviati continuano a trovarli.
+
+bp = Blueprint('assets', __name__)
+
+# File serviti con l'impronta (percorsi relativi a app/static)
+ASSETS = [
+    'css/app.css',
+    'vendor/jquery-3.7.1.min.js',
+    'vendor/select2-4.0.13.min.js',
+    'vendor/select2-4.0.13.min.css',
+    'tennis_rally.mp4',
+]
+
+# Estensioni dei file di testo, che hanno anche la versione .gz
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+
+MANIFEST = 'manifest.json'
+
+
+def _dist_dir(app):
+    return os.path.join(app.static_folder, 'dist')
+
+
+def _fingerprinted(name, data):
+    """'css/app.css' -> 'css/app.<impronta>.css' (12 cifre esadecimali di SHA-256)."""
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _load_manifest(app):
+    try:
+        with open(os.path.join(_dist_dir(app), MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'files': {}, 'previous': {}}
+
+
+def compile_css(app, binary):
+    """Compila app/static/src/app.css in app/static/css/app.css (minificato) con Tailwind."""
+    import subprocess
+    source = os.path.join(app.static_folder, 'src', 'app.css')
+    target = os.path.join(app.static_folder, 'css', 'app.css')
+    subprocess.run([binary, '--input', source, '--output', target, '--minify'],
+                   check=True, capture_output=True)
+    return os.path.getsize(target)
+
+
+def build_assets(app):
+    """
+    Copia i file di ASSETS in app/static/dist con l'impronta nel nome, scrive le
+    versioni .gz dei file di testo e il manifest. Restituisce una lista di
+    (nome, nome con impronta, byte, byte con gzip oppure None).
+    """
+    import gzip
+    dist = _dist_dir(app)
+    previous = _load_manifest(app)['files']
+    files, report = {}, []
+    for name in ASSETS:
+        with open(os.path.join(app.static_folder, name), 'rb') as f:
+            data = f.read()
+        built = _fingerprinted(name, data)
+        path = os.path.join(dist, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        compressed = None
+        if name.endswith(COMPRESSIBLE):
+            # mtime=0: la stessa sorgente dà sempre lo stesso file compresso
+            packed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(packed) < len(data):
+                with open(path + '.gz', 'wb') as f:
+                    f.write(packed)
+                compressed = len(packed)
+        files[name] = built
+        report.append((name, built, len(data), compressed))
+
+    # Manifest scritto per ultimo e sostituito in un colpo solo
+    tmp = os.path.join(dist, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'files': files, 'previous': previous}, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(dist, MANIFEST))
+
+    # Via i file più vecchi della build precedente
+    keep = set(files.values()) | set(previous.values())
+    for root, _, names in os.walk(dist):
+        for filename in names:
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, dist).replace(os.sep, '/')
+            if relative != MANIFEST and relative.removesuffix('.gz') not in keep:
+                os.remove(path)
+    return report
+
+
+def asset_url(name):
+    """URL di un file statico: quello con l'impronta se la build c'è, altrimenti /static."""
+    built = current_app.extensions['assets']['files'].get(name)
+    if built is None:
+        return url_for('static', filename=name)
+    return url_for('assets.serve_asset', filename=built)
+
+
+@bp.route('/assets/<path:filename>')
+def serve_asset(filename):
+    state = current_app.extensions['assets']
+    if filename not in state['served']:
+        abort(404)
+    dist = _dist_dir(current_app)
+    digest = filename.rsplit('.', 2)[-2]
+    options = {'max_age': current_app.config['ASSETS_MAX_AGE'], 'conditional': True,
+               'download_name': os.path.basename(filename)}
+
+    compressible = filename.endswith(COMPRESSIBLE)
+    if (compressible and request.accept_encodings['gzip'] > 0
+            and os.path.isfile(os.path.join(dist, filename + '.gz'))):
+        response = send_from_directory(dist, filename + '.gz', etag=digest + '-gzip',
+                                       mimetype=mimetypes.guess_type(filename)[0], **options)
+        response.content_encoding = 'gzip'
+    else:
+        response = send_from_directory(dist, filename, etag=digest, **options)
+        # Anche sulle risposte complete: il browser sa che può chiedere solo una parte del video
+        response.headers['Accept-Ranges'] = 'bytes'
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    """Legge il manifest dell'ultima build e rende disponibile asset_url() nei template."""
+    manifest = _load_manifest(app)
+    app.extensions['assets'] = {
+        'files': manifest['files'],
+        # Si servono solo i file delle ultime due build
+        'served': set(manifest['files'].values()) | set(manifest['previous'].values()),
+    }
+    app.add_template_global(asset_url)
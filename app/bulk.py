@@ -0,0 +1,555 @@
+# app/bulk.py
+
+import csv
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime
+
+from sqlalchemy import select, insert, delete, bindparam, tuple_, union
+from sqlalchemy.orm import aliased
+from werkzeug.datastructures import MultiDict
+from wtforms import StringField, DateField
+from wtforms.validators import AnyOf, Length, Optional
+
+from app import db
+from app.forms import RegistrationForm, EventForm
+from app.geo import cap_location, grid_cell
+from app.identity_cache import invalidate_users
+from app.models import User, Event, EventoArchiviato, partecipanti, lista_attesa, rally
+from app.rally_graph import record_rally
+from app.recommendations import record_preferences
+from app.schedule import user_is_busy, add_commitments
+from app.search import index_events
+from app.timeline import backfill
+
+
+# ==============================================================================
+# IMPORT / EXPORT IN BLOCCO (flask data-import / flask data-export)
+# ==============================================================================
+# I circoli ci mandano calendari con migliaia di sessioni: inserirli uno alla
+# volta dal form non è pensabile. Qui utenti, eventi, iscrizioni (partecipanti)
+# e rally si importano ed esportano in NDJSON (un oggetto JSON per riga) o CSV.
+# Import:
+# - il file viene letto in streaming e diviso in blocchi di BATCH righe;
+# - ogni riga è validata con le stesse regole dei form del sito
+#   (RegistrationForm, EventForm); i controlli che richiedono il database
+#   (email già usate, creatore, posti liberi, ...) sono fatti con una query
+#   per blocco, non per riga;
+# - ogni blocco è scritto con INSERT executemany ed è una transazione a sé,
+#   insieme ai contatori denormalizzati, all'indice di ricerca e alla posizione
+#   ricavata dal CAP. Le righe non valide vengono scartate e riportate;
+# - dopo ogni commit la posizione raggiunta è salvata in <file>.checkpoint: se
+#   l'import si interrompe, con --resume riparte dal primo blocco non salvato;
+# - gli hash delle password degli utenti sono calcolati in parallelo su un
+#   pool di processi.
+# Le attività importate non vengono pubblicate nelle bacheche dei compagni di
+# rally (sarebbero migliaia di voci tutte insieme).
+# Export: una SELECT letta a blocchi (yield_per), scritta riga per riga:
+# memoria costante qualunque sia la dimensione della tabella.
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M'      # lo stesso del campo data_ora di EventForm
+LIVELLI_GIOCATORE = ['Principiante', 'Intermedio', 'Avanzato']
+
+
+def detect_format(path, fmt=None):
+    """'csv' o 'ndjson': quello richiesto, oppure dedotto dall'estensione del file."""
+    if fmt:
+        return fmt
+    return 'csv' if str(path).lower().endswith('.csv') else 'ndjson'
+
+
+def read_rows(f, fmt):
+    """Righe del file come (dizionario, errore); l'errore è None se la riga è leggibile."""
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            yield row, None
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield None, f'JSON non valido: {e}'
+            continue
+        if isinstance(row, dict):
+            yield row, None
+        else:
+            yield None, 'ogni riga deve essere un oggetto JSON'
+
+
+def _formdata(row, fields):
+    """I valori della riga come li avrebbe inviati un form HTML (stringhe)."""
+    data = MultiDict()
+    for name in fields:
+        value = row.get(name)
+        if value is not None:
+            data[name] = str(value)
+    return data
+
+
+def _location(cap):
+    location = cap_location(cap)
+    if location is None:
+        return {'lat': None, 'lon': None, 'cella_lat': None, 'cella_lon': None}
+    cella_lat, cella_lon = grid_cell(*location)
+    return {'lat': location[0], 'lon': location[1], 'cella_lat': cella_lat, 'cella_lon': cella_lon}
+
+
+def _bump(table, key, counts):
+    """Aumenta in blocco (executemany) i contatori: counts = {id: {colonna: incremento}}."""
+    by_columns = {}
+    for row_id, increments in counts.items():
+        by_columns.setdefault(tuple(sorted(increments)), []).append((row_id, increments))
+    for columns, rows in by_columns.items():
+        db.session.execute(
+            table.update().where(table.c[key] == bindparam('_id'))
+            .values({column: table.c[column] + bindparam('_' + column) for column in columns}),
+            [{'_id': row_id, **{'_' + column: n for column, n in increments.items()}}
+             for row_id, increments in rows]
+        )
+    if table is User.__table__:
+        # I contatori sono anche nella cache dell'utente autenticato
+        invalidate_users(counts)
+
+
+def _users_by_email(emails):
+    """{email: (id, cap)} per gli utenti esistenti tra quelli indicati (una query)."""
+    if not emails:
+        return {}
+    rows = db.session.execute(select(User.email, User.id, User.cap).where(User.email.in_(set(emails))))
+    return {email: (user_id, cap) for email, user_id, cap in rows}
+
+
+# ==============================================================================
+# IMPORT: UN "IMPORTER" PER TABELLA
+# ==============================================================================
+# validate(rows) riceve un blocco di (numero di riga, dizionario) e restituisce
+# (valori validi, scarti); write(valori) li scrive nella transazione corrente.
+
+class _UserImportForm(RegistrationForm):
+    """Le regole della registrazione più quelle della pagina account."""
+    cognome = StringField('Cognome', validators=[Optional(), Length(max=64)])
+    data_di_nascita = DateField('Data di Nascita', format='%Y-%m-%d', validators=[Optional()])
+    livello = StringField('Livello', validators=[Optional(), AnyOf(LIVELLI_GIOCATORE)])
+
+    def validate_email(self, email):
+        # L'unicità delle email è controllata per tutto il blocco con una query
+        pass
+
+
+class UserImporter:
+    fields = ('nome', 'cognome', 'email', 'cap', 'data_di_nascita', 'livello', 'password', 'password_hash')
+
+    def __init__(self, hasher):
+        self.hasher = hasher
+
+    def validate(self, rows):
+        valid, rejected, passwords = [], [], []
+        for line, row in rows:
+            data = _formdata(row, self.fields)
+            has_hash = bool(data.get('password_hash')) and not data.get('password')
+            data['password2'] = data.get('password', '')
+            form = _UserImportForm(formdata=data, meta={'csrf': False})
+            if has_hash:
+                # Export di un'altra installazione: l'hash è già calcolato
+                del form.password
+                del form.password2
+            if not form.validate():
+                rejected.append((line, row, dict(form.errors)))
+                continue
+            values = {'nome': form.nome.data, 'cognome': form.cognome.data or None,
+                      'email': form.email.data, 'cap': form.cap.data,
+                      'data_di_nascita': form.data_di_nascita.data,
+                      'livello': form.livello.data or 'Principiante',
+                      'password_hash': data['password_hash'] if has_hash else None}
+            values.update(_location(values['cap']))
+            valid.append((line, row, values))
+            passwords.append(None if has_hash else form.password.data)
+
+        existing = _users_by_email([values['email'] for _, _, values in valid])
+        seen = set()
+        accepted, to_hash = [], []
+        for (line, row, values), password in zip(valid, passwords):
+            if values['email'] in existing or values['email'] in seen:
+                rejected.append((line, row, {'email': ['Questa email è già stata utilizzata.']}))
+                continue
+            seen.add(values['email'])
+            accepted.append(values)
+            to_hash.append(password)
+
+        # Gli hash mancanti, tutti insieme sul pool di processi
+        pending = [i for i, password in enumerate(to_hash) if password is not None]
+        for i, password_hash in zip(pending, self.hasher.hash_many([to_hash[i] for i in pending])):
+            accepted[i]['password_hash'] = password_hash
+        return accepted, rejected
+
+    def write(self, values):
+        if values:
+            db.session.execute(insert(User), values)
+
+
+class EventImporter:
+    fields = ('titolo', 'tipologia', 'descrizione', 'data_ora', 'durata', 'luogo', 'cap',
+              'max_partecipanti', 'livello_consigliato')
+
+    def validate(self, rows):
+        candidates, rejected = [], []
+        for line, row in rows:
+            data = _formdata(row, self.fields)
+            form = EventForm(formdata=data, meta={'csrf': False})
+            errors = {} if form.validate() else dict(form.errors)
+            if not row.get('creatore_email'):
+                errors['creatore_email'] = ['Il creatore è obbligatorio.']
+            event_id = row.get('id')
+            if event_id not in (None, ''):
+                try:
+                    event_id = int(event_id)
+                except (TypeError, ValueError):
+                    errors['id'] = ['Deve essere un numero intero.']
+            else:
+                event_id = None
+            if errors:
+                rejected.append((line, row, errors))
+                continue
+            values = {'titolo': form.titolo.data, 'tipologia': form.tipologia.data,
+                      'descrizione': form.descrizione.data, 'data_ora': form.data_ora.data,
+                      'durata': form.durata.data, 'luogo': form.luogo.data, 'cap': form.cap.data or None,
+                      'max_partecipanti': form.max_partecipanti.data,
+                      'livello_consigliato': form.livello_consigliato.data}
+            if event_id is not None:
+                values['id'] = event_id
+            candidates.append((line, row, values))
+
+        creators = _users_by_email([row['creatore_email'] for _, row, _ in candidates])
+        ids = [values['id'] for _, _, values in candidates if 'id' in values]
+        # Anche gli id degli eventi archiviati: lo storico unisce le due tabelle per id
+        taken = set(db.session.scalars(union(
+            select(Event.id).where(Event.id.in_(ids)),
+            select(EventoArchiviato.id).where(EventoArchiviato.id.in_(ids))))) if ids else set()
+        accepted = []
+        for line, row, values in candidates:
+            creator = creators.get(row['creatore_email'])
+            if creator is None:
+                rejected.append((line, row, {'creatore_email': ['Nessun utente con questa email.']}))
+                continue
+            if 'id' in values:
+                if values['id'] in taken:
+                    rejected.append((line, row, {'id': ['Esiste già un evento con questo id (anche in archivio).']}))
+                    continue
+                taken.add(values['id'])
+            # Come in create_event: senza CAP vale quello del creatore, e il
+            # creatore è il primo iscritto
+            values['user_id'], creator_cap = creator
+            values['cap'] = values['cap'] or creator_cap
+            values['num_iscritti'] = 1
+            values.update(_location(values['cap']))
+            accepted.append(values)
+        return accepted, rejected
+
+    def write(self, values):
+        if not values:
+            return
+        # Con e senza id esplicito: gruppi separati (stesse colonne in ogni executemany)
+        for group in ([v for v in values if 'id' in v], [v for v in values if 'id' not in v]):
+            if not group:
+                continue
+            ids = db.session.scalars(
+                insert(Event).returning(Event.id, sort_by_parameter_order=True), group).all()
+            for event_id, event in zip(ids, group):
+                event['id'] = event_id
+        db.session.execute(insert(partecipanti), [
+            {'user_id': v['user_id'], 'event_id': v['id']} for v in values])
+        counts = Counter(v['user_id'] for v in values)
+        _bump(User.__table__, 'id', {user_id: {'num_eventi_creati': n, 'num_eventi_iscritti': n}
+                                     for user_id, n in counts.items()})
+        record_preferences([(v['user_id'], v['data_ora']) for v in values])
+        add_commitments([{'event_id': v['id'], 'user_id': v['user_id'], 'inizio': v['data_ora'],
+                          'fine': Event.calcola_fine(v['data_ora'], v['durata'])} for v in values])
+        index_events(values)
+
+
+class EnrollmentImporter:
+    """Righe con 'email' dell'utente ed 'event_id'."""
+
+    def validate(self, rows):
+        candidates, rejected = [], []
+        for line, row in rows:
+            try:
+                event_id = int(row.get('event_id'))
+            except (TypeError, ValueError):
+                rejected.append((line, row, {'event_id': ['Deve essere un numero intero.']}))
+                continue
+            if not row.get('email'):
+                rejected.append((line, row, {'email': ['Campo obbligatorio.']}))
+                continue
+            candidates.append((line, row, row['email'], event_id))
+
+        users = _users_by_email([email for _, _, email, _ in candidates])
+        event_ids = {event_id for _, _, _, event_id in candidates}
+        seats, intervals = {}, {}
+        enrolled = set()
+        if event_ids:
+            for event_id, max_partecipanti, num_iscritti, data_ora, fine in db.session.execute(
+                    select(Event.id, Event.max_partecipanti, Event.num_iscritti, Event.data_ora, Event.fine)
+                    .where(Event.id.in_(event_ids))):
+                seats[event_id] = max_partecipanti - num_iscritti
+                intervals[event_id] = (data_ora, fine)
+            enrolled = set(db.session.execute(
+                select(partecipanti.c.user_id, partecipanti.c.event_id)
+                .where(partecipanti.c.event_id.in_(event_ids))).tuples())
+
+        accepted = []
+        # Orari già accettati in questo blocco, per utente (non ancora negli impegni)
+        batch = {}
+        for line, row, email, event_id in candidates:
+            user = users.get(email)
+            if user is None:
+                rejected.append((line, row, {'email': ['Nessun utente con questa email.']}))
+            elif event_id not in seats:
+                rejected.append((line, row, {'event_id': ['Evento inesistente.']}))
+            elif (user[0], event_id) in enrolled:
+                rejected.append((line, row, {'email': ["Già iscritto all'evento."]}))
+            elif seats[event_id] <= 0:
+                rejected.append((line, row, {'event_id': ['Evento al completo.']}))
+            elif self._overlaps(user[0], event_id, intervals[event_id], batch.get(user[0], ())):
+                rejected.append((line, row, {'event_id': ['Si sovrappone a un altro evento a cui è iscritto.']}))
+            else:
+                seats[event_id] -= 1
+                enrolled.add((user[0], event_id))
+                batch.setdefault(user[0], []).append(intervals[event_id])
+                accepted.append({'user_id': user[0], 'event_id': event_id})
+        return accepted, rejected
+
+    @staticmethod
+    def _overlaps(user_id, event_id, interval, accepted):
+        inizio, fine = interval
+        if any(start < fine and inizio < end for start, end in accepted):
+            return True
+        return user_is_busy(user_id, inizio, fine, exclude=event_id)
+
+    def write(self, values):
+        if not values:
+            return
+        db.session.execute(insert(partecipanti), values)
+        # Chi era in lista d'attesa per l'evento non lo è più
+        db.session.execute(delete(lista_attesa).where(
+            tuple_(lista_attesa.c.user_id, lista_attesa.c.event_id)
+            .in_([(v['user_id'], v['event_id']) for v in values])))
+        _bump(Event.__table__, 'id', {event_id: {'num_iscritti': n} for event_id, n
+                                      in Counter(v['event_id'] for v in values).items()})
+        _bump(User.__table__, 'id', {user_id: {'num_eventi_iscritti': n} for user_id, n
+                                     in Counter(v['user_id'] for v in values).items()})
+        times = {event_id: (data_ora, fine) for event_id, data_ora, fine in db.session.execute(
+            select(Event.id, Event.data_ora, Event.fine).where(Event.id.in_({v['event_id'] for v in values})))}
+        record_preferences([(v['user_id'], times[v['event_id']][0]) for v in values])
+        add_commitments([{'event_id': v['event_id'], 'user_id': v['user_id'], 'inizio': times[v['event_id']][0],
+                          'fine': times[v['event_id']][1]} for v in values])
+
+
+class RallyImporter:
+    """Righe con 'follower_email' e 'followed_email'."""
+
+    def validate(self, rows):
+        candidates, rejected = [], []
+        for line, row in rows:
+            follower, followed = row.get('follower_email'), row.get('followed_email')
+            if not follower or not followed:
+                rejected.append((line, row, {'follower_email': ['Servono entrambe le email.']}))
+            elif follower == followed:
+                rejected.append((line, row, {'followed_email': ['Non si può fare rally con se stessi.']}))
+            else:
+                candidates.append((line, row, follower, followed))
+
+        users = _users_by_email([e for _, _, a, b in candidates for e in (a, b)])
+        ids = {user_id for user_id, _ in users.values()}
+        existing = set(db.session.execute(
+            select(rally.c.follower_id, rally.c.followed_id).where(rally.c.follower_id.in_(ids))).tuples()) \
+            if ids else set()
+
+        accepted = []
+        for line, row, follower, followed in candidates:
+            missing = [name for name, email in (('follower_email', follower), ('followed_email', followed))
+                       if email not in users]
+            if missing:
+                rejected.append((line, row, {name: ['Nessun utente con questa email.'] for name in missing}))
+                continue
+            pair = (users[follower][0], users[followed][0])
+            if pair in existing:
+                rejected.append((line, row, {'followed_email': ['Fanno già rally.']}))
+                continue
+            existing.add(pair)
+            accepted.append({'follower_id': pair[0], 'followed_id': pair[1]})
+        return accepted, rejected
+
+    def write(self, values):
+        if not values:
+            return
+        db.session.execute(insert(rally), values)
+        _bump(User.__table__, 'id', {user_id: {'num_followed': n} for user_id, n
+                                     in Counter(v['follower_id'] for v in values).items()})
+        _bump(User.__table__, 'id', {user_id: {'num_followers': n} for user_id, n
+                                     in Counter(v['followed_id'] for v in values).items()})
+        # Come start_rally: le attività recenti entrano nelle bacheche e nel grafo dei rally
+        for v in values:
+            backfill(v['follower_id'], v['followed_id'])
+            record_rally(v['follower_id'], v['followed_id'])
+
+
+IMPORTERS = {
+    'utenti': UserImporter,
+    'eventi': EventImporter,
+    'partecipanti': EnrollmentImporter,
+    'rally': RallyImporter,
+}
+
+
+# ==============================================================================
+# IMPORT: CICLO A BLOCCHI CON CHECKPOINT
+# ==============================================================================
+
+class ImportStats:
+    def __init__(self, rows=0, imported=0, rejected=0):
+        self.rows = rows            # righe del file già elaborate (compresi gli scarti)
+        self.imported = imported
+        self.rejected = rejected
+        self.started = time.perf_counter()
+        self.rows_at_start = rows
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return (self.rows - self.rows_at_start) / elapsed if elapsed > 0 else 0.0
+
+
+def checkpoint_path(path):
+    return str(path) + '.checkpoint'
+
+
+def read_checkpoint(path, kind):
+    """Statistiche salvate dall'ultimo import interrotto di 'path', oppure None."""
+    try:
+        with open(checkpoint_path(path)) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if state.get('kind') != kind:
+        raise ValueError(f"Il checkpoint di {path} è di un import di '{state.get('kind')}', non di '{kind}'.")
+    return ImportStats(state['righe'], state['importate'], state['scartate'])
+
+
+def _write_checkpoint(path, kind, stats):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'kind': kind, 'righe': stats.rows, 'importate': stats.imported,
+                   'scartate': stats.rejected}, f)
+    os.replace(tmp, checkpoint_path(path))
+
+
+def import_file(kind, path, fmt, importer, batch_size=1000, stats=None, on_batch=None, on_reject=None):
+    """
+    Importa il file 'path' nella tabella 'kind', un blocco (e una transazione)
+    alla volta. Se 'stats' viene da read_checkpoint, le righe già salvate
+    vengono saltate. on_batch(stats) è chiamata dopo ogni commit,
+    on_reject(riga, dati, errori) per ogni riga scartata.
+    In caso di errore il blocco corrente viene annullato e il checkpoint
+    resta all'ultimo blocco salvato. Restituisce le statistiche finali.
+    """
+    stats = stats or ImportStats()
+    skip = stats.rows
+    with open(path, newline='', encoding='utf-8') as f:
+        batch, line = [], 0
+        for line, (row, error) in enumerate(read_rows(f, fmt), start=1):
+            if line <= skip:
+                continue
+            if error is not None:
+                batch.append((line, None, {'riga': [error]}))
+            else:
+                batch.append((line, row, None))
+            if len(batch) >= batch_size:
+                _import_batch(kind, path, importer, batch, stats, on_reject)
+                if on_batch:
+                    on_batch(stats)
+                batch = []
+        if batch:
+            _import_batch(kind, path, importer, batch, stats, on_reject)
+            if on_batch:
+                on_batch(stats)
+    try:
+        os.remove(checkpoint_path(path))
+    except FileNotFoundError:
+        pass
+    return stats
+
+
+def _import_batch(kind, path, importer, batch, stats, on_reject):
+    unreadable = [(line, row, errors) for line, row, errors in batch if errors is not None]
+    try:
+        values, rejected = importer.validate([(line, row) for line, row, errors in batch if errors is None])
+        importer.write(values)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    rejected = sorted(unreadable + rejected, key=lambda r: r[0])
+    stats.rows += len(batch)
+    stats.imported += len(values)
+    stats.rejected += len(rejected)
+    _write_checkpoint(path, kind, stats)
+    if on_reject:
+        for line, row, errors in rejected:
+            on_reject(line, row, errors)
+
+
+# ==============================================================================
+# EXPORT
+# ==============================================================================
+
+def _export_queries():
+    follower, followed = aliased(User), aliased(User)
+    return {
+        'utenti': select(User.id, User.nome, User.cognome, User.email, User.cap, User.data_di_nascita,
+                         User.livello, User.password_hash).order_by(User.id),
+        'eventi': select(Event.id, Event.titolo, Event.tipologia, Event.descrizione, Event.data_ora,
+                         Event.durata, Event.luogo, Event.cap, Event.max_partecipanti, Event.livello_consigliato,
+                         User.email.label('creatore_email'))
+                  .outerjoin(User, User.id == Event.user_id).order_by(Event.id),
+        'partecipanti': select(User.email, partecipanti.c.event_id)
+                        .join(User, User.id == partecipanti.c.user_id)
+                        .order_by(partecipanti.c.event_id, partecipanti.c.user_id),
+        'rally': select(follower.email.label('follower_email'), followed.email.label('followed_email'))
+                 .select_from(rally)
+                 .join(follower, follower.id == rally.c.follower_id)
+                 .join(followed, followed.id == rally.c.followed_id)
+                 .order_by(rally.c.follower_id, rally.c.followed_id),
+    }
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def export_rows(kind, f, fmt, chunk_size=1000):
+    """Scrive la tabella 'kind' su f in streaming. Restituisce il numero di righe."""
+    result = db.session.execute(_export_queries()[kind].execution_options(yield_per=chunk_size))
+    columns = list(result.keys())
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(columns)
+    count = 0
+    for row in result:
+        values = [_export_value(value) for value in row]
+        if writer is not None:
+            writer.writerow(['' if value is None else value for value in values])
+        else:
+            f.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n')
+        count += 1
+    return count
@@ -0,0 +1,299 @@
+# app/cache.py
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, make_response, request, session
+from flask_login import current_user
+
+from app.database import RoutingSession
+
+try:
+    import fcntl
+except ImportError:  # Windows: il lock sul file della versione non è disponibile
+    fcntl = None
+
+
+# ==============================================================================
+# CACHE VERSIONATA DI FRAMMENTI E RISPOSTE
+# ==============================================================================
+# Tutto ciò che mettiamo in cache (card degli eventi già renderizzate, elenco
+# dei creatori, risultati dei filtri) ha nella chiave la "versione dei dati":
+# un contatore che aumenta dopo ogni commit che scrive qualcosa (eventi,
+# iscrizioni, liste d'attesa, utenti, rally, ...). Non serve quindi cancellare
+# niente: dopo una scrittura le chiavi cambiano e le voci vecchie escono dalla
+# cache da sole (LRU / scadenza).
+# La stessa versione produce gli ETag di /index e /events: se nulla è cambiato
+# il browser riceve 304 Not Modified senza che la view venga eseguita.
+#
+# Backend (CACHE_BACKEND):
+# - 'memory':     LRU in memoria, per un singolo processo (predefinito);
+# - 'filesystem': file in CACHE_DIR condivisi da tutti i worker, con la
+#                 versione in un file: da usare con più processi;
+# - 'null':       nessuna cache (test).
+#
+# La versione non parte da 0 ma da un valore casuale, scelto all'avvio del
+# processo (memory) o alla creazione del file (filesystem): dopo un riavvio la
+# stessa versione, e quindi lo stesso ETag, non può indicare dati diversi.
+
+
+def _initial_version():
+    return int.from_bytes(os.urandom(6), 'big')
+
+
+class NullBackend:
+    """Nessuna cache: ogni lettura è un miss e non c'è versione (quindi niente ETag)."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def clear(self):
+        pass
+
+    def get_version(self):
+        return None
+
+    def bump_version(self):
+        pass
+
+
+class MemoryBackend:
+    """LRU in memoria con scadenza, protetta da un lock."""
+
+    def __init__(self, max_entries, default_ttl):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = _initial_version()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.default_ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+
+
+class FileBackend:
+    """Un file per voce in una cartella condivisa; la versione sta nel file 'VERSION'."""
+
+    # Ogni quante scritture controlliamo se la cartella ha troppe voci
+    PRUNE_EVERY = 200
+
+    def __init__(self, directory, max_entries, default_ttl):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.cache')
+
+    def _write(self, path, data):
+        # Scrittura atomica: chi legge vede il file vecchio o quello nuovo, mai uno a metà
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires <= time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._write(self._path(key), pickle.dumps((time.time() + (ttl or self.default_ttl), value)))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        """Se le voci sono troppe, cancella le meno recenti fino al 90% del massimo."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.cache'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - int(self.max_entries * 0.9)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.cache'):
+                os.remove(entry.path)
+
+    def _read_version(self):
+        try:
+            with open(os.path.join(self.directory, 'VERSION')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def get_version(self):
+        version = self._read_version()
+        if version is None:
+            # Cartella nuova o svuotata: scriviamo la versione iniziale
+            self.bump_version()
+            version = self._read_version()
+        return version
+
+    def bump_version(self):
+        with open(os.path.join(self.directory, 'VERSION.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            version = self._read_version()
+            version = _initial_version() if version is None else version + 1
+            self._write(os.path.join(self.directory, 'VERSION'), str(version).encode())
+
+
+def init_cache(app):
+    config = app.config
+    backend = config['CACHE_BACKEND']
+    if backend == 'memory':
+        cache = MemoryBackend(config['CACHE_MAX_ENTRIES'], config['CACHE_DEFAULT_TTL'])
+    elif backend == 'filesystem':
+        cache = FileBackend(config['CACHE_DIR'], config['CACHE_MAX_ENTRIES'], config['CACHE_DEFAULT_TTL'])
+    elif backend == 'null':
+        cache = NullBackend()
+    else:
+        raise ValueError(f'CACHE_BACKEND sconosciuto: {backend!r}')
+    app.extensions['cache'] = cache
+
+
+def get_cache():
+    return current_app.extensions['cache']
+
+
+def data_version():
+    """Versione dei dati, letta una sola volta per richiesta."""
+    if 'data_version' not in g:
+        g.data_version = get_cache().get_version()
+    return g.data_version
+
+
+def versioned_key(*parts):
+    """Chiave di cache legata alla versione corrente dei dati."""
+    return ':'.join(str(part) for part in (data_version(),) + parts)
+
+
+def cached(key, compute, ttl=None):
+    """Restituisce il valore in cache per 'key' o lo calcola con compute() e lo salva."""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, ttl)
+    return value
+
+
+# ==============================================================================
+# ETAG E 304 NOT MODIFIED
+# ==============================================================================
+
+def conditional_get(view):
+    """
+    Decoratore per le pagine GET che dipendono solo dai dati versionati e
+    dall'utente: aggiunge l'ETag e risponde 304 se il browser ha già la pagina.
+    Le pagine con messaggi flash in sospeso vengono sempre generate.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes') or data_version() is None:
+            return view(*args, **kwargs)
+
+        # Il token CSRF nei form della pagina scade (WTF_CSRF_TIME_LIMIT): a metà
+        # della sua durata l'ETag cambia, così il browser non riusa token scaduti
+        csrf_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+        bucket = int(time.time() // (csrf_limit / 2))
+        etag = hashlib.sha1(repr((
+            data_version(), current_user.get_id(), request.full_path, date.today().isoformat(), bucket,
+        )).encode()).hexdigest()
+
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+
+# ==============================================================================
+# AGGIORNAMENTO DELLA VERSIONE DOPO LE SCRITTURE
+# ==============================================================================
+# Una transazione "scrive" se il flush ha oggetti nuovi/modificati/cancellati
+# oppure se esegue INSERT/UPDATE/DELETE dirette (iscrizioni, contatori, ...).
+# La versione aumenta solo a commit avvenuto.
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    if session.new or session.dirty or session.deleted:
+        session.info['data_changed'] = True
+
+
+@sa.event.listens_for(RoutingSession, 'do_orm_execute')
+def _do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['data_changed'] = True
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('data_changed', False) and has_app_context() and 'cache' in current_app.extensions:
+        get_cache().bump_version()
+        g.pop('data_version', None)
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('data_changed', None)
@@ -0,0 +1,497 @@
+# app/chat.py
+
+import asyncio
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+from sqlalchemy import select, insert, func
+
+from app import db
+from app.database import RoutingSession
+from app.models import Event, Messaggio, User, partecipanti
+
+
+# ==============================================================================
+# CHAT TRA GIOCATORI: STANZE, MESSAGGI E CONSEGNA IN TEMPO REALE (SSE)
+# ==============================================================================
+# Due tipi di stanza: 'evento-<id>', per il creatore e gli iscritti di un
+# evento, e 'utenti-<id>-<id>', tra due utenti (id in ordine crescente).
+# I messaggi vanno nella tabella 'messaggio', che cresce solo: lo storico si
+# legge a pagine con il cursore sull'id (vedi app/pagination.py).
+#
+# Consegna: il browser apre uno stream Server-Sent Events. Ogni processo ha un
+# ChatHub, un event loop asyncio in un suo thread che tiene tutte le
+# connessioni aperte: con il server di produzione (app/server.py) la view
+# scrive le intestazioni e poi passa il socket all'hub, liberando subito il
+# thread del pool. Mille connessioni inattive sono mille oggetti nel loop,
+# non mille thread. Il server di sviluppo non può cedere le connessioni: lì lo
+# stream occupa un thread finché resta aperto.
+#
+# L'hub legge i messaggi nuovi dalla tabella in ordine di id, a partire
+# dall'ultimo già letto, e li distribuisce alle connessioni della stanza
+# (pub/sub in memoria). Chi lo sveglia dipende dal broker (CHAT_BROKER):
+# - 'local': il commit di un messaggio in questo stesso processo;
+# - 'database': anche un timer ogni CHAT_POLL_INTERVAL secondi, per i messaggi
+#   scritti dagli altri worker (serve.py lo sceglie con più di un worker).
+# Un altro broker (es. Redis pub/sub) deve solo sapere svegliare l'hub: si
+# aggiunge a BROKERS. Leggere "gli id dopo l'ultimo letto" non perde messaggi
+# perché con SQLite le scritture sono in serie: un id più basso non può
+# diventare visibile dopo uno più alto.
+# Ogni connessione ricorda l'ultimo id inviato: il browser, quando si
+# ricollega, lo rimanda (Last-Event-ID) e riceve solo quelli che ha perso.
+
+RETRY_MS = 3000
+PING = b': ping\n\n'
+# Messaggi letti dalla tabella in una volta
+TAIL_BATCH = 500
+
+
+def event_room(event_id):
+    return f'evento-{event_id}'
+
+
+def direct_room(user_id, other_id):
+    low, high = sorted((user_id, other_id))
+    return f'utenti-{low}-{high}'
+
+
+def can_access(stanza, user_id):
+    """True se l'utente può leggere e scrivere nella stanza."""
+    kind, _, rest = stanza.partition('-')
+    try:
+        ids = [int(part) for part in rest.split('-')]
+    except ValueError:
+        return False
+    if kind == 'evento' and len(ids) == 1:
+        return db.session.execute(select(
+            select(Event.id).where(Event.id == ids[0], Event.user_id == user_id).exists()
+            | select(partecipanti.c.user_id).where(partecipanti.c.event_id == ids[0],
+                                                   partecipanti.c.user_id == user_id).exists()
+        )).scalar()
+    if kind == 'utenti' and len(ids) == 2 and ids[0] < ids[1] and user_id in ids:
+        return db.session.get(User, ids[1] if ids[0] == user_id else ids[0]) is not None
+    return False
+
+
+def room_title(stanza, user_id):
+    """Titolo della stanza per chi la guarda: il titolo dell'evento o il nome dell'altro utente."""
+    kind, _, rest = stanza.partition('-')
+    if kind == 'evento':
+        return db.session.scalar(select(Event.titolo).where(Event.id == int(rest)))
+    other = [int(part) for part in rest.split('-') if int(part) != user_id][0]
+    return db.session.scalar(select(User.nome).where(User.id == other))
+
+
+def post_message(stanza, user_id, testo):
+    """Salva il messaggio (nella transazione della richiesta) e restituisce il suo id."""
+    # Come la coda dei lavori, passiamo dalla connessione: un messaggio non cambia
+    # niente di quello che c'è nella cache delle pagine
+    message_id = db.session.connection().execute(
+        insert(Messaggio).values(stanza=stanza, user_id=user_id, testo=testo).returning(Messaggio.id)
+    ).scalar_one()
+    db.session.info['chat_posted'] = True
+    return message_id
+
+
+def history_query(stanza):
+    """Query dei messaggi della stanza, da paginare con paginate_keyset su [Messaggio.id]."""
+    return Messaggio.query.filter(Messaggio.stanza == stanza)
+
+
+def as_dict(message):
+    return {'id': message.id, 'user_id': message.user_id, 'autore': message.autore.nome,
+            'testo': message.testo, 'inviato_il': message.inviato_il.isoformat(timespec='seconds')}
+
+
+def _frame(message):
+    return f'id: {message["id"]}\ndata: {json.dumps(message, separators=(",", ":"))}\n\n'.encode()
+
+
+def _read(condition, limit, newest=False):
+    """Messaggi (come dizionari, con il frame SSE già pronto) in ordine di id."""
+    query = (select(Messaggio.id, Messaggio.stanza, Messaggio.user_id, User.nome.label('autore'),
+                    Messaggio.testo, Messaggio.inviato_il)
+             .join(User, User.id == Messaggio.user_id).where(condition)
+             .order_by(Messaggio.id.desc() if newest else Messaggio.id).limit(limit))
+    rows = db.session.execute(query).all()
+    if newest:
+        rows.reverse()
+    messages = []
+    for row in rows:
+        message = {'id': row.id, 'user_id': row.user_id, 'autore': row.autore, 'testo': row.testo,
+                   'inviato_il': row.inviato_il.isoformat(timespec='seconds')}
+        messages.append((row.stanza, message['id'], _frame(message)))
+    return messages
+
+
+# ------------------------------------------------------------------------------
+# Broker: chi sveglia l'hub quando ci sono messaggi nuovi
+# ------------------------------------------------------------------------------
+
+class LocalBroker:
+    """Sveglia l'hub dopo il commit di un messaggio in questo processo."""
+
+    def __init__(self, config):
+        self._loop = self._event = None
+
+    def start(self, loop):
+        self._loop, self._event = loop, asyncio.Event()
+
+    def notify(self):
+        """Da qualunque thread."""
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+class DatabaseBroker(LocalBroker):
+    """Come LocalBroker, più un controllo periodico della tabella per i messaggi degli altri processi."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.interval = config['CHAT_POLL_INTERVAL']
+
+    async def wait(self):
+        try:
+            await asyncio.wait_for(self._event.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+BROKERS = {'local': LocalBroker, 'database': DatabaseBroker}
+
+
+# ------------------------------------------------------------------------------
+# Connessioni aperte
+# ------------------------------------------------------------------------------
+
+class _Stream:
+    """Una connessione SSE iscritta a una stanza. Usata solo dal thread dell'hub."""
+
+    def __init__(self, hub, stanza, last_id):
+        self.hub = hub
+        self.stanza = stanza
+        self.last_id = last_id
+        self.expires = hub.loop.time() + hub.timeout
+        self.closed = False
+        # Messaggi arrivati mentre leggiamo quelli persi: inviati dopo, senza doppioni
+        self.pending = []
+
+    def start(self, backlog):
+        pending, self.pending = self.pending, None
+        self.send(backlog)
+        self.send(pending)
+
+    def send(self, messages):
+        if self.pending is not None:
+            self.pending.extend(messages)
+            return
+        for _, message_id, frame in messages:
+            if message_id > self.last_id and not self.closed:
+                self.last_id = message_id
+                self.write(frame)
+
+
+class _SocketStream(_Stream, asyncio.Protocol):
+    """Connessione ceduta dal server: il socket è gestito dall'event loop."""
+
+    transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        pass    # dopo la richiesta il client non manda altro
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.hub._unsubscribe(self)
+
+    def write(self, data):
+        self.transport.write(data)
+        # Client che non legge: meglio chiudere che tenere in memoria i suoi messaggi
+        if self.transport.get_write_buffer_size() > self.hub.buffer_limit:
+            self.closed = True
+            self.transport.abort()
+
+    def close(self):
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+
+
+class _QueueStream(_Stream):
+    """Stream letto da un thread (server di sviluppo): i frame passano da una coda."""
+
+    def __init__(self, hub, stanza, last_id):
+        super().__init__(hub, stanza, last_id)
+        self.queue = queue.SimpleQueue()
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub._unsubscribe(self)
+            self.queue.put(None)
+
+
+# ------------------------------------------------------------------------------
+# Hub del processo
+# ------------------------------------------------------------------------------
+
+class ChatHub:
+    """Event loop (in un thread) con le connessioni SSE aperte in questo processo, per stanza."""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.broker = BROKERS[config['CHAT_BROKER']](config)
+        self.keepalive = config['CHAT_KEEPALIVE']
+        self.timeout = config['CHAT_STREAM_TIMEOUT']
+        self.buffer_limit = config['CHAT_BUFFER_LIMIT']
+        self.backlog = config['CHAT_HISTORY_PER_PAGE']
+        self.loop = None
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._rooms = {}        # stanza -> set di _Stream
+        self._streams = 0
+        self._cursor = 0        # ultimo id letto dalla tabella
+
+    @property
+    def running(self):
+        return self._pid == os.getpid()
+
+    @property
+    def open_streams(self):
+        return self._streams if self.running else 0
+
+    def start(self):
+        """Avvia il loop, se non è già attivo in questo processo (dopo un fork va ricreato)."""
+        if self.running:
+            return
+        with self._lock:
+            if self.running:
+                return
+            self._rooms, self._streams = {}, 0
+            self.loop = asyncio.new_event_loop()
+            # Le query girano in un piccolo pool, fuori dal loop
+            self.loop.set_default_executor(ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-db'))
+            self._cursor = self._call(lambda: db.session.scalar(select(func.max(Messaggio.id)))) or 0
+            self.broker.start(self.loop)
+            self._thread = threading.Thread(target=self._run, name='chat-hub', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        """Chiude tutte le connessioni (i browser si ricollegano altrove) e ferma il loop."""
+        if not self.running:
+            return
+        self.loop.call_soon_threadsafe(self._close_all)
+        self._thread.join(timeout)
+        self._pid = None
+
+    def notify(self):
+        """Dopo il commit di un messaggio (da qualunque thread)."""
+        if self.running:
+            self.broker.notify()
+
+    def attach_socket(self, sock, stanza, last_id):
+        """Prende in carico un socket con le intestazioni SSE già inviate."""
+        self.start()
+        self.loop.call_soon_threadsafe(self.loop.create_task, self._open_socket(sock, stanza, last_id))
+
+    def attach_queue(self, stanza, last_id):
+        """Stream per un thread che scrive da sé sulla connessione: i frame arrivano in stream.queue."""
+        self.start()
+        stream = _QueueStream(self, stanza, last_id)
+        self.loop.call_soon_threadsafe(self.loop.create_task, self._open(stream))
+        return stream
+
+    def detach(self, stream):
+        if self.running:
+            self.loop.call_soon_threadsafe(stream.close)
+
+    # ---------------------------------------------------------- thread dell'hub
+
+    def _call(self, fn):
+        with self.app.app_context():
+            return fn()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self._tail())
+        self.loop.create_task(self._ping())
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+            self.loop.close()
+
+    def _subscribe(self, stream):
+        self._rooms.setdefault(stream.stanza, set()).add(stream)
+        self._streams += 1
+
+    def _unsubscribe(self, stream):
+        room = self._rooms.get(stream.stanza)
+        if room is not None and stream in room:
+            room.discard(stream)
+            self._streams -= 1
+            if not room:
+                del self._rooms[stream.stanza]
+
+    async def _open_socket(self, sock, stanza, last_id):
+        try:
+            _, stream = await self.loop.connect_accepted_socket(
+                lambda: _SocketStream(self, stanza, last_id), sock)
+        except OSError:
+            sock.close()
+            return
+        await self._open(stream)
+
+    async def _open(self, stream):
+        # Prima l'iscrizione, poi la lettura dei messaggi persi: quello che
+        # arriva nel frattempo resta in stream.pending, niente va perso
+        self._subscribe(stream)
+        try:
+            backlog = await self.loop.run_in_executor(None, self._call, lambda: _read(
+                sa.and_(Messaggio.stanza == stream.stanza, Messaggio.id > stream.last_id),
+                self.backlog, newest=True))
+        except Exception:
+            self.app.logger.exception('Chat: lettura dei messaggi persi non riuscita')
+            backlog = []
+        stream.start(backlog)
+
+    async def _tail(self):
+        """Legge i messaggi nuovi quando il broker lo chiede e li distribuisce alle stanze."""
+        while True:
+            await self.broker.wait()
+            try:
+                while True:
+                    if not self._rooms:
+                        # Nessuno in ascolto: basta sapere da dove ripartire (se nel
+                        # frattempo qualcuno si è iscritto, rileggiamo dal cursore di prima)
+                        latest = await self.loop.run_in_executor(None, self._call, lambda: db.session.scalar(
+                            select(func.max(Messaggio.id))))
+                        if self._rooms:
+                            continue
+                        self._cursor = latest or self._cursor
+                        break
+                    cursor = self._cursor
+                    messages = await self.loop.run_in_executor(
+                        None, self._call, lambda: _read(Messaggio.id > cursor, TAIL_BATCH))
+                    if not messages:
+                        break
+                    self._cursor = messages[-1][1]
+                    self._dispatch(messages)
+                    if len(messages) < TAIL_BATCH:
+                        break
+            except Exception:
+                self.app.logger.exception('Chat: lettura dei messaggi nuovi non riuscita')
+                await asyncio.sleep(1)
+
+    def _dispatch(self, messages):
+        by_room = {}
+        for message in messages:
+            by_room.setdefault(message[0], []).append(message)
+        for stanza, items in by_room.items():
+            for stream in list(self._rooms.get(stanza, ())):
+                stream.send(items)
+
+    async def _ping(self):
+        """Un solo timer per tutte le connessioni: keep-alive e chiusura di quelle scadute."""
+        while True:
+            await asyncio.sleep(self.keepalive)
+            now = self.loop.time()
+            for room in list(self._rooms.values()):
+                for stream in list(room):
+                    if stream.expires <= now:
+                        stream.close()
+                    elif stream.pending is None and not stream.closed:
+                        stream.write(PING)
+
+    def _close_all(self):
+        for room in list(self._rooms.values()):
+            for stream in list(room):
+                stream.close()
+        # Lasciamo al loop il tempo di chiudere i socket, poi lo fermiamo
+        self.loop.call_later(0.1, self.loop.stop)
+
+
+# ------------------------------------------------------------------------------
+# Risposta SSE
+# ------------------------------------------------------------------------------
+
+class _HandOffBody:
+    """Corpo della risposta: dopo le intestazioni la connessione passa all'hub."""
+
+    def __init__(self, hub, hand_off, stanza, last_id):
+        self.hub = hub
+        self.hand_off = hand_off
+        self.stanza = stanza
+        self.last_id = last_id
+        self._sent = False
+
+    def __iter__(self):
+        yield f'retry: {RETRY_MS}\n\n'.encode()
+        self._sent = True
+
+    def close(self):
+        # Chiamata dal server alla fine della risposta; se l'invio delle
+        # intestazioni è fallito il client non c'è più
+        if self._sent:
+            self.hub.attach_socket(self.hand_off(), self.stanza, self.last_id)
+
+
+def _blocking_body(hub, stanza, last_id):
+    stream = hub.attach_queue(stanza, last_id)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'.encode()
+        while True:
+            frame = stream.queue.get()
+            if frame is None:
+                return
+            yield frame
+    finally:
+        hub.detach(stream)
+
+
+def stream_body(environ, stanza, last_id):
+    """Corpo della risposta SSE della stanza, dall'id successivo a last_id."""
+    hub = current_app.extensions['chat']
+    # Messa nell'environ dal server di produzione (vedi app/server.py)
+    hand_off = environ.get('tennis.hand_off')
+    if hand_off is not None:
+        return _HandOffBody(hub, hand_off, stanza, last_id)
+    return _blocking_body(hub, stanza, last_id)
+
+
+def init_chat(app):
+    app.extensions['chat'] = ChatHub(app)
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('chat_posted', False) and has_app_context():
+        hub = current_app.extensions.get('chat')
+        if hub is not None:
+            hub.notify()
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('chat_posted', None)
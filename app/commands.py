@@ -0,0 +1,371 @@
+# app/commands.py
+
+import json
+import os
+import shutil
+import time
+
+import click
+from flask import current_app
+
+from app import db
+
+
+# ==============================================================================
+# COMANDI DA RIGA DI COMANDO (flask <comando>)
+# ==============================================================================
+
+@click.command('search-rebuild')
+def search_rebuild_command():
+    """Ricrea l'indice di ricerca full-text degli eventi (FTS5)."""
+    from app.search import rebuild_search_index
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException("L'indice full-text è disponibile solo con SQLite.")
+    count = rebuild_search_index()
+    click.echo(f'Indice di ricerca ricreato: {count} eventi indicizzati.')
+
+
+@click.command('geo-load')
+@click.argument('path', required=False, type=click.Path(exists=True, dir_okay=False))
+def geo_load_command(path):
+    """Carica i centroidi dei CAP (di default app/data/cap_centroidi.csv) e ricalcola le posizioni."""
+    from app.geo import load_cap_centroids
+    count = load_cap_centroids(path)
+    click.echo(f'Centroidi caricati: {count} CAP. Posizioni di utenti ed eventi aggiornate.')
+
+
+@click.command('counters-repair')
+@click.option('--dry-run', is_flag=True, help='Mostra solo i contatori disallineati, senza correggerli.')
+def counters_repair_command(dry_run):
+    """Rileva e corregge in blocco i contatori denormalizzati disallineati."""
+    from app.counters import find_drift, repair_drift
+    drift = find_drift()
+    for name, rows in drift.items():
+        click.echo(f'{name}: {rows} righe disallineate')
+    if dry_run or not any(drift.values()):
+        return
+    repaired = repair_drift()
+    click.echo(f'Contatori corretti: {sum(repaired.values())} righe.')
+
+
+BULK_KINDS = click.Choice(['utenti', 'eventi', 'partecipanti', 'rally'])
+BULK_FORMATS = click.Choice(['ndjson', 'csv'])
+
+
+@click.command('data-import')
+@click.argument('kind', type=BULK_KINDS)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=BULK_FORMATS, help="Formato del file (di default dedotto dall'estensione).")
+@click.option('--batch-size', default=1000, show_default=True, help='Righe per blocco (e per transazione).')
+@click.option('--resume', is_flag=True, help="Riprende un import interrotto dall'ultimo blocco salvato.")
+@click.option('--rejects', type=click.File('w', encoding='utf-8'),
+              help='File NDJSON in cui scrivere le righe scartate con i relativi errori.')
+@click.option('--hash-workers', type=int, default=lambda: os.cpu_count() or 1,
+              help='Processi per calcolare gli hash delle password (utenti).')
+def data_import_command(kind, path, fmt, batch_size, resume, rejects, hash_workers):
+    """Importa utenti, eventi, partecipanti o rally da un file NDJSON o CSV."""
+    from flask import current_app
+    from app.bulk import IMPORTERS, UserImporter, import_file, read_checkpoint, detect_format, checkpoint_path
+    from app.passwords import PasswordHasher
+
+    stats = read_checkpoint(path, kind)
+    if stats is not None and not resume:
+        raise click.ClickException(f'Esiste un import interrotto ({checkpoint_path(path)}): '
+                                   'usa --resume per riprenderlo oppure cancella il checkpoint.')
+    if stats is not None:
+        click.echo(f'Ripresa dalla riga {stats.rows + 1} ({stats.imported} righe già importate).')
+
+    hasher = None
+    if IMPORTERS[kind] is UserImporter:
+        hasher = PasswordHasher(current_app.config['PASSWORD_HASH_METHOD'], hash_workers,
+                                queue_size=0, timeout=None)
+        importer = UserImporter(hasher)
+    else:
+        importer = IMPORTERS[kind]()
+
+    shown = [0]
+
+    def on_reject(line, row, errors):
+        if rejects is not None:
+            rejects.write(json.dumps({'riga': line, 'errori': errors, 'dati': row}, ensure_ascii=False) + '\n')
+        elif shown[0] < 20:
+            click.echo(f'  riga {line} scartata: {errors}', err=True)
+        shown[0] += 1
+
+    def on_batch(stats):
+        click.echo(f'{stats.rows} righe elaborate: {stats.imported} importate, {stats.rejected} scartate '
+                   f'({stats.rate():.0f} righe/s)')
+
+    try:
+        stats = import_file(kind, path, detect_format(path, fmt), importer, batch_size, stats,
+                            on_batch=on_batch, on_reject=on_reject)
+    except Exception as e:
+        raise click.ClickException(f'Import interrotto: {e}\nLe righe fino all\'ultimo blocco salvato sono '
+                                   'state importate: rilancia il comando con --resume per continuare.')
+    finally:
+        if hasher is not None:
+            hasher.shutdown()
+    click.echo(f'Import completato: {stats.imported} righe importate, {stats.rejected} scartate, '
+               f'{stats.rate():.0f} righe/s.')
+
+
+@click.command('data-export')
+@click.argument('kind', type=BULK_KINDS)
+@click.argument('path', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=BULK_FORMATS, help="Formato del file (di default dedotto dall'estensione).")
+def data_export_command(kind, path, fmt):
+    """Esporta utenti, eventi, partecipanti o rally in NDJSON o CSV (PATH '-' = standard output)."""
+    from app.bulk import export_rows, detect_format
+    start = time.perf_counter()
+    with click.open_file(path, 'w', encoding='utf-8') as f:
+        count = export_rows(kind, f, detect_format(path, fmt))
+    if path != '-':
+        elapsed = time.perf_counter() - start
+        click.echo(f'Esportate {count} righe in {elapsed:.1f} s ({count / elapsed if elapsed else 0:.0f} righe/s).')
+
+
+@click.command('events-archive')
+@click.option('--days', type=int, help='Archivia gli eventi più vecchi di tanti giorni (di default ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, help='Eventi per transazione (di default ARCHIVE_BATCH_SIZE).')
+@click.option('--pause', type=float, default=0.0, help='Secondi di pausa tra un blocco e l\'altro.')
+@click.option('--every', type=int, help='Resta attivo e ripete l\'archiviazione ogni tanti secondi.')
+@click.option('--dry-run', is_flag=True, help='Mostra solo quanti eventi verrebbero archiviati.')
+def events_archive_command(days, batch_size, pause, every, dry_run):
+    """Sposta gli eventi passati (e i loro iscritti) nelle tabelle di archivio, a blocchi."""
+    from app.archive import archive_cutoff, archive_past_events, count_archivable
+    if dry_run:
+        cutoff = archive_cutoff(days)
+        click.echo(f'Eventi da archiviare (prima del {cutoff:%d/%m/%Y}): {count_archivable(cutoff)}.')
+        return
+    while True:
+        start = time.perf_counter()
+        count = archive_past_events(days, batch_size, pause,
+                                    on_batch=lambda total: click.echo(f'  {total} eventi archiviati...'))
+        click.echo(f'Eventi archiviati: {count} in {time.perf_counter() - start:.1f} s.')
+        if not every:
+            return
+        time.sleep(every)
+
+
+@click.command('recommendations-rebuild')
+def recommendations_rebuild_command():
+    """Ricalcola da zero le preferenze di orario usate per i consigli sugli eventi."""
+    from app.recommendations import rebuild_preferences
+    count = rebuild_preferences()
+    click.echo(f'Preferenze ricalcolate: {count} righe (utente, fascia oraria).')
+
+
+@click.command('rally-graph-check')
+def rally_graph_check_command():
+    """Carica il grafo dei rally in memoria e lo confronta con la tabella 'rally'."""
+    from app.rally_graph import RallyGraph, differences
+    start = time.perf_counter()
+    with db.engine.connect() as conn:
+        graph = RallyGraph.load(conn)
+        elapsed = time.perf_counter() - start
+        missing, extra = differences(graph, conn)
+    click.echo(f'{len(graph)} rally caricati in {elapsed:.2f} s, {graph.memory_bytes() / 2 ** 20:.1f} MB.')
+    for follower_id, followed_id in missing[:20]:
+        click.echo(f'  solo nel database: {follower_id} -> {followed_id}')
+    for follower_id, followed_id in extra[:20]:
+        click.echo(f'  solo nel grafo: {follower_id} -> {followed_id}')
+    if missing or extra:
+        raise click.ClickException(f'{len(missing) + len(extra)} differenze tra grafo e database.')
+    click.echo('Nessuna differenza.')
+
+
+@click.command('schedule-rebuild')
+def schedule_rebuild_command():
+    """Ricalcola da zero gli impegni degli utenti (orari degli eventi a cui sono iscritti)."""
+    from app.schedule import rebuild_commitments
+    count = rebuild_commitments()
+    click.echo(f'Impegni ricalcolati: {count} righe (utente, evento).')
+
+
+@click.command('schedule-free')
+@click.argument('luogo')
+@click.option('--day', 'giorno', type=click.DateTime(formats=['%Y-%m-%d']), help='Giorno (di default oggi).')
+@click.option('--days', type=int, default=1, help='Quanti giorni mostrare.')
+@click.option('--durata', type=int, default=90, help='Minuti liberi richiesti.')
+def schedule_free_command(luogo, giorno, days, durata):
+    """Mostra gli orari liberi di un luogo (nell'orario di apertura SCHEDULE_OPEN_HOUR-SCHEDULE_CLOSE_HOUR)."""
+    from datetime import date, datetime, time, timedelta
+    from app.schedule import venue_free_slots
+    da = giorno or datetime.combine(date.today(), time())
+    slots = venue_free_slots(luogo, da, da + timedelta(days=days), durata)
+    for inizio, fine in slots:
+        click.echo(f'  {inizio:%a %d/%m %H:%M} - {fine:%H:%M}')
+    if not slots:
+        click.echo(f'Nessun orario libero di {durata} minuti.')
+
+
+@click.command('jobs-worker')
+@click.option('--threads', type=int, default=2, help='Thread che eseguono i lavori.')
+@click.option('--once', is_flag=True, help='Esegue i lavori pronti ed esce (per cron).')
+def jobs_worker_command(threads, once):
+    """Esegue i lavori in coda (email, bacheche) fuori dai processi web, fino a Ctrl+C."""
+    import signal
+    from flask import current_app
+    from app.jobs import prune, requeue_stale, run_pending
+    workers = current_app.extensions['jobs']
+    if once:
+        # Nessun thread: i lavori accodati dai lavori stessi vengono presi dal ciclo
+        workers.threads = 0
+        requeue_stale()
+        count = run_pending()
+        click.echo(f'Lavori eseguiti: {count}; lavori finiti cancellati: {prune()}.')
+        return
+    workers.threads = threads
+    workers.start()
+    click.echo(f'Worker avviato con {threads} thread (Ctrl+C per fermarlo).')
+    stop = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.append(signum))
+    try:
+        while not stop:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    click.echo('Arresto: attendo la fine dei lavori in corso...')
+    workers.stop()
+
+
+@click.command('jobs-status')
+def jobs_status_command():
+    """Mostra i lavori in coda, in corso e falliti, per tipo, e i tempi degli ultimi finiti."""
+    from app.jobs import queue_stats
+    stats = queue_stats()
+    tipi = sorted({tipo for tipo, _ in stats['depth']} | set(stats['latency']))
+    if not tipi:
+        click.echo('Nessun lavoro in coda.')
+    for tipo in tipi:
+        depth = {stato: n for (t, stato), n in stats['depth'].items() if t == tipo}
+        line = ', '.join(f'{n} {stato}' for stato, n in sorted(depth.items())) or 'nessuno in coda'
+        if tipo in stats['oldest_ready']:
+            line += f' (il più vecchio aspetta da {stats["oldest_ready"][tipo]:.0f} s)'
+        click.echo(f'{tipo:20} {line}')
+        latency = stats['latency'].get(tipo)
+        if latency:
+            click.echo(f'{"":20} {len(latency)} finiti di recente, mediana {latency[len(latency) // 2]:.1f} s, '
+                       f'massimo {latency[-1]:.1f} s')
+
+
+@click.command('jobs-retry')
+@click.option('--tipo', help='Solo i lavori di questo tipo.')
+def jobs_retry_command(tipo):
+    """Rimette in coda i lavori falliti dopo tutti i tentativi."""
+    from app.jobs import retry_failed
+    click.echo(f'Lavori rimessi in coda: {retry_failed(tipo)}.')
+
+
+@click.command('db-upgrade')
+@click.option('--to', 'target', type=int, help='Si ferma a questa versione (di default: tutte).')
+@click.option('--dry-run', is_flag=True, help='Mostra solo le migrazioni da applicare.')
+def db_upgrade_command(target, dry_run):
+    """Porta lo schema del database all'ultima versione, applicando le migrazioni mancanti."""
+    from app.migrations import pending, upgrade
+    todo = [(version, name) for version, name, _, _ in pending(db.engine)
+            if target is None or version <= target]
+    if not todo:
+        click.echo('Lo schema è già aggiornato.')
+        return
+    if dry_run:
+        for version, name in todo:
+            click.echo(f'  {version:3}  {name}')
+        click.echo(f'{len(todo)} migrazioni da applicare.')
+        return
+    start = time.perf_counter()
+    upgrade(db.engine, target, on_apply=lambda version, name: click.echo(f'  {version:3}  {name}'))
+    click.echo(f'{len(todo)} migrazioni applicate in {time.perf_counter() - start:.1f} s.')
+
+
+@click.command('db-status')
+def db_status_command():
+    """Mostra le migrazioni applicate e quelle mancanti, e le differenze tra database e modelli."""
+    from app.migrations import MIGRATIONS, applied_versions, schema_drift
+    applied = applied_versions(db.engine)
+    for version, name, _, _ in MIGRATIONS:
+        when = applied[version][1] if version in applied else 'da applicare'
+        click.echo(f'  {version:3}  {name}  [{when}]')
+    drift = schema_drift(db.engine, db.metadata)
+    for problem in drift:
+        click.echo(f'  ! {problem}')
+    if drift:
+        raise click.ClickException('Lo schema del database non corrisponde ai modelli (manca una migrazione?).')
+
+
+@click.command('db-advisor')
+@click.option('--plans', is_flag=True, help='Mostra il piano di esecuzione completo di ogni query.')
+@click.option('--strict', is_flag=True, help='Esce con errore se trova letture complete o ordinamenti senza indice.')
+def db_advisor_command(plans, strict):
+    """Analizza con EXPLAIN QUERY PLAN le query dell'applicazione e segnala gli indici mancanti."""
+    from app.advisor import advise
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException("L'analisi dei piani di esecuzione è disponibile solo con SQLite.")
+    report = advise()
+    for entry in report:
+        status = 'DA RIVEDERE' if entry['problems'] else 'ok'
+        click.echo(f'{entry["name"]:40} {status}')
+        for detail in entry['plan'] if plans else entry['problems'] + entry['accepted']:
+            note = ' (atteso)' if detail in entry['accepted'] else ''
+            click.echo(f'    {detail}{note}')
+    found = sum(1 for entry in report if entry['problems'])
+    click.echo(f'{len(report)} query analizzate, {found} da rivedere.')
+    if strict and found:
+        raise SystemExit(1)
+
+
+@click.command('assets-build')
+@click.option('--skip-css', is_flag=True,
+              help="Non ricompila il foglio di stile: usa app/static/css/app.css così com'è.")
+def assets_build_command(skip_css):
+    """Compila il foglio di stile e prepara i file statici con impronta e gzip (app/static/dist)."""
+    from app.assets import build_assets, compile_css
+    if not skip_css:
+        binary = shutil.which(current_app.config['TAILWINDCSS'])
+        if binary is None:
+            raise click.ClickException(
+                f"Eseguibile di Tailwind non trovato ({current_app.config['TAILWINDCSS']}): installalo "
+                "(es. pip install tailwindcss-bin), indica il percorso con TAILWINDCSS oppure usa --skip-css.")
+        size = compile_css(current_app, binary)
+        click.echo(f'Foglio di stile compilato: css/app.css, {size} byte.')
+    for name, built, size, compressed in build_assets(current_app):
+        gz = f', {compressed} con gzip' if compressed else ''
+        click.echo(f'{name} -> {built} ({size} byte{gz})')
+    click.echo('Riavviare il server per usare i nuovi file.')
+
+
+@click.command('precompile')
+def precompile_command():
+    """Compila in anticipo template (cache in JINJA_CACHE_DIR) e moduli Python (.pyc), per il deploy."""
+    from app.warmup import compile_modules, compile_templates
+    if not current_app.config['JINJA_CACHE_DIR']:
+        raise click.ClickException('JINJA_CACHE_DIR è vuota: la cache dei template è disattivata.')
+    start = time.perf_counter()
+    count = compile_templates(current_app)
+    click.echo(f"{count} template compilati in {current_app.config['JINJA_CACHE_DIR']} "
+               f'({(time.perf_counter() - start) * 1000:.0f} ms).')
+    if not compile_modules(current_app):
+        raise click.ClickException('Alcuni moduli non si compilano: vedi gli errori qui sopra.')
+    click.echo('Moduli Python compilati.')
+
+
+def register_commands(app):
+    """Registra tutti i comandi CLI dell'applicazione."""
+    app.cli.add_command(search_rebuild_command)
+    app.cli.add_command(geo_load_command)
+    app.cli.add_command(counters_repair_command)
+    app.cli.add_command(data_import_command)
+    app.cli.add_command(data_export_command)
+    app.cli.add_command(events_archive_command)
+    app.cli.add_command(recommendations_rebuild_command)
+    app.cli.add_command(rally_graph_check_command)
+    app.cli.add_command(schedule_rebuild_command)
+    app.cli.add_command(schedule_free_command)
+    app.cli.add_command(jobs_worker_command)
+    app.cli.add_command(jobs_status_command)
+    app.cli.add_command(jobs_retry_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_status_command)
+    app.cli.add_command(db_advisor_command)
+    app.cli.add_command(assets_build_command)
+    app.cli.add_command(precompile_command)
@@ -0,0 +1,89 @@
+# app/counters.py
+
+from sqlalchemy import select, func, update
+
+from app import db
+from app.identity_cache import invalidate_users
+from app.models import User, Event, EventoArchiviato, partecipanti, partecipanti_archivio, rally
+
+
+# ==============================================================================
+# CONTATORI DENORMALIZZATI
+# ==============================================================================
+# Gli iscritti di un evento e, per ogni utente, eventi creati, eventi a cui è
+# iscritto, followers e following sono salvati come colonne e aggiornati nella
+# stessa transazione delle scritture (vedi Event.add_partecipante,
+# User.start_rally, ...). Le pagine li leggono senza nessun COUNT(*).
+# Se per qualche motivo (import manuali, bug, script) un contatore si
+# disallinea, 'flask counters-repair' lo rileva e lo ricalcola in blocco.
+# Eventi creati ed eventi a cui un utente è iscritto contano anche quelli
+# spostati in archivio (vedi app/archive.py).
+
+def _definitions():
+    """Per ogni contatore: (nome, colonna, valore reale calcolato con una subquery correlata)."""
+    return [
+        ('event.num_iscritti', Event.num_iscritti,
+         select(func.count()).select_from(partecipanti)
+         .where(partecipanti.c.event_id == Event.id).scalar_subquery()),
+        ('user.num_eventi_creati', User.num_eventi_creati,
+         select(func.count(Event.id)).where(Event.user_id == User.id).scalar_subquery()
+         + select(func.count(EventoArchiviato.id)).where(EventoArchiviato.user_id == User.id).scalar_subquery()),
+        ('user.num_eventi_iscritti', User.num_eventi_iscritti,
+         select(func.count()).select_from(partecipanti)
+         .where(partecipanti.c.user_id == User.id).scalar_subquery()
+         + select(func.count()).select_from(partecipanti_archivio)
+         .where(partecipanti_archivio.c.user_id == User.id).scalar_subquery()),
+        ('user.num_followers', User.num_followers,
+         select(func.count()).select_from(rally)
+         .where(rally.c.followed_id == User.id).scalar_subquery()),
+        ('user.num_followed', User.num_followed,
+         select(func.count()).select_from(rally)
+         .where(rally.c.follower_id == User.id).scalar_subquery()),
+    ]
+
+
+def find_drift():
+    """Restituisce {nome contatore: numero di righe disallineate}."""
+    drift = {}
+    for name, column, actual in _definitions():
+        model = column.class_
+        drift[name] = db.session.query(func.count()).select_from(model) \
+            .filter(column != actual).scalar()
+    return drift
+
+
+def repair_drift():
+    """Ricalcola in blocco tutti i contatori disallineati. Restituisce {nome: righe corrette}."""
+    repaired = {}
+    for name, column, actual in _definitions():
+        model = column.class_
+        result = db.session.execute(
+            update(model).where(column != actual).values({column: actual})
+            .execution_options(synchronize_session=False)
+        )
+        repaired[name] = result.rowcount
+    db.session.commit()
+    return repaired
+
+
+def release_event_counters(event):
+    """
+    Da chiamare prima di cancellare un evento: scala i contatori del creatore e
+    di tutti gli iscritti con un'unica UPDATE, nella stessa transazione.
+    """
+    if event.user_id is not None:
+        db.session.execute(
+            update(User).where(User.id == event.user_id)
+            .values(num_eventi_creati=User.num_eventi_creati - 1)
+            .execution_options(synchronize_session=False)
+        )
+        invalidate_users([event.user_id])
+    iscritti = select(partecipanti.c.user_id).where(partecipanti.c.event_id == event.id)
+    changed = db.session.execute(
+        update(User).where(User.id.in_(iscritti))
+        .values(num_eventi_iscritti=User.num_eventi_iscritti - 1)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    # I contatori sono anche nella cache dell'utente autenticato
+    invalidate_users(changed)
@@ -0,0 +1,137 @@
+# app/database.py
+
+from functools import wraps
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+
+
+# ==============================================================================
+# PROFILO DEL DATABASE: PRAGMA, POOL DI CONNESSIONI, LETTURE SEPARATE
+# ==============================================================================
+# Con il profilo 'production' (predefinito, vedi config.Config.DB_PROFILE):
+# - ogni connessione SQLite usa il journal WAL (i lettori non si bloccano più
+#   dietro chi scrive), busy_timeout, synchronous=NORMAL e mmap;
+# - il pool delle connessioni ha dimensioni configurabili;
+# - le view in sola lettura (decorate con @read_only) eseguono le SELECT su un
+#   secondo pool, separato da quello delle scritture. Con SQLite è lo stesso file
+#   aperto con PRAGMA query_only; con altri database può essere una replica
+#   (SQLALCHEMY_READ_DATABASE_URI).
+# Con il profilo 'basic' si torna alle impostazioni predefinite di SQLAlchemy.
+
+def _is_sqlite_file(uri):
+    url = sa.engine.make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """Opzioni per create_engine (SQLALCHEMY_ENGINE_OPTIONS) in base al profilo."""
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if config.get('DB_PROFILE') != 'production':
+        return options
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if sa.engine.make_url(uri).get_backend_name() != 'sqlite' or _is_sqlite_file(uri):
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    if _is_sqlite_file(uri):
+        # Il busy_timeout lo impostiamo noi con la PRAGMA
+        options.setdefault('connect_args', {}).setdefault('timeout', config['SQLITE_BUSY_TIMEOUT'] / 1000)
+    return options
+
+
+def _sqlite_pragmas(config, read_only=False):
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+    if read_only:
+        pragmas.append('PRAGMA query_only=ON')
+    return pragmas
+
+
+def _install_pragmas(engine, pragmas):
+    @sa.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def init_database_profile(app, db):
+    """Da chiamare dopo db.init_app(app): applica le PRAGMA e crea il pool di sola lettura."""
+    config = app.config
+    if config.get('DB_PROFILE') != 'production':
+        return
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    read_uri = config.get('SQLALCHEMY_READ_DATABASE_URI') or uri
+
+    with app.app_context():
+        if _is_sqlite_file(uri):
+            _install_pragmas(db.engine, _sqlite_pragmas(config))
+
+        if not config.get('DB_READ_ROUTING'):
+            return
+        if sa.engine.make_url(read_uri).get_backend_name() == 'sqlite' and not _is_sqlite_file(read_uri):
+            # Database in memoria: un secondo pool vedrebbe un database diverso
+            return
+        read_engine = sa.create_engine(read_uri, pool_size=config['DB_READ_POOL_SIZE'],
+                                       max_overflow=config['DB_MAX_OVERFLOW'],
+                                       pool_timeout=config['DB_POOL_TIMEOUT'])
+        if _is_sqlite_file(read_uri):
+            _install_pragmas(read_engine, _sqlite_pragmas(config, read_only=True))
+        app.extensions['db_read_engine'] = read_engine
+
+
+def read_only(view):
+    """Decoratore per le view che leggono soltanto: le loro SELECT usano il pool di sola lettura."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Sessione che manda le SELECT delle view @read_only al pool di sola lettura."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context()
+                and g.get('db_read_only') and isinstance(clause, sa.sql.Select)):
+            engine = current_app.extensions.get('db_read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def dispose_engines(app, db, close=True):
+    """
+    Svuota i pool di connessioni (principale e di sola lettura).
+    Nei processi figli dopo un fork si usa close=False: le connessioni ereditate
+    appartengono al padre e non vanno chiuse, solo dimenticate.
+    """
+    with app.app_context():
+        db.engine.dispose(close=close)
+        read_engine = app.extensions.get('db_read_engine')
+        if read_engine is not None:
+            read_engine.dispose(close=close)
+
+
+def upsert_add(session, table, keys, column, rows):
+    """
+    Somma in blocco (executemany) un valore a un contatore, creando la riga se
+    manca: INSERT ... ON CONFLICT (keys) DO UPDATE SET column = column + excluded.column.
+    'rows' sono dizionari con le colonne di 'keys' e 'column'.
+    """
+    if not rows:
+        return
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                      set_={column: table.c[column] + stmt.excluded[column]})
+    session.execute(stmt, rows)
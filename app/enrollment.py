@@ -0,0 +1,236 @@
+# app/enrollment.py
+
+import time
+from datetime import datetime
+
+from sqlalchemy import select, insert, update, delete, exists, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import db
+from app.identity_cache import invalidate_users
+from app.models import User, Event, Attivita, partecipanti, lista_attesa
+from app.recommendations import record_preference
+from app.schedule import user_is_busy, add_commitment, remove_commitment
+from app.timeline import record_activity, forget_enrollment
+
+
+# ==============================================================================
+# ISCRIZIONI AGLI EVENTI: POSTI, LISTA D'ATTESA, PROMOZIONI
+# ==============================================================================
+# Prima join_event leggeva il numero di iscritti, lo confrontava con il massimo
+# e poi aggiungeva l'utente: due richieste contemporanee potevano superare
+# entrambe il controllo e riempire l'evento oltre il limite.
+# Qui il controllo dei posti e la prenotazione sono un'unica UPDATE condizionale:
+#
+#     UPDATE event SET num_iscritti = num_iscritti + 1
+#     WHERE id = :event AND num_iscritti < max_partecipanti AND <non già iscritto>
+#
+# Il database la esegue in modo atomico: se modifica una riga il posto è nostro,
+# altrimenti l'evento è pieno (o siamo già iscritti). La transazione comincia
+# direttamente con la scrittura e contiene solo 2-3 istruzioni, così il lock di
+# scrittura di SQLite resta occupato il meno possibile.
+# Ogni funzione è un'unità di lavoro completa: fa commit (o rollback) da sola.
+# Un utente non può iscriversi a due eventi che si sovrappongono (vedi
+# app/schedule.py): il controllo è una lettura sull'indice degli impegni,
+# fatta prima della transazione di scrittura.
+
+# Esiti di join_event
+ISCRITTO = 'iscritto'
+GIA_ISCRITTO = 'gia_iscritto'
+IN_ATTESA = 'in_attesa'
+GIA_IN_ATTESA = 'gia_in_attesa'
+COMPLETO = 'completo'
+SOVRAPPOSTO = 'sovrapposto'
+
+# Tentativi in caso di "database is locked" (oltre al busy_timeout del driver)
+MAX_ATTEMPTS = 3
+
+
+def _retry_when_locked(fn):
+    """Riesegue fn() se SQLite risponde 'database is locked', con una breve attesa crescente."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return fn()
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e) or attempt == MAX_ATTEMPTS:
+                raise
+            time.sleep(0.05 * attempt)
+
+
+def _is_enrolled(event_id, user_id):
+    return exists().where(partecipanti.c.event_id == event_id, partecipanti.c.user_id == user_id)
+
+
+def _take_seat(event_id, user_id):
+    """UPDATE condizionale: True se abbiamo ottenuto un posto."""
+    result = db.session.execute(
+        update(Event)
+        .where(Event.id == event_id,
+               Event.num_iscritti < Event.max_partecipanti,
+               ~_is_enrolled(event_id, user_id))
+        .values(num_iscritti=Event.num_iscritti + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _add_enrollment(event_id, user_id):
+    """
+    Inserisce la riga in 'partecipanti', aggiorna il contatore dell'utente e
+    pubblica l'iscrizione nelle bacheche dei suoi follower (il posto è già preso).
+    """
+    db.session.execute(insert(partecipanti).values(event_id=event_id, user_id=user_id))
+    db.session.execute(
+        update(User).where(User.id == user_id)
+        .values(num_eventi_iscritti=User.num_eventi_iscritti + 1)
+        .execution_options(synchronize_session=False)
+    )
+    invalidate_users([user_id])
+    record_activity(user_id, event_id, Attivita.ISCRITTO)
+    record_preference(user_id, event_id)
+    add_commitment(user_id, event_id)
+
+
+def _overlaps(event_id, user_id):
+    """True se l'utente è iscritto a un altro evento che si sovrappone a questo."""
+    interval = db.session.execute(select(Event.data_ora, Event.fine).where(Event.id == event_id)).first()
+    return interval is not None and user_is_busy(user_id, *interval, exclude=event_id)
+
+
+def join_event(event_id, user_id, waitlist=True):
+    """
+    Iscrive l'utente all'evento se c'è posto, altrimenti (se waitlist=True) lo
+    mette in lista d'attesa. Restituisce uno degli esiti definiti sopra.
+    """
+    # Due iscrizioni contemporanee dello stesso utente potrebbero passare
+    # entrambe il controllo: lo accettiamo, riguarda solo lui
+    if _overlaps(event_id, user_id):
+        db.session.rollback()
+        return SOVRAPPOSTO
+
+    def attempt():
+        # Chiudiamo un'eventuale transazione aperta: la nostra deve iniziare con la scrittura
+        db.session.commit()
+        try:
+            if _take_seat(event_id, user_id):
+                _add_enrollment(event_id, user_id)
+                # Se era in lista d'attesa, ora non serve più
+                db.session.execute(delete(lista_attesa).where(
+                    lista_attesa.c.event_id == event_id, lista_attesa.c.user_id == user_id))
+                db.session.commit()
+                return ISCRITTO
+
+            if db.session.execute(select(_is_enrolled(event_id, user_id))).scalar():
+                db.session.rollback()
+                return GIA_ISCRITTO
+            if not waitlist:
+                db.session.rollback()
+                return COMPLETO
+
+            db.session.execute(insert(lista_attesa).values(
+                event_id=event_id, user_id=user_id, data_richiesta=datetime.utcnow()))
+            db.session.commit()
+            return IN_ATTESA
+        except IntegrityError:
+            # Riga già presente (iscrizione o lista d'attesa) inserita da una richiesta concorrente
+            db.session.rollback()
+            if db.session.execute(select(_is_enrolled(event_id, user_id))).scalar():
+                return GIA_ISCRITTO
+            return GIA_IN_ATTESA
+
+    return _retry_when_locked(attempt)
+
+
+def promote_waitlist(event_id):
+    """
+    Riempie i posti liberi con i primi utenti in lista d'attesa (FIFO), saltando
+    chi nel frattempo si è iscritto a un evento allo stesso orario (resta in lista).
+    Non fa commit: va chiamata dentro una transazione già aperta.
+    Restituisce la lista degli id degli utenti promossi.
+    """
+    promoted = []
+    waiting = db.session.execute(
+        select(lista_attesa.c.id, lista_attesa.c.user_id)
+        .where(lista_attesa.c.event_id == event_id)
+        .order_by(lista_attesa.c.id)
+    ).all()
+    for first in waiting:
+        if _overlaps(event_id, first.user_id):
+            continue
+        if _take_seat(event_id, first.user_id):
+            db.session.execute(delete(lista_attesa).where(lista_attesa.c.id == first.id))
+            _add_enrollment(event_id, first.user_id)
+            promoted.append(first.user_id)
+        elif db.session.execute(select(_is_enrolled(event_id, first.user_id))).scalar():
+            # Già iscritto per altra via: la sua richiesta in attesa non serve più
+            db.session.execute(delete(lista_attesa).where(lista_attesa.c.id == first.id))
+        else:
+            # Nessun posto libero
+            break
+    return promoted
+
+
+def leave_event(event_id, user_id):
+    """
+    Cancella l'iscrizione dell'utente e promuove il primo della lista d'attesa.
+    Restituisce (cancellato, promossi).
+    """
+    def attempt():
+        db.session.commit()
+        result = db.session.execute(delete(partecipanti).where(
+            partecipanti.c.event_id == event_id, partecipanti.c.user_id == user_id))
+        if result.rowcount == 0:
+            db.session.rollback()
+            return False, []
+        db.session.execute(
+            update(Event).where(Event.id == event_id)
+            .values(num_iscritti=Event.num_iscritti - 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(User).where(User.id == user_id)
+            .values(num_eventi_iscritti=User.num_eventi_iscritti - 1)
+            .execution_options(synchronize_session=False)
+        )
+        invalidate_users([user_id])
+        forget_enrollment(user_id, event_id)
+        record_preference(user_id, event_id, -1)
+        remove_commitment(user_id, event_id)
+        promoted = promote_waitlist(event_id)
+        db.session.commit()
+        return True, promoted
+
+    return _retry_when_locked(attempt)
+
+
+def leave_waitlist(event_id, user_id):
+    """Toglie l'utente dalla lista d'attesa. Restituisce True se c'era."""
+    def attempt():
+        db.session.commit()
+        result = db.session.execute(delete(lista_attesa).where(
+            lista_attesa.c.event_id == event_id, lista_attesa.c.user_id == user_id))
+        db.session.commit()
+        return result.rowcount > 0
+
+    return _retry_when_locked(attempt)
+
+
+def waitlist_positions(event_ids, user_id):
+    """Posizione (1 = il prossimo) dell'utente nella lista d'attesa di ogni evento, in una sola query."""
+    if not event_ids:
+        return {}
+    mine = select(lista_attesa.c.event_id, lista_attesa.c.id) \
+        .where(lista_attesa.c.user_id == user_id, lista_attesa.c.event_id.in_(event_ids)) \
+        .subquery()
+    rows = db.session.execute(
+        select(mine.c.event_id, func.count(lista_attesa.c.id))
+        .join(lista_attesa, (lista_attesa.c.event_id == mine.c.event_id) & (lista_attesa.c.id <= mine.c.id))
+        .group_by(mine.c.event_id)
+    ).all()
+    return dict(rows)
+
+
+def clear_waitlist(event_id):
+    """Cancella la lista d'attesa di un evento (prima di eliminarlo). Non fa commit."""
+    db.session.execute(delete(lista_attesa).where(lista_attesa.c.event_id == event_id))
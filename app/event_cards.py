@@ -0,0 +1,168 @@
+# app/event_cards.py
+
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import List, Optional
+
+from flask import render_template
+
+from app import db
+from app.cache import get_cache, versioned_key
+from app.models import User, Event, partecipanti
+from app.geo import user_location, distance_km
+from app.enrollment import waitlist_positions
+
+
+# ==============================================================================
+# READ MODEL PER LE CARD DEGLI EVENTI
+# ==============================================================================
+# Le pagine /events e /index mostrano una card per ogni evento. Prima il template
+# interrogava le relazioni 'dynamic' (iscritti.count(), current_user in iscritti,
+# creatore.nome) card per card, con una query SQL per ogni accesso.
+# Qui raccogliamo tutto con un numero fisso di query raggruppate e passiamo al
+# template oggetti semplici, già calcolati.
+# La card è divisa in due: la parte comune (testi, creatore, partecipanti, con
+# il corpo già renderizzato) può stare in cache finché i dati non cambiano;
+# la parte personale (iscritto/creatore, distanza, lista d'attesa) viene
+# aggiunta per ogni richiesta, senza query tranne quella sulle liste d'attesa.
+
+@dataclass
+class EventCard:
+    """Dati di un evento pronti per essere mostrati in una card."""
+    id: int
+    titolo: str
+    tipologia: str
+    descrizione: Optional[str]
+    data_ora: datetime
+    luogo: str
+    max_partecipanti: int
+    livello_consigliato: str
+    creatore_id: Optional[int]
+    creatore_nome: Optional[str]
+    fine: Optional[datetime] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    iscritti: List[str] = field(default_factory=list)
+    iscritti_ids: List[int] = field(default_factory=list)
+    # Corpo della card renderizzato (uguale per tutti gli utenti)
+    html: str = ''
+    # Parti che dipendono dall'utente che guarda la pagina
+    is_iscritto: bool = False
+    is_creatore: bool = False
+    distanza_km: Optional[float] = None
+    posizione_attesa: Optional[int] = None
+
+    @property
+    def in_attesa(self):
+        return self.posizione_attesa is not None
+
+    @property
+    def num_iscritti(self):
+        return len(self.iscritti)
+
+    @property
+    def is_completo(self):
+        return self.num_iscritti >= self.max_partecipanti
+
+
+def _shared_cards(events):
+    """
+    Parte comune a tutti gli utenti delle card di una lista di eventi, con il
+    corpo della card già renderizzato. Due query: nomi dei creatori e partecipanti.
+    """
+    # Nomi dei creatori di tutti gli eventi della pagina, in un'unica query
+    creator_ids = {event.user_id for event in events if event.user_id is not None}
+    creator_names = dict(
+        db.session.query(User.id, User.nome).filter(User.id.in_(creator_ids)).all()
+    ) if creator_ids else {}
+
+    cards = {}
+    for event in events:
+        cards[event.id] = EventCard(
+            id=event.id,
+            titolo=event.titolo,
+            tipologia=event.tipologia,
+            descrizione=event.descrizione,
+            data_ora=event.data_ora,
+            fine=event.fine,
+            luogo=event.luogo,
+            max_partecipanti=event.max_partecipanti,
+            livello_consigliato=event.livello_consigliato,
+            creatore_id=event.user_id,
+            creatore_nome=creator_names.get(event.user_id),
+            lat=event.lat,
+            lon=event.lon,
+        )
+
+    # Tutti i partecipanti di tutti gli eventi della pagina, in un'unica query
+    rows = db.session.query(partecipanti.c.event_id, User.id, User.nome) \
+        .join(User, User.id == partecipanti.c.user_id) \
+        .filter(partecipanti.c.event_id.in_(list(cards))) \
+        .all()
+    for event_id, user_id, nome in rows:
+        cards[event_id].iscritti.append(nome)
+        cards[event_id].iscritti_ids.append(user_id)
+
+    for card in cards.values():
+        card.html = render_template('_event_card_body.html', event=card)
+    return cards
+
+
+def _personalize(cards, viewer):
+    """Copie delle card con le parti che dipendono dall'utente (le card in cache non si toccano)."""
+    viewer_id = viewer.id if viewer is not None and viewer.is_authenticated else None
+    center = user_location(viewer) if viewer_id is not None else None
+
+    result = []
+    for card in cards:
+        card = replace(card, is_iscritto=viewer_id in card.iscritti_ids,
+                       is_creatore=viewer_id is not None and card.creatore_id == viewer_id)
+        if center is not None and card.lat is not None:
+            card.distanza_km = distance_km(center[0], center[1], card.lat, card.lon)
+        result.append(card)
+
+    # Posizione dell'utente nelle liste d'attesa (solo eventi al completo a cui non è iscritto)
+    full = [card.id for card in result if card.is_completo and not card.is_iscritto]
+    if viewer_id is not None and full:
+        positions = waitlist_positions(full, viewer_id)
+        for card in result:
+            card.posizione_attesa = positions.get(card.id)
+    return result
+
+
+def build_event_cards(events, viewer):
+    """
+    Trasforma una lista di eventi in una lista di EventCard.
+
+    Le query eseguite sono al massimo tre, indipendentemente dal numero di
+    eventi: nomi dei creatori, partecipanti e posizione dell'utente nelle liste
+    d'attesa.
+    """
+    events = list(events)
+    if not events:
+        return []
+    cards = _shared_cards(events)
+    return _personalize([cards[event.id] for event in events], viewer)
+
+
+def build_event_cards_by_id(event_ids, viewer):
+    """
+    Come build_event_cards, partendo dagli id e usando la cache versionata
+    (vedi app/cache.py): solo gli eventi che non sono in cache vengono letti
+    dal database.
+    """
+    cache = get_cache()
+    shared = {}
+    for event_id in event_ids:
+        card = cache.get(versioned_key('event-card', event_id))
+        if card is not None:
+            shared[event_id] = card
+
+    missing = [event_id for event_id in event_ids if event_id not in shared]
+    if missing:
+        events = Event.query.filter(Event.id.in_(missing)).all()
+        for event_id, card in _shared_cards(events).items():
+            cache.set(versioned_key('event-card', event_id), card)
+            shared[event_id] = card
+
+    return _personalize([shared[event_id] for event_id in event_ids if event_id in shared], viewer)
@@ -76,7 +76,9 @@ class EventForm(FlaskForm):
         format='%Y-%m-%dT%H:%M',
         validators=[DataRequired()]
     )
+    durata = SelectField('Durata', choices=Event.DURATA_CHOICES, coerce=int, default=Event.DURATA_DEFAULT)
     luogo = StringField('Luogo (es. Tennis Club Milano)', validators=[DataRequired()])
+    cap = StringField('CAP del luogo (se vuoto, il tuo CAP)', validators=[Optional(), Length(min=5, max=5)])
     max_partecipanti = IntegerField('Numero massimo di partecipanti', validators=[DataRequired(), NumberRange(min=2, max=10)])
     livello_consigliato = SelectField(
         'Livello Consigliato',
@@ -85,10 +87,23 @@ class EventForm(FlaskForm):
     submit = SubmitField('Crea Evento')
 
 
+# Scelte comuni per i filtri di distanza (in km dal CAP dell'utente)
+DISTANZA_CHOICES = [
+    ('', 'Qualsiasi distanza'),
+    ('2', 'Entro 2 km'),
+    ('5', 'Entro 5 km'),
+    ('10', 'Entro 10 km'),
+    ('25', 'Entro 25 km')
+]
+
+
 class EventFilterForm(FlaskForm):
     """Form per filtrare gli eventi nella pagina dedicata."""
     query = StringField('Cerca per titolo o luogo', validators=[Optional(), Length(max=100)])
     data = DateField('Filtra per data', format='%Y-%m-%d', validators=[Optional()])
+    # Con 'al' la data diventa l'inizio di un intervallo di giorni
+    al = DateField('Fino al', format='%Y-%m-%d', validators=[Optional()])
+    libero = BooleanField('Solo quando sono libero')
     tipologia = SelectField(
         'Tipologia Evento',
         # Aggiunge l'opzione "Tutte" alla lista importata dal modello
@@ -97,6 +112,8 @@ class EventFilterForm(FlaskForm):
     )
 
     creatore = SelectField('Cerca per nome del creatore', choices=[('', 'Tutti i creatori')], validators=[Optional()])
+    distanza = SelectField('Distanza da te', choices=DISTANZA_CHOICES, validators=[Optional()])
+    ordina = SelectField('Ordina per', choices=[('data', 'Data'), ('distanza', 'Distanza')], default='data', validators=[Optional()])
     submit = SubmitField('Filtra Eventi')
 
 # ==============================================================================
@@ -104,6 +121,24 @@ class EventFilterForm(FlaskForm):
 # ==============================================================================
 
 class PlayerSearchForm(FlaskForm):
-    """Form per la ricerca di giocatori per nome."""
-    query = StringField('Nome del giocatore', validators=[DataRequired(), Length(min=1, max=64)])
-    submit = SubmitField('Cerca')
\ No newline at end of file
+    """Form per la ricerca di giocatori per nome e/o per distanza."""
+    query = StringField('Nome del giocatore', validators=[Optional(), Length(min=1, max=64)])
+    distanza = SelectField('Distanza da te', choices=DISTANZA_CHOICES, validators=[Optional()])
+    ordina = SelectField('Ordina per', choices=[('nome', 'Nome'), ('distanza', 'Distanza')], default='nome', validators=[Optional()])
+    submit = SubmitField('Cerca')
+
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        if not self.query.data and not self.distanza.data:
+            self.query.errors.append('Inserisci un nome oppure scegli una distanza.')
+            return False
+        return True
+# ==============================================================================
+# FORM PER I MESSAGGI DELLA CHAT
+# ==============================================================================
+
+class MessageForm(FlaskForm):
+    """Un messaggio in una stanza della chat (vedi app/chat.py)."""
+    testo = TextAreaField('Messaggio', validators=[DataRequired(), Length(max=1000)])
+    submit = SubmitField('Invia')
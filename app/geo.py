@@ -0,0 +1,156 @@
+# app/geo.py
+
+import csv
+import math
+import os
+
+from flask import current_app
+
+from app import db
+from app.models import User, Event, CapCentroid
+
+
+# ==============================================================================
+# RICERCA PER VICINANZA BASATA SUL CAP
+# ==============================================================================
+# Ogni utente ha un CAP obbligatorio e ogni evento può averne uno (altrimenti
+# si usa quello del creatore). Da una tabella di riferimento CAP -> centroide
+# ricaviamo latitudine e longitudine e le salviamo sulla riga, insieme alla
+# cella di una griglia regolare di circa 5,5 x 5,5 km (a queste latitudini).
+# Una ricerca "entro N km" legge con l'indice (cella_lat, cella_lon) solo le
+# celle che coprono il cerchio, e calcola la distanza solo su quelle righe.
+# La distanza è l'approssimazione equirettangolare (precisa per pochi km), che
+# si calcola in SQL con sole operazioni aritmetiche e si può usare per ordinare.
+
+DEFAULT_CAP_FILE = os.path.join(os.path.dirname(__file__), 'data', 'cap_centroidi.csv')
+
+KM_PER_DEG_LAT = 111.32
+LAT_STEP = 0.05     # ~5,6 km
+LON_STEP = 0.07     # ~5,5 km a 45° di latitudine
+
+
+def grid_cell(lat, lon):
+    """Cella della griglia che contiene il punto (lat, lon)."""
+    return math.floor(lat / LAT_STEP), math.floor(lon / LON_STEP)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Distanza in km tra due punti (formula dell'emisenoverso)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+# ------------------------------------------------------------------------------
+# Tabella di riferimento dei CAP
+# ------------------------------------------------------------------------------
+
+def _centroids():
+    """Dizionario CAP -> (lat, lon), letto una volta sola per processo."""
+    state = current_app.extensions.setdefault('geo', {})
+    if 'centroids' not in state:
+        state['centroids'] = {c.cap: (c.lat, c.lon) for c in CapCentroid.query.all()}
+    return state['centroids']
+
+
+def cap_location(cap):
+    """Restituisce (lat, lon) del centroide del CAP, oppure None se il CAP non è noto."""
+    if not cap:
+        return None
+    return _centroids().get(cap.strip())
+
+
+def localize(obj):
+    """Aggiorna posizione e cella di un User o di un Event a partire dal suo CAP."""
+    location = cap_location(obj.cap)
+    if location is None:
+        obj.lat = obj.lon = obj.cella_lat = obj.cella_lon = None
+        return
+    obj.lat, obj.lon = location
+    obj.cella_lat, obj.cella_lon = grid_cell(*location)
+
+
+def user_location(user):
+    """Posizione (lat, lon) dell'utente, oppure None se il suo CAP non è noto."""
+    if user.lat is None or user.lon is None:
+        return None
+    return user.lat, user.lon
+
+
+def load_cap_centroids(path=None):
+    """
+    Carica (o aggiorna) la tabella dei centroidi da un file CSV con colonne
+    cap, comune, lat, lon. Le righe che iniziano con '#' sono commenti.
+    Dopo il caricamento ricalcola posizione e cella di tutti gli utenti ed eventi.
+    """
+    path = path or DEFAULT_CAP_FILE
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = csv.DictReader(line for line in f if not line.startswith('#'))
+        centroids = {row['cap'].strip(): row for row in rows}
+
+    for cap, row in centroids.items():
+        db.session.merge(CapCentroid(cap=cap, comune=row.get('comune'),
+                                     lat=float(row['lat']), lon=float(row['lon'])))
+    db.session.flush()
+    current_app.extensions.setdefault('geo', {}).pop('centroids', None)
+    relocalize_all()
+    db.session.commit()
+    return len(centroids)
+
+
+def relocalize_all():
+    """Ricalcola in blocco posizione e cella di utenti ed eventi (una UPDATE per CAP)."""
+    params = []
+    for cap, (lat, lon) in _centroids().items():
+        cella_lat, cella_lon = grid_cell(lat, lon)
+        params.append({'c': cap, 'lat': lat, 'lon': lon, 'cl': cella_lat, 'co': cella_lon})
+    if not params:
+        return
+    for model in (User, Event):
+        table = model.__table__
+        db.session.execute(
+            table.update().where(table.c.cap == db.bindparam('c')).values(
+                lat=db.bindparam('lat'), lon=db.bindparam('lon'),
+                cella_lat=db.bindparam('cl'), cella_lon=db.bindparam('co')),
+            params
+        )
+
+
+# ------------------------------------------------------------------------------
+# Filtri e ordinamento per distanza
+# ------------------------------------------------------------------------------
+
+def _distance2_expr(model, center):
+    """Espressione SQL del quadrato della distanza (km²) dal centro, approssimazione equirettangolare."""
+    lat0, lon0 = center
+    kx = KM_PER_DEG_LAT * math.cos(math.radians(lat0))
+    dy = (model.lat - lat0) * KM_PER_DEG_LAT
+    dx = (model.lon - lon0) * kx
+    return dy * dy + dx * dx
+
+
+def within_radius(query, model, center, radius_km):
+    """Limita la query (su User o Event) alle righe entro radius_km dal centro."""
+    lat0, lon0 = center
+    dlat = radius_km / KM_PER_DEG_LAT
+    dlon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat0)), 0.01))
+    min_lat, min_lon = grid_cell(lat0 - dlat, lon0 - dlon)
+    max_lat, max_lon = grid_cell(lat0 + dlat, lon0 + dlon)
+    return query.filter(
+        model.cella_lat.between(min_lat, max_lat),
+        model.cella_lon.between(min_lon, max_lon),
+        _distance2_expr(model, center) <= radius_km * radius_km
+    )
+
+
+def with_distance(query, model, center):
+    """
+    Aggiunge alla query la colonna 'distanza2' (km² dal centro) da usare come
+    chiave di ordinamento. Le righe senza posizione vengono escluse.
+    Restituisce (query, colonna).
+    """
+    distance = _distance2_expr(model, center).label('distanza2')
+    query = query.filter(model.lat.isnot(None)).add_columns(distance)
+    return query, distance
@@ -0,0 +1,158 @@
+# app/identity_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import db
+from app.database import RoutingSession
+from app.models import User
+
+
+# ==============================================================================
+# CACHE IN MEMORIA DELL'UTENTE AUTENTICATO (user_loader)
+# ==============================================================================
+# Flask-Login chiama load_user a ogni richiesta autenticata, prima ancora della
+# view: senza cache è una SELECT garantita sul percorso più battuto.
+# Qui teniamo, per processo, i campi del profilo e i contatori degli ultimi
+# utenti caricati (LRU di USER_CACHE_SIZE voci, ognuna valida USER_CACHE_TTL
+# secondi). Da una voce in cache ricostruiamo un'istanza di User "persistente"
+# nella sessione corrente, senza query: la bacheca e il profilo, che mostrano
+# i contatori, non toccano la tabella degli utenti. Le relazioni
+# (eventi_iscritti, followed, ...) e la password_hash, che non vogliamo in
+# memoria, si caricano normalmente al primo accesso.
+# Ogni modifica di un utente fatta con l'ORM (account, quiz, cambio o rehash
+# della password, rally, ...) invalida la sua voce al flush e di nuovo al
+# commit; gli UPDATE diretti dei contatori (iscrizioni, eventi cancellati)
+# chiamano invalidate_users. I contatori in cache sono quindi una fotografia:
+# esatta nel processo che ha fatto la modifica, negli altri processi vecchia
+# al più di USER_CACHE_TTL secondi, come il resto della voce.
+# Con USER_CACHE_ENABLED = False (utile nei test) load_user legge sempre dal database.
+
+# Campi del profilo e contatori tenuti in cache
+CACHED_FIELDS = ('id', 'nome', 'cognome', 'data_di_nascita', 'email', 'cap', 'livello',
+                 'lat', 'lon', 'cella_lat', 'cella_lon',
+                 'num_eventi_creati', 'num_eventi_iscritti', 'num_followers', 'num_followed')
+
+
+class IdentityCache:
+    """Cache LRU con scadenza: user_id -> dizionario dei campi del profilo."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, fields):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, fields)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+def init_identity_cache(app):
+    if app.config['USER_CACHE_ENABLED']:
+        app.extensions['user_cache'] = IdentityCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+
+def _cache():
+    if has_app_context():
+        return current_app.extensions.get('user_cache')
+    return None
+
+
+def _from_fields(fields):
+    """Istanza di User persistente nella sessione corrente, costruita senza query."""
+    user = User(**fields)
+    # Ora l'istanza ha un'identità ed è "pulita", come se fosse stata letta dal database
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_user(user_id):
+    """user_loader di Flask-Login: prima la cache, poi il database."""
+    user_id = int(user_id)
+    cache = _cache()
+    if cache is not None:
+        fields = cache.get(user_id)
+        if fields is not None:
+            return _from_fields(fields)
+
+    user = db.session.get(User, user_id)
+    if user is not None and cache is not None:
+        cache.put(user_id, {name: getattr(user, name) for name in CACHED_FIELDS})
+    return user
+
+
+def invalidate_user(user_id):
+    cache = _cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+def invalidate_users(user_ids, session=None):
+    """
+    Invalida subito le voci degli utenti e di nuovo al commit della sessione.
+    Da chiamare dopo un UPDATE diretto (senza oggetti User) delle loro colonne.
+    """
+    session = session if session is not None else db.session
+    for user_id in user_ids:
+        invalidate_user(user_id)
+        session.info.setdefault('user_cache_invalidate', set()).add(user_id)
+
+
+# Invalidazione automatica: ogni UPDATE/DELETE di un User fatto con l'ORM
+@sa.event.listens_for(User, 'after_update')
+@sa.event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    session = sa.orm.object_session(target)
+    if session is not None:
+        invalidate_users([target.id], session)
+    else:
+        invalidate_user(target.id)
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    # Di nuovo dopo il commit: una richiesta concorrente potrebbe aver rimesso in
+    # cache i valori vecchi tra il flush e il commit
+    for user_id in session.info.pop('user_cache_invalidate', ()):
+        invalidate_user(user_id)
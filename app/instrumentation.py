@@ -0,0 +1,342 @@
+# app/instrumentation.py
+
+import bisect
+import hmac
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request, template_rendered, before_render_template
+
+
+# ==============================================================================
+# STRUMENTAZIONE: QUERY SQL, TEMPLATE E TEMPI PER RICHIESTA
+# ==============================================================================
+# Per ogni richiesta misuriamo, con gli eventi degli engine SQLAlchemy e i
+# segnali di Flask:
+# - numero di query e tempo totale passato nel database;
+# - tempo di rendering dei template;
+# - quante volte è stata eseguita la stessa istruzione (la sua "impronta":
+#   il testo SQL con le liste IN (?, ?, ...) ridotte a una). Se una stessa
+#   impronta si ripete almeno NPLUSONE_THRESHOLD volte è quasi sempre un
+#   problema N+1 (una query per ogni elemento di una lista): lo segnaliamo nel
+#   log, una volta per endpoint e impronta.
+# Le query più lente di SLOW_QUERY_MS finiscono nel log 'app.slow_query' (e nel
+# file SLOW_QUERY_LOG, se configurato). I parametri non vengono mai scritti.
+# Ogni risposta ha l'header Server-Timing (visibile negli strumenti del browser)
+# e i totali per endpoint sono su /metrics, in formato testo di Prometheus
+# (solo con il token METRICS_TOKEN).
+# Il costo è di due perf_counter() e qualche operazione su dizionari per query:
+# si può lasciare attivo in produzione (METRICS_ENABLED).
+# I totali sono per processo: con più worker ognuno ha i suoi.
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger('app.slow_query')
+
+# Limiti superiori (in secondi) degli intervalli dell'istogramma delle durate
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES_RE = re.compile(r'\s+')
+
+
+class RequestStats:
+    """Costi di una singola richiesta."""
+
+    __slots__ = ('start', 'queries', 'db_time', 'template_time', 'slow_queries', 'statements', 'templates')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.slow_queries = 0
+        self.statements = Counter()
+        self.templates = []         # pila degli istanti di inizio dei render in corso
+
+
+class EndpointStats:
+    """Totali di un endpoint da quando il processo è partito."""
+
+    def __init__(self):
+        self.requests = Counter()                       # stato HTTP -> richieste
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.slow_queries = 0
+        self.n_plus_one = 0
+
+
+class Metrics:
+    """Registro dei totali per endpoint, condiviso dai thread del processo."""
+
+    # Impronte già segnalate come N+1 oltre le quali non ne ricordiamo altre
+    MAX_REPORTED = 1000
+
+    def __init__(self, slow_query_ms, n_plus_one_threshold):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._reported = set()
+        self._fingerprints = {}
+
+    def fingerprint(self, statement):
+        """Il testo SQL normalizzato (memorizzato: le istruzioni distinte sono poche)."""
+        fingerprint = self._fingerprints.get(statement)
+        if fingerprint is None:
+            fingerprint = _IN_LIST_RE.sub('(?)', _SPACES_RE.sub(' ', statement).strip())
+            if len(self._fingerprints) < 10000:
+                self._fingerprints[statement] = fingerprint
+        return fingerprint
+
+    def record(self, endpoint, status, stats):
+        duration = time.perf_counter() - stats.start
+        repeated = [(fingerprint, n) for fingerprint, n in stats.statements.items()
+                    if n >= self.n_plus_one_threshold]
+        with self._lock:
+            totals = self.endpoints.get(endpoint)
+            if totals is None:
+                totals = self.endpoints[endpoint] = EndpointStats()
+            totals.requests[status] += 1
+            totals.buckets[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+            totals.duration += duration
+            totals.queries += stats.queries
+            totals.db_time += stats.db_time
+            totals.template_time += stats.template_time
+            totals.slow_queries += stats.slow_queries
+            if repeated:
+                totals.n_plus_one += 1
+            new = [(fingerprint, n) for fingerprint, n in repeated
+                   if (endpoint, fingerprint) not in self._reported]
+            if len(self._reported) < self.MAX_REPORTED:
+                self._reported.update((endpoint, fingerprint) for fingerprint, _ in new)
+        for fingerprint, n in new:
+            logger.warning('Possibile N+1 in %s: la stessa query eseguita %d volte in una richiesta: %s',
+                           endpoint, n, fingerprint[:500])
+        return duration
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: _copy(totals) for endpoint, totals in self.endpoints.items()}
+
+
+def _copy(totals):
+    copy = EndpointStats()
+    copy.__dict__.update(totals.__dict__)
+    copy.requests = Counter(totals.requests)
+    copy.buckets = list(totals.buckets)
+    return copy
+
+
+def _metrics():
+    return current_app.extensions.get('metrics')
+
+
+def _stats():
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+# ------------------------------------------------------------------------------
+# Eventi degli engine e segnali dei template
+# ------------------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = _stats()
+    if stats is None:
+        return
+    metrics = _metrics()
+    stats.queries += 1
+    stats.db_time += elapsed
+    stats.statements[metrics.fingerprint(statement)] += 1
+    if elapsed >= metrics.slow_query_seconds:
+        stats.slow_queries += 1
+        slow_query_logger.warning('%.1f ms in %s: %s', elapsed * 1000, request.endpoint,
+                                  _SPACES_RE.sub(' ', statement)[:1000])
+
+
+def _handle_error(exception_context):
+    # La query è fallita: after_cursor_execute non verrà chiamato
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None:
+        stats.templates.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None and stats.templates:
+        elapsed = time.perf_counter() - stats.templates.pop()
+        if not stats.templates:
+            # Solo i render più esterni: quelli annidati sono già compresi
+            stats.template_time += elapsed
+
+
+def instrument_engine(engine):
+    sa.event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    sa.event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    sa.event.listen(engine, 'handle_error', _handle_error)
+
+
+# ------------------------------------------------------------------------------
+# Hook delle richieste
+# ------------------------------------------------------------------------------
+
+def _before_request():
+    g.request_stats = RequestStats()
+
+
+def _after_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    duration = _metrics().record(request.endpoint or 'nessuno', response.status_code, stats)
+    if current_app.config['SERVER_TIMING']:
+        app_time = max(0.0, duration - stats.db_time - stats.template_time)
+        response.headers.add('Server-Timing', ', '.join((
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} query"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'app;dur={app_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        )))
+    return response
+
+
+def init_instrumentation(app, db):
+    """Da chiamare dopo init_database_profile: collega engine, segnali e hook delle richieste."""
+    config = app.config
+    if not config['METRICS_ENABLED']:
+        return
+    app.extensions['metrics'] = Metrics(config['SLOW_QUERY_MS'], config['NPLUSONE_THRESHOLD'])
+    with app.app_context():
+        instrument_engine(db.engine)
+    read_engine = app.extensions.get('db_read_engine')
+    if read_engine is not None:
+        instrument_engine(read_engine)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+    if config['SLOW_QUERY_LOG']:
+        handler = logging.FileHandler(config['SLOW_QUERY_LOG'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(process)d %(message)s'))
+        slow_query_logger.addHandler(handler)
+        slow_query_logger.setLevel(logging.WARNING)
+
+
+# ==============================================================================
+# /metrics: FORMATO TESTO DI PROMETHEUS
+# ==============================================================================
+
+def metrics_allowed():
+    """
+    /metrics richiede il token METRICS_TOKEN (header 'Authorization: Bearer ...');
+    senza token configurato non risponde a nessuno. Non ci fidiamo di
+    "viene da localhost": dietro un proxy sulla stessa macchina tutte le
+    richieste arrivano da 127.0.0.1.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        return False
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    """Totali per endpoint (e statistiche delle cache e della coda dei lavori) nel formato testo di Prometheus."""
+    snapshot = _metrics().snapshot()
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            rendered = ','.join(f'{key}="{_label(v)}"' for key, v in labels)
+            lines.append(f'{name}{{{rendered}}} {value}' if rendered else f'{name} {value}')
+
+    endpoints = sorted(snapshot.items())
+    family('tennis_requests_total', 'counter', 'Richieste servite, per endpoint e stato HTTP.',
+           [((('endpoint', e), ('status', status)), n)
+            for e, t in endpoints for status, n in sorted(t.requests.items())])
+
+    lines.append('# HELP tennis_request_duration_seconds Durata delle richieste, per endpoint.')
+    lines.append('# TYPE tennis_request_duration_seconds histogram')
+    for e, t in endpoints:
+        cumulative = 0
+        for bound, n in zip(DURATION_BUCKETS + ('+Inf',), t.buckets):
+            cumulative += n
+            lines.append(f'tennis_request_duration_seconds_bucket{{endpoint="{_label(e)}",le="{bound}"}} {cumulative}')
+        lines.append(f'tennis_request_duration_seconds_sum{{endpoint="{_label(e)}"}} {t.duration:.6f}')
+        lines.append(f'tennis_request_duration_seconds_count{{endpoint="{_label(e)}"}} {cumulative}')
+
+    for name, attr, help_text in (
+        ('tennis_db_queries_total', 'queries', 'Query SQL eseguite, per endpoint.'),
+        ('tennis_db_time_seconds_total', 'db_time', 'Tempo passato nel database, per endpoint.'),
+        ('tennis_template_time_seconds_total', 'template_time', 'Tempo di rendering dei template, per endpoint.'),
+        ('tennis_slow_queries_total', 'slow_queries', 'Query più lente di SLOW_QUERY_MS, per endpoint.'),
+        ('tennis_n_plus_one_requests_total', 'n_plus_one', 'Richieste con una query ripetuta (N+1), per endpoint.'),
+    ):
+        samples = []
+        for e, t in endpoints:
+            value = getattr(t, attr)
+            samples.append(((('endpoint', e),), f'{value:.6f}' if isinstance(value, float) else value))
+        family(name, 'counter', help_text, samples)
+
+    user_cache = current_app.extensions.get('user_cache')
+    if user_cache is not None:
+        stats = user_cache.stats()
+        family('tennis_user_cache_lookups_total', 'counter', "Letture della cache dell'utente autenticato.",
+               [((('result', 'hit'),), stats['hits']), ((('result', 'miss'),), stats['misses'])])
+        family('tennis_user_cache_evictions_total', 'counter', 'Voci uscite dalla cache per mancanza di spazio.',
+               [((), stats['evictions'])])
+        family('tennis_user_cache_entries', 'gauge', 'Voci nella cache degli utenti.', [((), stats['size'])])
+
+    hub = current_app.extensions.get('chat')
+    if hub is not None:
+        family('tennis_chat_streams', 'gauge', 'Stream SSE della chat aperti in questo processo.',
+               [((), hub.open_streams)])
+
+    if 'jobs' in current_app.extensions:
+        # Dalla tabella 'job': valori di tutti i processi, non solo di questo
+        from app.jobs import queue_stats
+        jobs = queue_stats()
+        family('tennis_jobs_queue_depth', 'gauge', 'Lavori non ancora finiti (o falliti), per tipo e stato.',
+               [((('tipo', tipo), ('stato', stato)), n) for (tipo, stato), n in sorted(jobs['depth'].items())])
+        family('tennis_jobs_oldest_ready_seconds', 'gauge', 'Attesa del lavoro pronto più vecchio, per tipo.',
+               [((('tipo', tipo),), f'{age:.3f}') for tipo, age in sorted(jobs['oldest_ready'].items())])
+        samples = []
+        for tipo, values in sorted(jobs['latency'].items()):
+            for q in (0.5, 0.95, 0.99):
+                samples.append(((('tipo', tipo), ('quantile', q)), f'{values[int(q * (len(values) - 1))]:.3f}'))
+        family('tennis_jobs_latency_seconds', 'summary',
+               "Dall'accodamento alla fine, lavori finiti negli ultimi JOBS_METRICS_WINDOW secondi.", samples)
+        for tipo, values in sorted(jobs['latency'].items()):
+            lines.append(f'tennis_jobs_latency_seconds_sum{{tipo="{_label(tipo)}"}} {sum(values):.3f}')
+            lines.append(f'tennis_jobs_latency_seconds_count{{tipo="{_label(tipo)}"}} {len(values)}')
+
+    return '\n'.join(lines) + '\n'
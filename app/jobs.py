@@ -0,0 +1,361 @@
+# app/jobs.py
+
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+from sqlalchemy import select, update, delete, func, and_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.database import RoutingSession
+from app.models import Job
+
+
+# ==============================================================================
+# CODA DEI LAVORI FUORI DALLE RICHIESTE
+# ==============================================================================
+# Le richieste non fanno il lavoro lento (email, copie nelle bacheche): salvano
+# un lavoro nella tabella 'job', nella loro stessa transazione, e rispondono.
+# Se la transazione fallisce il lavoro sparisce con lei; se riesce è durevole.
+# - enqueue(tipo, payload, chiave): con la chiave di idempotenza accodare due
+#   volte la stessa cosa (form inviato due volte, un lavoro che ne accoda altri
+#   e viene ripetuto) è innocuo: il secondo INSERT viene ignorato finché il
+#   primo resta nella tabella (JOBS_KEEP_HOURS dopo la fine).
+# - I worker prendono i lavori pronti a gruppi dello stesso tipo (fino al
+#   batch_size del tipo) con un solo UPDATE ... RETURNING: due worker non
+#   prendono mai lo stesso lavoro. Un lavoro rimasto 'in_corso' oltre
+#   JOBS_TIMEOUT (worker morto a metà) torna in coda con requeue_stale(),
+#   che i worker eseguono ogni minuto.
+# - Le scritture del gestore e lo stato 'fatto' vanno nella stessa
+#   transazione. Un errore rimette il lavoro in coda con attesa esponenziale
+#   (JOBS_RETRY_DELAY, poi il doppio a ogni tentativo, con un jitter casuale)
+#   fino a JOBS_MAX_ATTEMPTS tentativi; poi resta 'fallito' ('flask
+#   jobs-retry' lo rimette in coda). I gestori devono quindi essere ripetibili.
+# - Worker: JOBS_WORKERS thread in ogni processo dell'app, avviati alla prima
+#   richiesta e svegliati a ogni commit che accoda qualcosa, oppure un processo
+#   dedicato con 'flask jobs-worker'.
+# La contabilità della coda passa dalla connessione, non dalle query ORM della
+# sessione: così non fa aumentare la versione della cache (vedi app/cache.py).
+
+_HANDLERS = {}
+
+
+def job_handler(tipo, batch_size=1):
+    """
+    Registra la funzione che esegue i lavori di tipo 'tipo'. Riceve la lista
+    dei payload (al massimo batch_size: un numero o il nome di un'impostazione)
+    e può restituire {posizione: errore} per quelli non riusciti; un'eccezione
+    fa fallire tutto il gruppo. Le scritture vanno nella sessione, senza commit.
+    """
+    def decorator(fn):
+        _HANDLERS[tipo] = (fn, batch_size)
+        return fn
+    return decorator
+
+
+def _batch_size(tipo):
+    size = _HANDLERS[tipo][1]
+    return current_app.config[size] if isinstance(size, str) else size
+
+
+# ------------------------------------------------------------------------------
+# Accodamento (nella transazione della richiesta, senza commit)
+# ------------------------------------------------------------------------------
+
+def enqueue(tipo, payload, chiave=None, delay=0):
+    """Accoda un lavoro. payload: dati serializzabili in JSON; delay: secondi prima di eseguirlo."""
+    enqueue_many(tipo, [(payload, chiave)], delay)
+
+
+def enqueue_many(tipo, items, delay=0):
+    """Come enqueue, per più lavori dello stesso tipo: items = [(payload, chiave)]."""
+    if not items:
+        return
+    now = datetime.utcnow()
+    rows = [{'tipo': tipo, 'payload': json.dumps(payload, separators=(',', ':')), 'chiave': chiave,
+             'stato': Job.IN_CODA, 'tentativi': 0, 'eseguire_dopo': now + timedelta(seconds=delay),
+             'creato_il': now}
+            for payload, chiave in items]
+    conn = db.session.connection()
+    dialect = postgresql if conn.dialect.name == 'postgresql' else sqlite
+    conn.execute(dialect.insert(Job.__table__).on_conflict_do_nothing(index_elements=['chiave']), rows)
+    db.session.info['jobs_enqueued'] = True
+
+
+# ------------------------------------------------------------------------------
+# Esecuzione
+# ------------------------------------------------------------------------------
+
+def _ready(now):
+    """Lavori in coda e pronti: un intervallo dell'indice (stato, eseguire_dopo), già nell'ordine giusto."""
+    return and_(Job.stato == Job.IN_CODA, Job.eseguire_dopo <= now)
+
+
+def claim():
+    """
+    Prende in carico i lavori pronti più vecchi, tutti dello stesso tipo
+    (a parità di eseguire_dopo l'indice li tiene in ordine di id).
+    Restituisce (tipo, righe (id, payload, tentativi)), oppure (None, []). Fa commit.
+    """
+    now = datetime.utcnow()
+    order = (Job.eseguire_dopo, Job.id)
+    # Il tipo si legge in una transazione a parte: quella che prende i lavori
+    # comincia con la scrittura (vedi app/enrollment.py)
+    tipo = db.session.connection().execute(
+        select(Job.tipo).where(_ready(now)).order_by(*order).limit(1)).scalar()
+    db.session.commit()
+    if tipo is None:
+        return None, []
+    limit = _batch_size(tipo) if tipo in _HANDLERS else 1
+    ids = select(Job.id).where(_ready(now), Job.tipo == tipo).order_by(*order).limit(limit)
+    rows = db.session.connection().execute(
+        update(Job).where(Job.id.in_(ids), _ready(now))
+        .values(stato=Job.IN_CORSO, iniziato_il=now, tentativi=Job.tentativi + 1)
+        .returning(Job.id, Job.payload, Job.tentativi)).all()
+    db.session.commit()
+    return tipo, sorted(rows, key=lambda row: row.id)
+
+
+def _retry_delay(tentativi):
+    """Attesa prima del prossimo tentativo: raddoppia ogni volta, metà fissa e metà casuale."""
+    config = current_app.config
+    delay = min(config['JOBS_RETRY_DELAY'] * 2 ** (tentativi - 1), config['JOBS_RETRY_MAX_DELAY'])
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def _finish(rows, failures):
+    now = datetime.utcnow()
+    conn = db.session.connection()
+    done = [row.id for i, row in enumerate(rows) if i not in failures]
+    if done:
+        conn.execute(update(Job).where(Job.id.in_(done))
+                     .values(stato=Job.FATTO, finito_il=now, errore=None))
+    for i, error in failures.items():
+        row = rows[i]
+        if row.tentativi >= current_app.config['JOBS_MAX_ATTEMPTS']:
+            values = {'stato': Job.FALLITO, 'finito_il': now}
+        else:
+            values = {'stato': Job.IN_CODA, 'eseguire_dopo': now + _retry_delay(row.tentativi)}
+        conn.execute(update(Job).where(Job.id == row.id).values(errore=str(error)[:1000], **values))
+
+
+def run_batch(tipo, rows):
+    """Esegue un gruppo di lavori presi con claim() e ne registra l'esito. Fa commit."""
+    if tipo not in _HANDLERS:
+        current_app.logger.error('Lavori di tipo sconosciuto: %s', tipo)
+        failures = dict.fromkeys(range(len(rows)), f'tipo di lavoro sconosciuto: {tipo}')
+    else:
+        try:
+            failures = _HANDLERS[tipo][0]([json.loads(row.payload) for row in rows]) or {}
+            _finish(rows, failures)
+            db.session.commit()
+            return len(rows) - len(failures)
+        except Exception as exc:
+            db.session.rollback()
+            current_app.logger.exception('Lavori %s non riusciti (id %s)', tipo, [row.id for row in rows])
+            failures = dict.fromkeys(range(len(rows)), f'{type(exc).__name__}: {exc}')
+    _finish(rows, failures)
+    db.session.commit()
+    return 0
+
+
+def run_pending(max_batches=None):
+    """Esegue i lavori pronti, un gruppo alla volta, finché ce ne sono. Restituisce quanti ne ha presi."""
+    taken = batches = 0
+    while max_batches is None or batches < max_batches:
+        tipo, rows = claim()
+        if not rows:
+            break
+        run_batch(tipo, rows)
+        taken += len(rows)
+        batches += 1
+    return taken
+
+
+# ------------------------------------------------------------------------------
+# Manutenzione
+# ------------------------------------------------------------------------------
+
+def requeue_stale():
+    """
+    Rimette in coda i lavori rimasti 'in_corso' oltre JOBS_TIMEOUT (il worker
+    è morto a metà), o li segna falliti se hanno finito i tentativi. Fa commit.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=config['JOBS_TIMEOUT'])
+    conn = db.session.connection()
+    where = (Job.stato == Job.IN_CORSO, Job.eseguire_dopo < stale, Job.iniziato_il < stale)
+    failed = conn.execute(update(Job).where(*where, Job.tentativi >= config['JOBS_MAX_ATTEMPTS']).values(
+        stato=Job.FALLITO, finito_il=now, errore='interrotto: nessun esito entro JOBS_TIMEOUT')).rowcount
+    requeued = conn.execute(update(Job).where(*where).values(stato=Job.IN_CODA, eseguire_dopo=now)).rowcount
+    if requeued:
+        db.session.info['jobs_enqueued'] = True
+    db.session.commit()
+    return requeued + failed
+
+
+def prune():
+    """Cancella i lavori finiti da più di JOBS_KEEP_HOURS ore. Restituisce quanti. Fa commit."""
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config['JOBS_KEEP_HOURS'])
+    count = db.session.connection().execute(
+        delete(Job).where(Job.stato == Job.FATTO, Job.finito_il < cutoff)).rowcount
+    db.session.commit()
+    return count
+
+
+def retry_failed(tipo=None):
+    """Rimette in coda i lavori falliti (di un tipo o tutti), con i tentativi azzerati. Fa commit."""
+    query = update(Job).where(Job.stato == Job.FALLITO)
+    if tipo is not None:
+        query = query.where(Job.tipo == tipo)
+    count = db.session.connection().execute(query.values(
+        stato=Job.IN_CODA, tentativi=0, eseguire_dopo=datetime.utcnow(), finito_il=None)).rowcount
+    db.session.info['jobs_enqueued'] = True
+    db.session.commit()
+    return count
+
+
+def queue_stats():
+    """
+    Stato della coda per /metrics e 'flask jobs-status':
+    - 'depth': {(tipo, stato): lavori} (esclusi i finiti);
+    - 'oldest_ready': {tipo: secondi di attesa del lavoro pronto più vecchio};
+    - 'latency': {tipo: [secondi dall'accodamento alla fine]} dei lavori
+      finiti negli ultimi JOBS_METRICS_WINDOW secondi, in ordine crescente.
+    """
+    now = datetime.utcnow()
+    conn = db.session.connection()
+    depth = {(tipo, stato): n for tipo, stato, n in conn.execute(
+        select(Job.tipo, Job.stato, func.count())
+        .where(Job.stato.in_([Job.IN_CODA, Job.IN_CORSO, Job.FALLITO]))
+        .group_by(Job.tipo, Job.stato))}
+    oldest_ready = {tipo: (now - oldest).total_seconds() for tipo, oldest in conn.execute(
+        select(Job.tipo, func.min(Job.eseguire_dopo))
+        .where(Job.stato == Job.IN_CODA, Job.eseguire_dopo <= now)
+        .group_by(Job.tipo)) if oldest is not None}
+    since = now - timedelta(seconds=current_app.config['JOBS_METRICS_WINDOW'])
+    latency = {}
+    for tipo, creato_il, finito_il in conn.execute(
+            select(Job.tipo, Job.creato_il, Job.finito_il)
+            .where(Job.stato == Job.FATTO, Job.finito_il >= since)):
+        latency.setdefault(tipo, []).append((finito_il - creato_il).total_seconds())
+    for values in latency.values():
+        values.sort()
+    return {'depth': depth, 'oldest_ready': oldest_ready, 'latency': latency}
+
+
+# ==============================================================================
+# WORKER: THREAD CHE ESEGUONO I LAVORI
+# ==============================================================================
+# Un JobWorkers per app (app.extensions['jobs']). I thread partono alla prima
+# richiesta del processo (nei worker di serve.py, dopo il fork) e poi
+# aspettano: un commit che accoda lavori li sveglia subito, altrimenti
+# controllano la coda ogni JOBS_POLL_INTERVAL secondi (lavori accodati da
+# altri processi, tentativi rimandati). Ognuno ha il suo contesto dell'app,
+# quindi la sua sessione.
+
+class JobWorkers:
+    """Pool di thread che eseguono i lavori in coda."""
+
+    # Ogni quanti secondi uno dei thread rimette in coda i lavori interrotti
+    # e cancella quelli finiti da tempo
+    REQUEUE_EVERY = 60
+    PRUNE_EVERY = 3600
+
+    def __init__(self, app, threads, poll_interval):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._pid = None
+        self._pool = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._requeued_at = self._pruned_at = 0.0     # la prima volta subito
+
+    @property
+    def running(self):
+        return self._pid == os.getpid() and not self._stop.is_set()
+
+    def start(self):
+        """Avvia i thread, se non sono già attivi in questo processo."""
+        if not self.threads or self.running:
+            return
+        with self._lock:
+            if self.running:
+                return
+            # Primo avvio, oppure processo figlio: i thread del padre non esistono più
+            self._wakeup, self._stop = threading.Event(), threading.Event()
+            self._pool = [threading.Thread(target=self._run, name=f'jobs-{i}', daemon=True)
+                          for i in range(self.threads)]
+            for thread in self._pool:
+                thread.start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        if self.running:
+            self._wakeup.set()
+
+    def stop(self, timeout=None):
+        """Ferma i thread dopo il gruppo di lavori in corso."""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._pool:
+            thread.join(timeout)
+        self._pid = None
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    self._maintenance()
+                    taken = run_pending(max_batches=1)
+                except Exception:
+                    db.session.rollback()
+                    current_app.logger.exception('Errore nel worker dei lavori')
+                    taken = 0
+                if not taken:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+
+    def _maintenance(self):
+        now = time.monotonic()
+        with self._lock:
+            stale_due = now - self._requeued_at > self.REQUEUE_EVERY
+            prune_due = now - self._pruned_at > self.PRUNE_EVERY
+            if stale_due:
+                self._requeued_at = now
+            if prune_due:
+                self._pruned_at = now
+        if stale_due:
+            requeue_stale()
+        if prune_due:
+            prune()
+
+
+def init_jobs(app):
+    workers = JobWorkers(app, app.config['JOBS_WORKERS'], app.config['JOBS_POLL_INTERVAL'])
+    app.extensions['jobs'] = workers
+    app.before_request(workers.start)
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('jobs_enqueued', False) and has_app_context():
+        workers = current_app.extensions.get('jobs')
+        if workers is not None:
+            workers.wake()
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('jobs_enqueued', None)
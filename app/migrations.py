@@ -0,0 +1,449 @@
+# app/migrations.py
+
+import csv
+import math
+import os
+import re
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+
+# ==============================================================================
+# MIGRAZIONI DELLO SCHEMA CON STORICO VERSIONATO
+# ==============================================================================
+# reset_database.py cancella il database e lo ricrea: ogni modifica ai modelli
+# costava i dati. Ora lo schema ha una versione, salvata nella tabella
+# 'schema_version' (una riga per migrazione applicata), e ogni modifica è una
+# migrazione numerata qui sotto. 'flask db-upgrade' applica in ordine quelle
+# che mancano, ognuna nella sua transazione.
+# Regole per scriverle:
+# - una migrazione, una volta rilasciata, non si modifica più: se serve altro
+#   se ne aggiunge una nuova (e si aggiornano i modelli di conseguenza);
+# - usano solo SQL e le funzioni di questo file, non i modelli: devono dare lo
+#   stesso risultato anche quando i modelli saranno cambiati;
+# - sono idempotenti (IF NOT EXISTS, colonne aggiunte solo se mancano): così
+#   un database creato prima delle migrazioni, con db.create_all() in un
+#   momento qualsiasi, viene portato alla versione corrente senza errori;
+# - gli indici si creano con create_index(), fuori dalla transazione delle
+#   altre modifiche (vedi sotto).
+# Un database vuoto percorre tutte le migrazioni dalla prima: lo schema finale
+# deve coincidere con quello dei modelli ('flask db-status' lo controlla).
+
+MIGRATIONS = []
+
+
+def migration(version, name, transactional=True):
+    """Registra una migrazione. Con transactional=False la funzione gestisce da sola le transazioni."""
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, 'versioni delle migrazioni non in ordine'
+        MIGRATIONS.append((version, name, fn, transactional))
+        return fn
+    return register
+
+
+# ------------------------------------------------------------------------------
+# Funzioni di supporto
+# ------------------------------------------------------------------------------
+
+def _columns(conn, table):
+    return {column['name'] for column in sa.inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table, definition):
+    """ALTER TABLE ... ADD COLUMN, se la colonna non c'è già."""
+    name = definition.split()[0]
+    if name not in _columns(conn, table):
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {definition}')
+
+
+def create_index(engine, name, table, columns, unique=False):
+    """
+    Crea un indice senza bloccare il sito più del necessario:
+    - PostgreSQL: CREATE INDEX CONCURRENTLY, fuori da ogni transazione (letture
+      e scritture continuano durante la costruzione);
+    - SQLite: in una transazione breve e a sé stante. In WAL i lettori non si
+      fermano; gli scrittori aspettano (busy_timeout) solo per la durata della
+      costruzione. Poi ANALYZE aggiorna le statistiche per il planner.
+    """
+    columns_sql = ', '.join(columns)
+    unique_sql = 'UNIQUE ' if unique else ''
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql(
+                f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON "{table}" ({columns_sql})')
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON "{table}" ({columns_sql})')
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'ANALYZE "{table}"')
+
+
+def _ensure_version_table(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER NOT NULL PRIMARY KEY, '
+        'nome VARCHAR(200) NOT NULL, '
+        'applicata_il DATETIME NOT NULL)')
+
+
+def applied_versions(engine):
+    """{versione: (nome, data)} delle migrazioni già applicate."""
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {version: (name, applied) for version, name, applied
+                in conn.exec_driver_sql('SELECT version, nome, applicata_il FROM schema_version')}
+
+
+def pending(engine):
+    applied = applied_versions(engine)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def upgrade(engine, target=None, on_apply=None):
+    """Applica in ordine le migrazioni mancanti (fino a 'target'). Restituisce le versioni applicate."""
+    done = []
+    for version, name, fn, transactional in pending(engine):
+        if target is not None and version > target:
+            break
+        if on_apply:
+            on_apply(version, name)
+        if transactional:
+            with engine.begin() as conn:
+                fn(conn)
+                _record(conn, version, name)
+        else:
+            fn(engine)
+            with engine.begin() as conn:
+                _record(conn, version, name)
+        done.append(version)
+    return done
+
+
+def _record(conn, version, name):
+    conn.execute(sa.text('INSERT INTO schema_version (version, nome, applicata_il) VALUES (:v, :n, :d)'),
+                 {'v': version, 'n': name, 'd': datetime.utcnow()})
+
+
+def schema_drift(engine, metadata):
+    """
+    Differenze tra il database e i modelli: tabelle, colonne e indici che
+    mancano da una parte o dall'altra. Lista di stringhe leggibili.
+    """
+    inspector = sa.inspect(engine)
+    tables = set(inspector.get_table_names())
+    problems = []
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            problems.append(f'tabella mancante nel database: {table.name}')
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                problems.append(f'colonna mancante nel database: {table.name}.{column.name}')
+        for name in sorted(columns - {c.name for c in table.columns}):
+            problems.append(f'colonna non presente nei modelli: {table.name}.{name}')
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                problems.append(f'indice mancante nel database: {index.name}')
+        for name in sorted(indexes - {i.name for i in table.indexes}):
+            problems.append(f'indice non presente nei modelli: {name}')
+    return problems
+
+
+# ==============================================================================
+# STORICO DELLE MIGRAZIONI
+# ==============================================================================
+
+@migration(1, 'schema iniziale: utenti, eventi, partecipanti, rally')
+def _initial_schema(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS user ('
+        'id INTEGER NOT NULL, nome VARCHAR(64) NOT NULL, cognome VARCHAR(64), data_di_nascita DATE, '
+        'email VARCHAR(120) NOT NULL, cap VARCHAR(5) NOT NULL, password_hash VARCHAR(256), '
+        'livello VARCHAR(20), PRIMARY KEY (id))')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_user_nome ON user (nome)')
+    conn.exec_driver_sql('CREATE UNIQUE INDEX IF NOT EXISTS ix_user_email ON user (email)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_user_cognome ON user (cognome)')
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS rally ('
+        'follower_id INTEGER NOT NULL, followed_id INTEGER NOT NULL, '
+        'PRIMARY KEY (follower_id, followed_id), '
+        'FOREIGN KEY(follower_id) REFERENCES user (id), FOREIGN KEY(followed_id) REFERENCES user (id))')
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS event ('
+        'id INTEGER NOT NULL, titolo VARCHAR(100) NOT NULL, tipologia VARCHAR(50) NOT NULL, '
+        'descrizione VARCHAR(10000), data_ora DATETIME NOT NULL, luogo VARCHAR(100) NOT NULL, '
+        'max_partecipanti INTEGER NOT NULL, livello_consigliato VARCHAR(20) NOT NULL, user_id INTEGER, '
+        'PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_event_data_ora ON event (data_ora)')
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS partecipanti ('
+        'user_id INTEGER NOT NULL, event_id INTEGER NOT NULL, PRIMARY KEY (user_id, event_id), '
+        'FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(event_id) REFERENCES event (id))')
+
+
+@migration(2, 'ricerca full-text degli eventi (FTS5)')
+def _search_index(conn):
+    if conn.dialect.name != 'sqlite':
+        return
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_fts'").first()
+    if exists:
+        return
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE event_fts USING fts5(titolo, luogo, descrizione, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    conn.exec_driver_sql(
+        "INSERT INTO event_fts (rowid, titolo, luogo, descrizione) "
+        "SELECT id, titolo, luogo, coalesce(descrizione, '') FROM event")
+
+
+# Griglia di app/geo.py, copiata qui: la migrazione non deve cambiare se cambia geo.py
+_LAT_STEP, _LON_STEP = 0.05, 0.07
+
+
+@migration(3, 'posizione dal CAP: centroidi, coordinate e celle della griglia')
+def _geo(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS cap_centroid ('
+        'cap VARCHAR(5) NOT NULL, comune VARCHAR(100), lat FLOAT NOT NULL, lon FLOAT NOT NULL, '
+        'PRIMARY KEY (cap))')
+    for table in ('user', 'event'):
+        if table == 'event':
+            add_column(conn, 'event', 'cap VARCHAR(5)')
+        for definition in ('lat FLOAT', 'lon FLOAT', 'cella_lat INTEGER', 'cella_lon INTEGER'):
+            add_column(conn, table, definition)
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table}_cella ON "{table}" (cella_lat, cella_lon)')
+
+    # Gli eventi esistenti prendono il CAP del creatore (come fa create_event)
+    conn.exec_driver_sql(
+        'UPDATE event SET cap = (SELECT cap FROM user WHERE user.id = event.user_id) WHERE cap IS NULL')
+
+    # Centroidi inclusi nell'applicazione, poi posizione e cella di utenti ed eventi
+    path = os.path.join(os.path.dirname(__file__), 'data', 'cap_centroidi.csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [row for row in csv.DictReader(line for line in f if not line.startswith('#'))]
+    known = {cap for (cap,) in conn.exec_driver_sql('SELECT cap FROM cap_centroid')}
+    new = [{'cap': r['cap'].strip(), 'comune': r.get('comune'), 'lat': float(r['lat']), 'lon': float(r['lon'])}
+           for r in rows if r['cap'].strip() not in known]
+    if new:
+        conn.execute(sa.text('INSERT INTO cap_centroid (cap, comune, lat, lon) VALUES (:cap, :comune, :lat, :lon)'),
+                     new)
+    params = [{'c': cap, 'lat': lat, 'lon': lon,
+               'cl': math.floor(lat / _LAT_STEP), 'co': math.floor(lon / _LON_STEP)}
+              for cap, lat, lon in conn.exec_driver_sql('SELECT cap, lat, lon FROM cap_centroid')]
+    for table in ('user', 'event'):
+        if params:
+            conn.execute(sa.text(f'UPDATE "{table}" SET lat = :lat, lon = :lon, cella_lat = :cl, cella_lon = :co '
+                                 'WHERE cap = :c AND lat IS NULL'), params)
+
+
+@migration(4, 'contatori denormalizzati di eventi e utenti')
+def _counters(conn):
+    add_column(conn, 'event', "num_iscritti INTEGER DEFAULT '0' NOT NULL")
+    for name in ('num_eventi_creati', 'num_eventi_iscritti', 'num_followers', 'num_followed'):
+        add_column(conn, 'user', f"{name} INTEGER DEFAULT '0' NOT NULL")
+    # Valori calcolati dai dati (vedi app/counters.py)
+    conn.exec_driver_sql(
+        'UPDATE event SET num_iscritti = (SELECT count(*) FROM partecipanti WHERE event_id = event.id)')
+    conn.exec_driver_sql(
+        'UPDATE user SET '
+        'num_eventi_creati = (SELECT count(*) FROM event WHERE event.user_id = user.id), '
+        'num_eventi_iscritti = (SELECT count(*) FROM partecipanti WHERE partecipanti.user_id = user.id), '
+        'num_followers = (SELECT count(*) FROM rally WHERE rally.followed_id = user.id), '
+        'num_followed = (SELECT count(*) FROM rally WHERE rally.follower_id = user.id)')
+
+
+@migration(5, "lista d'attesa degli eventi al completo")
+def _waitlist(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS lista_attesa ('
+        'id INTEGER NOT NULL, event_id INTEGER NOT NULL, user_id INTEGER NOT NULL, '
+        'data_richiesta DATETIME NOT NULL, PRIMARY KEY (id), '
+        'CONSTRAINT uq_lista_attesa_event_user UNIQUE (event_id, user_id), '
+        'FOREIGN KEY(event_id) REFERENCES event (id), FOREIGN KEY(user_id) REFERENCES user (id))')
+
+
+@migration(6, 'attività e bacheche dei compagni di rally')
+def _timeline(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS attivita ('
+        'id INTEGER NOT NULL, user_id INTEGER NOT NULL, event_id INTEGER NOT NULL, '
+        'tipo VARCHAR(20) NOT NULL, data DATETIME NOT NULL, PRIMARY KEY (id), '
+        'FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(event_id) REFERENCES event (id))')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_attivita_user_id ON attivita (user_id)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_attivita_event_id ON attivita (event_id)')
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS timeline ('
+        'user_id INTEGER NOT NULL, attivita_id INTEGER NOT NULL, PRIMARY KEY (user_id, attivita_id), '
+        'FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(attivita_id) REFERENCES attivita (id))')
+
+
+@migration(7, 'indici per i percorsi di accesso reali', transactional=False)
+def _access_path_indexes(engine):
+    # Filtro per creatore, eventi creati da un utente
+    create_index(engine, 'ix_event_user_id', 'event', ['user_id'])
+    # Filtro per tipologia con ordinamento per data
+    create_index(engine, 'ix_event_tipologia_data_ora', 'event', ['tipologia', 'data_ora'])
+    # La chiave primaria (user_id, event_id) serve già gli eventi di un utente:
+    # manca il verso opposto, gli iscritti di un evento
+    create_index(engine, 'ix_partecipanti_event_id', 'partecipanti', ['event_id', 'user_id'])
+    # Idem per i rally: (follower_id, followed_id) è la chiave, servono i follower di un utente
+    create_index(engine, 'ix_rally_followed_id', 'rally', ['followed_id', 'follower_id'])
+    # Attività da togliere da tutte le bacheche (evento cancellato, iscrizione annullata)
+    create_index(engine, 'ix_timeline_attivita_id', 'timeline', ['attivita_id'])
+
+
+@migration(8, 'archivio degli eventi passati e storico delle partite', transactional=False)
+def _archive(engine):
+    with engine.begin() as conn:
+        _archive_tables(conn)
+    _event_autoincrement(engine)
+
+
+def _archive_tables(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS event_archivio ('
+        'id INTEGER NOT NULL, titolo VARCHAR(100) NOT NULL, tipologia VARCHAR(50) NOT NULL, '
+        'descrizione VARCHAR(10000), data_ora DATETIME NOT NULL, luogo VARCHAR(100) NOT NULL, '
+        "cap VARCHAR(5), max_partecipanti INTEGER NOT NULL, livello_consigliato VARCHAR(20) NOT NULL, "
+        "num_iscritti INTEGER DEFAULT '0' NOT NULL, user_id INTEGER, archiviato_il DATETIME NOT NULL, "
+        'PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_event_archivio_user_id ON event_archivio (user_id)')
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS partecipanti_archivio ('
+        'user_id INTEGER NOT NULL, event_id INTEGER NOT NULL, PRIMARY KEY (user_id, event_id), '
+        'FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(event_id) REFERENCES event_archivio (id))')
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS storico_partite ('
+        'user_id INTEGER NOT NULL, tipologia VARCHAR(50) NOT NULL, livello VARCHAR(20) NOT NULL, '
+        "partite INTEGER DEFAULT '0' NOT NULL, PRIMARY KEY (user_id, tipologia, livello), "
+        'FOREIGN KEY(user_id) REFERENCES user (id))')
+
+
+def _event_autoincrement(engine):
+    # Gli eventi archiviati conservano il loro id. Senza AUTOINCREMENT SQLite dà
+    # ai nuovi eventi max(id) + 1: cancellato o archiviato l'evento più recente,
+    # il suo id tornerebbe a un evento nuovo e si scontrerebbe con l'archivio.
+    # SQLite non sa aggiungere AUTOINCREMENT a una tabella esistente: la si
+    # ricrea con lo stesso schema e gli stessi dati, in una sola transazione.
+    # Con PostgreSQL gli id vengono già da una sequenza.
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.connect() as conn:
+        # DROP TABLE con le chiavi esterne attive cancellerebbe (o rifiuterebbe) le righe collegate
+        foreign_keys = conn.exec_driver_sql('PRAGMA foreign_keys').scalar()
+        if foreign_keys:
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        # Le DDL di pysqlite non aprono da sole una transazione
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        create = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'event'").scalar()
+        if 'AUTOINCREMENT' not in create.upper():
+            new, replaced = re.subn(r'^CREATE TABLE "?event"? \((\s*)id INTEGER NOT NULL,',
+                                    r'CREATE TABLE event_nuova (\1id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,',
+                                    create)
+            new, removed = re.subn(r',\s*PRIMARY KEY \(id\)', '', new)
+            if not (replaced and removed):
+                raise RuntimeError(f'schema della tabella event inatteso: {create}')
+            indexes = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'event' "
+                "AND sql IS NOT NULL").scalars().all()
+            columns = ', '.join(f'"{row[1]}"' for row in conn.exec_driver_sql('PRAGMA table_info(event)'))
+            conn.exec_driver_sql(new)
+            conn.exec_driver_sql(f'INSERT INTO event_nuova ({columns}) SELECT {columns} FROM event')
+            # Le chiavi esterne delle altre tabelle puntano al nome 'event', che resta lo stesso
+            conn.exec_driver_sql('DROP TABLE event')
+            conn.exec_driver_sql('ALTER TABLE event_nuova RENAME TO event')
+            for sql in indexes:
+                conn.exec_driver_sql(sql)
+        # Il prossimo id supera anche quelli già finiti in archivio
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'event'")
+        conn.exec_driver_sql(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'event', max("
+            "(SELECT coalesce(max(id), 0) FROM event), (SELECT coalesce(max(id), 0) FROM event_archivio))")
+        conn.commit()
+        if foreign_keys:
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+
+
+@migration(9, 'preferenze di orario per i consigli sugli eventi')
+def _time_preferences(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS preferenze_orario ('
+        'user_id INTEGER NOT NULL, fascia INTEGER NOT NULL, '
+        "iscrizioni INTEGER DEFAULT '0' NOT NULL, PRIMARY KEY (user_id, fascia), "
+        'FOREIGN KEY(user_id) REFERENCES user (id))')
+    if conn.exec_driver_sql('SELECT 1 FROM preferenze_orario LIMIT 1').first():
+        return
+    # Dalle iscrizioni esistenti, anche quelle in archivio. Fascia: giorno della
+    # settimana (0 = lunedì) * 3 + mattina (< 12) / pomeriggio (< 17) / sera
+    counts = {}
+    for user_id, data_ora in conn.exec_driver_sql(
+            'SELECT p.user_id, e.data_ora FROM partecipanti p JOIN event e ON e.id = p.event_id '
+            'UNION ALL '
+            'SELECT p.user_id, e.data_ora FROM partecipanti_archivio p JOIN event_archivio e ON e.id = p.event_id'):
+        if isinstance(data_ora, str):
+            data_ora = datetime.fromisoformat(data_ora)
+        fascia = data_ora.weekday() * 3 + (0 if data_ora.hour < 12 else 1 if data_ora.hour < 17 else 2)
+        counts[(user_id, fascia)] = counts.get((user_id, fascia), 0) + 1
+    if counts:
+        conn.execute(sa.text('INSERT INTO preferenze_orario (user_id, fascia, iscrizioni) VALUES (:u, :f, :n)'),
+                     [{'u': u, 'f': f, 'n': n} for (u, f), n in counts.items()])
+
+
+@migration(10, 'durata degli eventi, impegni degli utenti e indici per le sovrapposizioni', transactional=False)
+def _schedule(engine):
+    with engine.begin() as conn:
+        add_column(conn, 'event', "durata INTEGER DEFAULT '90' NOT NULL")
+        add_column(conn, 'event', 'fine DATETIME')
+        add_column(conn, 'event_archivio', "durata INTEGER DEFAULT '90' NOT NULL")
+        # Fine = data_ora + durata. Calcolata in Python e scritta con il tipo
+        # DateTime: il formato deve essere lo stesso delle date scritte dall'applicazione
+        rows = []
+        for event_id, data_ora, durata in conn.exec_driver_sql(
+                'SELECT id, data_ora, durata FROM event WHERE fine IS NULL'):
+            if isinstance(data_ora, str):
+                data_ora = datetime.fromisoformat(data_ora)
+            rows.append({'id': event_id, 'fine': data_ora + timedelta(minutes=durata)})
+        if rows:
+            conn.execute(sa.text('UPDATE event SET fine = :fine WHERE id = :id')
+                         .bindparams(sa.bindparam('fine', type_=sa.DateTime)), rows)
+
+        conn.exec_driver_sql(
+            'CREATE TABLE IF NOT EXISTS impegni ('
+            'event_id INTEGER NOT NULL, user_id INTEGER NOT NULL, '
+            'inizio DATETIME NOT NULL, fine DATETIME NOT NULL, PRIMARY KEY (event_id, user_id), '
+            'FOREIGN KEY(event_id) REFERENCES event (id), FOREIGN KEY(user_id) REFERENCES user (id))')
+        if not conn.exec_driver_sql('SELECT 1 FROM impegni LIMIT 1').first():
+            conn.exec_driver_sql(
+                'INSERT INTO impegni (event_id, user_id, inizio, fine) '
+                'SELECT p.event_id, p.user_id, e.data_ora, e.fine '
+                'FROM partecipanti p JOIN event e ON e.id = p.event_id')
+    create_index(engine, 'ix_impegni_user_inizio', 'impegni', ['user_id', 'inizio', 'fine'])
+    create_index(engine, 'ix_event_luogo_data_ora', 'event', ['luogo', 'data_ora', 'fine'])
+
+
+@migration(11, 'coda dei lavori fuori dalle richieste')
+def _jobs(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS job ('
+        'id INTEGER NOT NULL, tipo VARCHAR(50) NOT NULL, payload TEXT NOT NULL, chiave VARCHAR(200), '
+        'stato VARCHAR(10) NOT NULL, tentativi INTEGER NOT NULL, eseguire_dopo DATETIME NOT NULL, '
+        'creato_il DATETIME NOT NULL, iniziato_il DATETIME, finito_il DATETIME, errore VARCHAR(1000), '
+        'PRIMARY KEY (id), UNIQUE (chiave))')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_job_stato_eseguire_dopo ON job (stato, eseguire_dopo)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_job_stato_finito_il ON job (stato, finito_il)')
+
+
+@migration(12, 'messaggi delle chat tra giocatori')
+def _chat(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS messaggio ('
+        'id INTEGER NOT NULL, stanza VARCHAR(40) NOT NULL, user_id INTEGER NOT NULL, '
+        'testo VARCHAR(1000) NOT NULL, inviato_il DATETIME NOT NULL, '
+        'PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_messaggio_stanza_id ON messaggio (stanza, id)')
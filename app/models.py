@@ -1,15 +1,68 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.passwords import get_hasher
 from flask_login import UserMixin
+from datetime import datetime, timedelta
+from sqlalchemy.orm import validates
 
 partecipanti = db.Table('partecipanti',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True)
+    db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True),
+    # La chiave primaria serve gli eventi di un utente; questo indice gli iscritti di un evento
+    db.Index('ix_partecipanti_event_id', 'event_id', 'user_id')
+)
+# Lista d'attesa degli eventi al completo: l'ordine di arrivo (id crescente) decide
+# chi viene promosso quando si libera un posto (vedi app/enrollment.py).
+lista_attesa = db.Table('lista_attesa',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('event_id', db.Integer, db.ForeignKey('event.id'), nullable=False),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), nullable=False),
+    db.Column('data_richiesta', db.DateTime, nullable=False, default=datetime.utcnow),
+    db.UniqueConstraint('event_id', 'user_id', name='uq_lista_attesa_event_user')
+)
+# Bacheca precalcolata di ogni utente (vedi app/timeline.py): le attività delle
+# persone con cui fa rally, copiate qui al momento della scrittura (fan-out).
+timeline = db.Table('timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('attivita_id', db.Integer, db.ForeignKey('attivita.id'), primary_key=True),
+    # Per togliere un'attività da tutte le bacheche (vedi timeline._forget)
+    db.Index('ix_timeline_attivita_id', 'attivita_id')
+)
+# Iscrizioni degli eventi archiviati (vedi app/archive.py): la chiave inizia
+# con user_id, l'unico accesso è lo storico di un utente.
+partecipanti_archivio = db.Table('partecipanti_archivio',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('event_id', db.Integer, db.ForeignKey('event_archivio.id'), primary_key=True)
+)
+# Partite giocate da ogni utente negli eventi archiviati, per tipologia e livello
+storico_partite = db.Table('storico_partite',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('tipologia', db.String(50), primary_key=True),
+    db.Column('livello', db.String(20), primary_key=True),
+    db.Column('partite', db.Integer, nullable=False, default=0, server_default='0')
+)
+# Iscrizioni di ogni utente per fascia oraria della settimana (vedi app/recommendations.py)
+preferenze_orario = db.Table('preferenze_orario',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('fascia', db.Integer, primary_key=True),
+    db.Column('iscrizioni', db.Integer, nullable=False, default=0, server_default='0')
+)
+# Impegni di ogni utente: inizio e fine degli eventi a cui è iscritto, copiati
+# dalla tabella 'event' (vedi app/schedule.py). L'indice (user_id, inizio, fine)
+# trova le sovrapposizioni con una ricerca per intervallo, senza leggere tutte
+# le iscrizioni dell'utente.
+impegni = db.Table('impegni',
+    db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('inizio', db.DateTime, nullable=False),
+    db.Column('fine', db.DateTime, nullable=False),
+    db.Index('ix_impegni_user_inizio', 'user_id', 'inizio', 'fine')
 )
 # collega l'ID di chi segue (follower_id) a chi è seguito (followed_id).
 rally = db.Table('rally',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # Follower di un utente (la chiave primaria serve il verso opposto)
+    db.Index('ix_rally_followed_id', 'followed_id', 'follower_id')
 )
 
 class User(UserMixin, db.Model):
@@ -22,6 +75,18 @@ class User(UserMixin, db.Model):
     cap = db.Column(db.String(5), nullable=False)
     password_hash = db.Column(db.String(256))
     livello = db.Column(db.String(20), default='Principiante')
+    # Posizione ricavata dal CAP (vedi app/geo.py) e cella della griglia spaziale
+    lat = db.Column(db.Float)
+    lon = db.Column(db.Float)
+    cella_lat = db.Column(db.Integer)
+    cella_lon = db.Column(db.Integer)
+    # Contatori denormalizzati, aggiornati nella stessa transazione delle scritture
+    # su partecipanti/rally (vedi i metodi helper qui sotto e app/counters.py)
+    num_eventi_creati = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    num_eventi_iscritti = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    num_followers = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    num_followed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    __table_args__ = (db.Index('ix_user_cella', 'cella_lat', 'cella_lon'),)
     # Definiamo la relazione che ci permette di vedere con chi stiamo facendo rally.
     # 'followed' rappresenta la lista degli utenti che l'utente corrente sta seguendo.
     followed = db.relationship(
@@ -38,31 +103,69 @@ class User(UserMixin, db.Model):
     
     def start_rally(self, user):
         """Aggiunge un utente alla lista di quelli con cui facciamo rally."""
-        if not self.is_rallying(user):
+        if not self._rally_in_db(user):
             self.followed.append(user)
+            # Assegnare un'espressione SQL produce un UPDATE atomico (col = col + 1) al flush
+            self.num_followed = User.num_followed + 1
+            user.num_followers = User.num_followers + 1
+            # Le sue attività recenti entrano subito nella nostra bacheca
+            from app.timeline import backfill
+            backfill(self.id, user.id)
+            # ...e il grafo dei rally in memoria si aggiorna al commit
+            from app.rally_graph import record_rally
+            record_rally(self.id, user.id)
 
     def stop_rally(self, user):
         """Rimuove un utente dalla lista di quelli con cui facciamo rally."""
-        if self.is_rallying(user):
+        if self._rally_in_db(user):
             self.followed.remove(user)
+            self.num_followed = User.num_followed - 1
+            user.num_followers = User.num_followers - 1
+            # ...e ne escono quando smettiamo di fare rally
+            from app.timeline import purge
+            purge(self.id, user.id)
+            from app.rally_graph import record_rally
+            record_rally(self.id, user.id, added=False)
 
     def is_rallying(self, user):
         """Controlla se stiamo già facendo rally con un determinato utente."""
-        return self.followed.filter(
-            rally.c.followed_id == user.id).count() > 0
+        # Dal grafo in memoria (vedi app/rally_graph.py), se attivo
+        from app.rally_graph import get_graph
+        graph = get_graph()
+        if graph is not None:
+            return graph.is_following(self.id, user.id)
+        return self._rally_in_db(user)
+
+    def _rally_in_db(self, user):
+        """Come is_rallying, ma sempre dal database (da usare prima di scrivere)."""
+        return db.session.query(db.exists().where(
+            rally.c.follower_id == self.id, rally.c.followed_id == user.id)).scalar()
     
     def set_password(self, password):
         """Crea un hash sicuro della password."""
-        # Specifichiamo il metodo di hashing per massima compatibilità
-        self.password_hash = generate_password_hash(password, method='pbkdf2:sha256')
+        # L'hash viene calcolato nel pool di processi (vedi app/passwords.py),
+        # con il metodo configurato in PASSWORD_HASH_METHOD
+        self.password_hash = get_hasher().hash(password)
     
     def check_password(self, password):
         """Verifica se la password fornita corrisponde all'hash salvato."""
-        return check_password_hash(self.password_hash, password)
+        return get_hasher().verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """True se l'hash salvato usa parametri diversi da quelli configurati."""
+        return get_hasher().needs_rehash(self.password_hash)
 
     def __repr__(self):
         return f'<User {self.nome}>'
 
+def _fine_default(context):
+    """Default di Event.fine: vale anche per gli INSERT senza ORM (import, dati di prova)."""
+    params = context.get_current_parameters()
+    if params.get('data_ora') is None:
+        return None
+    return Event.calcola_fine(params['data_ora'], params.get('durata'))
+
+
 class Event(db.Model):
     """Modello per la tabella degli eventi."""
         # --- LISTE CENTRALIZZATE ---
@@ -78,19 +181,39 @@ class Event(db.Model):
         ('Avanzato', 'Avanzato'),
         ('Tutti', 'Tutti i livelli')
     ]
+    # Durata in minuti. DURATA_MAX limita la ricerca delle sovrapposizioni (vedi app/schedule.py)
+    DURATA_CHOICES = [
+        (60, '1 ora'),
+        (90, '1 ora e mezza'),
+        (120, '2 ore'),
+        (180, '3 ore'),
+        (240, '4 ore')
+    ]
+    DURATA_DEFAULT = 90
+    DURATA_MAX = max(value for value, _ in DURATA_CHOICES)
     # --- FINE LISTE ---
     id = db.Column(db.Integer, primary_key=True)
     titolo = db.Column(db.String(100), nullable=False)
     tipologia = db.Column(db.String(50), nullable=False)
     descrizione = db.Column(db.String(10000))
     data_ora = db.Column(db.DateTime, nullable=False, index=True)
-    # durata = db.Column(db.Integer, nullable=False )
+    durata = db.Column(db.Integer, nullable=False, default=DURATA_DEFAULT, server_default=str(DURATA_DEFAULT))
+    # data_ora + durata, calcolata a ogni INSERT e quando cambiano data_ora o durata
+    fine = db.Column(db.DateTime, default=_fine_default)
     luogo = db.Column(db.String(100), nullable=False)
+    # CAP del luogo, posizione ricavata dal CAP e cella della griglia spaziale
+    cap = db.Column(db.String(5))
+    lat = db.Column(db.Float)
+    lon = db.Column(db.Float)
+    cella_lat = db.Column(db.Integer)
+    cella_lon = db.Column(db.Integer)
     max_partecipanti = db.Column(db.Integer, nullable=False)
     livello_consigliato = db.Column(db.String(20), nullable=False)
+    # Contatore denormalizzato degli iscritti (vedi add_partecipante/remove_partecipante)
+    num_iscritti = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Chiave esterna per collegare l'evento al suo creatore
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     creatore = db.relationship('User')
 
     # Relazione Molti-a-Molti con gli utenti che partecipano
@@ -99,5 +222,152 @@ class Event(db.Model):
         backref=db.backref('eventi_iscritti', lazy='dynamic'),
         lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_event_cella', 'cella_lat', 'cella_lon'),
+        # Filtro per tipologia con ordinamento per data (pagina eventi)
+        db.Index('ix_event_tipologia_data_ora', 'tipologia', 'data_ora'),
+        # Eventi nello stesso luogo che si sovrappongono (vedi app/schedule.py)
+        db.Index('ix_event_luogo_data_ora', 'luogo', 'data_ora', 'fine'),
+        # Gli id non vengono mai riusati: in archivio (vedi app/archive.py) restano quelli originali
+        {'sqlite_autoincrement': True},
+    )
+
+    @staticmethod
+    def calcola_fine(data_ora, durata):
+        """Fine di un evento che inizia a data_ora e dura 'durata' minuti."""
+        return data_ora + timedelta(minutes=durata or Event.DURATA_DEFAULT)
+
+    @validates('data_ora', 'durata')
+    def _aggiorna_fine(self, key, value):
+        data_ora = value if key == 'data_ora' else self.data_ora
+        durata = value if key == 'durata' else self.durata
+        if data_ora is not None:
+            self.fine = Event.calcola_fine(data_ora, durata)
+        return value
+
+    def add_partecipante(self, user):
+        """Iscrive un utente all'evento e aggiorna i contatori nella stessa transazione."""
+        self.iscritti.append(user)
+        if self.id is None:
+            # Evento non ancora salvato: il valore va direttamente nell'INSERT
+            self.num_iscritti = (self.num_iscritti or 0) + 1
+        else:
+            self.num_iscritti = Event.num_iscritti + 1
+        user.num_eventi_iscritti = User.num_eventi_iscritti + 1
+
+    def remove_partecipante(self, user):
+        """Cancella l'iscrizione di un utente e aggiorna i contatori nella stessa transazione."""
+        self.iscritti.remove(user)
+        self.num_iscritti = Event.num_iscritti - 1
+        user.num_eventi_iscritti = User.num_eventi_iscritti - 1
+
     def __repr__(self):
         return f'<Event {self.tipologia} a {self.luogo}>'
+
+
+class Attivita(db.Model):
+    """Qualcosa che un utente ha fatto (creato un evento, si è iscritto), per le bacheche di chi fa rally con lui."""
+    CREATO = 'creato'
+    ISCRITTO = 'iscritto'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'), nullable=False, index=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    attore = db.relationship('User')
+    evento = db.relationship('Event')
+
+    def __repr__(self):
+        return f'<Attivita {self.user_id} {self.tipo} {self.event_id}>'
+
+
+class EventoArchiviato(db.Model):
+    """
+    Evento passato spostato fuori dalla tabella 'event' (vedi app/archive.py).
+    Conserva l'id originale; posizione e cella della griglia non servono più.
+    """
+    __tablename__ = 'event_archivio'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    titolo = db.Column(db.String(100), nullable=False)
+    tipologia = db.Column(db.String(50), nullable=False)
+    descrizione = db.Column(db.String(10000))
+    data_ora = db.Column(db.DateTime, nullable=False)
+    durata = db.Column(db.Integer, nullable=False, default=Event.DURATA_DEFAULT,
+                       server_default=str(Event.DURATA_DEFAULT))
+    luogo = db.Column(db.String(100), nullable=False)
+    cap = db.Column(db.String(5))
+    max_partecipanti = db.Column(db.Integer, nullable=False)
+    livello_consigliato = db.Column(db.String(20), nullable=False)
+    num_iscritti = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    archiviato_il = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    creatore = db.relationship('User')
+
+    def __repr__(self):
+        return f'<EventoArchiviato {self.tipologia} a {self.luogo}>'
+
+
+class CapCentroid(db.Model):
+    """Tabella di riferimento: centroide geografico di ogni CAP (caricata da app/data/cap_centroidi.csv)."""
+    cap = db.Column(db.String(5), primary_key=True)
+    comune = db.Column(db.String(100))
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<CapCentroid {self.cap} {self.comune}>'
+
+
+class Job(db.Model):
+    """Lavoro da eseguire fuori dalle richieste, in coda nel database (vedi app/jobs.py)."""
+    IN_CODA = 'in_coda'
+    IN_CORSO = 'in_corso'
+    FATTO = 'fatto'
+    FALLITO = 'fallito'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)       # JSON
+    # Chiave di idempotenza: un secondo lavoro con la stessa chiave viene ignorato
+    chiave = db.Column(db.String(200), unique=True)
+    stato = db.Column(db.String(10), nullable=False, default=IN_CODA)
+    tentativi = db.Column(db.Integer, nullable=False, default=0)
+    eseguire_dopo = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    creato_il = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    iniziato_il = db.Column(db.DateTime)
+    finito_il = db.Column(db.DateTime)
+    errore = db.Column(db.String(1000))
+
+    __table_args__ = (
+        # Lavori pronti, nell'ordine in cui vanno eseguiti
+        db.Index('ix_job_stato_eseguire_dopo', 'stato', 'eseguire_dopo'),
+        # Lavori finiti di recente (tempi in /metrics) e da cancellare
+        db.Index('ix_job_stato_finito_il', 'stato', 'finito_il'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.tipo} {self.stato}>'
+
+
+class Messaggio(db.Model):
+    """Messaggio di una chat (vedi app/chat.py). La tabella cresce solo: i messaggi non si modificano."""
+    __tablename__ = 'messaggio'
+    id = db.Column(db.Integer, primary_key=True)
+    # 'evento-<id>' (gli iscritti di un evento) oppure 'utenti-<id>-<id>' (due utenti, id crescenti)
+    stanza = db.Column(db.String(40), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    testo = db.Column(db.String(1000), nullable=False)
+    inviato_il = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    autore = db.relationship('User', lazy='joined')
+
+    __table_args__ = (
+        # Storico di una stanza, dal messaggio più recente
+        db.Index('ix_messaggio_stanza_id', 'stanza', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<Messaggio {self.id} {self.stanza}>'
@@ -0,0 +1,144 @@
+# app/notifications.py
+
+import hashlib
+import json
+from datetime import datetime
+
+from flask import current_app, render_template
+from sqlalchemy import select
+
+from app import db
+from app.jobs import enqueue, enqueue_many, job_handler
+from app.models import User, partecipanti
+
+
+# ==============================================================================
+# AVVISI AGLI ISCRITTI: EMAIL FUORI DALLE RICHIESTE
+# ==============================================================================
+# Quando il creatore modifica o cancella un evento, la richiesta accoda un solo
+# lavoro 'avviso-evento' (vedi app/jobs.py) con i dati dell'evento; per la
+# cancellazione anche gli iscritti, che dopo il commit non ci sono più.
+# Il worker legge gli indirizzi, prepara un'email per iscritto e le accoda
+# come lavori 'email' con chiave '<chiave dell'avviso>:<user_id>': se
+# l'avviso viene ripetuto, nessuno riceve due volte la stessa email.
+# Le email partono a gruppi di MAIL_BATCH_SIZE su una sola connessione SMTP.
+# Senza MAIL_SERVER le email vengono scritte nel log dell'applicazione; per
+# provarle con un server vero in locale c'è smtp_debug.py.
+
+# Campi che interessano a chi è iscritto, con il nome da mostrare nell'email
+CAMPI = {
+    'titolo': 'Titolo',
+    'tipologia': 'Tipologia',
+    'data_ora': 'Data e ora',
+    'durata': 'Durata (minuti)',
+    'luogo': 'Luogo',
+    'livello_consigliato': 'Livello consigliato',
+    'max_partecipanti': 'Posti',
+}
+
+
+def event_snapshot(event):
+    """I dati dell'evento che finiscono nell'avviso (da prendere prima di modificarlo)."""
+    values = {campo: getattr(event, campo) for campo in CAMPI}
+    values['data_ora'] = values['data_ora'].strftime('%d/%m/%Y %H:%M')
+    values['id'] = event.id
+    return values
+
+
+def _notice(tipo, evento, **extra):
+    """Accoda l'avviso. La chiave dipende dal contenuto: lo stesso form inviato due volte avvisa una volta."""
+    payload = {'tipo': tipo, 'evento': evento, 'quando': datetime.now().strftime('%d/%m/%Y %H:%M'), **extra}
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+    payload['chiave'] = f'avviso-evento:{evento["id"]}:{digest}'
+    enqueue('avviso-evento', payload, chiave=payload['chiave'])
+
+
+def notify_event_changed(before, event):
+    """Nella transazione della modifica: avvisa gli iscritti se è cambiato qualcosa che li riguarda."""
+    after = event_snapshot(event)
+    modifiche = [campo for campo in CAMPI if before[campo] != after[campo]]
+    if modifiche:
+        _notice('modificato', after, prima=before, modifiche=modifiche, autore_id=event.user_id)
+
+
+def notify_event_deleted(event):
+    """Da chiamare prima di cancellare l'evento: gli iscritti vengono letti adesso."""
+    iscritti = db.session.scalars(select(partecipanti.c.user_id).where(
+        partecipanti.c.event_id == event.id, partecipanti.c.user_id != event.user_id)).all()
+    if iscritti:
+        _notice('cancellato', event_snapshot(event), destinatari=iscritti)
+
+
+@job_handler('avviso-evento', batch_size=10)
+def _prepare_emails(payloads):
+    """Un'email per ogni iscritto, accodata come lavoro 'email'."""
+    for avviso in payloads:
+        if avviso['tipo'] == 'cancellato':
+            destinatari = select(User.id).where(User.id.in_(avviso['destinatari']))
+        else:
+            # Gli iscritti di adesso: chi si è cancellato nel frattempo non riceve niente
+            destinatari = select(partecipanti.c.user_id).where(
+                partecipanti.c.event_id == avviso['evento']['id'], partecipanti.c.user_id != avviso['autore_id'])
+        users = db.session.execute(
+            select(User.id, User.nome, User.email).where(User.id.in_(destinatari)).order_by(User.id)).all()
+        template = f'email/evento_{avviso["tipo"]}.txt'
+        subject = f'Evento {avviso["tipo"]}: {avviso["evento"]["titolo"]}'
+        enqueue_many('email', [
+            ({'a': user.email, 'oggetto': subject,
+              'testo': render_template(template, avviso=avviso, nome=user.nome, campi=CAMPI)},
+             f'{avviso["chiave"]}:{user.id}')
+            for user in users])
+
+
+# ------------------------------------------------------------------------------
+# Invio (SMTP)
+# ------------------------------------------------------------------------------
+
+def _connect(config):
+    import smtplib
+    smtp = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+    try:
+        if config['MAIL_USE_TLS']:
+            smtp.starttls()
+        if config['MAIL_USERNAME']:
+            smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
+
+
+def _message(mail, sender):
+    from email.message import EmailMessage
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = mail['a']
+    message['Subject'] = mail['oggetto']
+    message.set_content(mail['testo'])
+    return message
+
+
+@job_handler('email', batch_size='MAIL_BATCH_SIZE')
+def _send_emails(payloads):
+    """Manda un gruppo di email su una sola connessione SMTP."""
+    import smtplib
+    config = current_app.config
+    if not config['MAIL_SERVER']:
+        for mail in payloads:
+            current_app.logger.info('Email (MAIL_SERVER non impostato) a %s: %s\n%s',
+                                    mail['a'], mail['oggetto'], mail['testo'])
+        return {}
+    failures = {}
+    # Un errore di connessione qui fa ripetere tutto il gruppo
+    with _connect(config) as smtp:
+        for i, mail in enumerate(payloads):
+            try:
+                smtp.send_message(_message(mail, config['MAIL_SENDER']))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as exc:
+                # Rifiutata dal server: si ripete solo questa
+                failures[i] = f'{type(exc).__name__}: {exc}'
+            except (smtplib.SMTPServerDisconnected, OSError) as exc:
+                # Connessione persa a metà: quelle già inviate restano fatte
+                failures.update(dict.fromkeys(range(i, len(payloads)), f'{type(exc).__name__}: {exc}'))
+                break
+    return failures
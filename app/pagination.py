@@ -0,0 +1,131 @@
+# app/pagination.py
+
+from datetime import datetime, date
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import tuple_
+
+
+# ==============================================================================
+# PAGINAZIONE A CURSORE (KEYSET)
+# ==============================================================================
+# Invece di LIMIT/OFFSET (che obbliga il database a scorrere tutte le righe
+# saltate) usiamo come "segnalibro" i valori delle colonne di ordinamento
+# dell'ultima riga vista: WHERE (a, b) > (:a, :b) ORDER BY a, b LIMIT n.
+# Così anche una pagina profonda costa quanto la prima.
+# Le colonne devono identificare univocamente una riga (es. (data_ora, id)).
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='keyset-cursor')
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+
+def encode_cursor(values, direction):
+    """Crea un cursore opaco (e firmato) a partire dai valori della chiave."""
+    return _serializer().dumps({'k': [_dump_value(v) for v in values], 'd': direction})
+
+
+def decode_cursor(token):
+    """Restituisce (valori, direzione) oppure None se il cursore non è valido."""
+    if not token:
+        return None
+    try:
+        data = _serializer().loads(token)
+        return [_load_value(v) for v in data['k']], data['d']
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    """Una pagina di risultati con i cursori per la pagina successiva e precedente."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate_keyset(query, columns, cursor=None, per_page=20, descending=False):
+    """
+    Restituisce una KeysetPage della query, ordinata in modo crescente su 'columns'
+    (decrescente con descending=True, es. prima i più recenti).
+
+    La query non deve avere un ORDER BY proprio: l'ordinamento viene applicato qui.
+    Il cursore è quello prodotto da una pagina precedente (next_cursor o prev_cursor).
+    Se la query restituisce righe (entità + colonne extra, es. la pertinenza di
+    una ricerca) gli elementi della pagina sono le entità, e i valori della chiave
+    vengono letti dalla riga.
+    """
+    decoded = decode_cursor(cursor)
+    key = tuple_(*columns)
+
+    if decoded is None:
+        values, direction = None, 'next'
+    else:
+        values, direction = decoded
+
+    # Andando avanti in ordine crescente (o indietro in ordine decrescente)
+    # cerchiamo chiavi maggiori del cursore, altrimenti minori
+    upward = (direction == 'prev') == descending
+    if values is not None:
+        query = query.filter(key > tuple_(*values) if upward else key < tuple_(*values))
+    query = query.order_by(*[c.asc() if upward else c.desc() for c in columns])
+
+    # Chiediamo una riga in più per sapere se esiste un'altra pagina
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([])
+
+    def key_of(row):
+        mapping = getattr(row, '_mapping', None)
+        if mapping is None:
+            return [getattr(row, c.key) for c in columns]
+        return [mapping[c.key] if c.key in mapping else getattr(row[0], c.key) for c in columns]
+
+    if direction == 'prev':
+        has_next, has_prev = values is not None, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+
+    items = [row[0] if hasattr(row, '_mapping') else row for row in rows]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(key_of(rows[-1]), 'next') if has_next else None,
+        prev_cursor=encode_cursor(key_of(rows[0]), 'prev') if has_prev else None,
+    )
@@ -0,0 +1,213 @@
+# app/passwords.py
+
+import multiprocessing
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app, has_app_context, has_request_context, request
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import Config
+
+
+# ==============================================================================
+# HASHING DELLE PASSWORD FUORI DAI THREAD DELLE RICHIESTE
+# ==============================================================================
+# pbkdf2 con un milione di iterazioni costa centinaia di millisecondi di CPU.
+# Eseguito dentro login() e register(), un'ondata di login (o un attacco di
+# credential stuffing) occupa tutti i worker e rallenta ogni altra pagina.
+# Qui l'hashing gira in un piccolo pool di processi:
+# - il pool ha PASSWORD_HASH_WORKERS processi, quindi al massimo quei core sono
+#   dedicati alle password e il resto resta libero per le pagine;
+# - le richieste in coda sono al massimo PASSWORD_HASH_QUEUE: oltre quel limite
+#   rispondiamo subito con HashingBusy (la view restituisce 503 + Retry-After)
+#   invece di accumulare attese;
+# - se il metodo di hashing configurato cambia, al primo login riuscito la
+#   password viene ricalcolata con i nuovi parametri (rehash trasparente).
+# Con PASSWORD_HASH_WORKERS = 0 l'hashing resta nel thread della richiesta.
+
+class HashingBusy(Exception):
+    """Troppe richieste di hashing in coda: riprovare più tardi."""
+
+
+class PasswordHasher:
+    """Pool di processi per generare e verificare gli hash, con coda limitata."""
+
+    def __init__(self, method, workers, queue_size, timeout):
+        self.method = method
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Creato alla prima richiesta; 'spawn' evita di copiare con fork lo stato
+        # (lock, connessioni) dei thread del server
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self._slots is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._pool().submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingBusy()
+        except BrokenProcessPool:
+            # Un processo è morto: il pool verrà ricreato alla prossima richiesta
+            self.shutdown()
+            raise HashingBusy()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash_many(self, passwords):
+        """
+        Hash di più password in parallelo su tutti i processi del pool, senza
+        limiti di coda: per i comandi offline (import), non per le richieste.
+        """
+        passwords = list(passwords)
+        if not self._workers or len(passwords) < 2:
+            return [generate_password_hash(password, self.method) for password in passwords]
+        chunksize = max(1, len(passwords) // (self._workers * 4))
+        return list(self._pool().map(partial(generate_password_hash, method=self.method),
+                                     passwords, chunksize=chunksize))
+
+    def needs_rehash(self, password_hash):
+        """True se l'hash è stato generato con parametri diversi da quelli configurati."""
+        return bool(password_hash) and password_hash.split('$', 1)[0] != self.method
+
+    def reset_after_fork(self):
+        """Nel processo figlio dopo un fork: il pool (e il lock) del padre non sono utilizzabili."""
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def init_passwords(app):
+    """Crea il pool di hashing e i limitatori dei tentativi di login per l'app."""
+    config = app.config
+    app.extensions['passwords'] = {
+        'hasher': PasswordHasher(config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_WORKERS'],
+                                 config['PASSWORD_HASH_QUEUE'], config['PASSWORD_HASH_TIMEOUT']),
+        'account_throttle': SlidingWindowThrottle(config['LOGIN_MAX_ATTEMPTS_ACCOUNT'],
+                                                  config['LOGIN_THROTTLE_WINDOW']),
+        'ip_throttle': SlidingWindowThrottle(config['LOGIN_MAX_ATTEMPTS_IP'],
+                                             config['LOGIN_THROTTLE_WINDOW']),
+    }
+
+
+def get_hasher():
+    """
+    L'hasher dell'app corrente durante le richieste. Fuori dalle richieste
+    (comandi CLI, script) l'hashing avviene direttamente, con lo stesso metodo.
+    """
+    if has_request_context() and 'passwords' in current_app.extensions:
+        return current_app.extensions['passwords']['hasher']
+    method = current_app.config['PASSWORD_HASH_METHOD'] if has_app_context() else Config.PASSWORD_HASH_METHOD
+    return PasswordHasher(method, workers=0, queue_size=0, timeout=None)
+
+
+# ==============================================================================
+# LIMITE AI TENTATIVI DI LOGIN (FINESTRA SCORREVOLE, IN MEMORIA)
+# ==============================================================================
+# Per ogni chiave (email o indirizzo IP) teniamo gli istanti dei tentativi
+# falliti degli ultimi LOGIN_THROTTLE_WINDOW secondi. Superato il limite, i
+# nuovi tentativi vengono rifiutati (429) prima di calcolare qualsiasi hash.
+# I contatori sono per processo: con più processi il limite effettivo si
+# moltiplica per il numero di processi, che per questo scopo va bene.
+
+class SlidingWindowThrottle:
+    """Limita il numero di eventi per chiave in una finestra scorrevole di 'window' secondi."""
+
+    # Oltre questo numero di chiavi si fa pulizia di quelle scadute
+    MAX_KEYS = 100000
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, hits, now):
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+    def retry_after(self, key):
+        """0 se la chiave può riprovare, altrimenti i secondi da attendere."""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if not hits:
+                return 0
+            self._expire(hits, now)
+            if len(hits) < self.limit:
+                return 0
+            return max(1, int(hits[0] + self.window - now) + 1)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._hits) >= self.MAX_KEYS:
+                self._purge(now)
+            hits = self._hits.setdefault(key, deque())
+            self._expire(hits, now)
+            hits.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def _purge(self, now):
+        for key in list(self._hits):
+            self._expire(self._hits[key], now)
+            if not self._hits[key]:
+                del self._hits[key]
+
+
+def client_ip():
+    """
+    Indirizzo del client per i limiti per IP. Dietro un proxy è l'indirizzo
+    che il proxy mette in X-Forwarded-For (ProxyFix, vedi TRUSTED_PROXIES):
+    senza, tutti i client avrebbero l'IP del proxy e un solo contatore.
+    """
+    return request.remote_addr or '-'
+
+
+def login_retry_after(email, ip):
+    """Secondi di attesa imposti all'account o all'IP (0 = nessun blocco)."""
+    state = current_app.extensions['passwords']
+    return max(state['account_throttle'].retry_after(email.lower()),
+               state['ip_throttle'].retry_after(ip))
+
+
+def record_login_failure(email, ip):
+    state = current_app.extensions['passwords']
+    state['account_throttle'].hit(email.lower())
+    state['ip_throttle'].hit(ip)
+
+
+def record_login_success(email):
+    current_app.extensions['passwords']['account_throttle'].reset(email.lower())
@@ -0,0 +1,356 @@
+# app/rally_graph.py
+
+import itertools
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+from sqlalchemy import select, func, union_all
+
+from app import db
+from app.cache import cached, versioned_key
+from app.database import RoutingSession
+from app.models import User, rally, partecipanti, partecipanti_archivio
+
+
+# ==============================================================================
+# GRAFO DEI RALLY IN MEMORIA (CSR)
+# ==============================================================================
+# "Facciamo già rally?", "quanti giocatori seguiamo in comune?" e "chi potrei
+# conoscere?" sono domande sul grafo dei rally che in SQL costano una query
+# ciascuna (o un doppio join per i compagni dei compagni). Qui teniamo, per
+# processo, tutta la tabella 'rally' in formato CSR (compressed sparse row):
+# - _out contiene gli id seguiti, utente dopo utente, ognuno in ordine
+#   crescente; quelli di u sono _out[_out_start[u]:_out_start[u + 1]];
+# - _in / _in_start lo stesso per i follower.
+# Sono array di interi a 4 byte (modulo 'array'): 8 byte per rally più 8 per
+# utente, contro le centinaia di un dizionario di insiemi. La verifica di un
+# rally è una ricerca binaria, le intersezioni lavorano su fette contigue.
+#
+# Gli array non si modificano: i rally iniziati o terminati dopo il
+# caricamento stanno in piccoli insiemi a parte (_added / _removed), che
+# start_rally e stop_rally aggiornano dopo il commit (vedi record_rally).
+# Gli altri processi li vedono con il controllo periodico: ogni
+# RALLY_GRAPH_CHECK_INTERVAL secondi si confronta l'impronta della tabella
+# (numero di righe e somma delle coppie) e, se è cambiata, il grafo viene
+# ricaricato in un thread mentre quello vecchio continua a rispondere.
+# Con serve.py il grafo è caricato nel master prima del fork, così gli array
+# sono condivisi tra i worker finché non vengono ricaricati.
+# Le scritture (start_rally, stop_rally) controllano sempre il database.
+
+class RallyGraph:
+    """Grafo dei rally: array CSR caricati dal database più le modifiche successive."""
+
+    def __init__(self, out_start, out, in_start, in_):
+        self._out_start, self._out = out_start, out
+        self._in_start, self._in = in_start, in_
+        self._added_out, self._added_in = {}, {}
+        self._removed_out, self._removed_in = {}, {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, connection):
+        """Legge tutta la tabella 'rally' (due letture ordinate, dagli indici)."""
+        size = (connection.scalar(select(func.max(User.id))) or 0) + 1
+        out_start, out = _csr(connection, rally.c.follower_id, rally.c.followed_id, size)
+        in_start, in_ = _csr(connection, rally.c.followed_id, rally.c.follower_id, size)
+        return cls(out_start, out, in_start, in_)
+
+    # ------------------------------------------------------------------ letture
+
+    @staticmethod
+    def _row(start, u):
+        if 0 <= u < len(start) - 1:
+            return start[u], start[u + 1]
+        return 0, 0
+
+    def _in_arrays(self, a, b):
+        lo, hi = self._row(self._out_start, a)
+        i = bisect_left(self._out, b, lo, hi)
+        return i < hi and self._out[i] == b
+
+    def is_following(self, a, b):
+        """True se l'utente a fa rally con b."""
+        if b in self._removed_out.get(a, ()):
+            return False
+        return b in self._added_out.get(a, ()) or self._in_arrays(a, b)
+
+    def _neighbours(self, start, targets, added, removed, u):
+        lo, hi = self._row(start, u)
+        result = set(targets[lo:hi])
+        result |= added.get(u, set())
+        result -= removed.get(u, set())
+        return result
+
+    def following(self, u):
+        """Insieme degli id con cui u fa rally."""
+        return self._neighbours(self._out_start, self._out, self._added_out, self._removed_out, u)
+
+    def followers(self, u):
+        """Insieme degli id che fanno rally con u."""
+        return self._neighbours(self._in_start, self._in, self._added_in, self._removed_in, u)
+
+    def mutual_count(self, a, b):
+        """Quanti giocatori seguono sia a sia b (rally in comune)."""
+        return len(self.following(a) & self.following(b))
+
+    def friends_of_friends(self, u):
+        """
+        Giocatori seguiti da quelli che u segue, esclusi u e chi segue già:
+        Counter id -> quanti dei suoi compagni di rally lo seguono.
+        """
+        mine = self.following(u)
+        counts = Counter()
+        for friend in mine:
+            counts.update(self.following(friend))
+        for known in mine | {u}:
+            counts.pop(known, None)
+        return counts
+
+    # --------------------------------------------------------------- modifiche
+
+    def apply(self, follower_id, followed_id, added):
+        """Registra un rally iniziato (added=True) o terminato dopo il caricamento."""
+        in_arrays = self._in_arrays(follower_id, followed_id)
+        with self._lock:
+            if added:
+                self._removed_out.get(follower_id, set()).discard(followed_id)
+                self._removed_in.get(followed_id, set()).discard(follower_id)
+                if not in_arrays:
+                    self._added_out.setdefault(follower_id, set()).add(followed_id)
+                    self._added_in.setdefault(followed_id, set()).add(follower_id)
+            else:
+                self._added_out.get(follower_id, set()).discard(followed_id)
+                self._added_in.get(followed_id, set()).discard(follower_id)
+                if in_arrays:
+                    self._removed_out.setdefault(follower_id, set()).add(followed_id)
+                    self._removed_in.setdefault(followed_id, set()).add(follower_id)
+
+    def sources(self):
+        """Id degli utenti che fanno rally con qualcuno (dagli array o dalle modifiche)."""
+        start = self._out_start
+        return {u for u in range(len(start) - 1) if start[u] < start[u + 1]} | set(self._added_out)
+
+    def memory_bytes(self):
+        """Memoria occupata dagli array CSR (le modifiche successive sono trascurabili)."""
+        return sum(a.buffer_info()[1] * a.itemsize for a in (self._out_start, self._out, self._in_start, self._in))
+
+    def __len__(self):
+        return len(self._out) + sum(map(len, self._added_out.values())) - sum(map(len, self._removed_out.values()))
+
+
+def _csr(connection, source, target, size):
+    """Array (inizi, destinazioni) della tabella 'rally' vista da 'source' verso 'target'."""
+    start = array('i', bytes(4 * (size + 1)))
+    for u, n in connection.execute(select(source, func.count()).group_by(source)):
+        start[u + 1] = n
+    for u in range(1, size + 1):
+        start[u] += start[u - 1]
+
+    # Un milione di righe: con il cursore DBAPI a blocchi, senza creare una Row per riga
+    targets = array('i')
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(str(select(target).order_by(source, target).compile(connection)))
+        while rows := cursor.fetchmany(50000):
+            targets.extend([row[0] for row in rows])
+    finally:
+        cursor.close()
+    return start, targets
+
+
+def fingerprint(connection):
+    """Impronta della tabella 'rally': cambia (quasi sempre) a ogni rally iniziato o terminato."""
+    return tuple(connection.execute(
+        select(func.count(), func.coalesce(func.sum(rally.c.follower_id * 1000003 + rally.c.followed_id), 0))).one())
+
+
+def differences(graph, connection):
+    """Rally diversi tra il grafo e il database: (solo nel database, solo nel grafo)."""
+    missing, extra = [], []
+
+    def compare(u, stored):
+        in_graph = graph.following(u)
+        missing.extend((u, v) for v in sorted(stored - in_graph))
+        extra.extend((u, v) for v in sorted(in_graph - stored))
+
+    rows = connection.execute(select(rally.c.follower_id, rally.c.followed_id).order_by(rally.c.follower_id))
+    checked = set()
+    for u, group in itertools.groupby(rows, key=lambda row: row[0]):
+        compare(u, {followed_id for _, followed_id in group})
+        checked.add(u)
+    # Chi nel grafo segue qualcuno ma nel database nessuno
+    for u in graph.sources() - checked:
+        compare(u, set())
+    return missing, extra
+
+
+# ------------------------------------------------------------------------------
+# Il grafo del processo
+# ------------------------------------------------------------------------------
+
+class RallyGraphCache:
+    """Tiene il grafo del processo e lo ricarica quando la tabella cambia altrove."""
+
+    def __init__(self, app, check_interval):
+        self.app = app
+        self.check_interval = check_interval
+        self.graph = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._replay = None     # modifiche arrivate durante un caricamento
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+
+    def get(self):
+        if self.graph is None:
+            self.reload()
+        elif self.check_interval and time.monotonic() - self._checked_at > self.check_interval:
+            self._checked_at = time.monotonic()
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return self.graph
+
+    def reload(self):
+        with self._loading:
+            with self._lock:
+                self._replay = []
+            with db.engine.connect() as conn:
+                current = fingerprint(conn)
+                graph = RallyGraph.load(conn)
+            with self._lock:
+                for change in self._replay:
+                    graph.apply(*change)
+                self.graph, self._fingerprint, self._replay = graph, current, None
+                self._checked_at = time.monotonic()
+
+    def _refresh(self):
+        if self._loading.locked():
+            return
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                current = fingerprint(conn)
+            if current != self._fingerprint:
+                self.reload()
+
+    def apply(self, changes):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            if self.graph is not None:
+                for change in changes:
+                    self.graph.apply(*change)
+        if self._fingerprint is not None:
+            # Le nostre modifiche non devono far ricaricare il grafo al prossimo controllo
+            count, total = self._fingerprint
+            for follower_id, followed_id, added in changes:
+                sign = 1 if added else -1
+                count, total = count + sign, total + sign * (follower_id * 1000003 + followed_id)
+            self._fingerprint = (count, total)
+
+
+def init_rally_graph(app):
+    if app.config['RALLY_GRAPH_ENABLED']:
+        app.extensions['rally_graph'] = RallyGraphCache(app, app.config['RALLY_GRAPH_CHECK_INTERVAL'])
+
+
+def _holder():
+    if has_app_context():
+        return current_app.extensions.get('rally_graph')
+    return None
+
+
+def get_graph():
+    """Il grafo dei rally del processo (caricato al primo uso), oppure None se disattivato."""
+    holder = _holder()
+    return holder.get() if holder is not None else None
+
+
+def warm_rally_graph(app):
+    """Carica il grafo subito (es. nel master di serve.py, prima del fork)."""
+    with app.app_context():
+        holder = _holder()
+        if holder is not None:
+            holder.reload()
+
+
+# ------------------------------------------------------------------------------
+# Aggiornamento dopo il commit
+# ------------------------------------------------------------------------------
+
+def record_rally(follower_id, followed_id, added=True):
+    """Da chiamare quando si inserisce o cancella una riga di 'rally': il grafo cambia al commit."""
+    db.session.info.setdefault('rally_graph', []).append((follower_id, followed_id, added))
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    changes = session.info.pop('rally_graph', None)
+    holder = _holder()
+    if changes and holder is not None:
+        holder.apply(changes)
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('rally_graph', None)
+
+
+# ------------------------------------------------------------------------------
+# Giocatori che potresti conoscere
+# ------------------------------------------------------------------------------
+
+@dataclass
+class Suggerimento:
+    """Un giocatore suggerito, con i motivi."""
+    id: int
+    nome: str
+    cognome: str
+    livello: str
+    rally_in_comune: int
+    partite_insieme: int
+    punteggio: float
+
+
+# Peso di ogni evento giocato insieme, rispetto a un compagno di rally in comune
+PESO_PARTITE = 1.0
+
+
+def _played_together(user_id, candidates):
+    """Eventi (attuali e in archivio) in comune tra user_id e ognuno dei candidati."""
+    together = union_all(*[
+        select(table.c.user_id).where(
+            table.c.event_id.in_(select(table.c.event_id).where(table.c.user_id == user_id)),
+            table.c.user_id.in_(candidates))
+        for table in (partecipanti, partecipanti_archivio)]).subquery()
+    return dict(db.session.execute(
+        select(together.c.user_id, func.count()).group_by(together.c.user_id)).all())
+
+
+def _suggest(user, k):
+    graph = get_graph()
+    if graph is None:
+        return []
+    counts = graph.friends_of_friends(user.id)
+    if not counts:
+        return []
+    # Le partite insieme solo per i più vicini nel grafo: una query sugli indici
+    shortlist = [uid for uid, _ in counts.most_common(current_app.config['RALLY_SUGGESTIONS_CANDIDATES'])]
+    played = _played_together(user.id, shortlist)
+    scores = {uid: counts[uid] + PESO_PARTITE * played.get(uid, 0) for uid in shortlist}
+    best = sorted(shortlist, key=lambda uid: (-scores[uid], uid))[:k]
+    users = {u.id: u for u in db.session.execute(
+        select(User.id, User.nome, User.cognome, User.livello).where(User.id.in_(best)))}
+    return [Suggerimento(id=uid, nome=users[uid].nome, cognome=users[uid].cognome, livello=users[uid].livello,
+                         rally_in_comune=counts[uid], partite_insieme=played.get(uid, 0), punteggio=scores[uid])
+            for uid in best if uid in users]
+
+
+def suggest_partners(user, k=None):
+    """I k giocatori che l'utente potrebbe conoscere (lista di Suggerimento), dalla cache se possibile."""
+    k = k or current_app.config['RALLY_SUGGESTIONS_COUNT']
+    return cached(versioned_key('suggerimenti', user.id, k), lambda: _suggest(user, k))
@@ -0,0 +1,240 @@
+# app/recommendations.py
+
+import heapq
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, delete, func, exists, union_all
+
+from app import db
+from app.cache import cached, versioned_key
+from app.database import upsert_add
+from app.geo import LAT_STEP, LON_STEP, within_radius, distance_km, user_location
+from app.models import (Event, EventoArchiviato, partecipanti, partecipanti_archivio, preferenze_orario,
+                        rally)
+
+
+# ==============================================================================
+# EVENTI CONSIGLIATI (BACHECA)
+# ==============================================================================
+# Per ogni utente diamo un punteggio agli eventi futuri con posti liberi a cui
+# non è iscritto, e mostriamo i migliori. Le caratteristiche usate:
+# - livello: User.livello contro Event.livello_consigliato ('Tutti' va bene a tutti);
+# - distanza tra il CAP dell'utente e quello dell'evento;
+# - posti liberi (un evento quasi vuoto ha più bisogno di giocatori);
+# - orario: quanto spesso l'utente si è iscritto in quella fascia della
+#   settimana (giorno + mattina/pomeriggio/sera), dalla tabella
+#   'preferenze_orario', aggiornata a ogni iscrizione (record_preference);
+# - compagni di rally già iscritti.
+# Consideriamo solo i prossimi RECOMMENDATIONS_DAYS giorni e non diamo un
+# punteggio a tutta la tabella per ogni richiesta:
+# - livello, distanza e posti liberi sono uguali per tutti gli utenti della
+#   stessa cella della griglia e dello stesso livello: la lista dei migliori
+#   RECOMMENDATIONS_CANDIDATES eventi della zona si calcola una volta e resta
+#   in cache (RECOMMENDATIONS_ZONE_TTL secondi) per tutti;
+# - a questa si aggiungono gli eventi dei compagni di rally nello stesso
+#   raggio (dalla chiave di 'partecipanti'), così un loro evento compare subito;
+# - i candidati vengono riletti (posti liberi attuali, iscrizioni dell'utente)
+#   e ordinati con la parte personale: orario preferito e compagni iscritti.
+# Le caratteristiche degli eventi (iscritti, data, posizione) sono colonne
+# della riga, aggiornate dalle scritture; quelle dell'utente sono la sua riga
+# e le sue preferenze. Il risultato resta in cache finché i dati non cambiano.
+
+# Peso di ogni caratteristica (i singoli punteggi sono tra 0 e 1)
+PESI = {'livello': 3.0, 'distanza': 2.0, 'orario': 1.5, 'amici': 2.0, 'posti': 0.5}
+
+_LIVELLI = {'Principiante': 0, 'Intermedio': 1, 'Avanzato': 2}
+
+# Distanza (km) a cui il punteggio della distanza vale 0,5
+_DISTANZA_MEZZA = 5.0
+
+
+def fascia(data_ora):
+    """Fascia oraria della settimana: giorno (0 = lunedì) * 3 + mattina (< 12) / pomeriggio (< 17) / sera."""
+    return data_ora.weekday() * 3 + (0 if data_ora.hour < 12 else 1 if data_ora.hour < 17 else 2)
+
+
+# ------------------------------------------------------------------------------
+# Preferenze di orario (aggiornate nella transazione delle iscrizioni)
+# ------------------------------------------------------------------------------
+
+def record_preferences(enrollments, delta=1):
+    """Aggiunge (o toglie, con delta=-1) le iscrizioni [(user_id, data_ora), ...] alle preferenze. Non fa commit."""
+    counts = Counter((user_id, fascia(data_ora)) for user_id, data_ora in enrollments)
+    upsert_add(db.session, preferenze_orario, ['user_id', 'fascia'], 'iscrizioni',
+               [{'user_id': user_id, 'fascia': f, 'iscrizioni': n * delta} for (user_id, f), n in counts.items()])
+
+
+def record_preference(user_id, event_id, delta=1):
+    """Come record_preferences, per una sola iscrizione (o cancellazione) a un evento."""
+    data_ora = db.session.scalar(select(Event.data_ora).where(Event.id == event_id))
+    if data_ora is not None:
+        record_preferences([(user_id, data_ora)], delta)
+
+
+def move_preferences(event_id, old_data_ora, new_data_ora=None):
+    """
+    L'evento ha cambiato orario (o, con new_data_ora=None, sta per essere
+    cancellato): sposta o toglie la fascia di tutti i suoi iscritti. Non fa commit.
+    """
+    if new_data_ora is not None and fascia(old_data_ora) == fascia(new_data_ora):
+        return
+    users = db.session.scalars(select(partecipanti.c.user_id).where(partecipanti.c.event_id == event_id)).all()
+    record_preferences([(user_id, old_data_ora) for user_id in users], -1)
+    if new_data_ora is not None:
+        record_preferences([(user_id, new_data_ora) for user_id in users])
+
+
+def rebuild_preferences():
+    """Ricalcola da zero tutte le preferenze (iscrizioni attuali e in archivio). Restituisce le righe scritte."""
+    enrollments = union_all(
+        select(partecipanti.c.user_id, Event.data_ora).join(Event, Event.id == partecipanti.c.event_id),
+        select(partecipanti_archivio.c.user_id, EventoArchiviato.data_ora)
+        .join(EventoArchiviato, EventoArchiviato.id == partecipanti_archivio.c.event_id))
+    counts = Counter()
+    for user_id, data_ora in db.session.execute(enrollments).yield_per(5000):
+        counts[(user_id, fascia(data_ora))] += 1
+    db.session.execute(delete(preferenze_orario))
+    if counts:
+        db.session.execute(preferenze_orario.insert(), [
+            {'user_id': user_id, 'fascia': f, 'iscrizioni': n} for (user_id, f), n in counts.items()])
+    db.session.commit()
+    return len(counts)
+
+
+# ------------------------------------------------------------------------------
+# Punteggio
+# ------------------------------------------------------------------------------
+
+@dataclass
+class Consiglio:
+    """Un evento consigliato, con i dati da mostrare e i motivi del punteggio."""
+    id: int
+    titolo: str
+    tipologia: str
+    data_ora: datetime
+    luogo: str
+    livello_consigliato: str
+    posti_liberi: int
+    distanza_km: float = None
+    amici: int = 0
+    punteggio: float = 0.0
+
+
+def _score_level(user_level, event_level):
+    if event_level == 'Tutti' or user_level not in _LIVELLI or event_level not in _LIVELLI:
+        return 0.75 if event_level == 'Tutti' else 0.5
+    return 1.0 - abs(_LIVELLI[user_level] - _LIVELLI[event_level]) / 2
+
+
+def _shared_scores(user_level, center, e):
+    """Punteggi che dipendono solo da livello e posizione dell'utente (uguali per tutta la zona)."""
+    scores = {
+        'livello': _score_level(user_level, e.livello_consigliato),
+        'posti': (e.max_partecipanti - e.num_iscritti) / e.max_partecipanti if e.max_partecipanti else 0.0,
+        'distanza': 0.5,
+    }
+    if center is not None and e.lat is not None:
+        scores['distanza'] = 1 / (1 + distance_km(center[0], center[1], e.lat, e.lon) / _DISTANZA_MEZZA)
+    return scores
+
+
+def _open_events(now):
+    """Eventi con posti liberi nei prossimi RECOMMENDATIONS_DAYS giorni."""
+    return Event.data_ora >= now, \
+        Event.data_ora < now + timedelta(days=current_app.config['RECOMMENDATIONS_DAYS']), \
+        Event.num_iscritti < Event.max_partecipanti
+
+
+def _zone_shortlist(cell, livello, now):
+    """
+    I RECOMMENDATIONS_CANDIDATES eventi migliori per la parte comune del
+    punteggio (livello, distanza dal centro della cella, posti liberi), per
+    tutti gli utenti della stessa cella e dello stesso livello.
+    """
+    center = None
+    query = select(Event.id, Event.livello_consigliato, Event.lat, Event.lon,
+                   Event.num_iscritti, Event.max_partecipanti).where(*_open_events(now))
+    if cell is not None:
+        center = ((cell[0] + 0.5) * LAT_STEP, (cell[1] + 0.5) * LON_STEP)
+        query = within_radius(query, Event, center, current_app.config['RECOMMENDATIONS_RADIUS_KM'])
+    scored = [(sum(PESI[name] * value for name, value in _shared_scores(livello, center, e).items()), e.id)
+              for e in db.session.execute(query)]
+    scored.sort(key=lambda pair: -pair[0])
+    return [event_id for _, event_id in scored[:current_app.config['RECOMMENDATIONS_CANDIDATES']]]
+
+
+def _candidates(user, now):
+    """
+    Candidati: la lista della zona (in cache per RECOMMENDATIONS_ZONE_TTL
+    secondi, condivisa) più gli eventi a cui sono iscritti i compagni di rally,
+    con quanti ce ne sono. Restituisce (ids, {event_id: compagni iscritti}).
+    """
+    cell = (user.cella_lat, user.cella_lon) if user.cella_lat is not None else None
+    ttl = current_app.config['RECOMMENDATIONS_ZONE_TTL']
+    # La chiave cambia ogni 'ttl' secondi: la lista si ricalcola anche con la cache su file
+    bucket = int(now.timestamp() // ttl)
+    zone = cached(f'consigli-zona:{cell}:{user.livello}:{bucket}',
+                  lambda: _zone_shortlist(cell, user.livello, now), ttl)
+
+    # Dai rally: seguiti -> loro iscrizioni (chiave di 'partecipanti') -> eventi,
+    # nello stesso raggio della zona (chi segue molti giocatori ne avrebbe centinaia)
+    query = select(partecipanti.c.event_id, func.count()) \
+        .select_from(rally) \
+        .join(partecipanti, partecipanti.c.user_id == rally.c.followed_id) \
+        .join(Event, Event.id == partecipanti.c.event_id) \
+        .where(rally.c.follower_id == user.id, *_open_events(now)) \
+        .group_by(partecipanti.c.event_id)
+    center = user_location(user)
+    if center is not None:
+        query = within_radius(query, Event, center, current_app.config['RECOMMENDATIONS_RADIUS_KM'])
+    friends = dict(db.session.execute(query).all())
+    return set(zone) | set(friends), friends
+
+
+def _recommend(user, k):
+    now = datetime.now()
+    ids, friends = _candidates(user, now)
+    if not ids:
+        return []
+
+    # Righe attuali dei candidati (posti liberi aggiornati), esclusi quelli a cui è già iscritto
+    enrolled = exists().where(partecipanti.c.event_id == Event.id, partecipanti.c.user_id == user.id)
+    events = db.session.execute(
+        select(Event.id, Event.titolo, Event.tipologia, Event.data_ora, Event.luogo, Event.livello_consigliato,
+               Event.lat, Event.lon, Event.num_iscritti, Event.max_partecipanti)
+        .where(Event.id.in_(ids), *_open_events(now), ~enrolled)).all()
+    preferences = dict(db.session.execute(
+        select(preferenze_orario.c.fascia, preferenze_orario.c.iscrizioni)
+        .where(preferenze_orario.c.user_id == user.id)).all())
+    favourite = max(preferences.values(), default=0)
+    center = user_location(user)
+
+    def score(e):
+        scores = _shared_scores(user.livello, center, e)
+        # Senza storico nessuna fascia è preferita alle altre
+        scores['orario'] = preferences.get(fascia(e.data_ora), 0) / favourite if favourite else 0.5
+        scores['amici'] = min(friends.get(e.id, 0), 3) / 3
+        return round(sum(PESI[name] * value for name, value in scores.items()), 4)
+
+    # I candidati possono essere centinaia: il Consiglio si costruisce solo per i primi k.
+    # A parità di punteggio, prima l'evento più vicino nel tempo
+    best = heapq.nsmallest(k, ((-score(e), e.data_ora, e.id, e) for e in events))
+    result = []
+    for punteggio, _, _, e in best:
+        c = Consiglio(id=e.id, titolo=e.titolo, tipologia=e.tipologia, data_ora=e.data_ora, luogo=e.luogo,
+                      livello_consigliato=e.livello_consigliato,
+                      posti_liberi=e.max_partecipanti - e.num_iscritti, amici=friends.get(e.id, 0),
+                      punteggio=-punteggio)
+        if center is not None and e.lat is not None:
+            c.distanza_km = distance_km(center[0], center[1], e.lat, e.lon)
+        result.append(c)
+    return result
+
+
+def recommend(user, k=None):
+    """I migliori k eventi per l'utente (lista di Consiglio), dalla cache se possibile."""
+    k = k or current_app.config['RECOMMENDATIONS_COUNT']
+    return cached(versioned_key('consigli', user.id, k), lambda: _recommend(user, k))
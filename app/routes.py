@@ -1,9 +1,26 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, abort
+from flask import Blueprint, render_template, flash, redirect, url_for, request, abort, current_app, make_response
 from app import db
 from app.forms import *
 from app.models import *
+from app.event_cards import build_event_cards_by_id
+from app.pagination import KeysetPage, paginate_keyset
+from app.cache import cached, versioned_key, conditional_get
+from app.timeline import record_activity, forget_event, feed_query
+from app.search import apply_event_search, index_event, unindex_event
+from app.database import read_only
+from app.instrumentation import metrics_allowed, render_metrics
+from app.counters import release_event_counters
+from app.archive import history_page, match_stats
+from app.recommendations import recommend, record_preferences, move_preferences
+from app.rally_graph import get_graph, suggest_partners
+from app.schedule import (user_conflicts, venue_is_busy, first_free_slot, only_when_free, add_commitment,
+                          move_commitments, forget_commitments)
+from app import enrollment, chat
+from app.notifications import event_snapshot, notify_event_changed, notify_event_deleted
+from app.passwords import HashingBusy, client_ip, login_retry_after, record_login_failure, record_login_success
+from app.geo import localize, user_location, within_radius, with_distance, distance_km
 from flask_login import current_user, login_user, logout_user, login_required 
-from datetime import datetime, date 
+from datetime import datetime, date, timedelta
 
 bp = Blueprint('main', __name__)
 
@@ -11,91 +28,192 @@ bp = Blueprint('main', __name__)
 @bp.route('/')
 @bp.route('/index')
 @login_required
+@read_only
+@conditional_get
 def index():
-    # Query per trovare tutti gli eventi futuri
-    today = date.today()
-    events = Event.query.filter(Event.data_ora >= today).order_by(Event.data_ora.asc()).all()
-
-    # --- NUOVA LOGICA: CALCOLO STATISTICHE UTENTE ---
-    eventi_partecipati = current_user.eventi_iscritti.count()
-    eventi_creati = Event.query.filter_by(creatore=current_user).count()
+    # Statistiche dell'utente (contatori denormalizzati)
+    eventi_partecipati = current_user.num_eventi_iscritti
+    eventi_creati = current_user.num_eventi_creati
+
+    # Attività dei compagni di rally, dalla bacheca precalcolata (vedi app/timeline.py),
+    # dalla più recente, una pagina alla volta
+    feed = paginate_keyset(
+        feed_query(current_user), [Attivita.id],
+        cursor=request.args.get('cursor'),
+        per_page=current_app.config['TIMELINE_PER_PAGE'],
+        descending=True
+    )
     
+    # Eventi consigliati per l'utente (vedi app/recommendations.py)
+    consigli = recommend(current_user)
+
     return render_template(
         'index.html', 
         title='Bacheca', 
-        events=events,
         eventi_partecipati=eventi_partecipati,
-        eventi_creati=eventi_creati
+        eventi_creati=eventi_creati,
+        feed=feed,
+        consigli=consigli
     )
 
 # ==============================================================================
 # PAGINA DEDICATA A TUTTI GLI EVENTI CON FILTRI
 # ==============================================================================
+def _creator_choices():
+    """Coppie (id, nome) degli utenti che hanno creato almeno un evento, ordinate per nome."""
+    def load():
+        rows = db.session.query(User.id, User.nome) \
+            .filter(User.id.in_(db.session.query(Event.user_id))) \
+            .order_by(User.nome).all()
+        return [(str(user_id), nome) for user_id, nome in rows]
+    return cached(versioned_key('creator-choices'), load)
+
 @bp.route('/events', methods=['GET', 'POST'])
 @login_required
+@read_only
+@conditional_get
 def events():
     form = EventFilterForm(request.form)
-    # --- NUOVA LOGICA: POPOLIAMO LA DROPDOWN DEI CREATORI ---
-    # 1. Troviamo gli ID di tutti gli utenti che sono creatori di almeno un evento
-    creator_ids = db.session.query(Event.user_id).distinct().all()
-    # 2. Trasformiamo la lista di tuple in una lista semplice di ID
-    creator_ids_list = [c[0] for c in creator_ids]
-    # 3. Recuperiamo gli oggetti User completi
-    creators = User.query.filter(User.id.in_(creator_ids_list)).order_by(User.nome).all()
-    # 4. Assegnamo le choices al campo del form
-    form.creatore.choices = [('', 'Tutti i creatori')] + [(str(u.id), u.nome) for u in creators]
-    # --- FINE NUOVA LOGICA ---
-
-
-    # Partiamo da una query di base: tutti gli eventi futuri, ordinati per data
-    query = Event.query.filter(Event.data_ora >= date.today()).order_by(Event.data_ora.asc())
+    # La dropdown dei creatori: utenti che hanno creato almeno un evento
+    # (in cache finché i dati non cambiano, vedi app/cache.py)
+    form.creatore.choices = [('', 'Tutti i creatori')] + _creator_choices()
+
+    # Partiamo da una query di base: tutti gli eventi futuri
+    # (l'ordinamento per data lo applica la paginazione a cursore)
+    query = Event.query.filter(Event.data_ora >= date.today())
+    rank = None
+    distance = None
+    # Filtri applicati: insieme alla versione dei dati fanno la chiave della cache
+    filters = {}
 
     # Applichiamo i filtri solo se il form viene inviato con metodo POST
     if request.method == 'POST' and form.validate():
         
-        # Filtro 1: Ricerca testuale per titolo o luogo
+        # Filtro 1: Ricerca testuale su titolo, luogo e descrizione (indice full-text)
         if form.query.data:
-            search_term = f"%{form.query.data}%"
-            # Usiamo db.or_ per cercare il termine in entrambe le colonne
-            query = query.filter(db.or_(Event.titolo.ilike(search_term), Event.luogo.ilike(search_term)))
+            query, rank = apply_event_search(query, form.query.data)
+            filters['query'] = form.query.data
         
-        # Filtro 2: Data esatta
-        if form.data.data:
+        # Filtro 2: Data esatta, oppure dal giorno 'data' (o da oggi) al giorno 'al'
+        if form.al.data:
+            if form.data.data:
+                query = query.filter(Event.data_ora >= form.data.data)
+                filters['data'] = form.data.data
+            query = query.filter(Event.data_ora < form.al.data + timedelta(days=1))
+            filters['al'] = form.al.data
+        elif form.data.data:
             # Filtriamo per la parte "data" del campo data_ora
             query = query.filter(db.func.date(Event.data_ora) == form.data.data)
+            filters['data'] = form.data.data
 
         # Filtro 3: Tipologia esatta
         if form.tipologia.data:
             query = query.filter(Event.tipologia == form.tipologia.data)
+            filters['tipologia'] = form.tipologia.data
             
         # Filtro 4: Nome del creatore
         if form.creatore.data:
             query = query.filter(Event.user_id == form.creatore.data)
+            filters['creatore'] = form.creatore.data
+
+        # Filtro 5 e ordinamento: distanza dal CAP dell'utente
+        if form.distanza.data or form.ordina.data == 'distanza':
+            center = user_location(current_user)
+            if center is None:
+                flash('Il tuo CAP non è presente nel nostro elenco: non possiamo filtrare per distanza.', 'info')
+            else:
+                filters['centro'] = center
+                if form.distanza.data:
+                    query = within_radius(query, Event, center, float(form.distanza.data))
+                    filters['distanza'] = form.distanza.data
+                if form.ordina.data == 'distanza':
+                    query, distance = with_distance(query, Event, center)
+                    filters['ordina'] = 'distanza'
+
+        # Filtro 6: solo gli eventi che non si sovrappongono ai miei impegni
+        # (il risultato dipende dall'utente: il suo id entra nella chiave della cache)
+        if form.libero.data:
+            query = only_when_free(query, current_user.id)
+            filters['libero'] = current_user.id
+
+    # Prendiamo solo la pagina richiesta, a partire dal cursore (se presente).
+    # Ordiniamo per distanza se richiesto, per pertinenza se c'è una ricerca
+    # testuale, altrimenti per data.
+    if distance is not None:
+        sort_key = [distance, Event.id]
+    elif rank is not None:
+        sort_key = [rank, Event.id]
+    else:
+        sort_key = [Event.data_ora, Event.id]
+    # In cache teniamo solo gli id della pagina e i cursori; le card arrivano
+    # a loro volta dalla cache, con le parti personali aggiunte sopra.
+    cursor = request.values.get('cursor')
+    per_page = current_app.config['EVENTS_PER_PAGE']
 
-    # Eseguiamo la query finale (filtrata o non) per ottenere la lista degli eventi
-    all_events = query.all()
-    
-    return render_template('events.html', title='Tutti gli Eventi', form=form, events=all_events)
+    def search():
+        page = paginate_keyset(query, sort_key, cursor=cursor, per_page=per_page)
+        return KeysetPage([event.id for event in page.items], page.next_cursor, page.prev_cursor)
+
+    key = versioned_key('event-list', date.today(), sorted(filters.items()), cursor, per_page)
+    page = cached(key, search)
+    all_events = build_event_cards_by_id(page.items, current_user)
+
+    # "Carica altri": restituiamo solo le card della pagina successiva
+    if request.values.get('partial'):
+        return render_template('_event_cards.html', events=all_events, page=page)
+
+    return render_template('events.html', title='Tutti gli Eventi', form=form, events=all_events, page=page)
 
 ################################################## EVENTS PART ##################################################
+def _check_schedule(form, event_id=None):
+    """
+    Controlla l'orario del form: il creatore non può avere un altro impegno
+    sovrapposto (errore sul campo, restituisce False); se il luogo è già
+    occupato lo segnala con il primo orario libero, ma l'evento si può creare.
+    """
+    inizio = form.data_ora.data
+    fine = Event.calcola_fine(inizio, form.durata.data)
+    conflicts = user_conflicts(current_user.id, inizio, fine, exclude=event_id)
+    if conflicts:
+        other = conflicts[0]
+        form.data_ora.errors.append(
+            f'Sei già iscritto a "{other.titolo}" dalle {other.data_ora:%H:%M} alle {other.fine:%H:%M} di quel giorno.')
+        return False
+    if venue_is_busy(form.luogo.data, inizio, fine, exclude=event_id):
+        libero = first_free_slot(form.luogo.data, inizio, form.durata.data)
+        consiglio = f' Il primo orario libero è {libero:%d/%m alle %H:%M}.' if libero else ''
+        flash(f'A {form.luogo.data} c\'è già un evento in quell\'orario.{consiglio}', 'warning')
+    return True
+
+
 @bp.route('/create_event', methods=['GET', 'POST'])
 @login_required
 def create_event():
     form = EventForm()
-    if form.validate_on_submit():
+    if form.validate_on_submit() and _check_schedule(form):
         event = Event(
             titolo=form.titolo.data,
             tipologia=form.tipologia.data,
             descrizione=form.descrizione.data,
             data_ora=form.data_ora.data,
+            durata=form.durata.data,
             luogo=form.luogo.data,
             max_partecipanti=form.max_partecipanti.data,
             livello_consigliato=form.livello_consigliato.data,
+            cap=form.cap.data or current_user.cap,
             creatore=current_user
         )
+        localize(event)
         # Aggiungiamo automaticamente il creatore come primo partecipante
-        event.iscritti.append(current_user)
+        event.add_partecipante(current_user)
+        current_user.num_eventi_creati = User.num_eventi_creati + 1
         db.session.add(event)
+        index_event(event)
+        # L'evento nuovo compare nelle bacheche di chi fa rally con noi
+        db.session.flush()
+        record_activity(current_user.id, event.id, Attivita.CREATO)
+        record_preferences([(current_user.id, event.data_ora)])
+        add_commitment(current_user.id, event.id)
         db.session.commit()
         flash('Il tuo evento è stato creato!', 'success')
         return redirect(url_for('main.index'))
@@ -106,24 +224,34 @@ def create_event():
 @login_required
 def join_event(event_id):
     event = Event.query.get_or_404(event_id)
-    if event.iscritti.count() >= event.max_partecipanti:
-        flash('Questo evento è al completo!', 'error')
-    elif current_user in event.iscritti:
+    # Controllo dei posti e iscrizione in un'unica operazione atomica (vedi app/enrollment.py)
+    esito = enrollment.join_event(event.id, current_user.id)
+    if esito == enrollment.ISCRITTO:
+        flash('Ti sei iscritto all\'evento con successo!', 'success')
+    elif esito == enrollment.GIA_ISCRITTO:
         flash('Sei già iscritto a questo evento.', 'info')
+    elif esito == enrollment.IN_ATTESA:
+        flash('Questo evento è al completo: sei in lista d\'attesa, ti iscriveremo appena si libera un posto.', 'info')
+    elif esito == enrollment.GIA_IN_ATTESA:
+        flash('Sei già in lista d\'attesa per questo evento.', 'info')
+    elif esito == enrollment.SOVRAPPOSTO:
+        other = user_conflicts(current_user.id, event.data_ora, event.fine, exclude=event.id)
+        nome = f' "{other[0].titolo}"' if other else ''
+        flash(f'Sei già iscritto a un evento allo stesso orario{nome}.', 'error')
     else:
-        event.iscritti.append(current_user)
-        db.session.commit()
-        flash('Ti sei iscritto all\'evento con successo!', 'success')
+        flash('Questo evento è al completo!', 'error')
     return redirect(url_for('main.index'))
 
 @bp.route('/leave_event/<int:event_id>', methods=['POST'])
 @login_required
 def leave_event(event_id):
     event = Event.query.get_or_404(event_id)
-    if current_user in event.iscritti:
-        event.iscritti.remove(current_user)
-        db.session.commit()
+    # Se si libera un posto, il primo della lista d'attesa viene iscritto nella stessa transazione
+    cancellato, _ = enrollment.leave_event(event.id, current_user.id)
+    if cancellato:
         flash('Hai annullato la tua iscrizione all\'evento.', 'success')
+    elif enrollment.leave_waitlist(event.id, current_user.id):
+        flash('Sei uscito dalla lista d\'attesa.', 'success')
     else:
         flash('Non sei iscritto a questo evento.', 'error')
     return redirect(url_for('main.index'))
@@ -137,15 +265,29 @@ def edit_event(event_id):
         abort(403) # Forbidden
         
     form = EventForm()
-    if form.validate_on_submit():
+    if form.validate_on_submit() and _check_schedule(form, event.id):
         # Aggiorna i dati dell'evento con quelli del form
+        # (se cambia l'orario, cambia la fascia oraria per le preferenze degli iscritti)
+        before = event_snapshot(event)
+        move_preferences(event.id, event.data_ora, form.data_ora.data)
         event.titolo = form.titolo.data
         event.tipologia = form.tipologia.data
         event.descrizione = form.descrizione.data
         event.data_ora = form.data_ora.data
+        event.durata = form.durata.data
         event.luogo = form.luogo.data
         event.max_partecipanti = form.max_partecipanti.data
         event.livello_consigliato = form.livello_consigliato.data
+        event.cap = form.cap.data or current_user.cap
+        localize(event)
+        index_event(event)
+        # Gli impegni degli iscritti seguono il nuovo orario; poi, se i posti
+        # sono aumentati, iscriviamo chi è in lista d'attesa
+        db.session.flush()
+        move_commitments(event)
+        enrollment.promote_waitlist(event.id)
+        # Gli iscritti vengono avvisati per email, fuori dalla richiesta
+        notify_event_changed(before, event)
         db.session.commit()
         flash('Il tuo evento è stato aggiornato!', 'success')
         return redirect(url_for('main.index'))
@@ -155,9 +297,11 @@ def edit_event(event_id):
         form.tipologia.data = event.tipologia
         form.descrizione.data = event.descrizione
         form.data_ora.data = event.data_ora
+        form.durata.data = event.durata
         form.luogo.data = event.luogo
         form.max_partecipanti.data = event.max_partecipanti
         form.livello_consigliato.data = event.livello_consigliato
+        form.cap.data = event.cap
         
     return render_template('edit_event.html', title='Modifica Evento', form=form, event=event)
 
@@ -170,6 +314,14 @@ def delete_event(event_id):
     if event.creatore != current_user:
         abort(403)
         
+    # Avviso agli iscritti (letti prima che la cancellazione li tolga)
+    notify_event_deleted(event)
+    unindex_event(event.id)
+    release_event_counters(event)
+    move_preferences(event.id, event.data_ora)
+    enrollment.clear_waitlist(event.id)
+    forget_event(event.id)
+    forget_commitments([event.id])
     db.session.delete(event)
     db.session.commit()
     flash('L\'evento è stato cancellato con successo.', 'success')
@@ -184,13 +336,36 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        # Troppi tentativi falliti per questo account o da questo IP: rifiutiamo
+        # prima di calcolare qualsiasi hash
+        ip = client_ip()
+        retry_after = login_retry_after(form.email.data, ip)
+        if retry_after:
+            flash(f'Troppi tentativi di accesso. Riprova tra {retry_after} secondi.', 'error')
+            return _retry_later('login.html', 'Login', form, 429, retry_after)
+
         # Cerca l'utente nel database tramite la sua email
         user = User.query.filter_by(email=form.email.data).first()
         
         # Se l'utente non esiste o la password è sbagliata, mostra un errore
-        if user is None or not user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except HashingBusy:
+            flash('Il servizio è momentaneamente sovraccarico, riprova tra qualche secondo.', 'error')
+            return _retry_later('login.html', 'Login', form, 503, 5)
+        if not valid:
+            record_login_failure(form.email.data, ip)
             flash('Email o password non validi', 'error')
             return redirect(url_for('main.login'))
+        record_login_success(form.email.data)
+
+        # Hash generato con parametri vecchi: lo ricalcoliamo ora che conosciamo la password
+        if user.password_needs_rehash():
+            try:
+                user.set_password(form.password.data)
+                db.session.commit()
+            except HashingBusy:
+                pass  # Ci riproveremo al prossimo login
         
         # Se i dati sono corretti, effettua il login
         login_user(user, remember=form.remember_me.data)
@@ -204,6 +379,12 @@ def login():
         
     return render_template('login.html', title='Login', form=form)
 
+def _retry_later(template, title, form, status, retry_after):
+    """Risposta per login/registrazioni rifiutati (429 troppi tentativi, 503 hashing sovraccarico)."""
+    response = make_response(render_template(template, title=title, form=form), status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @bp.route('/logout')
 def logout():
     logout_user()
@@ -222,7 +403,12 @@ def register():
             email=form.email.data,
             cap=form.cap.data
         )
-        user.set_password(form.password.data)
+        localize(user)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash('Il servizio è momentaneamente sovraccarico, riprova tra qualche secondo.', 'error')
+            return _retry_later('register.html', 'Registrazione', form, 503, 5)
         db.session.add(user)
         db.session.commit()
         
@@ -291,9 +477,9 @@ def account():
         form.cognome.data = current_user.cognome
         form.data_di_nascita.data = current_user.data_di_nascita
 
-    # Calcoliamo le statistiche (logica già presente in index)
-    eventi_partecipati = current_user.eventi_iscritti.count()
-    eventi_creati = Event.query.filter_by(creatore=current_user).count()
+    # Statistiche (contatori denormalizzati, come in index)
+    eventi_partecipati = current_user.num_eventi_iscritti
+    eventi_creati = current_user.num_eventi_creati
 
     # Calcoliamo l'età
     eta = None
@@ -364,41 +550,179 @@ def unrally_user(username):
 # ==============================================================================
 @bp.route('/user/<username>')
 @login_required
+@read_only
 def user_profile(username):
     """Mostra la pagina profilo di un utente specifico."""
     # Troviamo l'utente nel database o restituiamo un errore 404
     user = User.query.filter_by(nome=username).first_or_404()
     
-    # Raccogliamo le statistiche per questo utente
-    eventi_creati = Event.query.filter_by(creatore=user).count()
-    eventi_partecipati = user.eventi_iscritti.count()
+    # Raccogliamo le statistiche per questo utente (contatori denormalizzati)
+    eventi_creati = user.num_eventi_creati
+    eventi_partecipati = user.num_eventi_iscritti
+
+    # Rally in comune e "fa rally con te", dal grafo in memoria
+    rally_in_comune = ti_segue = None
+    graph = get_graph()
+    if graph is not None and user != current_user:
+        rally_in_comune = graph.mutual_count(current_user.id, user.id)
+        ti_segue = graph.is_following(user.id, current_user.id)
     
     return render_template(
         'user_profile.html', 
         user=user, 
         title=f'Profilo di {user.nome}',
         eventi_creati=eventi_creati,
-        eventi_partecipati=eventi_partecipati
+        eventi_partecipati=eventi_partecipati,
+        rally_in_comune=rally_in_comune,
+        ti_segue=ti_segue
     )
 
+@bp.route('/user/<username>/storico')
+@login_required
+@read_only
+def user_history(username):
+    """Storico delle partite di un utente: statistiche per tipologia e livello, eventi passati."""
+    user = User.query.filter_by(nome=username).first_or_404()
+    page = history_page(user.id, cursor=request.args.get('cursor'),
+                        per_page=current_app.config['HISTORY_PER_PAGE'])
+    return render_template('user_history.html', title=f'Storico di {user.nome}', user=user,
+                           page=page, stats=match_stats(user.id))
+
 # ==============================================================================
 # PAGINA DI RICERCA GIOCATORI
 # ==============================================================================
 @bp.route('/players', methods=['GET', 'POST'])
 @login_required
+@read_only
 def players():
     """Mostra una lista di tutti i giocatori con una barra di ricerca."""
     form = PlayerSearchForm()
     # Inizialmente, la lista 'users' è vuota.
     users = [] 
+    page = None
+    distanze = {}
 
     # Se il form viene inviato e i dati sono validi...
     if form.validate_on_submit():
-        search_term = f"%{form.query.data}%"
         # ...cerchiamo gli utenti il cui nome corrisponde al termine di ricerca,
         # escludendo l'utente attualmente loggato dai risultati.
-        users = User.query.filter(User.nome.ilike(search_term), User.id != current_user.id).order_by(User.nome).all()
+        query = User.query.filter(User.id != current_user.id)
+        if form.query.data:
+            query = query.filter(User.nome.ilike(f"%{form.query.data}%"))
+
+        # Filtro e ordinamento per distanza dal CAP dell'utente
+        sort_key = [User.nome, User.id]
+        center = user_location(current_user)
+        if (form.distanza.data or form.ordina.data == 'distanza') and center is None:
+            flash('Il tuo CAP non è presente nel nostro elenco: non possiamo cercare per distanza.', 'info')
+        elif center is not None:
+            if form.distanza.data:
+                query = within_radius(query, User, center, float(form.distanza.data))
+            if form.ordina.data == 'distanza':
+                query, distance = with_distance(query, User, center)
+                sort_key = [distance, User.id]
+
+        page = paginate_keyset(
+            query, sort_key,
+            cursor=request.values.get('cursor'),
+            per_page=current_app.config['PLAYERS_PER_PAGE']
+        )
+        users = page.items
+        if center is not None:
+            distanze = {u.id: distance_km(center[0], center[1], u.lat, u.lon)
+                        for u in users if u.lat is not None}
+        if request.values.get('partial'):
+            return render_template('_player_cards.html', users=users, page=page, distanze=distanze)
         if not users:
             flash('Nessun giocatore trovato con quel nome.', 'info')
+    elif request.method == 'POST':
+        for error in form.query.errors:
+            flash(error, 'info')
+
+    # Prima di una ricerca: i giocatori che potresti conoscere
+    suggeriti = suggest_partners(current_user) if not users and request.method == 'GET' else []
     
-    return render_template('players.html', title='Cerca Giocatori', form=form, users=users)
+    return render_template('players.html', title='Cerca Giocatori', form=form, users=users, page=page, distanze=distanze,
+                           suggeriti=suggeriti)
+
+
+# ==============================================================================
+# CHAT TRA GIOCATORI (vedi app/chat.py)
+# ==============================================================================
+def _chat_room_or_403(stanza):
+    if not chat.can_access(stanza, current_user.id):
+        abort(403)
+
+@bp.route('/chat/con/<username>')
+@login_required
+def chat_with(username):
+    """Stanza della chat con un altro giocatore."""
+    user = User.query.filter_by(nome=username).first_or_404()
+    if user == current_user:
+        abort(404)
+    return redirect(url_for('main.chat_room', stanza=chat.direct_room(current_user.id, user.id)))
+
+@bp.route('/chat/<stanza>')
+@login_required
+@read_only
+def chat_room(stanza):
+    """Gli ultimi messaggi della stanza; i nuovi arrivano dallo stream SSE."""
+    _chat_room_or_403(stanza)
+    page = paginate_keyset(chat.history_query(stanza), [Messaggio.id], cursor=request.args.get('cursor'),
+                           per_page=current_app.config['CHAT_HISTORY_PER_PAGE'], descending=True)
+    # Con partial=1 solo i messaggi (il pulsante "Messaggi precedenti")
+    template = '_chat_messages.html' if request.args.get('partial') else 'chat.html'
+    return render_template(template, title=f'Chat: {chat.room_title(stanza, current_user.id)}', stanza=stanza,
+                           page=page, messages=list(reversed(page.items)), form=MessageForm())
+
+@bp.route('/chat/<stanza>/messaggi', methods=['POST'])
+@login_required
+def chat_post(stanza):
+    """Nuovo messaggio; con una richiesta fetch risponde in JSON, altrimenti torna alla stanza."""
+    _chat_room_or_403(stanza)
+    form = MessageForm()
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    testo = (form.testo.data or '').strip()
+    if not form.validate() or not testo:
+        if wants_json:
+            return {'errore': 'Messaggio vuoto o troppo lungo.'}, 400
+        flash('Messaggio vuoto o troppo lungo.', 'error')
+    else:
+        message_id = chat.post_message(stanza, current_user.id, testo)
+        db.session.commit()
+        if wants_json:
+            return {'id': message_id}, 201
+    return redirect(url_for('main.chat_room', stanza=stanza))
+
+@bp.route('/chat/<stanza>/stream')
+@login_required
+@read_only
+def chat_stream(stanza):
+    """Stream SSE dei messaggi nuovi, dall'id in Last-Event-ID (o 'dopo')."""
+    _chat_room_or_403(stanza)
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('dopo') or 0
+    try:
+        last_id = int(last_id)
+    except ValueError:
+        abort(400)
+    response = current_app.response_class(chat.stream_body(request.environ, stanza, last_id),
+                                          mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    # Nessun buffer nei proxy davanti all'app (nginx)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ==============================================================================
+# METRICHE (PROMETHEUS)
+# ==============================================================================
+@bp.route('/metrics')
+def metrics():
+    """Totali per endpoint di richieste, query e tempi (vedi app/instrumentation.py)."""
+    if 'metrics' not in current_app.extensions or not metrics_allowed():
+        abort(404)
+    response = make_response(render_metrics())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,219 @@
+# app/schedule.py
+
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import select, insert, update, delete, exists, func, literal
+
+from app import db
+from app.models import Event, impegni, partecipanti
+
+
+# ==============================================================================
+# ORARI: DURATA DEGLI EVENTI, SOVRAPPOSIZIONI, ORARI LIBERI
+# ==============================================================================
+# Un evento occupa l'intervallo [data_ora, fine), con fine = data_ora + durata.
+# Due intervalli si sovrappongono se ognuno inizia prima che l'altro finisca:
+#
+#     inizio_a < fine_b AND inizio_b < fine_a
+#
+# Con un indice sull'inizio, la sola condizione 'inizio < fine_cercata' legge
+# tutti gli intervalli precedenti. Ma la durata non supera Event.DURATA_MAX:
+# un intervallo che si sovrappone inizia dopo 'inizio_cercato - DURATA_MAX'.
+# Con questo limite la ricerca è un intervallo dell'indice chiuso da entrambe
+# le parti, O(log n) più le poche righe al suo interno, comunque sia lungo il
+# calendario. Due indici:
+# - per utente, la tabella 'impegni' (inizio e fine di ogni iscrizione,
+#   copiati dall'evento) con l'indice (user_id, inizio, fine): prima serviva
+#   leggere tutte le iscrizioni dell'utente, centinaia per chi gioca spesso;
+# - per luogo, l'indice (luogo, data_ora, fine) della tabella 'event'.
+# 'impegni' si aggiorna nella stessa transazione delle iscrizioni (vedi
+# app/enrollment.py e le route degli eventi); 'flask schedule-rebuild' la
+# ricalcola da 'partecipanti'.
+
+
+def _overlapping(start, end, inizio, fine):
+    """Condizioni per gli intervalli [start, end) che si sovrappongono a [inizio, fine)."""
+    return (start > inizio - timedelta(minutes=Event.DURATA_MAX),
+            start < fine,
+            end > inizio)
+
+
+def _minutes_before(column, minutes):
+    """La colonna di tipo data meno 'minutes' minuti, in SQL."""
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite salva le date come testo: l'aritmetica si fa con datetime()
+        return func.datetime(column, f'-{minutes} minutes')
+    return column - timedelta(minutes=minutes)
+
+
+# ------------------------------------------------------------------------------
+# Sovrapposizioni
+# ------------------------------------------------------------------------------
+
+def _user_overlaps(user_id, inizio, fine, exclude):
+    conditions = [impegni.c.user_id == user_id, *_overlapping(impegni.c.inizio, impegni.c.fine, inizio, fine)]
+    if exclude is not None:
+        conditions.append(impegni.c.event_id != exclude)
+    return conditions
+
+
+def user_is_busy(user_id, inizio, fine, exclude=None):
+    """True se l'utente ha un impegno che si sovrappone a [inizio, fine). Legge solo l'indice degli impegni."""
+    return db.session.execute(select(exists().where(*_user_overlaps(user_id, inizio, fine, exclude)))).scalar()
+
+
+def user_conflicts(user_id, inizio, fine, exclude=None):
+    """Eventi a cui l'utente è iscritto che si sovrappongono a [inizio, fine): righe (id, titolo, data_ora, fine)."""
+    query = select(Event.id, Event.titolo, Event.data_ora, Event.fine) \
+        .select_from(impegni) \
+        .join(Event, Event.id == impegni.c.event_id) \
+        .where(*_user_overlaps(user_id, inizio, fine, exclude))
+    return db.session.execute(query.order_by(impegni.c.inizio)).all()
+
+
+def _venue_overlaps(luogo, inizio, fine, exclude):
+    conditions = [Event.luogo == luogo, *_overlapping(Event.data_ora, Event.fine, inizio, fine)]
+    if exclude is not None:
+        conditions.append(Event.id != exclude)
+    return conditions
+
+
+def venue_is_busy(luogo, inizio, fine, exclude=None):
+    """True se nel luogo c'è un evento che si sovrappone a [inizio, fine). Legge solo l'indice (luogo, data_ora, fine)."""
+    return db.session.execute(select(exists().where(*_venue_overlaps(luogo, inizio, fine, exclude)))).scalar()
+
+
+def venue_conflicts(luogo, inizio, fine, exclude=None):
+    """Eventi nello stesso luogo che si sovrappongono a [inizio, fine): righe (id, titolo, data_ora, fine)."""
+    query = select(Event.id, Event.titolo, Event.data_ora, Event.fine) \
+        .where(*_venue_overlaps(luogo, inizio, fine, exclude))
+    return db.session.execute(query.order_by(Event.data_ora)).all()
+
+
+def only_when_free(query, user_id):
+    """
+    Filtra una query sugli eventi lasciando quelli che non si sovrappongono
+    agli impegni dell'utente (sono esclusi anche quelli a cui è già iscritto).
+    Per ogni evento, una ricerca per intervallo nell'indice degli impegni.
+    """
+    busy = exists().where(
+        impegni.c.user_id == user_id,
+        impegni.c.inizio > _minutes_before(Event.data_ora, Event.DURATA_MAX),
+        impegni.c.inizio < Event.fine,
+        impegni.c.fine > Event.data_ora)
+    return query.filter(~busy)
+
+
+# ------------------------------------------------------------------------------
+# Orari liberi
+# ------------------------------------------------------------------------------
+
+def _opening_hours(da, a):
+    """Orari di apertura [(apertura, chiusura)] dei giorni tra da e a, limitati a [da, a)."""
+    open_hour = current_app.config['SCHEDULE_OPEN_HOUR']
+    close_hour = current_app.config['SCHEDULE_CLOSE_HOUR']
+    giorno = da.date()
+    while datetime.combine(giorno, time()) < a:
+        midnight = datetime.combine(giorno, time())
+        start = max(midnight + timedelta(hours=open_hour), da)
+        end = min(midnight + timedelta(hours=close_hour), a)
+        if start < end:
+            yield start, end
+        giorno += timedelta(days=1)
+
+
+def _gaps(busy, windows, durata):
+    """Spazi di almeno 'durata' minuti, dentro 'windows', fra gli intervalli 'busy' (ordinati per inizio)."""
+    # Intervalli occupati uniti quando si toccano: così sono ordinati anche per fine
+    merged = []
+    for start, end in busy:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    minimum = timedelta(minutes=durata)
+    gaps = []
+    i = 0
+    for window_start, window_end in windows:
+        while i < len(merged) and merged[i][1] <= window_start:
+            i += 1
+        cursor = window_start
+        j = i
+        while j < len(merged) and merged[j][0] < window_end:
+            if merged[j][0] - cursor >= minimum:
+                gaps.append((cursor, merged[j][0]))
+            cursor = max(cursor, merged[j][1])
+            j += 1
+        if window_end - cursor >= minimum:
+            gaps.append((cursor, window_end))
+    return gaps
+
+
+def venue_free_slots(luogo, da, a, durata):
+    """Orari liberi [(inizio, fine)] del luogo tra da e a, nell'orario di apertura, lunghi almeno 'durata' minuti."""
+    busy = db.session.execute(
+        select(Event.data_ora, Event.fine)
+        .where(Event.luogo == luogo, *_overlapping(Event.data_ora, Event.fine, da, a))
+        .order_by(Event.data_ora)).all()
+    return _gaps(busy, _opening_hours(da, a), durata)
+
+
+def user_free_slots(user_id, da, a, durata):
+    """Come venue_free_slots, per gli impegni di un utente."""
+    busy = db.session.execute(
+        select(impegni.c.inizio, impegni.c.fine)
+        .where(impegni.c.user_id == user_id, *_overlapping(impegni.c.inizio, impegni.c.fine, da, a))
+        .order_by(impegni.c.inizio)).all()
+    return _gaps(busy, _opening_hours(da, a), durata)
+
+
+def first_free_slot(luogo, dopo, durata):
+    """Primo orario (datetime) dopo 'dopo' in cui il luogo è libero per 'durata' minuti, o None."""
+    days = current_app.config['SCHEDULE_SEARCH_DAYS']
+    slots = venue_free_slots(luogo, dopo, dopo + timedelta(days=days), durata)
+    return slots[0][0] if slots else None
+
+
+# ------------------------------------------------------------------------------
+# Aggiornamento degli impegni (nella transazione delle iscrizioni, senza commit)
+# ------------------------------------------------------------------------------
+
+def add_commitment(user_id, event_id):
+    """L'utente si è iscritto all'evento: copia inizio e fine dell'evento nei suoi impegni."""
+    db.session.execute(insert(impegni).from_select(
+        ['event_id', 'user_id', 'inizio', 'fine'],
+        select(Event.id, literal(user_id), Event.data_ora, Event.fine).where(Event.id == event_id)))
+
+
+def add_commitments(rows):
+    """Come add_commitment, per più iscrizioni di cui si conoscono già gli orari: [{event_id, user_id, inizio, fine}]."""
+    if rows:
+        db.session.execute(insert(impegni), rows)
+
+
+def remove_commitment(user_id, event_id):
+    db.session.execute(delete(impegni).where(impegni.c.event_id == event_id, impegni.c.user_id == user_id))
+
+
+def move_commitments(event):
+    """L'evento ha cambiato orario o durata: aggiorna gli impegni di tutti gli iscritti."""
+    db.session.execute(update(impegni).where(impegni.c.event_id == event.id)
+                       .values(inizio=event.data_ora, fine=event.fine))
+
+
+def forget_commitments(event_ids):
+    """Gli eventi stanno per essere cancellati o archiviati."""
+    db.session.execute(delete(impegni).where(impegni.c.event_id.in_(event_ids)))
+
+
+def rebuild_commitments():
+    """Ricalcola da zero la tabella degli impegni dalle iscrizioni. Restituisce le righe scritte."""
+    db.session.execute(delete(impegni))
+    db.session.execute(insert(impegni).from_select(
+        ['event_id', 'user_id', 'inizio', 'fine'],
+        select(partecipanti.c.event_id, partecipanti.c.user_id, Event.data_ora, Event.fine)
+        .join(Event, Event.id == partecipanti.c.event_id)))
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(impegni))
@@ -0,0 +1,147 @@
+# app/search.py
+
+import re
+
+from flask import current_app
+from sqlalchemy import text, table, column, select, literal_column
+
+from app import db
+from app.models import Event
+
+
+# ==============================================================================
+# INDICE DI RICERCA FULL-TEXT PER GLI EVENTI (SQLite FTS5)
+# ==============================================================================
+# La ricerca con ilike('%termine%') non può usare nessun indice e scorre ogni
+# volta tutta la tabella. Qui teniamo una tabella virtuale FTS5 con titolo, luogo
+# e descrizione di ogni evento (rowid = Event.id):
+# - 'remove_diacritics 2' rende la ricerca insensibile agli accenti (città = citta);
+# - 'prefix' indicizza i prefissi di 2 e 3 lettere, per cercare mentre si scrive;
+# - bm25() (la colonna nascosta 'rank') ordina i risultati per pertinenza.
+# Se il database non è SQLite o l'indice non è stato ancora creato si torna
+# alla vecchia ricerca con ilike.
+
+FTS_TABLE = 'event_fts'
+
+_CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "titolo, luogo, descrizione, "
+    "tokenize = 'unicode61 remove_diacritics 2', "
+    "prefix = '2 3')"
+)
+
+# Costrutto "leggero" per usare la tabella virtuale nelle query SQLAlchemy
+# (non fa parte dei metadata, quindi db.create_all() non la tocca)
+event_fts = table(FTS_TABLE, column('rowid'), column('rank'))
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_available():
+    """True se l'indice FTS5 esiste nel database corrente (il controllo è fatto una volta sola)."""
+    state = current_app.extensions.setdefault('event_search', {})
+    if 'available' not in state:
+        available = False
+        if db.engine.dialect.name == 'sqlite':
+            available = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE}
+            ).first() is not None
+        state['available'] = available
+    return state['available']
+
+
+def create_search_index():
+    """Crea la tabella virtuale FTS5 (se non esiste già)."""
+    db.session.execute(text(_CREATE_SQL))
+    db.session.commit()
+    current_app.extensions.setdefault('event_search', {})['available'] = True
+
+
+def rebuild_search_index():
+    """Ricrea l'indice da zero a partire dalla tabella 'event'. Restituisce il numero di eventi indicizzati."""
+    db.session.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    db.session.execute(text(_CREATE_SQL))
+    result = db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, titolo, luogo, descrizione) "
+        "SELECT id, titolo, luogo, coalesce(descrizione, '') FROM event"
+    ))
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    current_app.extensions.setdefault('event_search', {})['available'] = True
+    return result.rowcount
+
+
+def index_event(event):
+    """Inserisce o aggiorna un evento nell'indice. Va chiamata prima del commit, nella stessa transazione."""
+    if not search_available():
+        return
+    if event.id is None:
+        db.session.flush()
+    db.session.execute(
+        text(f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, titolo, luogo, descrizione) "
+             "VALUES (:id, :titolo, :luogo, :descrizione)"),
+        {'id': event.id, 'titolo': event.titolo, 'luogo': event.luogo,
+         'descrizione': event.descrizione or ''}
+    )
+
+
+def index_events(events):
+    """Come index_event, in blocco (executemany): 'events' sono dizionari con id, titolo, luogo e descrizione."""
+    if not events or not search_available():
+        return
+    db.session.execute(
+        text(f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, titolo, luogo, descrizione) "
+             "VALUES (:id, :titolo, :luogo, :descrizione)"),
+        [{'id': e['id'], 'titolo': e['titolo'], 'luogo': e['luogo'], 'descrizione': e['descrizione'] or ''}
+         for e in events]
+    )
+
+
+def unindex_event(event_id):
+    """Rimuove un evento dall'indice. Va chiamata prima del commit, nella stessa transazione."""
+    if not search_available():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': event_id})
+
+
+def unindex_events(event_ids):
+    """Come unindex_event, in blocco (executemany)."""
+    if not event_ids or not search_available():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), [{'id': i} for i in event_ids])
+
+
+def build_match_expression(term):
+    """
+    Trasforma il testo inserito dall'utente in un'espressione MATCH di FTS5.
+
+    Ogni parola diventa un prefisso tra virgolette ("tenn"* "mil"*), così la
+    sintassi di FTS5 non viene mai interpretata e tutte le parole devono comparire.
+    """
+    words = _WORD_RE.findall(term or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def apply_event_search(query, term):
+    """
+    Applica la ricerca testuale a una query sugli eventi.
+
+    Restituisce (query, rank): 'rank' è la colonna di pertinenza da usare per
+    l'ordinamento, oppure None se si è usata la ricerca ilike di ripiego.
+    """
+    if search_available():
+        match = build_match_expression(term)
+        if match is None:
+            return query, None
+        hits = select(event_fts.c.rowid.label('event_id'), event_fts.c.rank.label('rank')) \
+            .where(literal_column(FTS_TABLE).op('MATCH')(match)) \
+            .subquery('hits')
+        query = query.join(hits, hits.c.event_id == Event.id).add_columns(hits.c.rank)
+        return query, hits.c.rank
+
+    search_term = f"%{term}%"
+    query = query.filter(db.or_(Event.titolo.ilike(search_term), Event.luogo.ilike(search_term)))
+    return query, None
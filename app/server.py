@@ -0,0 +1,271 @@
+# app/server.py
+
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from app import db
+from app.database import dispose_engines
+from app.warmup import prime_connections, warm_up
+
+
+# ==============================================================================
+# SERVER DI PRODUZIONE: MASTER + WORKER PREFORK, THREAD PER WORKER
+# ==============================================================================
+# run.py avvia il server di sviluppo di Werkzeug, con il debugger attivo: non
+# va usato in produzione. Questo server (avviato da serve.py):
+# - crea l'app e carica tutti i template (e il grafo dei rally) nel processo
+#   master, poi fa fork di N worker: il codice e i template già compilati
+#   restano condivisi tra i processi (copy-on-write, aiutato da gc.freeze());
+#   con warmup=True ogni worker apre anche le sue connessioni al database
+#   prima di accettare richieste (vedi app/warmup.py);
+# - ogni worker serve le richieste con un pool di THREADS thread, accettando
+#   le connessioni dallo stesso socket in ascolto;
+# - con SIGHUP il master sostituisce tutti i worker con processi nuovi senza
+#   interrompere il servizio (i vecchi finiscono le richieste in corso);
+#   con SIGTERM/SIGINT si ferma, sempre aspettando le richieste in corso;
+# - dopo MAX_REQUESTS richieste (più un jitter casuale, per non riciclarli
+#   tutti insieme) un worker esce e il master ne avvia uno nuovo: contiene
+#   eventuali perdite di memoria;
+# - i pool di connessioni SQLAlchemy vengono svuotati prima del fork nel master
+#   e "dimenticati" nei figli, così nessuna connessione è condivisa tra processi.
+# Il codice dell'app è quello caricato all'avvio: per pubblicare una nuova
+# versione va riavviato il master.
+
+def _log(message):
+    print(f'[serve {os.getpid()}] {message}', file=sys.stderr, flush=True)
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # Una richiesta per connessione: con il keep-alive una connessione inattiva
+    # occuperebbe un thread del pool
+    protocol_version = 'HTTP/1.0'
+
+    def make_environ(self):
+        environ = super().make_environ()
+        # Le risposte che restano aperte (gli stream della chat, vedi app/chat.py)
+        # si prendono la connessione e liberano il thread
+        environ['tennis.hand_off'] = self._hand_off
+        return environ
+
+    def _hand_off(self):
+        """Stacca la connessione da questo thread e ne restituisce una copia, che il chiamante deve chiudere."""
+        self.server.handed_off.add(self.connection)
+        return self.connection.dup()
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """Server WSGI di Werkzeug che gestisce le richieste con un pool di thread di dimensione fissa."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, fd, threads, on_request):
+        super().__init__(host, port, app, handler=_RequestHandler, fd=fd)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='worker')
+        # Non accettiamo più connessioni di quante il pool possa servire a breve:
+        # le altre restano nella coda del socket, dove un altro worker le può prendere
+        self._slots = threading.BoundedSemaphore(threads * 2)
+        self._on_request = on_request
+        # Connessioni cedute dalle risposte (vedi _RequestHandler._hand_off)
+        self.handed_off = set()
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if request in self.handed_off:
+                # Chiudiamo solo il nostro descrittore: la connessione resta aperta
+                self.handed_off.discard(request)
+                request.close()
+            else:
+                self.shutdown_request(request)
+            self._slots.release()
+            self._on_request()
+
+    def drain(self):
+        """Aspetta la fine delle richieste in corso."""
+        self._pool.shutdown(wait=True)
+
+
+class PreforkServer:
+    """Processo master: tiene in vita WORKERS processi che servono l'app sullo stesso socket."""
+
+    def __init__(self, app, host='127.0.0.1', port=8000, workers=2, threads=4,
+                 max_requests=0, max_requests_jitter=0, graceful_timeout=30, backlog=2048, warmup=False):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.warmup = warmup
+        self._children = {}       # pid -> generazione
+        self._retiring = {}       # pid -> istante oltre il quale usare SIGKILL
+        self._generation = 0
+        self._signals = []
+        self._stopping = False
+
+    # --------------------------------------------------------------------- master
+
+    def run(self):
+        self.socket = socket.create_server((self.host, self.port), backlog=self.backlog)
+        self.socket.set_inheritable(True)
+        _log(f'in ascolto su http://{self.host}:{self.port} '
+             f'({self.workers} worker x {self.threads} thread)')
+
+        start = time.perf_counter()
+        templates = warm_up(self.app)
+        _log(f'{templates} template, mapper e grafo dei rally pronti in {(time.perf_counter() - start) * 1000:.0f} ms')
+        # Nessuna connessione aperta nel master al momento del fork
+        dispose_engines(self.app, db)
+        # Gli oggetti già creati non verranno più toccati dal garbage collector:
+        # le pagine di memoria restano condivise con i worker
+        gc.freeze()
+
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame: self._signals.append(signum))
+
+        while True:
+            while self._signals:
+                self._handle_signal(self._signals.pop(0))
+            self._reap()
+            if self._stopping:
+                if not self._children:
+                    break
+            else:
+                while len(self._children) - len(self._retiring) < self.workers:
+                    self._spawn()
+            self._kill_stuck()
+            time.sleep(0.2)
+
+        self.socket.close()
+        _log('arrestato')
+
+    def _handle_signal(self, signum):
+        if signum == signal.SIGHUP:
+            # Restart graduale: un worker nuovo per ogni worker vecchio, poi
+            # il vecchio finisce le sue richieste ed esce
+            _log('SIGHUP: sostituzione graduale dei worker')
+            self._generation += 1
+            for pid in [pid for pid, gen in self._children.items() if gen < self._generation]:
+                if pid not in self._retiring:
+                    self._spawn()
+                    self._retire(pid)
+        else:
+            _log('arresto in corso: attendo le richieste in corso')
+            self._stopping = True
+            for pid in list(self._children):
+                self._retire(pid)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._worker()
+            except BaseException:
+                code = 1
+                import traceback
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self._children[pid] = self._generation
+
+    def _retire(self, pid):
+        if pid not in self._retiring:
+            self._retiring[pid] = time.monotonic() + self.graceful_timeout
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self._children.pop(pid, None)
+            if self._retiring.pop(pid, None) is None and not self._stopping:
+                code = os.waitstatus_to_exitcode(status)
+                if code != 0:
+                    _log(f'worker {pid} terminato con codice {code}')
+
+    def _kill_stuck(self):
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now > deadline:
+                _log(f'worker {pid} non si è fermato entro {self.graceful_timeout} s: SIGKILL')
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self._retiring[pid] = float('inf')
+
+    # --------------------------------------------------------------------- worker
+
+    def _worker(self):
+        stop = threading.Event()
+        for sig in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(sig, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        # Le connessioni ereditate dal master (se ce ne fossero) non sono nostre
+        dispose_engines(self.app, db, close=False)
+        # Il pool per l'hashing delle password è per processo
+        passwords = self.app.extensions.get('passwords')
+        if passwords is not None:
+            passwords['hasher'].reset_after_fork()
+        if self.warmup:
+            prime_connections(self.app, self.threads)
+
+        limit = 0
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+        served = [0]
+        lock = threading.Lock()
+
+        def on_request():
+            with lock:
+                served[0] += 1
+                if limit and served[0] >= limit:
+                    stop.set()
+
+        server = _PooledWSGIServer(self.host, self.port, self.app, self.socket.fileno(),
+                                   self.threads, on_request)
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.5}, daemon=True)
+        thread.start()
+        while not stop.wait(1):
+            pass
+        if limit and served[0] >= limit:
+            _log(f'{served[0]} richieste servite: il worker viene riciclato')
+        server.shutdown()
+        server.drain()
+        # I thread dei lavori in coda finiscono il gruppo in corso
+        jobs = self.app.extensions.get('jobs')
+        if jobs is not None:
+            jobs.stop(timeout=self.graceful_timeout)
+        # Gli stream della chat vengono chiusi: i browser si ricollegano a un altro worker
+        chat = self.app.extensions.get('chat')
+        if chat is not None:
+            chat.stop(timeout=self.graceful_timeout)
+        dispose_engines(self.app, db)
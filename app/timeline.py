@@ -0,0 +1,142 @@
+# app/timeline.py
+
+from flask import current_app
+from sqlalchemy import select, insert, delete, exists, literal, or_
+from sqlalchemy.orm import contains_eager
+
+from app import db
+from app.jobs import enqueue, job_handler
+from app.models import User, Attivita, rally, timeline
+
+
+# ==============================================================================
+# BACHECA DELLE ATTIVITÀ DEI COMPAGNI DI RALLY (FAN-OUT IN SCRITTURA)
+# ==============================================================================
+# Calcolare la bacheca in lettura vorrebbe dire unire rally, eventi e
+# partecipanti a ogni visita della pagina. Invece ogni attività (evento creato,
+# iscrizione) viene salvata una volta in 'attivita' e il suo id viene copiato
+# nella tabella 'timeline' di ogni follower, con un'unica INSERT ... SELECT.
+# Leggere la bacheca è poi una scansione dell'indice (user_id, attivita_id).
+# - La copia (fino a TIMELINE_FANOUT_MAX_FOLLOWERS righe, più la pulizia
+#   delle bacheche troppo lunghe) non avviene nella richiesta: la richiesta
+#   accoda un lavoro 'bacheche' (vedi app/jobs.py) e le bacheche si
+#   aggiornano pochi istanti dopo il commit.
+# - Fan-out limitato: per chi ha più di TIMELINE_FANOUT_MAX_FOLLOWERS follower
+#   non copiamo niente; le sue attività vengono unite in lettura, direttamente
+#   da 'attivita' (che ha l'indice su user_id).
+# - Ogni bacheca tiene al massimo TIMELINE_MAX_LENGTH voci: le più vecchie
+#   vengono cancellate a ogni nuovo inserimento.
+# - start_rally/stop_rally copiano o tolgono solo le attività dell'utente
+#   interessato (backfill / purge).
+# Nessuna funzione fa commit: tutto avviene nella transazione della scrittura
+# (o del lavoro in coda).
+
+def _fanout_cap():
+    return current_app.config['TIMELINE_FANOUT_MAX_FOLLOWERS']
+
+
+def _trim(user_ids):
+    """Cancella le voci oltre TIMELINE_MAX_LENGTH dalle bacheche di user_ids (id o SELECT)."""
+    newer = timeline.alias('newer')
+    oldest_kept = select(newer.c.attivita_id) \
+        .where(newer.c.user_id == timeline.c.user_id) \
+        .order_by(newer.c.attivita_id.desc()) \
+        .limit(1).offset(current_app.config['TIMELINE_MAX_LENGTH'] - 1) \
+        .scalar_subquery()
+    db.session.execute(delete(timeline).where(
+        timeline.c.user_id.in_(user_ids), timeline.c.attivita_id < oldest_kept))
+
+
+def record_activity(user_id, event_id, tipo):
+    """Salva un'attività e accoda la sua copia nelle bacheche dei follower (se non sono troppi)."""
+    attivita_id = db.session.execute(
+        insert(Attivita).values(user_id=user_id, event_id=event_id, tipo=tipo)
+    ).inserted_primary_key[0]
+
+    num_followers = db.session.execute(
+        select(User.num_followers).where(User.id == user_id)).scalar()
+    if num_followers and num_followers <= _fanout_cap():
+        enqueue('bacheche', {'attivita_id': attivita_id, 'user_id': user_id})
+    return attivita_id
+
+
+@job_handler('bacheche', batch_size=100)
+def _fan_out(payloads):
+    """Copia le attività nelle bacheche dei follower dei loro autori."""
+    for payload in payloads:
+        attivita_id = payload['attivita_id']
+        # Niente se l'attività è già stata tolta (evento cancellato, iscrizione
+        # annullata); salta chi l'ha già avuta con il backfill di un rally nuovo
+        db.session.execute(insert(timeline).from_select(
+            ['user_id', 'attivita_id'],
+            select(rally.c.follower_id, literal(attivita_id))
+            .where(rally.c.followed_id == payload['user_id'],
+                   exists().where(Attivita.id == attivita_id),
+                   ~exists().where(timeline.c.user_id == rally.c.follower_id,
+                                   timeline.c.attivita_id == attivita_id))))
+    authors = {payload['user_id'] for payload in payloads}
+    _trim(select(rally.c.follower_id).where(rally.c.followed_id.in_(authors)))
+
+
+def backfill(follower_id, followed_id):
+    """Copia le attività recenti di followed_id nella bacheca di follower_id (inizio di un rally)."""
+    # (la SELECT fa partire l'autoflush: il rally appena aggiunto è già contato)
+    num_followers = db.session.execute(
+        select(User.num_followers).where(User.id == followed_id)).scalar()
+    if num_followers is not None and num_followers > _fanout_cap():
+        # Sopra il limite del fan-out: le sue attività vengono unite in lettura
+        return
+    recent = select(literal(follower_id), Attivita.id) \
+        .where(Attivita.user_id == followed_id,
+               ~exists().where(timeline.c.user_id == follower_id, timeline.c.attivita_id == Attivita.id)) \
+        .order_by(Attivita.id.desc()) \
+        .limit(current_app.config['TIMELINE_MAX_LENGTH'])
+    db.session.execute(insert(timeline).from_select(['user_id', 'attivita_id'], recent))
+    _trim([follower_id])
+
+
+def purge(follower_id, followed_id):
+    """Toglie dalla bacheca di follower_id le attività di followed_id (fine di un rally)."""
+    db.session.execute(delete(timeline).where(
+        timeline.c.user_id == follower_id,
+        timeline.c.attivita_id.in_(select(Attivita.id).where(Attivita.user_id == followed_id))))
+
+
+def forget_enrollment(user_id, event_id):
+    """L'utente non è più iscritto: la sua attività di iscrizione sparisce dalle bacheche."""
+    _forget(select(Attivita.id).where(Attivita.user_id == user_id, Attivita.event_id == event_id,
+                                      Attivita.tipo == Attivita.ISCRITTO))
+
+
+def forget_event(event_id):
+    """Da chiamare prima di cancellare un evento: toglie tutte le sue attività."""
+    _forget(select(Attivita.id).where(Attivita.event_id == event_id))
+
+
+def forget_events(event_ids):
+    """Come forget_event, per più eventi insieme (archiviazione)."""
+    _forget(select(Attivita.id).where(Attivita.event_id.in_(event_ids)))
+
+
+def _forget(attivita_ids):
+    ids = [attivita_id for (attivita_id,) in db.session.execute(attivita_ids)]
+    if ids:
+        db.session.execute(delete(timeline).where(timeline.c.attivita_id.in_(ids)))
+        db.session.execute(delete(Attivita).where(Attivita.id.in_(ids)))
+
+
+def feed_query(user):
+    """
+    Attività per la bacheca di 'user', con autore ed evento già caricati:
+    quelle copiate nella sua timeline più quelle, unite in lettura, degli
+    utenti sopra il limite del fan-out con cui fa rally.
+    Da ordinare/paginare per Attivita.id decrescente.
+    """
+    copied = select(timeline.c.attivita_id).where(timeline.c.user_id == user.id)
+    popular = select(rally.c.followed_id) \
+        .join(User, User.id == rally.c.followed_id) \
+        .where(rally.c.follower_id == user.id, User.num_followers > _fanout_cap())
+    return Attivita.query \
+        .join(Attivita.attore).join(Attivita.evento) \
+        .options(contains_eager(Attivita.attore), contains_eager(Attivita.evento)) \
+        .filter(or_(Attivita.id.in_(copied), Attivita.user_id.in_(popular)))
@@ -0,0 +1,88 @@
+# app/warmup.py
+
+import os
+
+import sqlalchemy as sa
+from jinja2 import FileSystemBytecodeCache
+
+from app import db
+from app.rally_graph import warm_rally_graph
+
+
+# ==============================================================================
+# AVVIO A FREDDO: CACHE DEI TEMPLATE COMPILATI E RISCALDAMENTO
+# ==============================================================================
+# Quello che un processo appena avviato fa una volta sola, prima o durante le
+# prime richieste:
+# - compilare i template: Jinja traduce ogni template in codice Python al primo
+#   uso (65 ms per tutti, dal sorgente). Con JINJA_CACHE_DIR il risultato resta
+#   su disco e il processo successivo lo rilegge in 2 ms; se il template cambia,
+#   Jinja se ne accorge dal checksum del sorgente e lo ricompila;
+# - configurare i mapper di SQLAlchemy (al primo uso dei modelli, ~10 ms) e
+#   caricare il grafo dei rally;
+# - aprire le connessioni al database, con le PRAGMA di ogni connessione.
+# warm_up() fa le prime due cose: serve.py la chiama nel master prima del fork,
+# così i worker nascono con tutto pronto. Le connessioni invece sono di ogni
+# processo: con 'serve.py --warmup' ogni worker le apre (prime_connections)
+# prima di accettare richieste. Con SQLite aprire una connessione costa poco;
+# conta di più con un database in rete (READ_DATABASE_URI su un altro server).
+# 'flask precompile' prepara la cache dei template e i .pyc dei moduli durante
+# il deploy, anche se poi il server gira con un utente che non può scriverli.
+
+def init_template_cache(app):
+    """Salva i template compilati in JINJA_CACHE_DIR (niente cache se è vuota)."""
+    directory = app.config.get('JINJA_CACHE_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """Carica (e compila) tutti i template di app/templates; restituisce quanti sono."""
+    names = app.jinja_env.list_templates()
+    with app.app_context():
+        for name in names:
+            app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warm_up(app):
+    """Template, mapper e grafo dei rally: da fare una volta, prima del fork dei worker."""
+    count = compile_templates(app)
+    sa.orm.configure_mappers()
+    warm_rally_graph(app)
+    return count
+
+
+def prime_connections(app, count):
+    """
+    Apre fino a 'count' connessioni in ciascun pool (principale e di sola lettura),
+    tutte insieme, e le rimette nel pool: le prime richieste le trovano pronte.
+    Restituisce il numero di connessioni aperte.
+    """
+    opened = 0
+    with app.app_context():
+        for engine in (db.engine, app.extensions.get('db_read_engine')):
+            if engine is None:
+                continue
+            pool = engine.pool
+            n = min(count, pool.size()) if isinstance(pool, sa.pool.QueuePool) else 1
+            connections = []
+            try:
+                for _ in range(n):
+                    connection = engine.connect()
+                    connections.append(connection)
+                    connection.exec_driver_sql('SELECT 1')
+            finally:
+                for connection in connections:
+                    connection.close()
+            opened += len(connections)
+    return opened
+
+
+def compile_modules(app):
+    """Scrive i .pyc dei moduli dell'applicazione e di config.py; False se qualcuno non compila."""
+    import compileall
+    config = os.path.join(os.path.dirname(app.root_path), 'config.py')
+    return bool(compileall.compile_dir(app.root_path, quiet=1) and compileall.compile_file(config, quiet=1))
@@ -0,0 +1,134 @@
+# benchmarks/bench_api.py
+"""
+Sessione tipica del client mobile, fatta una volta con le pagine HTML e una
+volta con l'API JSON (app/api.py), attraverso il test client di Flask:
+login, lista degli eventi, iscrizione, profilo di un giocatore, rally,
+cancellazione dell'iscrizione e, alla fine, una seconda apertura della lista
+degli eventi (con If-None-Match: il client ha ancora la risposta precedente).
+
+Per ogni passo: richieste (compresi i redirect), byte ricevuti (corpo più
+intestazioni, e corpo compresso con gzip come lo manderebbe un proxy) e tempo.
+Con --rtt si stima anche il tempo su rete mobile: richieste x RTT più il
+tempo di trasferimento dei byte compressi a --kbps.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_api --users 500 --events 1000 --rtt 150 --kbps 2000
+"""
+
+import argparse
+import gzip
+import os
+import time
+
+from app import create_app, db
+from app.models import Event, User
+from benchmarks.common import temp_config
+from benchmarks.seed import seed, PASSWORD
+
+
+class Session:
+    """Test client che conta richieste, byte e tempo di ogni passo."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.steps = []
+
+    def step(self, name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = self.client.open(url, method=method, follow_redirects=True, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        requests = raw = compressed = 0
+        for r in list(response.history) + [response]:
+            body = r.get_data()
+            headers = sum(len(k) + len(v) + 4 for k, v in r.headers.items()) + 17
+            requests += 1
+            raw += len(body) + headers
+            # Un proxy non comprime i corpi che con gzip diventerebbero più grandi
+            compressed += min(len(body), len(gzip.compress(body, 6))) + headers
+        self.steps.append((name, response.status_code, requests, raw, compressed, elapsed))
+        return response
+
+
+def html_session(app, email, event_id, other):
+    s = Session(app)
+    s.step('login (form)', 'GET', '/login')
+    s.step('login', 'POST', '/login', data={'email': email, 'password': PASSWORD})
+    s.step('lista eventi', 'GET', '/events')
+    s.step('iscrizione', 'POST', f'/join_event/{event_id}')
+    s.step('profilo giocatore', 'GET', f'/user/{other}')
+    s.step('rally', 'POST', f'/rally/{other}', headers={'Referer': f'/user/{other}'})
+    s.step('cancellazione', 'POST', f'/leave_event/{event_id}')
+    etag = s.step('lista eventi', 'GET', '/events').headers.get('ETag')
+    s.step('lista eventi (di nuovo)', 'GET', '/events', headers={'If-None-Match': etag or ''})
+    return s.steps
+
+
+def api_session(app, email, event_id, other):
+    s = Session(app)
+    fields = 'id,titolo,data_ora,luogo,posti_liberi,is_iscritto'
+    s.step('login', 'POST', '/api/v1/login', json={'email': email, 'password': PASSWORD})
+    s.step('lista eventi', 'GET', f'/api/v1/events?fields={fields}')
+    s.step('iscrizione', 'PUT', f'/api/v1/events/{event_id}/iscrizione')
+    s.step('profilo giocatore', 'GET', f'/api/v1/players/{other}')
+    s.step('rally', 'PUT', f'/api/v1/players/{other}/rally')
+    s.step('cancellazione', 'DELETE', f'/api/v1/events/{event_id}/iscrizione')
+    etag = s.step('lista eventi', 'GET', f'/api/v1/events?fields={fields}').headers.get('ETag')
+    s.step('lista eventi (di nuovo)', 'GET', f'/api/v1/events?fields={fields}', headers={'If-None-Match': etag or ''})
+    return s.steps
+
+
+def report(title, steps, args):
+    print(title)
+    print(f'  {"passo":<26}{"stato":>6}{"rich.":>7}{"byte":>10}{"gzip":>9}{"ms":>9}')
+    for name, status, requests, raw, compressed, elapsed in steps:
+        print(f'  {name:<26}{status:>6}{requests:>7}{raw:>10}{compressed:>9}{elapsed:>9.1f}')
+    requests = sum(s[2] for s in steps)
+    raw = sum(s[3] for s in steps)
+    compressed = sum(s[4] for s in steps)
+    server = sum(s[5] for s in steps)
+    network = requests * args.rtt + compressed * 8 / args.kbps
+    print(f'  {"totale":<26}{"":>6}{requests:>7}{raw:>10}{compressed:>9}{server:>9.1f}')
+    print(f'  stima su rete mobile (RTT {args.rtt:g} ms, {args.kbps:g} kbit/s): {network + server:.0f} ms')
+    return requests, raw, compressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rtt', type=float, default=150, help='round trip della rete mobile, in ms')
+    parser.add_argument('--kbps', type=float, default=2000, help='banda in download, in kbit/s')
+    args = parser.parse_args()
+
+    config = temp_config()
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed(args.users, args.events, args.seed)
+        user = db.session.get(User, 1)
+        email = user.email
+        # Un evento futuro con posti liberi e un giocatore con cui l'utente non fa ancora rally
+        event_id = db.session.query(Event.id).filter(
+            Event.data_ora >= db.func.now(), Event.num_iscritti < Event.max_partecipanti - 1,
+            ~Event.iscritti.any(User.id == user.id)).order_by(Event.data_ora).limit(1).scalar()
+        other = User.query.filter(User.id != user.id, ~User.followers.any(User.id == user.id)).first().nome
+
+    # Due sessioni identiche: l'iscrizione la annulla la sessione stessa, il rally lo togliamo qui
+    html = report('Pagine HTML', html_session(app, email, event_id, other), args)
+    with app.app_context():
+        other_user = User.query.filter_by(nome=other).first()
+        db.session.get(User, 1).stop_rally(other_user)
+        db.session.commit()
+    api = report('API JSON (/api/v1)', api_session(app, email, event_id, other), args)
+
+    print(f'API rispetto a HTML: richieste {api[0]}/{html[0]}, byte {api[1] / html[1]:.1%}, '
+          f'gzip {api[2] / html[2]:.1%}')
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# benchmarks/bench_archive.py
+"""
+Pagine "calde" prima e dopo l'archiviazione degli eventi passati
+(app/archive.py), su dati sintetici con uno storico di più anni: la maggior
+parte degli eventi è nel passato, le pagine leggono solo quelli futuri.
+Misura /events (senza filtri e con i filtri più comuni), la bacheca, il
+profilo e lo storico di un utente, poi archivia tutto il passato e ripete.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_archive --users 2000 --events 40000 --years 3
+"""
+
+import argparse
+import os
+import time
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.archive import archive_past_events
+from app.models import Event, EventoArchiviato, User, partecipanti
+from benchmarks.bench_routes import QueryCounter, logged_client, measure, report
+from benchmarks.common import temp_config
+from benchmarks.seed import seed
+
+
+def table_sizes():
+    """Righe e pagine (dimensione su disco) delle tabelle principali."""
+    sizes = {}
+    for name in ('event', 'partecipanti', 'event_archivio', 'partecipanti_archivio'):
+        rows = db.session.scalar(sa.text(f'SELECT count(*) FROM {name}'))
+        pages = db.session.scalar(sa.text(f"SELECT count(*) FROM dbstat WHERE name = '{name}'")) \
+            if _has_dbstat() else None
+        sizes[name] = (rows, pages)
+    return sizes
+
+
+def _has_dbstat():
+    try:
+        db.session.execute(sa.text('SELECT 1 FROM dbstat LIMIT 1'))
+        return True
+    except sa.exc.OperationalError:
+        db.session.rollback()
+        return False
+
+
+def run_pages(app, counter, viewer, creator, repeat, warmup):
+    client = logged_client(app, viewer.id)
+    pages = [
+        ('events', 'GET', '/events', None),
+        ('events?tipologia', 'POST', '/events', {'tipologia': 'Lezione'}),
+        ('events?creatore', 'POST', '/events', {'creatore': str(creator)}),
+        ('index', 'GET', '/index', None),
+        ('user_profile', 'GET', f'/user/{viewer.nome}', None),
+        ('user_history', 'GET', f'/user/{viewer.nome}/storico', None),
+    ]
+    results = {}
+    for name, method, url, data in pages:
+        results[name] = measure(counter, lambda: client.open(url, method=method, data=data).status_code,
+                                repeat, warmup)
+        report(name, results[name])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=40000)
+    parser.add_argument('--years', type=int, default=3, help='anni di storico nel passato')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    # Senza cache: misuriamo le query, non la cache delle pagine
+    parser.add_argument('--cache', choices=['memory', 'null'], default='null')
+    args = parser.parse_args()
+
+    config = temp_config(CACHE_BACKEND=args.cache)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seed(args.users, args.events, args.seed, days_past=365 * args.years, days_ahead=90)
+        print(f'dati generati in {time.perf_counter() - start:.1f} s')
+        # Il giocatore con più partite e il creatore con più eventi futuri
+        viewer = db.session.get(User, db.session.scalar(
+            sa.select(partecipanti.c.user_id).group_by(partecipanti.c.user_id)
+            .order_by(sa.func.count().desc()).limit(1)))
+        creator = db.session.scalar(sa.select(Event.user_id).group_by(Event.user_id)
+                                    .order_by(sa.func.count().desc()).limit(1))
+        db.session.execute(sa.text('ANALYZE'))
+        before_sizes = table_sizes()
+        engines = [db.engine] + [e for e in [app.extensions.get('db_read_engine')] if e is not None]
+    counter = QueryCounter(engines)
+
+    print(f'\nprima dell\'archiviazione ({before_sizes["event"][0]} eventi nella tabella principale)')
+    before = run_pages(app, counter, viewer, creator, args.repeat, args.warmup)
+
+    with app.app_context():
+        start = time.perf_counter()
+        archived = archive_past_events(days=0)
+        elapsed = time.perf_counter() - start
+        # VACUUM: le pagine liberate tornano al file, gli indici vengono ricostruiti compatti
+        db.session.commit()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+            conn.exec_driver_sql('ANALYZE')
+        after_sizes = table_sizes()
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(EventoArchiviato)) == archived
+    print(f'\narchiviati {archived} eventi in {elapsed:.1f} s ({archived / elapsed:.0f} eventi/s)')
+    for name, (rows, pages) in after_sizes.items():
+        old_rows, old_pages = before_sizes[name]
+        print(f'  {name:24} righe {old_rows:>8} -> {rows:<8}' + (f' pagine {old_pages} -> {pages}' if pages is not None else ''))
+
+    print('\ndopo l\'archiviazione')
+    after = run_pages(app, counter, viewer, creator, args.repeat, args.warmup)
+
+    print('\nconfronto p50 (ms)')
+    for name in before:
+        old, new = before[name]['p50_ms'], after[name]['p50_ms']
+        print(f'  {name:24} {old:8.2f} -> {new:8.2f}  ({(new - old) / old * 100:+.0f}%)')
+
+    app.extensions['passwords']['hasher'].shutdown()
+    with app.app_context():
+        db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# benchmarks/bench_assets.py
+"""
+File statici di una pagina prima e dopo la build (app/assets.py), attraverso
+il test client di Flask: per le pagine di login, bacheca ed eventi conta
+- le richieste e i byte trasferiti (compressi, come li manda il server) per
+  fogli di stile, script e video, al primo accesso e quando si torna sulla
+  pagina con i file già in cache;
+- i byte che bloccano il primo paint (fogli di stile e script nel <head>);
+- le origini esterne da contattare (DNS, TCP e TLS in più prima del paint).
+
+"Prima" sono i CDN che base.html usava (Tailwind Play CDN, jQuery e Select2):
+le loro dimensioni si misurano scaricandoli, se la rete lo permette; il
+Tailwind Play CDN inoltre compila il CSS nel browser a ogni pagina, prima che
+la pagina abbia uno stile. Il tempo del primo paint vero si misura con un
+browser (es. Lighthouse); qui contiamo quello che lo determina.
+
+Uso (dalla cartella principale del progetto, dopo flask --app run assets-build):
+    python -m benchmarks.bench_assets
+"""
+
+import argparse
+import gzip
+import os
+import re
+import urllib.request
+from urllib.parse import urlsplit
+
+from app import create_app, db
+from benchmarks.common import temp_config
+from benchmarks.seed import seed, PASSWORD
+
+PAGES = [('login', '/login', False), ('bacheca', '/', True), ('eventi', '/events', True)]
+
+# Quello che base.html caricava in ogni pagina prima della build
+CDN = [
+    'https://cdn.tailwindcss.com',
+    'https://code.jquery.com/jquery-3.7.1.min.js',
+    'https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/css/select2.min.css',
+    'https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/js/select2.min.js',
+]
+
+HEAD_RE = re.compile(r'<head>(.*?)</head>', re.S)
+BLOCKING_RE = re.compile(r'<link href="([^"]+)" rel="stylesheet"|<script src="([^"]+)"></script>')
+MEDIA_RE = re.compile(r'<source src="([^"]+)"')
+
+
+class Resource:
+    def __init__(self, url, size, cached):
+        # size: byte trasferiti; cached: al ritorno non serve nessuna richiesta (None = non misurabile)
+        self.url, self.size, self.cached = url, size, cached
+
+
+def _headers_size(headers):
+    return sum(len(k) + len(v) + 4 for k, v in headers.items()) + 17
+
+
+def _fresh(cache_control):
+    """True se il browser può riusare la risposta senza chiedere (max-age > 0 e niente no-cache)."""
+    cache_control = (cache_control or '').lower()
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return 'no-cache' not in cache_control and 'no-store' not in cache_control and bool(match and int(match[1]))
+
+
+def fetch_cdn(url, timeout):
+    try:
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip', 'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            return Resource(url, len(body) + _headers_size(response.headers),
+                            _fresh(response.headers.get('Cache-Control')))
+    except OSError:
+        return Resource(url, None, None)
+
+
+def fetch_local(client, url):
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    return Resource(url, len(response.data) + _headers_size(response.headers),
+                    _fresh(response.headers.get('Cache-Control')))
+
+
+def page_resources(client, html):
+    head = HEAD_RE.search(html).group(1)
+    blocking = [a or b for a, b in BLOCKING_RE.findall(head)]
+    media = MEDIA_RE.findall(html)
+    return ([fetch_local(client, url) for url in blocking], [fetch_local(client, url) for url in media])
+
+
+def report(name, blocking, media):
+    resources = blocking + media
+    known = [r.size for r in resources if r.size is not None]
+    missing = len(resources) - len(known)
+    first = f'{sum(known) / 1024:8.1f} KB' + (f' (+{missing} n/d)' if missing else '')
+    blocking_known = [r.size for r in blocking if r.size is not None]
+    again = str(sum(1 for r in resources if r.cached is False)) + (f' (+{missing} n/d)' if missing else '')
+    origins = len({urlsplit(r.url).netloc for r in resources} - {''})
+    print(f'  {name:<10}{len(resources):>6}{first:>22}{sum(blocking_known) / 1024:>12.1f} KB'
+          f'{again:>16}{origins:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timeout', type=float, default=10, help='secondi per scaricare un file dai CDN')
+    args = parser.parse_args()
+
+    config = temp_config()
+    app = create_app(config)
+    if not app.extensions['assets']['files']:
+        raise SystemExit('Manca la build dei file statici: eseguire prima flask --app run assets-build')
+    with app.app_context():
+        db.create_all()
+        seed(20, 40)
+    client = app.test_client()
+
+    cdn = [fetch_cdn(url, args.timeout) for url in CDN]
+    for resource in cdn:
+        size = f'{resource.size / 1024:.1f} KB' if resource.size is not None else 'non raggiungibile'
+        print(f'{resource.url}: {size}')
+    # Il video prima della build: /static, con Cache-Control: no-cache
+    video = fetch_local(client, '/static/tennis_rally.mp4')
+
+    header = (f'  {"pagina":<10}{"file":>6}{"byte al 1° accesso":>22}{"bloccanti":>15}'
+              f'{"rich. ritorno":>16}{"origini":>9}')
+    results = {}
+    for name, url, login in PAGES:
+        if login:
+            client.post('/login', data={'email': 'utente1@example.com', 'password': PASSWORD})
+        html = client.get(url).get_data(as_text=True)
+        results[name] = (html, page_resources(client, html))
+
+    print('Prima (CDN, Tailwind compilato nel browser)')
+    print(header)
+    for name, _, _ in PAGES:
+        html = results[name][0]
+        report(name, cdn, [video] if MEDIA_RE.search(html) else [])
+    print('Dopo (file nostri con impronta, gzip, cache immutable)')
+    print(header)
+    for name, _, _ in PAGES:
+        blocking, media = results[name][1]
+        report(name, blocking, media)
+
+    css = app.extensions['assets']['files']['css/app.css']
+    with open(os.path.join(app.static_folder, 'dist', css), 'rb') as f:
+        data = f.read()
+    print(f'Foglio di stile compilato: {len(data) / 1024:.1f} KB, {len(gzip.compress(data, 9)) / 1024:.1f} KB con gzip')
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# benchmarks/bench_chat.py
+"""
+Chat (app/chat.py) servita da serve.py: molti stream SSE aperti insieme e
+tempo dall'invio di un messaggio alla sua consegna a tutti gli stream della
+stanza.
+- apre --streams connessioni SSE (distribuite su --rooms stanze) e le tiene
+  aperte: conta i thread e la memoria dei worker mentre sono tutte aperte;
+- invia --messages messaggi (POST, uno ogni --interval secondi, a stanze a
+  rotazione) e misura per ogni consegna il tempo da prima del POST alla
+  ricezione sullo stream: p50, p95, p99 e massimo;
+- con un worker il broker è 'local' (l'hub viene svegliato dal commit), con
+  più worker 'database' (i messaggi scritti da un altro worker arrivano al
+  controllo successivo della tabella, ogni CHAT_POLL_INTERVAL secondi).
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_chat --streams 2000 --rooms 50 --messages 200
+
+Client e server girano sulla stessa macchina: servono almeno 2 * --streams
+file descriptor (ulimit -n).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from benchmarks.bench_server import HOST, ROOT, login, request, seed, wait_ready
+from benchmarks.common import percentile
+
+# Gli eventi di benchmarks.bench_server.seed sono creati a rotazione dagli
+# utenti: l'utente 1 (g0) ha creato l'evento 1, 1 + USERS, 1 + 2 * USERS, ...
+USERS = 10
+
+
+def worker_stats(server_pid):
+    """Thread e memoria residente (MB) dei processi figli del master."""
+    with open(f'/proc/{server_pid}/task/{server_pid}/children') as f:
+        children = [int(pid) for pid in f.read().split()]
+    threads, rss = [], 0
+    for pid in children:
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        threads.append(int(status['Threads']))
+        rss += int(status['VmRSS'].split()[0]) / 1024
+    return threads, rss
+
+
+async def open_stream(port, cookie, stanza, after, received):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(f'GET /chat/{stanza}/stream?dopo={after} HTTP/1.0\r\nHost: {HOST}\r\nCookie: {cookie}\r\n'
+                 f'Accept: text/event-stream\r\n\r\n'.encode())
+    status = await reader.readline()
+    if b' 200 ' not in status:
+        raise RuntimeError(f'stream {stanza}: {status!r}')
+    await reader.readuntil(b'\r\n\r\n')
+    return asyncio.create_task(consume(reader, writer, received))
+
+
+async def consume(reader, writer, received):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'data: '):
+                message = json.loads(line[6:])
+                received.append(time.perf_counter() - float(message['testo']))
+    finally:
+        writer.close()
+
+
+def post(port, cookie, token, stanza):
+    """Invia un messaggio il cui testo è l'istante (perf_counter) prima del POST; restituisce il suo id."""
+    body = urlencode({'csrf_token': token, 'testo': repr(time.perf_counter())})
+    response, data = request(port, 'POST', f'/chat/{stanza}/messaggi', cookie, body,
+                             headers={'Accept': 'application/json'})
+    return json.loads(data)['id'] if response.status == 201 else None
+
+
+def sender(port, cookie, token, rooms, count, interval, errors):
+    for i in range(count):
+        if post(port, cookie, token, rooms[i % len(rooms)]) is None:
+            errors.append(i)
+        time.sleep(interval)
+
+
+async def run_load(port, server_pid, args):
+    cookie = login(port, 0)
+    _, page = request(port, 'GET', '/chat/evento-1', cookie)
+    token = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1).decode()
+    rooms = [f'evento-{1 + USERS * i}' for i in range(args.rooms)]
+    # Gli stream partono da qui: i messaggi delle prove precedenti non contano
+    after = post(port, cookie, token, rooms[0])
+
+    received = []
+    start = time.perf_counter()
+    tasks = []
+    # A gruppi, per non riempire la coda del socket in ascolto
+    for first in range(0, args.streams, 200):
+        tasks += await asyncio.gather(*[open_stream(port, cookie, rooms[i % len(rooms)], after, received)
+                                        for i in range(first, min(first + 200, args.streams))])
+    opened = time.perf_counter() - start
+    await asyncio.sleep(1)
+    threads, rss = worker_stats(server_pid)
+    print(f'  {args.streams} stream aperti in {opened:.1f} s; thread per worker: {threads}, '
+          f'memoria dei worker: {rss:.0f} MB')
+
+    errors = []
+    thread = threading.Thread(target=sender, args=(port, cookie, token, rooms, args.messages, args.interval, errors))
+    thread.start()
+    while thread.is_alive():
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(args.poll + 1)
+    expected = sum(args.streams // len(rooms) + (r < args.streams % len(rooms))
+                   for r in (i % len(rooms) for i in range(args.messages)))
+    latencies = [t * 1000 for t in received]
+    print(f'  {args.messages} messaggi, {len(received)} consegne su {expected} attese, errori di invio {len(errors)}')
+    print(f'  consegna: p50 {percentile(latencies, 50):7.1f}  p95 {percentile(latencies, 95):7.1f}  '
+          f'p99 {percentile(latencies, 99):7.1f}  max {max(latencies, default=0):7.1f} ms')
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.02, help='secondi tra un invio e il successivo')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--poll', type=float, default=0.5, help='CHAT_POLL_INTERVAL con più worker')
+    parser.add_argument('--port', type=int, default=8790)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < args.streams + 100:
+        sys.exit(f'servono almeno {args.streams + 100} file descriptor (ulimit -n è {hard})')
+
+    fd, path = tempfile.mkstemp(prefix='tennis-bench-', suffix='.db')
+    os.close(fd)
+    cache_dir = tempfile.mkdtemp(prefix='tennis-bench-cache-')
+    env = dict(os.environ, DATABASE_URI='sqlite:///' + path, CACHE_DIR=cache_dir, JOBS_WORKERS='0',
+               LOGIN_MAX_ATTEMPTS_IP='1000000', CHAT_POLL_INTERVAL=str(args.poll))
+    seed(env, USERS, USERS * args.rooms)
+
+    print(f'{os.cpu_count()} CPU, {args.streams} stream su {args.rooms} stanze')
+    for workers in (1, 2):
+        port = args.port + workers
+        broker = 'local' if workers == 1 else f'database, controllo ogni {args.poll:g} s'
+        print(f'serve.py ({workers} worker x {args.threads} thread, broker {broker})')
+        server = subprocess.Popen(
+            [sys.executable, 'serve.py', '--bind', f'{HOST}:{port}',
+             '--workers', str(workers), '--threads', str(args.threads)],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(port)
+            asyncio.run(run_load(port, server.pid, args))
+        finally:
+            server.terminate()
+            server.wait(60)
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# benchmarks/bench_cold_start.py
+"""
+Avvio a freddo: ogni misura è un processo Python nuovo, come un worker appena
+avviato (o riciclato) che non ha ancora servito nulla. Per ogni processo:
+- import dell'applicazione e create_app();
+- il riscaldamento di app/warmup.py (template, mapper, grafo dei rally e
+  connessioni al database), quando lo scenario lo prevede;
+- la prima e la seconda richiesta a login, bacheca, eventi, giocatori e
+  profilo, attraverso il test client di Flask (la differenza tra le due è
+  quello che paga il primo utente).
+
+Scenari: senza cache dei template (come prima), con la cache su disco ancora
+vuota (primo avvio dopo un deploy), con la cache già pronta (avvii successivi,
+oppure dopo flask precompile) e con la cache più il riscaldamento.
+serve.py compila i template e configura i mapper nel master, prima del fork:
+lì i worker partono come nell'ultimo scenario (le connessioni solo con --warmup).
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_cold_start --runs 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Hashing leggero: il login non è quello che misuriamo
+HASH_METHOD = 'pbkdf2:sha256:1000'
+
+PAGES = [('login', '/login'), ('bacheca', '/'), ('eventi', '/events'),
+         ('giocatori', '/players'), ('profilo', '/user/{nome}')]
+
+SCENARIOS = [
+    ('senza cache dei template', 'none', False),
+    ('cache dei template vuota', 'empty', False),
+    ('cache dei template pronta', 'ready', False),
+    ('cache pronta + riscaldamento', 'ready', True),
+]
+
+
+def _ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def child(warmup, player):
+    """Un avvio: stampa i tempi in JSON sullo standard output."""
+    start = time.perf_counter()
+    from app import create_app
+    from benchmarks.seed import PASSWORD
+    from config import Config
+    timings = {'import': _ms(start)}
+
+    config = type('ColdStartConfig', (Config,), {
+        'WTF_CSRF_ENABLED': False, 'TESTING': True, 'JOBS_WORKERS': 0, 'CACHE_BACKEND': 'memory'})
+    start = time.perf_counter()
+    app = create_app(config)
+    timings['create_app'] = _ms(start)
+
+    if warmup:
+        from app.warmup import prime_connections, warm_up
+        start = time.perf_counter()
+        warm_up(app)
+        prime_connections(app, 4)
+        timings['riscaldamento'] = _ms(start)
+
+    client = app.test_client()
+    for name, url in PAGES:
+        if name == 'bacheca':
+            client.post('/login', data={'email': 'utente1@example.com', 'password': PASSWORD})
+        url = url.format(nome=player)
+        for attempt in ('1', '2'):
+            start = time.perf_counter()
+            response = client.get(url)
+            timings[f'{name}:{attempt}'] = _ms(start)
+            assert response.status_code == 200, (url, response.status_code)
+    print(json.dumps(timings))
+
+
+def run(env, cache_dir, mode, warmup, player):
+    env = dict(env)
+    if mode == 'none':
+        env['JINJA_CACHE_DIR'] = ''
+    else:
+        if mode == 'empty':
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        env['JINJA_CACHE_DIR'] = cache_dir
+    args = [sys.executable, '-m', 'benchmarks.bench_cold_start', '--child', '--player', player]
+    if warmup:
+        args.append('--warmup')
+    start = time.perf_counter()
+    out = subprocess.run(args, cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    timings = json.loads(out.strip().splitlines()[-1])
+    timings['processo'] = _ms(start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='avvii per scenario (si riporta la mediana)')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warmup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--player', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.warmup, args.player)
+
+    from app import create_app, db
+    from app.database import dispose_engines
+    from app.models import User
+    from benchmarks.common import temp_config
+    from benchmarks.seed import seed
+
+    config = temp_config(PASSWORD_HASH_METHOD=HASH_METHOD)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed(args.users, args.events)
+        player = db.session.get(User, 2).nome
+    dispose_engines(app, db)
+
+    cache_dir = tempfile.mkdtemp(prefix='tennis-jinja-')
+    env = dict(os.environ, DATABASE_URI=config.SQLALCHEMY_DATABASE_URI, PASSWORD_HASH_METHOD=HASH_METHOD,
+               PASSWORD_HASH_WORKERS='0', PYTHONPATH=ROOT)
+
+    columns = ['processo', 'import', 'create_app', 'riscaldamento'] + [
+        f'{name}:{attempt}' for name, _ in PAGES for attempt in '12']
+    results = []
+    for title, mode, warmup in SCENARIOS:
+        runs = [run(env, cache_dir, mode, warmup, player) for _ in range(args.runs)]
+        results.append((title, {c: statistics.median(r.get(c, 0) for r in runs) for c in columns}))
+
+    print(f'Mediana di {args.runs} avvii, in ms (1a / 2a richiesta per pagina)')
+    print(f'  {"scenario":<30}{"processo":>9}{"import":>8}{"app":>6}{"risc.":>7}'
+          + ''.join(f'{name:>15}' for name, _ in PAGES))
+    for title, m in results:
+        pages = ''.join(f'{m[name + ":1"]:>8.1f} /{m[name + ":2"]:>5.1f}' for name, _ in PAGES)
+        print(f'  {title:<30}{m["processo"]:>9.0f}{m["import"]:>8.0f}{m["create_app"]:>6.0f}'
+              f'{m["riscaldamento"]:>7.0f}{pages}')
+    for title, m in results:
+        first = sum(m[name + ':1'] for name, _ in PAGES)
+        print(f'  {title}: prime richieste {first:.0f} ms in tutto, '
+              f'pronto alla prima risposta dopo {m["import"] + m["create_app"] + m["riscaldamento"]:.0f} ms')
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
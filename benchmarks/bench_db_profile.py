@@ -0,0 +1,123 @@
+# benchmarks/bench_db_profile.py
+"""
+Throughput delle letture (pagina /events) mentre un processo di scrittura è
+attivo, con il profilo del database 'production' (WAL, PRAGMA, pool di sola
+lettura) e con il profilo 'basic' (impostazioni predefinite).
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_db_profile --readers 8 --seconds 5
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import User, Event
+from benchmarks.common import temp_config, percentile
+
+
+def seed(n_events):
+    user = User(nome='lettore', email='lettore@example.com', cap='20121', password_hash='-')
+    db.session.add(user)
+    db.session.flush()
+    start = datetime.now() + timedelta(days=1)
+    db.session.execute(Event.__table__.insert(), [
+        {'titolo': f'Evento {i}', 'tipologia': 'Partita 1vs1', 'descrizione': '',
+         'data_ora': start + timedelta(hours=i), 'luogo': 'Circolo', 'max_partecipanti': 4,
+         'livello_consigliato': 'Tutti', 'user_id': user.id}
+        for i in range(n_events)
+    ])
+    db.session.commit()
+
+
+def writer(app, stop, stats, batch, ready):
+    """Scrive continuamente: ogni transazione inserisce 'batch' eventi e poi li cancella."""
+    ready.wait()
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                rows = [{'titolo': 'Scrittura', 'tipologia': 'Lezione', 'descrizione': 'x' * 500,
+                         'data_ora': datetime.now() - timedelta(days=1), 'luogo': 'Circolo',
+                         'max_partecipanti': 2, 'livello_consigliato': 'Tutti'} for _ in range(batch)]
+                db.session.execute(Event.__table__.insert(), rows)
+                db.session.execute(Event.__table__.delete().where(Event.titolo == 'Scrittura'))
+                db.session.commit()
+                stats['writes'] += 1
+            except Exception:
+                db.session.rollback()
+                stats['write_errors'] += 1
+            stats['write_ms'].append((time.perf_counter() - start) * 1000)
+        db.session.remove()
+
+
+def reader(app, stop, stats, ready):
+    client = app.test_client()
+    # Login diretto sulla sessione, per non misurare l'hashing della password
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    ready.wait()
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            ok = client.get('/events').status_code == 200
+        except Exception:
+            ok = False
+        stats['read_ms'].append((time.perf_counter() - start) * 1000)
+        if not ok:
+            stats['read_errors'] += 1
+
+
+def run(profile, args):
+    config = temp_config(DB_PROFILE=profile, SQLITE_BUSY_TIMEOUT=2000)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed(args.events)
+
+    stats = {'writes': 0, 'write_errors': 0, 'write_ms': [], 'read_ms': [], 'read_errors': 0}
+    stop = threading.Event()
+    ready = threading.Barrier(args.readers + (0 if args.no_writer else 1) + 1)
+    threads = [threading.Thread(target=reader, args=(app, stop, stats, ready)) for _ in range(args.readers)]
+    if not args.no_writer:
+        threads.append(threading.Thread(target=writer, args=(app, stop, stats, args.batch, ready)))
+    for t in threads:
+        t.start()
+    ready.wait()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    reads = len(stats['read_ms'])
+    print(f'\nProfilo {profile!r}: {args.readers} lettori, scrittore {"assente" if args.no_writer else "attivo"}')
+    print(f'  letture/s             {reads / args.seconds:10.1f}   (errori: {stats["read_errors"]})')
+    print(f'  latenza lettura p50/p95/p99  {percentile(stats["read_ms"], 50):.1f} / '
+          f'{percentile(stats["read_ms"], 95):.1f} / {percentile(stats["read_ms"], 99):.1f} ms')
+    print(f'  transazioni di scrittura/s   {stats["writes"] / args.seconds:10.1f}   (errori: {stats["write_errors"]})')
+
+    with app.app_context():
+        db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=2000, help='righe scritte per transazione')
+    parser.add_argument('--no-writer', action='store_true')
+    args = parser.parse_args()
+    for profile in ('basic', 'production'):
+        run(profile, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_geo.py
+"""
+Ricerca "eventi entro N km": griglia spaziale indicizzata contro calcolo della
+distanza riga per riga, al crescere della tabella degli eventi.
+Gli eventi sono sparsi a caso su un'area di circa 280 x 240 km attorno a Milano
+(come se il CAP fosse sempre noto), per simulare un bacino di utenti regionale.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_geo --sizes 10000 100000 400000
+"""
+
+import argparse
+import os
+import random
+from datetime import datetime, timedelta, date
+
+from app import create_app, db
+from app.models import User, Event
+from app.geo import grid_cell, within_radius, with_distance, distance_km
+from benchmarks.common import temp_config, timeit, summary
+
+
+def add_events(n, creator_id, rng):
+    start = datetime.combine(date.today(), datetime.min.time())
+    rows = []
+    for i in range(n):
+        lat, lon = rng.uniform(44.4, 46.6), rng.uniform(7.8, 10.9)
+        cella_lat, cella_lon = grid_cell(lat, lon)
+        rows.append({
+            'titolo': f'Evento {i}', 'tipologia': 'Partita 1vs1', 'descrizione': '',
+            'data_ora': start + timedelta(minutes=rng.randrange(60, 60 * 24 * 365)),
+            'luogo': 'Circolo', 'lat': lat, 'lon': lon,
+            'cella_lat': cella_lat, 'cella_lon': cella_lon,
+            'max_partecipanti': 4, 'livello_consigliato': 'Tutti', 'user_id': creator_id,
+        })
+        if len(rows) == 5000:
+            db.session.execute(Event.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Event.__table__.insert(), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 400000])
+    parser.add_argument('--radius', type=float, default=5.0)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=24)
+    args = parser.parse_args()
+
+    config = temp_config()
+    app = create_app(config)
+    rng = random.Random(42)
+    with app.app_context():
+        db.create_all()
+        creator = User(nome='bench', email='bench@example.com', cap='20121', password_hash='-')
+        db.session.add(creator)
+        db.session.commit()
+        center = (45.4642, 9.1900)    # Milano, piazza del Duomo
+
+        total = 0
+        for size in sorted(args.sizes):
+            add_events(size - total, creator.id, rng)
+            total = size
+            base = Event.query.filter(Event.data_ora >= date.today())
+
+            def grid():
+                query, distance = with_distance(within_radius(base, Event, center, args.radius), Event, center)
+                return query.order_by(distance, Event.id).limit(args.page_size).all()
+
+            def row_by_row():
+                rows = db.session.query(Event.id, Event.lat, Event.lon).filter(Event.data_ora >= date.today()).all()
+                near = [(distance_km(center[0], center[1], lat, lon), id_) for id_, lat, lon in rows
+                        if lat is not None and distance_km(center[0], center[1], lat, lon) <= args.radius]
+                return sorted(near)[:args.page_size]
+
+            print(f'\n{size} eventi, raggio {args.radius} km')
+            print(f'  griglia + indice     {summary(timeit(grid, args.repeat))}')
+            print(f'  riga per riga        {summary(timeit(row_by_row, max(3, args.repeat // 3)))}')
+
+    os.remove(config.BENCH_DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# benchmarks/bench_jobs.py
+"""
+Coda dei lavori (app/jobs.py) e avvisi per email (app/notifications.py), con
+il server SMTP di prova di smtp_debug.py al posto di un server di posta:
+- modifica di un evento con molti iscritti: la richiesta che accoda l'avviso
+  contro l'invio delle email dentro la richiesta;
+- email al secondo eseguite dai worker, una connessione SMTP per email
+  (gruppi da 1) contro gruppi di MAIL_BATCH_SIZE sulla stessa connessione,
+  con 1 e più thread;
+- costo di claim() con una coda lunga (lavori pronti e rimandati).
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_jobs --emails 2000 --iscritti 200
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.jobs import JobWorkers, claim, enqueue_many, run_pending
+from app.models import Event, Job, User, partecipanti
+from app.notifications import _prepare_emails, _send_emails, event_snapshot, notify_event_changed
+from benchmarks.common import temp_config, percentile
+from benchmarks.seed import seed
+from smtp_debug import DebugSMTPServer
+
+
+def per_call(label, fn, repeat):
+    """Tempo di fn() ripetuta: p50 e p95 in millisecondi."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1e3)
+    print(f'  {label:50} p50 {percentile(timings, 50):8.2f}  p95 {percentile(timings, 95):8.2f} ms')
+
+
+def _queued():
+    return db.session.scalar(sa.select(sa.func.count()).where(Job.stato.in_([Job.IN_CODA, Job.IN_CORSO])))
+
+
+def drain(app, threads, smtp, count):
+    """Esegue tutta la coda con 'threads' thread; restituisce le email al secondo."""
+    smtp.messages.clear()
+    start = time.perf_counter()
+    if threads == 1:
+        run_pending()
+    else:
+        workers = JobWorkers(app, threads, poll_interval=0.05)
+        workers.start()
+        while _queued():
+            db.session.commit()
+            time.sleep(0.01)
+        workers.stop()
+    elapsed = time.perf_counter() - start
+    assert len(smtp.messages) == count, (len(smtp.messages), count)
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--iscritti', type=int, default=200, help="iscritti dell'evento modificato")
+    parser.add_argument('--emails', type=int, default=2000, help='email per la misura dei worker')
+    parser.add_argument('--backlog', type=int, default=100000, help='lavori in coda per la misura di claim()')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    smtp = DebugSMTPServer(port=args.port).start()
+    config = temp_config(CACHE_BACKEND='null', MAIL_SERVER='127.0.0.1', MAIL_PORT=args.port)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed(args.users, args.events, args.seed)
+
+        # --- un evento con molti iscritti (aggiunti direttamente, senza i controlli delle iscrizioni)
+        event = db.session.scalars(sa.select(Event).order_by(Event.data_ora.desc())).first()
+        db.session.execute(sa.delete(partecipanti).where(partecipanti.c.event_id == event.id))
+        db.session.execute(sa.insert(partecipanti), [
+            {'user_id': user_id, 'event_id': event.id} for user_id in db.session.scalars(
+                sa.select(User.id).where(User.id != event.user_id).limit(args.iscritti))])
+        db.session.commit()
+        print(f'\nmodifica di un evento con {args.iscritti} iscritti')
+
+        def edit(notify):
+            before = event_snapshot(event)
+            event.titolo = f'Evento {time.perf_counter_ns()}'
+            notify(before)
+            db.session.commit()
+
+        def enqueue_only(before):
+            notify_event_changed(before, event)
+
+        def send_inline(before):
+            # Come farebbe la richiesta senza coda: prepara le email e le invia subito
+            after = event_snapshot(event)
+            chiave = f'prova:{after["titolo"]}'
+            _prepare_emails([{'tipo': 'modificato', 'evento': after, 'prima': before, 'quando': '',
+                              'modifiche': ['titolo'], 'autore_id': event.user_id, 'chiave': chiave}])
+            _send_emails([json.loads(payload) for payload in db.session.scalars(
+                sa.select(Job.payload).where(Job.chiave.like(f'{chiave}:%')))])
+
+        with app.test_request_context():
+            per_call("la richiesta accoda l'avviso (ora)", lambda: edit(enqueue_only), 20)
+            per_call('la richiesta prepara e invia le email', lambda: edit(send_inline), 5)
+        db.session.execute(sa.delete(Job))
+        db.session.commit()
+
+        # --- worker: gruppi da 1 contro gruppi sulla stessa connessione
+        print(f'\n{args.emails} email al server SMTP di prova')
+        items = [({'a': f'utente{i}@example.com', 'oggetto': 'Prova', 'testo': 'Testo di prova.'}, None)
+                 for i in range(args.emails)]
+        for batch in (1, app.config['MAIL_BATCH_SIZE']):
+            for threads in (1, 4):
+                app.config['MAIL_BATCH_SIZE'] = batch
+                enqueue_many('email', items)
+                db.session.commit()
+                rate = drain(app, threads, smtp, args.emails)
+                print(f'  gruppi da {batch:3}, {threads} thread: {rate:8.0f} email/s')
+
+        # --- claim() con una coda lunga: metà pronta, metà rimandata di un'ora
+        db.session.execute(sa.delete(Job))
+        half = args.backlog // 2
+        enqueue_many('email', items[:1] * half)
+        enqueue_many('email', items[:1] * half, delay=3600)
+        db.session.commit()
+        db.session.execute(sa.text('ANALYZE'))
+        app.config['MAIL_BATCH_SIZE'] = 50
+        print(f'\nclaim() con {args.backlog} lavori in coda')
+        per_call('claim (gruppo da 50) e fine dei lavori', _claim_and_finish, 200)
+        db.engine.dispose()
+
+    app.extensions['passwords']['hasher'].shutdown()
+    smtp.shutdown()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+def _claim_and_finish():
+    # Solo la contabilità della coda: i lavori finiscono senza inviare niente
+    tipo, rows = claim()
+    db.session.connection().execute(sa.update(Job).where(Job.id.in_([row.id for row in rows]))
+                                    .values(stato=Job.FATTO, finito_il=datetime.utcnow()))
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# benchmarks/bench_join.py
+"""
+Stress test delle iscrizioni: molti thread e processi cercano di iscriversi
+contemporaneamente allo stesso evento.
+
+Verifica che l'evento non superi mai max_partecipanti e riporta iscrizioni al
+secondo, latenza dei tentativi (incluse le attese sul lock di SQLite) ed
+eventuali errori "database is locked".
+Con --naive ripete la vecchia logica (conta, confronta, aggiungi) per mostrare
+l'overbooking.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_join --processes 4 --threads 8 --seats 50 --users 800
+    python -m benchmarks.bench_join --naive
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.models import User, Event, partecipanti
+from app import enrollment
+from benchmarks.common import temp_config, percentile
+
+
+def naive_join(event_id, user_id):
+    """La vecchia logica di join_event: lettura, confronto e scrittura separati."""
+    event = db.session.get(Event, event_id)
+    user = db.session.get(User, user_id)
+    if event.iscritti.count() >= event.max_partecipanti:
+        result = enrollment.COMPLETO
+    elif user in event.iscritti:
+        result = enrollment.GIA_ISCRITTO
+    else:
+        event.iscritti.append(user)
+        db.session.commit()
+        result = enrollment.ISCRITTO
+    db.session.rollback()
+    return result
+
+
+def run_thread(app, event_id, user_ids, naive, out):
+    with app.app_context():
+        for user_id in user_ids:
+            start = time.perf_counter()
+            try:
+                if naive:
+                    result = naive_join(event_id, user_id)
+                else:
+                    result = enrollment.join_event(event_id, user_id, waitlist=False)
+            except OperationalError:
+                db.session.rollback()
+                result = 'locked'
+            out.append((result, (time.perf_counter() - start) * 1000))
+        db.session.remove()
+
+
+def run_process(db_uri, event_id, user_ids, threads, naive, queue):
+    config = temp_config(SQLALCHEMY_DATABASE_URI=db_uri)
+    os.remove(config.BENCH_DB_PATH)
+    app = create_app(config)
+    results = []
+    chunks = [user_ids[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=run_thread, args=(app, event_id, chunk, naive, results))
+               for chunk in chunks]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    queue.put(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seats', type=int, default=50)
+    parser.add_argument('--users', type=int, default=800)
+    parser.add_argument('--naive', action='store_true', help='usa la vecchia logica non atomica')
+    args = parser.parse_args()
+
+    config = temp_config()
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [
+            {'nome': f'giocatore{i}', 'email': f'g{i}@example.com', 'cap': '20121', 'password_hash': '-'}
+            for i in range(args.users)
+        ])
+        event = Event(titolo='Finale del torneo', tipologia='Partita 2vs2', descrizione='',
+                      data_ora=datetime.now() + timedelta(days=7), luogo='Centrale',
+                      max_partecipanti=args.seats, livello_consigliato='Tutti')
+        db.session.add(event)
+        db.session.commit()
+        event_id = event.id
+        user_ids = [u for (u,) in db.session.query(User.id).all()]
+
+    queue = multiprocessing.Queue()
+    chunks = [user_ids[i::args.processes] for i in range(args.processes)]
+    procs = [multiprocessing.Process(target=run_process,
+                                     args=(config.SQLALCHEMY_DATABASE_URI, event_id, chunk, args.threads, args.naive, queue))
+             for chunk in chunks]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    results = []
+    for _ in procs:
+        results.extend(queue.get())
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        enrolled = db.session.query(func.count()).select_from(partecipanti) \
+            .filter(partecipanti.c.event_id == event_id).scalar()
+        counter = db.session.get(Event, event_id).num_iscritti
+
+    latencies = [ms for _, ms in results]
+    outcomes = {}
+    for result, _ in results:
+        outcomes[result] = outcomes.get(result, 0) + 1
+
+    print(f"Modalità: {'vecchia logica (naive)' if args.naive else 'UPDATE condizionale atomica'}")
+    print(f'{args.processes} processi x {args.threads} thread, {len(results)} tentativi in {elapsed:.2f} s')
+    print(f'  tentativi/s           {len(results) / elapsed:10.1f}')
+    print(f'  iscrizioni/s          {outcomes.get(enrollment.ISCRITTO, 0) / elapsed:10.1f}')
+    print(f'  latenza p50/p95/p99   {percentile(latencies, 50):.1f} / {percentile(latencies, 95):.1f} / '
+          f'{percentile(latencies, 99):.1f} ms')
+    print(f'  esiti                 {outcomes}')
+    print(f'  posti {args.seats}, righe in partecipanti {enrolled}, contatore {counter}')
+    print('  OVERBOOKING!' if enrolled > args.seats else '  nessun overbooking')
+
+    os.remove(config.BENCH_DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
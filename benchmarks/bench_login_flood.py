@@ -0,0 +1,123 @@
+# benchmarks/bench_login_flood.py
+"""
+Latenza delle pagine normali (/events) durante un'ondata di login falliti
+(credential stuffing simulato), in tre configurazioni:
+- 'inline':   hashing nel thread della richiesta, nessun limite ai tentativi;
+- 'pool':     hashing nel pool di processi con coda limitata;
+- 'throttle': pool + limiti ai tentativi per account e per IP (configurazione predefinita).
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_login_flood --attackers 16 --readers 4 --seconds 10
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import User, Event
+from app.passwords import get_hasher
+from benchmarks.common import temp_config, percentile
+
+SCENARIOS = {
+    'inline': {'PASSWORD_HASH_WORKERS': 0, 'LOGIN_MAX_ATTEMPTS_ACCOUNT': 10 ** 9, 'LOGIN_MAX_ATTEMPTS_IP': 10 ** 9},
+    'pool': {'LOGIN_MAX_ATTEMPTS_ACCOUNT': 10 ** 9, 'LOGIN_MAX_ATTEMPTS_IP': 10 ** 9},
+    'throttle': {},
+}
+
+
+def seed(n_users, n_events):
+    password_hash = get_hasher().hash('password')
+    db.session.execute(User.__table__.insert(), [
+        {'nome': f'giocatore{i}', 'email': f'g{i}@example.com', 'cap': '20121',
+         'password_hash': password_hash}
+        for i in range(n_users)
+    ])
+    start = datetime.now() + timedelta(days=1)
+    db.session.execute(Event.__table__.insert(), [
+        {'titolo': f'Evento {i}', 'tipologia': 'Partita 1vs1', 'descrizione': '',
+         'data_ora': start + timedelta(hours=i), 'luogo': 'Circolo', 'max_partecipanti': 4,
+         'livello_consigliato': 'Tutti', 'user_id': 1}
+        for i in range(n_events)
+    ])
+    db.session.commit()
+
+
+def attacker(app, n, stop, stats, ready):
+    client = app.test_client()
+    ready.wait()
+    i = n
+    while not stop.is_set():
+        response = client.post('/login', data={'email': f'g{i % 1000}@example.com', 'password': 'sbagliata'})
+        stats['logins'][response.status_code] = stats['logins'].get(response.status_code, 0) + 1
+        i += 7
+
+
+def reader(app, stop, stats, ready):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    ready.wait()
+    while not stop.is_set():
+        start = time.perf_counter()
+        status = client.get('/events').status_code
+        stats['read_ms'].append((time.perf_counter() - start) * 1000)
+        if status != 200:
+            stats['read_errors'] += 1
+
+
+def run(name, args):
+    config = temp_config(**SCENARIOS[name])
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed(1000, args.events)
+
+    for flood in (False, True):
+        stats = {'read_ms': [], 'read_errors': 0, 'logins': {}}
+        stop = threading.Event()
+        attackers = args.attackers if flood else 0
+        ready = threading.Barrier(args.readers + attackers + 1)
+        threads = [threading.Thread(target=reader, args=(app, stop, stats, ready)) for _ in range(args.readers)]
+        threads += [threading.Thread(target=attacker, args=(app, n, stop, stats, ready)) for n in range(attackers)]
+        for t in threads:
+            t.start()
+        ready.wait()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        reads = stats['read_ms']
+        label = f'{attackers} attaccanti' if flood else 'nessun attacco'
+        print(f'  {name:9} {label:16} /events: {len(reads) / args.seconds:6.1f} req/s   '
+              f'p50 {percentile(reads, 50):7.1f}  p95 {percentile(reads, 95):7.1f}  '
+              f'p99 {percentile(reads, 99):7.1f} ms   login per stato {dict(sorted(stats["logins"].items()))}')
+
+    app.extensions['passwords']['hasher'].shutdown()
+    with app.app_context():
+        db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--attackers', type=int, default=16)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help='scenari da eseguire (predefinito: tutti)')
+    args = parser.parse_args()
+    print(f'{os.cpu_count()} CPU, {args.readers} lettori')
+    for name in args.scenario or SCENARIOS:
+        run(name, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# benchmarks/bench_rally_graph.py
+"""
+Grafo dei rally in memoria (app/rally_graph.py) contro le query SQL, su dati
+sintetici (di default 50.000 utenti e circa un milione di rally):
+- caricamento e memoria degli array CSR (e, per confronto, di un dizionario
+  di insiemi con gli stessi rally);
+- "facciamo rally?", rally in comune e compagni dei compagni, in
+  microsecondi, contro le query equivalenti;
+- giocatori suggeriti (grafo + una query per le partite insieme);
+- rally iniziati e terminati dopo il caricamento, poi confronto completo tra
+  grafo e database.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_rally_graph --users 50000 --rallies 26 --events 20000
+"""
+
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.models import User, rally
+from app.rally_graph import RallyGraph, differences, get_graph, _suggest
+from benchmarks.common import temp_config, percentile
+from benchmarks.seed import seed
+
+
+def per_call(label, fn, args, unit='us'):
+    """Tempo di fn(*a) per ogni a in args: p50 e p95, in microsecondi o millisecondi."""
+    scale = 1e6 if unit == 'us' else 1e3
+    timings = []
+    for a in args:
+        start = time.perf_counter()
+        fn(*a)
+        timings.append((time.perf_counter() - start) * scale)
+    print(f'  {label:42} p50 {percentile(timings, 50):9.1f}  p95 {percentile(timings, 95):9.1f} {unit}')
+
+
+def sql_mutual(a, b):
+    mine = sa.select(rally.c.followed_id).where(rally.c.follower_id == a)
+    return db.session.scalar(sa.select(sa.func.count()).select_from(rally)
+                             .where(rally.c.follower_id == b, rally.c.followed_id.in_(mine)))
+
+
+def sql_friends_of_friends(u):
+    mine = sa.select(rally.c.followed_id).where(rally.c.follower_id == u)
+    second = rally.alias('r2')
+    return db.session.execute(
+        sa.select(second.c.followed_id, sa.func.count())
+        .where(second.c.follower_id.in_(mine), second.c.followed_id != u, second.c.followed_id.not_in(mine))
+        .group_by(second.c.followed_id)).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--rallies', type=int, default=26, help='rally medi per utente')
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=2000, help='coppie/utenti su cui misurare')
+    parser.add_argument('--changes', type=int, default=2000, help='rally iniziati/terminati dopo il caricamento')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config = temp_config(CACHE_BACKEND='null', RALLY_GRAPH_CHECK_INTERVAL=0)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seed(args.users, args.events, args.seed, rallies_per_user=args.rallies)
+        db.session.execute(sa.text('ANALYZE'))
+        print(f'dati generati in {time.perf_counter() - start:.1f} s')
+
+        # --- caricamento e memoria
+        start = time.perf_counter()
+        with db.engine.connect() as conn:
+            graph = RallyGraph.load(conn)
+        load_s = time.perf_counter() - start
+        print(f'\n{len(graph)} rally, {args.users} utenti')
+        print(f'  caricamento: {load_s:.2f} s')
+        print(f'  array CSR:   {graph.memory_bytes() / 2 ** 20:.1f} MB '
+              f'({graph.memory_bytes() / len(graph):.1f} byte per rally, entrambe le direzioni)')
+
+        tracemalloc.start()
+        adjacency = {}
+        for a, b in db.session.execute(sa.select(rally.c.follower_id, rally.c.followed_id)):
+            adjacency.setdefault(a, set()).add(b)
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'  per confronto, dizionario di insiemi (una sola direzione): {dict_bytes / 2 ** 20:.1f} MB')
+        del adjacency
+
+        # --- letture
+        rng = random.Random(args.seed)
+        edges = db.session.execute(sa.select(rally.c.follower_id, rally.c.followed_id)).all()
+        pairs = [rng.choice(edges) if i % 2 else (rng.randint(1, args.users), rng.randint(1, args.users))
+                 for i in range(args.sample)]
+        users = [(rng.randint(1, args.users),) for _ in range(args.sample)]
+        few_pairs, few_users = pairs[:200], users[:200]
+        loaded = {u.id: u for u in db.session.scalars(
+            sa.select(User).where(User.id.in_({p for pair in few_pairs for p in pair} | {u for u, in few_users})))}
+
+        print('\n"facciamo rally?"')
+        per_call('grafo', graph.is_following, pairs)
+        per_call('SQL (COUNT sulla relazione, prima)',
+                 lambda a, b: loaded[a].followed.filter(rally.c.followed_id == b).count(), few_pairs)
+        per_call('SQL (EXISTS sulla chiave)', lambda a, b: loaded[a]._rally_in_db(loaded[b]), few_pairs)
+        print('rally in comune')
+        per_call('grafo', graph.mutual_count, pairs)
+        per_call('SQL', sql_mutual, few_pairs)
+        print('compagni dei compagni')
+        per_call('grafo', graph.friends_of_friends, users)
+        per_call('SQL', sql_friends_of_friends, few_users)
+
+        with app.test_request_context():
+            get_graph()
+            print('giocatori suggeriti (grafo + partite insieme)')
+            per_call('_suggest', lambda u: _suggest(loaded[u], app.config['RALLY_SUGGESTIONS_COUNT']),
+                     few_users, unit='ms')
+
+            # --- modifiche dopo il caricamento, poi confronto con il database
+            start = time.perf_counter()
+            for _ in range(args.changes):
+                a, b = rng.randint(1, args.users), rng.randint(1, args.users)
+                if a == b:
+                    continue
+                follower, followed = db.session.get(User, a), db.session.get(User, b)
+                if rng.random() < 0.5:
+                    follower.start_rally(followed)
+                else:
+                    victim = rng.choice(edges)
+                    db.session.get(User, victim[0]).stop_rally(db.session.get(User, victim[1]))
+                db.session.commit()
+            print(f'\n{args.changes} rally iniziati/terminati in {time.perf_counter() - start:.1f} s')
+            with db.engine.connect() as conn:
+                start = time.perf_counter()
+                missing, extra = differences(get_graph(), conn)
+            print(f'  confronto con il database in {time.perf_counter() - start:.1f} s: '
+                  f'{len(missing)} rally solo nel database, {len(extra)} solo nel grafo')
+        db.engine.dispose()
+
+    app.extensions['passwords']['hasher'].shutdown()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
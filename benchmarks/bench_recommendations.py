@@ -0,0 +1,86 @@
+# benchmarks/bench_recommendations.py
+"""
+Tempo per calcolare gli eventi consigliati di un utente (app/recommendations.py),
+su dati sintetici, senza la cache del risultato per utente:
+- con la lista della zona già in cache (il caso normale);
+- ricalcolando anche la lista della zona (primo utente della zona);
+- per confronto, dando un punteggio a tutti gli eventi con posti liberi dei
+  prossimi giorni a ogni richiesta (raggio e candidati illimitati).
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_recommendations --users 2000 --events 20000 --sample 50
+"""
+
+import argparse
+import os
+import random
+import time
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.cache import get_cache
+from app.models import User
+from app.recommendations import _recommend
+from benchmarks.bench_routes import QueryCounter
+from benchmarks.common import temp_config, percentile
+from benchmarks.seed import seed
+
+
+def run(app, users, counter, label, clear=False):
+    timings, queries, candidates = [], [], []
+    for user in users:
+        if clear:
+            get_cache().clear()
+        counter.count = 0
+        start = time.perf_counter()
+        top = _recommend(user, app.config['RECOMMENDATIONS_COUNT'])
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+        candidates.append(top)
+    print(f'  {label:32} p50 {percentile(timings, 50):7.2f}  p95 {percentile(timings, 95):7.2f} ms   '
+          f'query {sum(queries) / len(queries):4.1f}')
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=50, help='utenti su cui misurare')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config = temp_config(CACHE_BACKEND='memory')
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed(args.users, args.events, args.seed)
+        db.session.execute(sa.text('ANALYZE'))
+        rng = random.Random(args.seed)
+        users = db.session.scalars(sa.select(User).where(
+            User.id.in_(rng.sample(range(1, args.users + 1), args.sample)))).all()
+        counter = QueryCounter([db.engine])
+
+        with app.test_request_context():
+            print(f'{args.users} utenti, {args.events} eventi, {len(users)} utenti misurati')
+            run(app, users, counter, 'lista della zona da calcolare', clear=True)
+            run(app, users, counter, '(riempie la cache delle zone)')
+            limited = run(app, users, counter, 'lista della zona in cache')
+            app.config.update(RECOMMENDATIONS_RADIUS_KM=100000, RECOMMENDATIONS_CANDIDATES=10 ** 9)
+            full = run(app, users, counter, 'tutti gli eventi', clear=True)
+
+        # Quanti dei consigli coincidono con quelli calcolati su tutta la tabella
+        same = sum(len({c.id for c in a} & {c.id for c in b}) for a, b in zip(limited, full))
+        total = sum(len(b) for b in full)
+        print(f'  consigli uguali a quelli del calcolo su tutti gli eventi: {same}/{total}')
+        db.engine.dispose()
+
+    app.extensions['passwords']['hasher'].shutdown()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# benchmarks/bench_routes.py
+"""
+Benchmark delle pagine principali su dati sintetici (benchmarks/seed.py),
+attraverso il test client di Flask: index, events (senza filtri e con ogni
+filtro), players, user_profile, join_event e login.
+Per ogni pagina: latenza p50/p95/p99, numero di query SQL per richiesta e
+picco di memoria allocata durante una richiesta (tracemalloc).
+I risultati vengono salvati in JSON, per confrontarli tra un commit e l'altro.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_routes --users 2000 --events 5000 --repeat 30
+    python -m benchmarks.bench_routes --compare benchmarks/results/abc1234.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.models import User, Event, rally
+from benchmarks.common import temp_config, percentile
+from benchmarks.seed import seed, PASSWORD
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Peggioramento (in %) oltre il quale il confronto segnala una regressione
+REGRESSION_THRESHOLD = 20
+
+
+class QueryCounter:
+    """Conta le query eseguite su uno o più engine."""
+
+    def __init__(self, engines):
+        self.count = 0
+        for engine in engines:
+            sa.event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-modificato' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'sconosciuto'
+
+
+def pick_fixtures():
+    """Utente che naviga, utente da visitare, creatore per il filtro ed eventi con posti liberi."""
+    viewer = db.session.scalar(
+        sa.select(rally.c.follower_id).group_by(rally.c.follower_id)
+        .order_by(sa.func.count().desc(), rally.c.follower_id).limit(1))
+    popular = db.session.scalar(sa.select(User.nome).order_by(User.num_followers.desc(), User.id).limit(1))
+    creator = db.session.scalar(sa.select(Event.user_id).where(Event.data_ora >= datetime.now())
+                                .group_by(Event.user_id).order_by(sa.func.count().desc()).limit(1))
+    day = db.session.scalar(sa.select(sa.func.date(Event.data_ora)).where(Event.data_ora >= datetime.now())
+                            .group_by(sa.func.date(Event.data_ora)).order_by(sa.func.count().desc()).limit(1))
+    open_events = db.session.scalars(
+        sa.select(Event.id).where(Event.data_ora >= datetime.now(),
+                                  Event.num_iscritti < Event.max_partecipanti).order_by(Event.id)).all()
+    email = db.session.get(User, viewer).email
+    return {'viewer': viewer, 'email': email, 'popular': popular, 'creator': creator,
+            'day': day, 'open_events': open_events}
+
+
+def scenarios(fixtures):
+    """(nome, metodo, url, dati del form). join_event e login sono gestiti a parte."""
+    return [
+        ('index', 'GET', '/index', None),
+        ('events', 'GET', '/events', None),
+        ('events?query', 'POST', '/events', {'query': 'partita'}),
+        ('events?data', 'POST', '/events', {'data': fixtures['day']}),
+        ('events?tipologia', 'POST', '/events', {'tipologia': 'Lezione'}),
+        ('events?creatore', 'POST', '/events', {'creatore': str(fixtures['creator'])}),
+        ('events?distanza', 'POST', '/events', {'distanza': '5'}),
+        ('events?ordina=distanza', 'POST', '/events', {'ordina': 'distanza'}),
+        ('players?nome', 'POST', '/players', {'query': 'sara'}),
+        ('players?distanza', 'POST', '/players', {'distanza': '5', 'ordina': 'distanza'}),
+        ('user_profile', 'GET', f'/user/{fixtures["popular"]}', None),
+    ]
+
+
+def logged_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def measure(counter, request, repeat, warmup):
+    """Esegue request() e restituisce le statistiche di latenza, query e memoria."""
+    statuses = {}
+    for _ in range(warmup):
+        request()
+    timings, queries = [], []
+    for _ in range(repeat):
+        counter.count = 0
+        start = time.perf_counter()
+        status = request()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    # Memoria: poche richieste in più sotto tracemalloc (che le rallenta molto)
+    peaks = []
+    for _ in range(3):
+        tracemalloc.start()
+        request()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 50), 2), 'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2), 'mean_ms': round(sum(timings) / len(timings), 2),
+        'queries_mean': round(sum(queries) / len(queries), 2), 'queries_max': max(queries),
+        'peak_kib': round(max(peaks) / 1024, 1), 'requests': repeat,
+        'status': {str(code): n for code, n in sorted(statuses.items())},
+    }
+
+
+def report(name, result):
+    print(f'  {name:24} p50 {result["p50_ms"]:7.2f}  p95 {result["p95_ms"]:7.2f}  p99 {result["p99_ms"]:7.2f} ms   '
+          f'query {result["queries_mean"]:5.1f}   picco {result["peak_kib"]:8.1f} KiB   stato {result["status"]}')
+
+
+def run(args):
+    config = temp_config(CACHE_BACKEND=args.cache)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        sizes = seed(args.users, args.events, args.seed)
+        print(f'dati generati in {time.perf_counter() - start:.1f} s: '
+              + ', '.join(f'{table} {n}' for table, n in sizes.items()))
+        fixtures = pick_fixtures()
+        engines = [db.engine] + [e for e in [app.extensions.get('db_read_engine')] if e is not None]
+    counter = QueryCounter(engines)
+
+    results = {}
+    client = logged_client(app, fixtures['viewer'])
+    for name, method, url, data in scenarios(fixtures):
+        results[name] = measure(counter, lambda: client.open(url, method=method, data=data).status_code,
+                                args.repeat, args.warmup)
+        report(name, results[name])
+
+    # Scritture: ogni iscrizione su un evento diverso con posti liberi
+    open_events = iter(fixtures['open_events'])
+    results['join_event'] = measure(
+        counter, lambda: client.post(f'/join_event/{next(open_events)}').status_code, args.repeat, args.warmup)
+    # Login completo (hash della password compreso), ogni volta con un client nuovo
+    credentials = {'email': fixtures['email'], 'password': PASSWORD}
+    results['login'] = measure(
+        counter, lambda: app.test_client().post('/login', data=credentials).status_code,
+        args.login_repeat, 1)
+    for name in ('join_event', 'login'):
+        report(name, results[name])
+
+    app.extensions['passwords']['hasher'].shutdown()
+    with app.app_context():
+        db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+    return {
+        'meta': {
+            'revision': git_revision(), 'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpu': os.cpu_count(),
+            'users': args.users, 'events': args.events, 'seed': args.seed, 'cache': args.cache,
+            'repeat': args.repeat, 'sizes': sizes,
+            # ru_maxrss è in KiB su Linux, in byte su macOS
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1),
+        },
+        'routes': results,
+    }
+
+
+def compare(old, new):
+    """Stampa le differenze tra due risultati; restituisce il numero di regressioni."""
+    print(f'\nconfronto {old["meta"]["revision"]} -> {new["meta"]["revision"]}')
+    different = [key for key in ('users', 'events', 'seed', 'cache') if old['meta'].get(key) != new['meta'].get(key)]
+    if different:
+        print(f'  attenzione: i due run differiscono per {", ".join(different)}')
+    regressions = 0
+    for name, current in new['routes'].items():
+        before = old['routes'].get(name)
+        if before is None:
+            print(f'  {name:24} (nuova)')
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'queries_mean', 'peak_kib'):
+            delta = (current[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            flag = ''
+            if delta > REGRESSION_THRESHOLD or (key == 'queries_mean' and current[key] > before[key]):
+                flag = ' !'
+                regressions += 1
+            changes.append(f'{key} {before[key]:g} -> {current[key]:g} ({delta:+.0f}%){flag}')
+        print(f'  {name:24} ' + '   '.join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--login-repeat', type=int, default=10)
+    parser.add_argument('--cache', choices=['memory', 'null'], default='memory',
+                        help="'null' misura le pagine senza cache")
+    parser.add_argument('--output', help='file JSON dei risultati (predefinito: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='file JSON di un run precedente da confrontare con questo')
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPU, {args.users} utenti, {args.events} eventi, seme {args.seed}, cache {args.cache}')
+    result = run(args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{result["meta"]["revision"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'risultati salvati in {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), result)
+        if regressions:
+            print(f'{regressions} possibili regressioni (oltre il {REGRESSION_THRESHOLD}% o query in più)')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# benchmarks/bench_schedule.py
+"""
+Controllo delle sovrapposizioni di orario (app/schedule.py) su dati sintetici,
+per utenti con centinaia di iscrizioni e luoghi con migliaia di eventi:
+- impegni di un utente: indice (user_id, inizio, fine) con la ricerca chiusa
+  da entrambe le parti, contro le sue iscrizioni lette tutte da 'partecipanti'
+  e confrontate con la tabella degli eventi;
+- eventi nello stesso luogo: indice (luogo, data_ora, fine) con e senza il
+  limite inferiore dato da Event.DURATA_MAX;
+- orari liberi di un luogo in una giornata e prima pagina degli eventi
+  "solo quando sono libero".
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_schedule --users 2000 --events 50000
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.models import Event, partecipanti
+from app.pagination import paginate_keyset
+from app.schedule import (user_conflicts, user_is_busy, venue_conflicts, venue_is_busy, venue_free_slots,
+                          only_when_free)
+from benchmarks.common import temp_config, percentile
+from benchmarks.seed import seed, LUOGHI
+
+
+def per_call(label, fn, args):
+    """Tempo di fn(*a) per ogni a in args: p50 e p95 in microsecondi."""
+    timings = []
+    for a in args:
+        start = time.perf_counter()
+        fn(*a)
+        timings.append((time.perf_counter() - start) * 1e6)
+    print(f'  {label:50} p50 {percentile(timings, 50):9.1f}  p95 {percentile(timings, 95):9.1f} us')
+
+
+def _by_scan(user_id, inizio, fine):
+    # Come prima della tabella degli impegni: tutte le iscrizioni dell'utente, poi l'orario dell'evento
+    return [partecipanti.c.event_id == Event.id, partecipanti.c.user_id == user_id,
+            Event.data_ora < fine, Event.fine > inizio]
+
+
+def _unbounded(luogo, inizio, fine):
+    # Senza il limite inferiore: l'indice del luogo viene letto dall'inizio fino a 'fine'
+    return [Event.luogo == luogo, Event.data_ora < fine, Event.fine > inizio]
+
+
+def user_is_busy_by_scan(user_id, inizio, fine):
+    return db.session.execute(sa.select(sa.exists().where(*_by_scan(user_id, inizio, fine)))).scalar()
+
+
+def venue_is_busy_unbounded(luogo, inizio, fine):
+    return db.session.execute(sa.select(sa.exists().where(*_unbounded(luogo, inizio, fine)))).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=500, help='controlli per ogni variante')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config = temp_config(CACHE_BACKEND='null')
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seed(args.users, args.events, args.seed)
+        db.session.execute(sa.text('ANALYZE'))
+        print(f'dati generati in {time.perf_counter() - start:.1f} s')
+
+        # Utenti con centinaia di iscrizioni (i pochissimi con decine di migliaia,
+        # frutto della legge di potenza dei dati generati, non sono realistici)
+        # e numero di eventi per luogo
+        busiest = db.session.execute(
+            sa.select(partecipanti.c.user_id, sa.func.count().label('n'))
+            .group_by(partecipanti.c.user_id).having(sa.func.count().between(200, 1000))
+            .order_by(sa.desc('n')).limit(50)).all()
+        venues = dict(db.session.execute(
+            sa.select(Event.luogo, sa.func.count()).group_by(Event.luogo)).all())
+        print(f'\n{args.events} eventi, {args.users} utenti')
+        print(f'  iscrizioni dei {len(busiest)} utenti misurati: da {busiest[-1].n} a {busiest[0].n}')
+        print(f'  eventi per luogo: da {min(venues.values())} a {max(venues.values())}')
+
+        rng = random.Random(args.seed)
+        now = datetime.now().replace(second=0, microsecond=0)
+
+        def interval():
+            inizio = now + timedelta(days=rng.randint(-30, 90), hours=rng.randint(-10, 12))
+            return inizio, inizio + timedelta(minutes=rng.choice([60, 90, 120]))
+
+        user_args = [(rng.choice(busiest).user_id, *interval()) for _ in range(args.sample)]
+        venue_args = [(rng.choice(LUOGHI), *interval()) for _ in range(args.sample)]
+
+        # Stesso risultato con e senza indice
+        for a in user_args[:100]:
+            assert {r.id for r in user_conflicts(*a)} == set(db.session.scalars(
+                sa.select(Event.id).where(*_by_scan(*a))))
+        for a in venue_args[:100]:
+            assert {r.id for r in venue_conflicts(*a)} == set(db.session.scalars(
+                sa.select(Event.id).where(*_unbounded(*a))))
+
+        print('\nsovrapposizioni con gli impegni di un utente (utenti con centinaia di iscrizioni)')
+        per_call('user_is_busy: indice impegni', user_is_busy, user_args)
+        per_call("scansione delle iscrizioni dell'utente", user_is_busy_by_scan, user_args)
+        per_call('user_conflicts (con i titoli, per i messaggi)', user_conflicts, user_args)
+        print('eventi sovrapposti nello stesso luogo')
+        per_call('venue_is_busy: (luogo, data_ora, fine), due limiti', venue_is_busy, venue_args)
+        per_call('stesso indice, senza limite inferiore', venue_is_busy_unbounded, venue_args)
+
+        # Lo stesso controllo senza SQLAlchemy: il costo della sola ricerca nel database
+        raw = db.session.connection().connection.driver_connection
+        text = lambda d: d.strftime('%Y-%m-%d %H:%M:%S.%f')
+        print('solo SQLite (DBAPI), stessi controlli sugli utenti')
+        per_call('indice impegni', lambda u, s, f: raw.execute(
+            'SELECT 1 FROM impegni WHERE user_id = ? AND inizio > ? AND inizio < ? AND fine > ? LIMIT 1',
+            (u, text(s - timedelta(minutes=Event.DURATA_MAX)), text(f), text(s))).fetchall(), user_args)
+        per_call("scansione delle iscrizioni", lambda u, s, f: raw.execute(
+            'SELECT 1 FROM partecipanti p JOIN event e ON e.id = p.event_id '
+            'WHERE p.user_id = ? AND e.data_ora < ? AND e.fine > ? LIMIT 1', (u, text(f), text(s))).fetchall(),
+            user_args)
+
+        print('orari liberi di un luogo in una giornata')
+        day_args = [(luogo, inizio.replace(hour=0, minute=0), inizio.replace(hour=0, minute=0) + timedelta(days=1), 90)
+                    for luogo, inizio, _ in venue_args[:200]]
+        per_call('venue_free_slots', venue_free_slots, day_args)
+
+        print('prima pagina degli eventi "solo quando sono libero" (utenti con centinaia di iscrizioni)')
+        upcoming = Event.query.filter(Event.data_ora >= now)
+        page_args = [(row.user_id,) for row in busiest[:20]]
+        per_call('con il filtro', lambda u: paginate_keyset(
+            only_when_free(upcoming, u), [Event.data_ora, Event.id], per_page=20), page_args)
+        per_call('senza filtro (riferimento)', lambda u: paginate_keyset(
+            upcoming, [Event.data_ora, Event.id], per_page=20), page_args)
+        db.engine.dispose()
+
+    app.extensions['passwords']['hasher'].shutdown()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(config.BENCH_DB_PATH + suffix):
+            os.remove(config.BENCH_DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    main()
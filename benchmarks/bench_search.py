@@ -0,0 +1,95 @@
+# benchmarks/bench_search.py
+"""
+Confronta la ricerca testuale degli eventi: ilike('%termine%') contro l'indice FTS5.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_search --events 100000
+"""
+
+import argparse
+import os
+import random
+from datetime import datetime, timedelta, date
+
+from app import create_app, db
+from app.models import User, Event
+from app.search import rebuild_search_index, apply_event_search
+from benchmarks.common import temp_config, timeit, summary
+
+TITOLI = ['Partita amichevole', 'Doppio del sabato', 'Allenamento al servizio', 'Lezione di rovescio',
+          'Singolare serale', 'Torneo sociale', 'Sfida in città', 'Match veloce', 'Palleggio libero']
+LUOGHI = ['Tennis Club Milano', 'Circolo Università', 'Centro Sportivo Bicocca', 'Tennis Monza',
+          'Circolo della Città', 'Campi di Sesto', 'Tennis Club Brera', 'Polisportiva Lambrate']
+PAROLE = ['terra rossa', 'cemento', 'erba sintetica', 'coperto', 'notturna', 'principianti benvenuti',
+          'portare le palline', 'spogliatoi', 'parcheggio', 'al meglio dei tre set']
+TIPOLOGIE = [t[0] for t in Event.TIPOLOGIA_CHOICES]
+LIVELLI = [l[0] for l in Event.LIVELLO_CHOICES]
+
+
+def seed(n_events, rng):
+    creator = User(nome='bench', email='bench@example.com', cap='20100')
+    creator.password_hash = '-'
+    db.session.add(creator)
+    db.session.flush()
+    start = datetime.combine(date.today(), datetime.min.time())
+    rows = []
+    for i in range(n_events):
+        rows.append({
+            'titolo': f'{rng.choice(TITOLI)} #{i}',
+            'tipologia': rng.choice(TIPOLOGIE),
+            'descrizione': ', '.join(rng.sample(PAROLE, 3)),
+            'data_ora': start + timedelta(minutes=rng.randrange(0, 60 * 24 * 365)),
+            'luogo': rng.choice(LUOGHI),
+            'max_partecipanti': rng.randint(2, 10),
+            'livello_consigliato': rng.choice(LIVELLI),
+            'user_id': creator.id,
+        })
+        if len(rows) == 5000:
+            db.session.execute(Event.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Event.__table__.insert(), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=24)
+    args = parser.parse_args()
+
+    config = temp_config()
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        print(f'Creazione di {args.events} eventi...')
+        seed(args.events, random.Random(42))
+        print(f'Indicizzazione FTS5: {rebuild_search_index()} eventi')
+
+        base = Event.query.filter(Event.data_ora >= date.today())
+        for term in ['citta', 'circolo univ', 'terra rossa', 'monza']:
+            def run_ilike():
+                like = f'%{term}%'
+                return base.filter(db.or_(Event.titolo.ilike(like), Event.luogo.ilike(like))) \
+                    .order_by(Event.data_ora, Event.id).limit(args.page_size).all()
+
+            def run_ilike_all():
+                like = f'%{term}%'
+                return base.filter(db.or_(Event.titolo.ilike(like), Event.luogo.ilike(like))) \
+                    .order_by(Event.data_ora).all()
+
+            def run_fts():
+                query, rank = apply_event_search(base, term)
+                return query.order_by(rank, Event.id).limit(args.page_size).all()
+
+            print(f'\nTermine: {term!r}  (corrispondenze FTS: {apply_event_search(base, term)[0].count()})')
+            print(f'  ilike, tutti i risultati   {summary(timeit(run_ilike_all, args.repeat))}')
+            print(f'  ilike, una pagina          {summary(timeit(run_ilike, args.repeat))}')
+            print(f'  FTS5,  una pagina          {summary(timeit(run_fts, args.repeat))}')
+
+    os.remove(config.BENCH_DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# benchmarks/bench_server.py
+"""
+Throughput e latenza di /events servito dal server di sviluppo (run.py:
+app.run con debug, un thread per connessione) e dal server di produzione
+(serve.py: worker prefork con pool di thread), con più client concorrenti.
+
+Uso (dalla cartella principale del progetto):
+    python -m benchmarks.bench_server --clients 8 --seconds 10 --workers 2 --threads 4
+
+Client e server girano sulla stessa macchina: con poche CPU i numeri
+assoluti sono bassi, conta il confronto tra le due configurazioni.
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from benchmarks.common import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+
+DEV_SERVER = ('from app import create_app\n'
+              'create_app().run(host="{host}", port={port}, debug=True, use_reloader=False)')
+
+
+def seed(env, n_users, n_events):
+    """Crea e popola il database temporaneo in un processo separato."""
+    script = f'''
+from app import create_app, db
+from app.models import User, Event
+from app.passwords import get_hasher
+app = create_app()
+with app.app_context():
+    db.create_all()
+    password_hash = get_hasher().hash('password')
+    db.session.execute(User.__table__.insert(), [
+        {{'nome': f'giocatore{{i}}', 'email': f'g{{i}}@example.com', 'cap': '20121',
+          'password_hash': password_hash}} for i in range({n_users})])
+    start = datetime.now() + timedelta(days=1)
+    db.session.execute(Event.__table__.insert(), [
+        {{'titolo': f'Evento {{i}}', 'tipologia': 'Partita 1vs1', 'descrizione': '',
+          'data_ora': start + timedelta(hours=i), 'luogo': 'Circolo', 'max_partecipanti': 4,
+          'livello_consigliato': 'Tutti', 'user_id': 1 + i % {n_users}}} for i in range({n_events})])
+    db.session.commit()
+'''
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True)
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(HOST, port, timeout=2)
+            conn.request('GET', '/login')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'il server sulla porta {port} non risponde')
+
+
+def request(port, method, path, cookie=None, body=None, headers=None):
+    conn = http.client.HTTPConnection(HOST, port, timeout=30)
+    headers = dict(headers or {})
+    if cookie:
+        headers['Cookie'] = cookie
+    if body is not None:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response, data
+
+
+def login(port, n):
+    """Login via HTTP (con token CSRF): restituisce il cookie di sessione."""
+    response, data = request(port, 'GET', '/login')
+    cookie = response.getheader('Set-Cookie').split(';')[0]
+    token = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', data).group(1).decode()
+    body = urlencode({'csrf_token': token, 'email': f'g{n}@example.com', 'password': 'password'})
+    response, _ = request(port, 'POST', '/login', cookie, body)
+    if response.status != 302:
+        raise RuntimeError(f'login fallito: {response.status}')
+    return response.getheader('Set-Cookie').split(';')[0]
+
+
+def client(port, n, seconds, start_at, results):
+    cookie = login(port, n)
+    time.sleep(max(0.0, start_at - time.time()))
+    timings, errors = [], 0
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            response, _ = request(port, 'GET', '/events', cookie)
+            ok = response.status == 200
+        except OSError:
+            ok = False
+        timings.append((time.perf_counter() - start) * 1000)
+        errors += not ok
+    results.put((timings, errors))
+
+
+def load(port, args):
+    results = multiprocessing.Queue()
+    start_at = time.time() + 2 + args.clients * 0.5   # tempo per i login
+    clients = [multiprocessing.Process(target=client, args=(port, n, args.seconds, start_at, results))
+               for n in range(args.clients)]
+    for process in clients:
+        process.start()
+    timings, errors = [], 0
+    for _ in clients:
+        t, e = results.get()
+        timings += t
+        errors += e
+    for process in clients:
+        process.join()
+    return timings, errors
+
+
+def run(name, command, port, env, args):
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        timings, errors = load(port, args)
+    finally:
+        server.terminate()
+        server.wait(60)
+    print(f'  {name:30} {len(timings) / args.seconds:7.1f} req/s   '
+          f'p50 {percentile(timings, 50):7.1f}  p95 {percentile(timings, 95):7.1f}  '
+          f'p99 {percentile(timings, 99):7.1f} ms   errori {errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(prefix='tennis-bench-', suffix='.db')
+    os.close(fd)
+    cache_dir = tempfile.mkdtemp(prefix='tennis-bench-cache-')
+    env = dict(os.environ, DATABASE_URI='sqlite:///' + path, CACHE_DIR=cache_dir,
+               LOGIN_MAX_ATTEMPTS_IP='1000000')
+    seed(env, max(args.clients, 10), args.events)
+
+    print(f'{os.cpu_count()} CPU, {args.clients} client, GET /events per {args.seconds:g} s')
+    run('sviluppo (app.run, debug)', [sys.executable, '-c', DEV_SERVER.format(host=HOST, port=args.port)],
+        args.port, env, args)
+    run(f'serve.py ({args.workers} worker x {args.threads} thread)',
+        [sys.executable, 'serve.py', '--bind', f'{HOST}:{args.port + 1}',
+         '--workers', str(args.workers), '--threads', str(args.threads)],
+        args.port + 1, env, args)
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
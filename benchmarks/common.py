@@ -0,0 +1,59 @@
+# benchmarks/common.py
+
+import os
+import statistics
+import tempfile
+import time
+
+from config import Config
+
+
+# ==============================================================================
+# FUNZIONI COMUNI AI BENCHMARK
+# ==============================================================================
+# I benchmark non toccano mai instance/app.db: ognuno lavora su un database
+# SQLite temporaneo creato con questa configurazione.
+
+def temp_config(**overrides):
+    """Restituisce una classe di configurazione che punta a un database temporaneo."""
+    fd, path = tempfile.mkstemp(prefix='tennis-bench-', suffix='.db')
+    os.close(fd)
+    attrs = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'WTF_CSRF_ENABLED': False,
+        'TESTING': True,
+        'BENCH_DB_PATH': path,
+        # I lavori in coda si eseguono solo quando il benchmark lo chiede
+        'JOBS_WORKERS': 0,
+    }
+    attrs.update(overrides)
+    return type('BenchConfig', (Config,), attrs)
+
+
+def timeit(fn, repeat=20, warmup=2):
+    """Esegue fn() più volte e restituisce i tempi in millisecondi."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(values, p):
+    """Percentile p (0-100) con interpolazione lineare."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summary(timings):
+    """Riassunto leggibile di una lista di tempi in millisecondi."""
+    return (f'mediana {statistics.median(timings):8.2f} ms   '
+            f'p95 {percentile(timings, 95):8.2f} ms   '
+            f'min {min(timings):8.2f} ms')
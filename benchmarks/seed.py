@@ -0,0 +1,191 @@
+# benchmarks/seed.py
+"""
+Generatore di dati sintetici, deterministico a partire da un seme: utenti con
+CAP e livello, eventi distribuiti nel tempo, rally con una distribuzione a
+legge di potenza (pochi giocatori molto seguiti, molti con pochi follower) e
+iscrizioni. Popola anche bacheche, contatori, indice di ricerca, posizioni e
+preferenze di orario.
+Tutti gli utenti hanno la password 'password'.
+
+Uso (dalla cartella principale del progetto), su un database nuovo:
+    python -m benchmarks.seed --database /tmp/tennis-demo.db --users 2000 --events 5000 --seed 42
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import random
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert, select, func
+
+from app import db
+from app.counters import repair_drift
+from app.geo import DEFAULT_CAP_FILE, load_cap_centroids, relocalize_all
+from app.models import User, Event, Attivita, partecipanti, rally, timeline
+from app.passwords import get_hasher
+from app.recommendations import rebuild_preferences
+from app.schedule import rebuild_commitments
+from app.search import rebuild_search_index
+from app.timeline import _fanout_cap
+
+PASSWORD = 'password'
+
+NOMI = ['Luca', 'Giulia', 'Marco', 'Sara', 'Andrea', 'Chiara', 'Matteo', 'Francesca', 'Davide',
+        'Elena', 'Simone', 'Martina', 'Paolo', 'Anna', 'Stefano', 'Laura', 'Alessio', 'Valentina']
+COGNOMI = ['Rossi', 'Bianchi', 'Colombo', 'Ferrari', 'Esposito', 'Romano', 'Ricci', 'Marino',
+           'Greco', 'Bruno', 'Gallo', 'Conti', 'Costa', 'Fontana', 'Rinaldi', 'Moretti']
+LIVELLI = ['Principiante', 'Intermedio', 'Avanzato']
+LUOGHI = ['Tennis Club Milano', 'Circolo Bonacossa', 'Centro Sportivo Saini', 'Tennis Lombardo',
+          'Circolo del Parco', 'Sporting Milano 3', 'Campi di Quarto Oggiaro', 'Tennis Navigli']
+
+BATCH = 5000
+
+
+def _caps():
+    with open(DEFAULT_CAP_FILE, newline='', encoding='utf-8') as f:
+        return [row['cap'] for row in csv.DictReader(line for line in f if not line.startswith('#'))]
+
+
+def _insert(table, rows):
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(insert(table), rows[i:i + BATCH])
+
+
+def _power_law_weights(n, alpha):
+    """Pesi cumulativi: il giocatore di "rango" i ha peso proporzionale a 1 / (i + 1)^alpha."""
+    return list(itertools.accumulate(1.0 / (i + 1) ** alpha for i in range(n)))
+
+
+def seed(n_users=1000, n_events=2000, seed=42, rallies_per_user=8, alpha=1.1, fill=0.6,
+         days_past=30, days_ahead=90):
+    """
+    Popola il database corrente (app context attivo, tabelle già create).
+    - rallies_per_user: numero medio di giocatori seguiti da ogni utente;
+    - alpha: esponente della legge di potenza di popolarità (rally e iscrizioni);
+    - fill: riempimento medio degli eventi (frazione dei posti occupati);
+    - gli eventi vanno da 'days_past' giorni fa a 'days_ahead' giorni da oggi.
+    Restituisce un dizionario con il numero di righe create per tabella.
+    """
+    rng = random.Random(seed)
+    load_cap_centroids()
+    caps = _caps()
+    password_hash = get_hasher().hash(PASSWORD)
+
+    # --- utenti (nomi univoci: la pagina profilo li cerca per nome)
+    users = []
+    for i in range(n_users):
+        users.append({
+            'id': i + 1, 'nome': f'{rng.choice(NOMI)}{i + 1}', 'cognome': rng.choice(COGNOMI),
+            'email': f'utente{i + 1}@example.com', 'cap': rng.choice(caps),
+            'livello': rng.choice(LIVELLI), 'password_hash': password_hash,
+        })
+    _insert(User.__table__, users)
+
+    # La popolarità segue una legge di potenza su una permutazione casuale degli utenti
+    ranking = list(range(1, n_users + 1))
+    rng.shuffle(ranking)
+    popularity = _power_law_weights(n_users, alpha)
+
+    # --- rally: ogni utente ne segue in media 'rallies_per_user', scelti per popolarità
+    rally_rows = set()
+    for follower in range(1, n_users + 1):
+        k = min(n_users - 1, int(rng.expovariate(1 / rallies_per_user)))
+        for followed in rng.choices(ranking, cum_weights=popularity, k=k):
+            if followed != follower:
+                rally_rows.add((follower, followed))
+    _insert(rally, [{'follower_id': a, 'followed_id': b} for a, b in sorted(rally_rows)])
+
+    # --- eventi distribuiti nel tempo (ore "da tennis", dalle 8 alle 21)
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=days_past)
+    span_days = days_past + days_ahead
+    now = datetime.now()
+    tipologie = [value for value, _ in Event.TIPOLOGIA_CHOICES]
+    livelli_evento = [value for value, _ in Event.LIVELLO_CHOICES]
+    events, enrollments, activities = [], [], []
+    # Durate da un generatore a parte: il resto dei dati resta uguale a prima della durata
+    durations = random.Random(seed + 1)
+    durate = [value for value, _ in Event.DURATA_CHOICES]
+    for i in range(n_events):
+        creator = rng.choices(ranking, cum_weights=popularity)[0]
+        data_ora = start + timedelta(days=rng.randrange(span_days), hours=rng.randrange(8, 22) - start.hour)
+        tipologia = rng.choice(tipologie)
+        event = {
+            'id': i + 1, 'titolo': f'{tipologia} #{i + 1}', 'tipologia': tipologia,
+            'descrizione': f'Evento generato {i + 1}', 'data_ora': data_ora,
+            'durata': durations.choice(durate),
+            'luogo': rng.choice(LUOGHI), 'cap': rng.choice(caps),
+            'max_partecipanti': rng.randint(2, 10), 'livello_consigliato': rng.choice(livelli_evento),
+            'user_id': creator,
+        }
+        event['fine'] = Event.calcola_fine(data_ora, event['durata'])
+        events.append(event)
+        activities.append({'user_id': creator, 'event_id': event['id'], 'tipo': Attivita.CREATO,
+                           'data': min(now, data_ora - timedelta(days=7))})
+        # Il creatore è il primo iscritto, poi altri fino a circa 'fill' dei posti
+        members = {creator}
+        wanted = min(event['max_partecipanti'], n_users, max(1, round(rng.gauss(fill, 0.25) * event['max_partecipanti'])))
+        while len(members) < wanted:
+            members.add(rng.choices(ranking, cum_weights=popularity)[0])
+        for member in sorted(members):
+            enrollments.append({'user_id': member, 'event_id': event['id']})
+            if member != creator:
+                activities.append({'user_id': member, 'event_id': event['id'], 'tipo': Attivita.ISCRITTO,
+                                   'data': min(now, data_ora - timedelta(days=rng.randint(0, 6)))})
+    _insert(Event.__table__, events)
+    _insert(partecipanti, enrollments)
+    # Le attività in ordine di tempo, come sarebbero state registrate
+    activities.sort(key=lambda a: a['data'])
+    _insert(Attivita.__table__, activities)
+
+    # Posizioni dal CAP, contatori, bacheche (fan-out con i limiti di app/timeline.py), indice
+    relocalize_all()
+    db.session.commit()
+    repair_drift()
+    # Per ogni follower solo le TIMELINE_MAX_LENGTH attività più recenti
+    copies = select(rally.c.follower_id, Attivita.id.label('attivita_id'),
+                    func.row_number().over(partition_by=rally.c.follower_id,
+                                           order_by=Attivita.id.desc()).label('n')) \
+        .join(rally, rally.c.followed_id == Attivita.user_id) \
+        .join(User, User.id == Attivita.user_id) \
+        .where(User.num_followers <= _fanout_cap()) \
+        .subquery()
+    db.session.execute(insert(timeline).from_select(
+        ['user_id', 'attivita_id'],
+        select(copies.c.follower_id, copies.c.attivita_id)
+        .where(copies.c.n <= current_app.config['TIMELINE_MAX_LENGTH'])))
+    db.session.commit()
+    rebuild_search_index()
+    rebuild_preferences()
+    rebuild_commitments()
+
+    return {'user': len(users), 'rally': len(rally_rows), 'event': len(events),
+            'partecipanti': len(enrollments), 'attivita': len(activities),
+            'timeline': db.session.scalar(select(func.count()).select_from(timeline))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', required=True, help='file SQLite da creare (non deve esistere)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rallies-per-user', type=int, default=8)
+    args = parser.parse_args()
+    if os.path.exists(args.database):
+        parser.error(f'{args.database} esiste già: il generatore lavora solo su un database nuovo')
+
+    from app import create_app
+    from config import Config
+    config = type('SeedConfig', (Config,), {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(args.database)})
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        counts = seed(args.users, args.events, args.seed, args.rallies_per_user)
+    print(', '.join(f'{table}: {n}' for table, n in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
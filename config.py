@@ -12,4 +12,154 @@ class Config:
     # Configurazione del database SQLite
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or \
         'sqlite:///' + os.path.join(basedir, 'instance', 'app.db')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Paginazione a cursore: numero di elementi per pagina
+    EVENTS_PER_PAGE = int(os.environ.get('EVENTS_PER_PAGE') or 24)
+    PLAYERS_PER_PAGE = int(os.environ.get('PLAYERS_PER_PAGE') or 24)
+    # API JSON (vedi app/api.py): massimo per ?per_page=
+    API_MAX_PER_PAGE = int(os.environ.get('API_MAX_PER_PAGE') or 100)
+
+    # Profilo del database (vedi app/database.py): 'production' oppure 'basic'
+    DB_PROFILE = os.environ.get('DB_PROFILE') or 'production'
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 30)
+    # Pool separato per le view in sola lettura (index, events, players, user_profile)
+    DB_READ_ROUTING = os.environ.get('DB_READ_ROUTING', '1') != '0'
+    DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE') or 20)
+    SQLALCHEMY_READ_DATABASE_URI = os.environ.get('READ_DATABASE_URI')
+    # PRAGMA di SQLite
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)        # millisecondi
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)  # byte
+
+    # Password (vedi app/passwords.py)
+    # Metodo di hashing: cambiandolo, le password vengono ricalcolate al login successivo
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:1000000'
+    # Processi dedicati all'hashing (0 = nel thread della richiesta) e richieste in coda
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE') or 16)
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)     # secondi
+    # Tentativi di login falliti ammessi nella finestra, per account e per indirizzo IP
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW') or 300)     # secondi
+    LOGIN_MAX_ATTEMPTS_ACCOUNT = int(os.environ.get('LOGIN_MAX_ATTEMPTS_ACCOUNT') or 5)
+    LOGIN_MAX_ATTEMPTS_IP = int(os.environ.get('LOGIN_MAX_ATTEMPTS_IP') or 30)
+    # Proxy fidati davanti all'applicazione (nginx, bilanciatore): con N > 0 l'IP
+    # del client, lo schema e l'host si leggono dagli header X-Forwarded-* degli
+    # ultimi N proxy (ProxyFix). Con 0 gli header si ignorano: nessuno li può falsificare
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES') or 0)
+
+    # Cache in memoria dell'utente autenticato (vedi app/identity_cache.py)
+    USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', '1') != '0'
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)     # secondi
+
+    # Cache versionata di frammenti e risultati (vedi app/cache.py):
+    # 'memory' (un solo processo), 'filesystem' (più worker) oppure 'null'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'memory'
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(basedir, 'instance', 'cache')
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES') or 5000)
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL') or 600)     # secondi
+
+    # Bacheca delle attività dei compagni di rally (vedi app/timeline.py)
+    TIMELINE_PER_PAGE = int(os.environ.get('TIMELINE_PER_PAGE') or 10)
+    TIMELINE_MAX_LENGTH = int(os.environ.get('TIMELINE_MAX_LENGTH') or 500)
+    # Oltre questo numero di follower le attività non vengono copiate ma unite in lettura
+    TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS') or 1000)
+
+    # Archivio degli eventi passati (vedi app/archive.py)
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 30)
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE') or 500)
+    HISTORY_PER_PAGE = int(os.environ.get('HISTORY_PER_PAGE') or 20)
+
+    # Eventi consigliati in bacheca (vedi app/recommendations.py)
+    RECOMMENDATIONS_COUNT = int(os.environ.get('RECOMMENDATIONS_COUNT') or 6)
+    RECOMMENDATIONS_DAYS = int(os.environ.get('RECOMMENDATIONS_DAYS') or 14)
+    RECOMMENDATIONS_RADIUS_KM = float(os.environ.get('RECOMMENDATIONS_RADIUS_KM') or 15)
+    # Eventi della lista condivisa per cella e livello, e sua durata in cache (secondi)
+    RECOMMENDATIONS_CANDIDATES = int(os.environ.get('RECOMMENDATIONS_CANDIDATES') or 100)
+    RECOMMENDATIONS_ZONE_TTL = int(os.environ.get('RECOMMENDATIONS_ZONE_TTL') or 300)
+
+    # Grafo dei rally in memoria e giocatori suggeriti (vedi app/rally_graph.py)
+    RALLY_GRAPH_ENABLED = os.environ.get('RALLY_GRAPH_ENABLED', '1') != '0'
+    # Ogni quanti secondi controllare se altri processi hanno cambiato i rally
+    RALLY_GRAPH_CHECK_INTERVAL = int(os.environ.get('RALLY_GRAPH_CHECK_INTERVAL') or 30)
+    RALLY_SUGGESTIONS_COUNT = int(os.environ.get('RALLY_SUGGESTIONS_COUNT') or 6)
+    # Candidati (i più seguiti dai propri compagni) per cui contare le partite insieme
+    RALLY_SUGGESTIONS_CANDIDATES = int(os.environ.get('RALLY_SUGGESTIONS_CANDIDATES') or 50)
+
+    # Orari degli eventi (vedi app/schedule.py): apertura dei campi per la
+    # ricerca degli orari liberi e giorni in cui cercarli
+    SCHEDULE_OPEN_HOUR = int(os.environ.get('SCHEDULE_OPEN_HOUR') or 8)
+    SCHEDULE_CLOSE_HOUR = int(os.environ.get('SCHEDULE_CLOSE_HOUR') or 23)
+    SCHEDULE_SEARCH_DAYS = int(os.environ.get('SCHEDULE_SEARCH_DAYS') or 7)
+
+    # Coda dei lavori fuori dalle richieste (vedi app/jobs.py)
+    # Thread che eseguono i lavori in ogni processo dell'app (0 = solo 'flask jobs-worker')
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 1))
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL') or 5)      # secondi
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS') or 6)
+    # Attesa prima del secondo tentativo (poi raddoppia) e attesa massima, in secondi
+    JOBS_RETRY_DELAY = float(os.environ.get('JOBS_RETRY_DELAY') or 30)
+    JOBS_RETRY_MAX_DELAY = float(os.environ.get('JOBS_RETRY_MAX_DELAY') or 3600)
+    # Un lavoro 'in_corso' da più di tanti secondi (worker morto) torna in coda
+    JOBS_TIMEOUT = int(os.environ.get('JOBS_TIMEOUT') or 600)
+    # Ore per cui i lavori finiti (e le loro chiavi di idempotenza) restano nella tabella
+    JOBS_KEEP_HOURS = int(os.environ.get('JOBS_KEEP_HOURS') or 48)
+    # Finestra (secondi) dei tempi dei lavori finiti mostrati in /metrics
+    JOBS_METRICS_WINDOW = int(os.environ.get('JOBS_METRICS_WINDOW') or 300)
+
+    # Email agli iscritti (vedi app/notifications.py): senza MAIL_SERVER finiscono nel log
+    MAIL_SERVER = os.environ.get('MAIL_SERVER')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '0') == '1'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_SENDER = os.environ.get('MAIL_SENDER') or 'Tennis App <noreply@tennis-app.local>'
+    MAIL_TIMEOUT = float(os.environ.get('MAIL_TIMEOUT') or 10)     # secondi
+    # Email inviate sulla stessa connessione SMTP
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 50)
+
+    # Chat tra giocatori (vedi app/chat.py)
+    # 'local': solo i messaggi scritti da questo processo; 'database': anche quelli
+    # degli altri processi, letti dalla tabella ogni CHAT_POLL_INTERVAL secondi
+    CHAT_BROKER = os.environ.get('CHAT_BROKER', 'local')
+    CHAT_POLL_INTERVAL = float(os.environ.get('CHAT_POLL_INTERVAL') or 0.5)
+    # Commento di keep-alive ogni tanti secondi; dopo CHAT_STREAM_TIMEOUT secondi
+    # la connessione viene chiusa e il browser si ricollega (e i permessi vengono ricontrollati)
+    CHAT_KEEPALIVE = float(os.environ.get('CHAT_KEEPALIVE') or 15)
+    CHAT_STREAM_TIMEOUT = float(os.environ.get('CHAT_STREAM_TIMEOUT') or 300)
+    # Byte in attesa di invio oltre i quali un client troppo lento viene scollegato
+    CHAT_BUFFER_LIMIT = int(os.environ.get('CHAT_BUFFER_LIMIT') or 256 * 1024)
+    CHAT_HISTORY_PER_PAGE = int(os.environ.get('CHAT_HISTORY_PER_PAGE') or 50)
+    CHAT_MAX_LENGTH = 1000
+
+    # File statici (vedi app/assets.py): eseguibile standalone di Tailwind usato da
+    # 'flask assets-build' e durata della cache dei file con l'impronta (secondi)
+    TAILWINDCSS = os.environ.get('TAILWINDCSS') or 'tailwindcss'
+    ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE') or 365 * 24 * 3600)
+
+    # Strumentazione delle richieste (vedi app/instrumentation.py)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+    # Token per /metrics ('Authorization: Bearer <token>'); senza token /metrics è disattivato
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') != '0'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')     # file; se vuoto solo il log dell'applicazione
+    # Ripetizioni della stessa query in una richiesta oltre le quali segnaliamo un N+1
+    NPLUSONE_THRESHOLD = int(os.environ.get('NPLUSONE_THRESHOLD') or 5)
+
+    # Server di produzione (vedi serve.py e app/server.py)
+    SERVER_HOST = os.environ.get('SERVER_HOST') or '127.0.0.1'
+    SERVER_PORT = int(os.environ.get('SERVER_PORT') or 8000)
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or os.cpu_count() or 2)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 4)
+    # Richieste dopo le quali un worker viene riciclato (0 = mai) e jitter casuale
+    SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS', 5000))
+    SERVER_MAX_REQUESTS_JITTER = int(os.environ.get('SERVER_MAX_REQUESTS_JITTER', 500))
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT') or 30)   # secondi
+    # Ogni worker apre le connessioni al database prima di accettare richieste (vedi app/warmup.py)
+    SERVER_WARMUP = os.environ.get('SERVER_WARMUP', '0') != '0'
+
+    # Template compilati salvati su disco e riletti all'avvio successivo ('' = niente cache)
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR', os.path.join(basedir, 'instance', 'jinja-cache'))
@@ -24,6 +24,9 @@ else:
 print("Creazione di un nuovo database pulito...")
 app = create_app()
 with app.app_context():
-    db.create_all()
+    # Lo schema si costruisce con le migrazioni (vedi app/migrations.py): tabelle,
+    # indice di ricerca full-text, centroidi dei CAP e indici, fino all'ultima versione
+    from app.migrations import upgrade
+    upgrade(db.engine)
 
 exit()
\ No newline at end of file
@@ -0,0 +1,53 @@
+# serve.py
+"""
+Avvio dell'applicazione in produzione: un processo master che carica l'app e
+N worker (fork) con un pool di thread ciascuno. Vedi app/server.py.
+
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+
+Segnali al master: SIGHUP sostituisce i worker senza interrompere il servizio,
+SIGTERM / Ctrl+C arresta il server dopo le richieste in corso.
+"""
+
+import argparse
+import os
+
+from config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=f'{Config.SERVER_HOST}:{Config.SERVER_PORT}', help='host:porta')
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS)
+    parser.add_argument('--threads', type=int, default=Config.SERVER_THREADS)
+    parser.add_argument('--max-requests', type=int, default=Config.SERVER_MAX_REQUESTS)
+    parser.add_argument('--max-requests-jitter', type=int, default=Config.SERVER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--graceful-timeout', type=int, default=Config.SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument('--warmup', action='store_true', default=Config.SERVER_WARMUP,
+                        help='ogni worker apre le connessioni al database prima di accettare richieste')
+    args = parser.parse_args()
+    host, _, port = args.bind.rpartition(':')
+
+    # Con più processi la cache in memoria non vedrebbe le scritture degli altri
+    # worker: se non è stato scelto altro, usiamo quella su disco, condivisa
+    if args.workers > 1:
+        os.environ.setdefault('CACHE_BACKEND', 'filesystem')
+        Config.CACHE_BACKEND = os.environ['CACHE_BACKEND']
+        # Allo stesso modo la chat deve vedere i messaggi scritti dagli altri worker
+        os.environ.setdefault('CHAT_BROKER', 'database')
+        Config.CHAT_BROKER = os.environ['CHAT_BROKER']
+
+    from app import create_app
+    from app.server import PreforkServer
+
+    app = create_app()
+    PreforkServer(
+        app, host=host or '127.0.0.1', port=int(port),
+        workers=args.workers, threads=args.threads,
+        max_requests=args.max_requests, max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=args.graceful_timeout, warmup=args.warmup,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
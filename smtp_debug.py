@@ -0,0 +1,118 @@
+# smtp_debug.py
+"""
+Server SMTP di prova, solo per lo sviluppo: accetta tutte le email e le stampa
+(o le salva in una cartella), senza inoltrarle. Per provare gli avvisi agli
+iscritti (app/notifications.py) senza un server di posta vero:
+
+    python smtp_debug.py --port 8025
+    MAIL_SERVER=localhost MAIL_PORT=8025 flask --app run.py jobs-worker
+
+Con --reject gli indirizzi indicati vengono rifiutati (per vedere i tentativi
+ripetuti della coda dei lavori).
+"""
+
+import argparse
+import os
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Il minimo del protocollo SMTP: HELO/EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 smtp-debug pronto')
+        sender, recipients = None, []
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = line[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 smtp-debug')
+            elif verb == 'MAIL':
+                sender, recipients = line.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = line.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.reject:
+                    self.reply(f'550 {address}: destinatario rifiutato')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply('503 nessun destinatario')
+                    continue
+                self.reply('354 fine con <CRLF>.<CRLF>')
+                body = []
+                for data in self.rfile:
+                    if data in (b'.\r\n', b'.\n'):
+                        break
+                    body.append(data[1:] if data.startswith(b'..') else data)
+                self.server.deliver(sender, recipients, b''.join(body))
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 arrivederci')
+                return
+            else:
+                self.reply('502 comando non supportato')
+
+
+class DebugSMTPServer(socketserver.ThreadingTCPServer):
+    """Server SMTP che tiene le email ricevute in 'messages' (e le stampa o salva, se richiesto)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=8025, reject=(), directory=None, echo=False):
+        super().__init__((host, port), _SMTPHandler)
+        self.reject = set(reject)
+        self.directory = directory
+        self.echo = echo
+        self.messages = []      # (mittente, destinatari, testo in byte)
+        self._lock = threading.Lock()
+
+    def deliver(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append((sender, recipients, data))
+            count = len(self.messages)
+        if self.directory:
+            with open(os.path.join(self.directory, f'{time.time_ns()}-{count}.eml'), 'wb') as f:
+                f.write(data)
+        if self.echo:
+            print(f'---------- da {sender} a {", ".join(recipients)}')
+            print(data.decode('utf-8', 'replace'), flush=True)
+
+    def start(self):
+        """Serve in un thread in background (per i benchmark e le prove da script)."""
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--dir', help='Salva ogni email in un file .eml in questa cartella.')
+    parser.add_argument('--reject', nargs='*', default=(), help='Indirizzi da rifiutare.')
+    args = parser.parse_args()
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+    server = DebugSMTPServer(args.host, args.port, args.reject, args.dir, echo=True)
+    print(f'Server SMTP di prova su {args.host}:{args.port} (Ctrl+C per fermarlo)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# tests/conftest.py
+
+from datetime import datetime
+
+import pytest
+
+from app import create_app, db
+from app.database import dispose_engines
+from app.migrations import upgrade
+from app.models import Event, User
+from config import Config
+
+
+# ==============================================================================
+# FIXTURE COMUNI
+# ==============================================================================
+# Ogni test lavora su un database SQLite nuovo, in un file temporaneo (non in
+# memoria: i test di concorrenza aprono più connessioni), creato con le
+# migrazioni come in produzione. instance/app.db non viene mai toccato.
+
+PASSWORD = 'password'
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Crea app di prova, con eventuali impostazioni diverse da quelle di TestConfig."""
+    apps = []
+
+    def make(**overrides):
+        config = type('TestConfig', (Config,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+            'SQLALCHEMY_READ_DATABASE_URI': None,
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            # Hashing leggero e nel thread della richiesta
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            'PASSWORD_HASH_WORKERS': 0,
+            # Nessun worker in background: i lavori si eseguono con jobs.run_pending()
+            'JOBS_WORKERS': 0,
+            'JOBS_RETRY_DELAY': 0,
+            # Niente cache dei template compilati in instance/
+            'JINJA_CACHE_DIR': '',
+            **overrides,
+        })
+        app = create_app(config)
+        with app.app_context():
+            upgrade(db.engine)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        dispose_engines(app, db)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def ctx(app):
+    """Un contesto dell'applicazione aperto per tutta la durata del test."""
+    with app.app_context():
+        yield
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(n, cap='20121'):
+    """Crea (e salva) l'utente n, con email utente{n}@example.com."""
+    user = User(nome=f'utente{n}', email=f'utente{n}@example.com', cap=cap)
+    user.set_password(PASSWORD)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_event(creatore, max_partecipanti=4, data_ora=None, titolo='Partita di prova'):
+    """Crea (e salva) un evento con il creatore già iscritto, come fa la route create_event."""
+    event = Event(
+        titolo=titolo,
+        tipologia='Partita 2vs2',
+        data_ora=data_ora or datetime(2030, 6, 1, 18, 0),
+        luogo='Tennis Club Milano',
+        max_partecipanti=max_partecipanti,
+        livello_consigliato='Intermedio',
+        creatore=creatore,
+    )
+    event.add_partecipante(creatore)
+    creatore.num_eventi_creati = User.num_eventi_creati + 1
+    db.session.add(event)
+    db.session.commit()
+    return event
+
+
+def login(client, email):
+    return client.post('/login', data={'email': email, 'password': PASSWORD})
@@ -0,0 +1,56 @@
+# tests/test_api.py
+
+from tests.conftest import PASSWORD, make_event, make_user
+
+
+def _login(client, email, password=PASSWORD, ip=None):
+    headers = {'X-Forwarded-For': ip} if ip else {}
+    return client.post('/api/v1/login', json={'email': email, 'password': password}, headers=headers)
+
+
+def test_events_with_sparse_fields_and_etag(app, client):
+    with app.app_context():
+        event_id = make_event(make_user(0), max_partecipanti=2).id
+    assert client.get('/api/v1/events').status_code == 401
+    assert _login(client, 'utente0@example.com').status_code == 200
+
+    response = client.get('/api/v1/events?fields=id,posti_liberi')
+    assert response.get_json() == {'items': [{'id': event_id, 'posti_liberi': 1}], 'next_cursor': None}
+    assert client.get('/api/v1/events?fields=nessuno').status_code == 400
+
+    etag = response.headers['ETag']
+    assert client.get('/api/v1/events?fields=id,posti_liberi', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_join_and_leave_return_the_seat_state(app, client):
+    with app.app_context():
+        event_id = make_event(make_user(0), max_partecipanti=2).id
+        make_user(1)
+        make_user(2)
+
+    _login(client, 'utente1@example.com')
+    response = client.put(f'/api/v1/events/{event_id}/iscrizione')
+    assert response.status_code == 200
+    assert response.get_json()['posti_liberi'] == 0
+
+    client.post('/api/v1/logout')
+    _login(client, 'utente2@example.com')
+    response = client.put(f'/api/v1/events/{event_id}/iscrizione', json={'lista_attesa': False})
+    assert response.status_code == 409
+    assert response.get_json()['esito'] == 'completo'
+    response = client.delete(f'/api/v1/events/{event_id}/iscrizione')
+    assert (response.status_code, response.get_json()['esito']) == (409, 'non_iscritto')
+
+
+def test_login_ip_limit_behind_proxy_is_per_client(make_app):
+    app = make_app(TRUSTED_PROXIES=1, LOGIN_MAX_ATTEMPTS_IP=3)
+    client = app.test_client()
+    with app.app_context():
+        for n in range(5):
+            make_user(n)
+
+    # Come il form di login: il limite per IP usa l'indirizzo del client, non quello del proxy
+    for n in range(3):
+        _login(client, f'utente{n}@example.com', 'sbagliata', ip='203.0.113.1')
+    assert _login(client, 'utente3@example.com', ip='203.0.113.1').status_code == 429
+    assert _login(client, 'utente4@example.com', ip='203.0.113.2').status_code == 200
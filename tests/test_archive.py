@@ -0,0 +1,63 @@
+# tests/test_archive.py
+
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app import db
+from app.archive import archive_past_events, history_page
+from app.counters import find_drift
+from app.migrations import upgrade
+from app.models import Event, EventoArchiviato
+from tests.conftest import make_event, make_user
+
+PASSATO = datetime(2020, 6, 1, 18, 0)
+
+
+def test_archive_moves_every_past_event_and_ids_are_never_reused(ctx):
+    creatore = make_user(0)
+    old = [make_event(creatore, data_ora=PASSATO, titolo=f'Partita {n}').id for n in range(3)]
+
+    # Anche l'evento con l'id più alto va in archivio
+    assert archive_past_events(days=30, batch_size=2) == 3
+    assert Event.query.count() == 0
+    assert {e.id for e in EventoArchiviato.query} == set(old)
+    assert not any(find_drift().values())
+
+    # Un evento nuovo non riprende l'id di uno archiviato...
+    nuovo = make_event(creatore).id
+    assert nuovo > max(old)
+    # ...né quello di uno cancellato
+    db.session.delete(db.session.get(Event, nuovo))
+    db.session.commit()
+    assert make_event(creatore).id > nuovo
+
+    assert [e.id for e in history_page(creatore.id).items] == sorted(old, reverse=True)
+
+
+def test_migration_rebuilds_an_existing_event_table(ctx, tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'vecchio.db'))
+    try:
+        upgrade(engine, target=7)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO user (id, nome, email, cap) VALUES (1, 'utente0', 'utente0@example.com', '20121')")
+            conn.exec_driver_sql(
+                "INSERT INTO event (id, titolo, tipologia, data_ora, luogo, max_partecipanti, "
+                "livello_consigliato, user_id) VALUES (5, 'Partita', 'Partita 2vs2', '2030-06-01 18:00:00', "
+                "'Tennis Club Milano', 4, 'Intermedio', 1)")
+            conn.exec_driver_sql('INSERT INTO partecipanti (user_id, event_id) VALUES (1, 5)')
+            indexes = set(conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'event'").scalars())
+
+        upgrade(engine)
+        with engine.begin() as conn:
+            create = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'event'").scalar()
+            assert 'AUTOINCREMENT' in create
+            assert conn.exec_driver_sql('SELECT id, titolo FROM event').all() == [(5, 'Partita')]
+            assert conn.exec_driver_sql('SELECT event_id FROM partecipanti').scalars().all() == [5]
+            assert indexes <= set(conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'event'").scalars())
+            assert conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'event'").scalar() == 5
+    finally:
+        engine.dispose()
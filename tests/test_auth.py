@@ -0,0 +1,77 @@
+# tests/test_auth.py
+
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models import User
+from tests.conftest import PASSWORD, make_user
+
+
+def _login(client, email, password=PASSWORD, ip=None):
+    headers = {'X-Forwarded-For': ip} if ip else {}
+    return client.post('/login', data={'email': email, 'password': password}, headers=headers)
+
+
+def _users(app, count):
+    with app.app_context():
+        for n in range(count):
+            make_user(n)
+
+
+def test_login_and_logout(app, client):
+    _users(app, 1)
+
+    assert _login(client, 'utente0@example.com', 'sbagliata').headers['Location'].endswith('/login')
+    response = _login(client, 'utente0@example.com')
+    assert response.status_code == 302 and not response.headers['Location'].endswith('/login')
+    assert client.get('/account').status_code == 200
+    client.get('/logout')
+    assert client.get('/account').status_code == 302
+
+
+def test_account_is_locked_after_too_many_failures(make_app):
+    app = make_app(LOGIN_MAX_ATTEMPTS_ACCOUNT=3)
+    client = app.test_client()
+    _users(app, 1)
+
+    for _ in range(3):
+        assert _login(client, 'utente0@example.com', 'sbagliata').status_code == 302
+    # Anche con la password giusta: 429, senza calcolare l'hash
+    response = _login(client, 'utente0@example.com')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_rehash_on_login_with_old_parameters(app, client):
+    _users(app, 1)
+    with app.app_context():
+        User.query.one().password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:2000')
+        db.session.commit()
+
+    assert _login(client, 'utente0@example.com').status_code == 302
+    with app.app_context():
+        assert User.query.one().password_hash.startswith('pbkdf2:sha256:1000$')
+
+
+def test_ip_limit_behind_proxy_is_per_client(make_app):
+    app = make_app(TRUSTED_PROXIES=1, LOGIN_MAX_ATTEMPTS_IP=3)
+    client = app.test_client()
+    _users(app, 5)
+
+    # Un client sbaglia tre volte (account diversi): il suo IP è bloccato...
+    for n in range(3):
+        _login(client, f'utente{n}@example.com', 'sbagliata', ip='203.0.113.1')
+    assert _login(client, 'utente3@example.com', ip='203.0.113.1').status_code == 429
+    # ...ma non gli altri client dietro lo stesso proxy
+    assert _login(client, 'utente4@example.com', ip='203.0.113.2').status_code == 302
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(make_app):
+    app = make_app(LOGIN_MAX_ATTEMPTS_IP=3)
+    client = app.test_client()
+    _users(app, 5)
+
+    # Senza TRUSTED_PROXIES l'header si può falsificare: non lo usiamo
+    for n in range(3):
+        _login(client, f'utente{n}@example.com', 'sbagliata', ip=f'203.0.113.{n}')
+    assert _login(client, 'utente4@example.com', ip='203.0.113.9').status_code == 429
@@ -0,0 +1,69 @@
+# tests/test_bulk.py
+
+import json
+from datetime import datetime
+
+from app import db
+from app.archive import archive_past_events
+from app.bulk import EnrollmentImporter, EventImporter, import_file
+from app.counters import find_drift
+from app.models import Event, EventoArchiviato, User
+from tests.conftest import make_event, make_user
+
+
+def _write_ndjson(path, rows):
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows), encoding='utf-8')
+    return str(path)
+
+
+def test_enrollment_import_updates_counters_and_user_cache(app, ctx, tmp_path):
+    event = make_event(make_user(0), max_partecipanti=2)
+    user = make_user(1)
+    cache = app.extensions['user_cache']
+    cache.put(user.id, {'id': user.id, 'num_eventi_iscritti': 0})
+
+    rejected = []
+    path = _write_ndjson(tmp_path / 'iscrizioni.ndjson', [
+        {'email': 'utente1@example.com', 'event_id': event.id},
+        {'email': 'utente1@example.com', 'event_id': event.id},
+        {'email': 'nessuno@example.com', 'event_id': event.id},
+    ])
+    stats = import_file('partecipanti', path, 'ndjson', EnrollmentImporter(),
+                        on_reject=lambda line, row, errors: rejected.append((line, errors)))
+
+    assert (stats.imported, stats.rejected) == (1, 2)
+    assert [line for line, _ in rejected] == [2, 3]
+    db.session.expire_all()
+    assert db.session.get(Event, event.id).num_iscritti == 2
+    assert db.session.get(User, user.id).num_eventi_iscritti == 1
+    assert not any(find_drift().values())
+    # Il contatore in cache non è più quello di prima dell'import
+    assert cache.get(user.id) is None
+
+
+def _event_row(event_id, titolo):
+    return {'id': event_id, 'titolo': titolo, 'tipologia': 'Partita 2vs2', 'data_ora': '2030-06-01T18:00',
+            'luogo': 'Tennis Club Milano', 'max_partecipanti': 4, 'livello_consigliato': 'Intermedio',
+            'creatore_email': 'utente0@example.com'}
+
+
+def test_event_import_rejects_ids_of_live_and_archived_events(ctx, tmp_path):
+    creatore = make_user(0)
+    archiviato = make_event(creatore, data_ora=datetime(2020, 6, 1, 18, 0)).id
+    archive_past_events(days=30)
+    attivo = make_event(creatore).id
+
+    rejected = []
+    path = _write_ndjson(tmp_path / 'eventi.ndjson', [
+        _event_row(archiviato, 'Stesso id di un evento archiviato'),
+        _event_row(attivo, 'Stesso id di un evento attivo'),
+        _event_row(attivo + 100, 'Id libero'),
+    ])
+    stats = import_file('eventi', path, 'ndjson', EventImporter(),
+                        on_reject=lambda line, row, errors: rejected.append((line, list(errors))))
+
+    assert (stats.imported, stats.rejected) == (1, 2)
+    assert rejected == [(1, ['id']), (2, ['id'])]
+    assert db.session.get(EventoArchiviato, archiviato).titolo == 'Partita di prova'
+    assert db.session.get(Event, attivo + 100).titolo == 'Id libero'
+    assert not any(find_drift().values())
@@ -0,0 +1,59 @@
+# tests/test_cache.py
+
+from app.cache import FileBackend, MemoryBackend
+from tests.conftest import login, make_event, make_user
+
+
+def test_memory_version_does_not_restart_from_the_same_value():
+    # Due processi (o due avvii dello stesso) partono da versioni diverse
+    first, second = MemoryBackend(10, 60), MemoryBackend(10, 60)
+    assert first.get_version() != second.get_version()
+
+    version = first.get_version()
+    first.bump_version()
+    assert first.get_version() == version + 1
+
+
+def test_file_version_starts_at_random_and_is_shared(tmp_path):
+    worker, other = FileBackend(str(tmp_path), 10, 60), FileBackend(str(tmp_path), 10, 60)
+    version = worker.get_version()
+    assert version == other.get_version() != 0
+
+    other.bump_version()
+    assert worker.get_version() == version + 1
+
+    # Cartella svuotata: si riparte da un valore nuovo, non da 0
+    (tmp_path / 'VERSION').unlink()
+    assert worker.get_version() not in (0, version + 1)
+
+
+def test_etag_is_different_after_a_restart(make_app):
+    with make_app().app_context():
+        make_user(0)
+
+    # Stessi dati, stesso utente, due avvii: gli ETag non devono coincidere
+    etags = []
+    for _ in range(2):
+        client = make_app().test_client()
+        login(client, 'utente0@example.com')
+        client.get('/')     # consuma il messaggio flash del login
+        etags.append(client.get('/').headers['ETag'])
+    assert etags[0] != etags[1]
+
+
+def test_matching_etag_gets_304_until_data_changes(app, client):
+    with app.app_context():
+        creatore = make_user(0)
+        make_event(creatore)
+    login(client, 'utente0@example.com')
+    client.get('/')     # consuma il messaggio flash del login
+
+    etag = client.get('/events').headers['ETag']
+    response = client.get('/events', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    with app.app_context():
+        make_event(make_user(1), titolo='Partita nuova')
+    response = client.get('/events', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Partita nuova' in response.get_data(as_text=True)
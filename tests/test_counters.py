@@ -0,0 +1,103 @@
+# tests/test_counters.py
+
+from sqlalchemy import func, select
+
+from app import db
+from app.counters import find_drift, repair_drift
+from app.models import Event, User, lista_attesa, partecipanti
+from tests.conftest import login, make_event, make_user
+
+
+def _assert_no_drift():
+    drift = find_drift()
+    assert not any(drift.values()), drift
+
+
+def _enrolled(event_id):
+    return set(db.session.execute(
+        select(partecipanti.c.user_id).where(partecipanti.c.event_id == event_id)).scalars())
+
+
+def _waiting(event_id):
+    return db.session.execute(
+        select(lista_attesa.c.user_id).where(lista_attesa.c.event_id == event_id)
+        .order_by(lista_attesa.c.id)).scalars().all()
+
+
+def _switch_user(client, n):
+    client.get('/logout')
+    login(client, f'utente{n}@example.com')
+
+
+def test_counters_stay_in_sync_through_routes(app, client):
+    with app.app_context():
+        creatore_id, *giocatori = (make_user(n).id for n in range(5))
+
+    login(client, 'utente0@example.com')
+    response = client.post('/create_event', data={
+        'titolo': 'Doppio del giovedì', 'tipologia': 'Partita 2vs2', 'descrizione': '',
+        'data_ora': '2030-06-05T19:00', 'durata': '90', 'luogo': 'Tennis Club Milano',
+        'cap': '', 'max_partecipanti': '3', 'livello_consigliato': 'Intermedio'})
+    assert response.status_code == 302
+    with app.app_context():
+        event_id = db.session.execute(select(Event.id).where(Event.user_id == creatore_id)).scalar_one()
+        _assert_no_drift()
+
+    # Due entrano, due restano in lista d'attesa
+    for n in range(1, 5):
+        _switch_user(client, n)
+        assert client.post(f'/join_event/{event_id}').status_code == 302
+    with app.app_context():
+        assert db.session.get(Event, event_id).num_iscritti == 3
+        assert _enrolled(event_id) == {creatore_id, giocatori[0], giocatori[1]}
+        assert _waiting(event_id) == [giocatori[2], giocatori[3]]
+        _assert_no_drift()
+
+    # Rally in entrambe le direzioni, poi uno si interrompe
+    _switch_user(client, 1)
+    assert client.post('/rally/utente0').status_code == 302
+    assert client.post('/rally/utente2').status_code == 302
+    _switch_user(client, 0)
+    assert client.post('/rally/utente1').status_code == 302
+    assert client.post('/unrally/utente1').status_code == 302
+    with app.app_context():
+        assert db.session.get(User, creatore_id).num_followers == 1
+        assert db.session.get(User, giocatori[0]).num_followed == 2
+        _assert_no_drift()
+
+    # Un iscritto esce: entra il primo della lista d'attesa
+    _switch_user(client, 1)
+    assert client.post(f'/leave_event/{event_id}').status_code == 302
+    with app.app_context():
+        assert db.session.get(Event, event_id).num_iscritti == 3
+        assert _enrolled(event_id) == {creatore_id, giocatori[1], giocatori[2]}
+        assert _waiting(event_id) == [giocatori[3]]
+        _assert_no_drift()
+
+    # Il creatore elimina l'evento: scendono i contatori di tutti gli iscritti,
+    # nessuno viene promosso e la lista d'attesa sparisce
+    _switch_user(client, 0)
+    assert client.post(f'/delete_event/{event_id}').status_code == 302
+    with app.app_context():
+        assert db.session.get(Event, event_id) is None
+        assert db.session.execute(select(func.count()).select_from(partecipanti)).scalar() == 0
+        assert db.session.execute(select(func.count()).select_from(lista_attesa)).scalar() == 0
+        assert db.session.get(User, creatore_id).num_eventi_creati == 0
+        assert all(u.num_eventi_iscritti == 0 for u in User.query)
+        _assert_no_drift()
+
+
+def test_repair_fixes_only_the_rows_out_of_sync(ctx):
+    creatore = make_user(0)
+    event, *_ = (make_event(creatore, titolo=f'Partita {n}') for n in range(3))
+    db.session.execute(User.__table__.update().values(num_eventi_creati=7))
+    db.session.execute(Event.__table__.update().where(Event.id == event.id).values(num_iscritti=0))
+    db.session.commit()
+
+    assert find_drift() == {'event.num_iscritti': 1, 'user.num_eventi_creati': 1, 'user.num_eventi_iscritti': 0,
+                            'user.num_followers': 0, 'user.num_followed': 0}
+    assert repair_drift()['user.num_eventi_creati'] == 1
+    _assert_no_drift()
+    db.session.expire_all()
+    assert creatore.num_eventi_creati == 3
+    assert event.num_iscritti == 1
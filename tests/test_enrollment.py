@@ -0,0 +1,146 @@
+# tests/test_enrollment.py
+
+import threading
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from app import db, enrollment
+from app.counters import find_drift
+from app.models import Event, lista_attesa, partecipanti
+from tests.conftest import make_event, make_user
+
+
+def _waiting(event_id):
+    """Utenti in lista d'attesa, nell'ordine in cui verranno promossi."""
+    return db.session.execute(
+        select(lista_attesa.c.user_id).where(lista_attesa.c.event_id == event_id)
+        .order_by(lista_attesa.c.id)).scalars().all()
+
+
+def _enrolled(event_id):
+    return set(db.session.execute(
+        select(partecipanti.c.user_id).where(partecipanti.c.event_id == event_id)).scalars())
+
+
+def _assert_no_drift():
+    drift = find_drift()
+    assert not any(drift.values()), drift
+
+
+# ==============================================================================
+# ISCRIZIONI CONTEMPORANEE
+# ==============================================================================
+
+def test_concurrent_joins_never_overbook(app, ctx):
+    creatore = make_user(0)
+    event = make_event(creatore, max_partecipanti=4)
+    event_id, user_ids = event.id, [make_user(n).id for n in range(1, 13)]
+
+    # Tutti i thread partono insieme, ognuno con la sua sessione e la sua connessione
+    start = threading.Barrier(len(user_ids))
+    results, errors = {}, []
+
+    def join(user_id):
+        with app.app_context():
+            try:
+                start.wait()
+                results[user_id] = enrollment.join_event(event_id, user_id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=join, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    joined = [u for u, esito in results.items() if esito == enrollment.ISCRITTO]
+    waiting = [u for u, esito in results.items() if esito == enrollment.IN_ATTESA]
+    # Il creatore occupa già un posto: ne restano 3
+    assert len(joined) == 3
+    assert len(waiting) == len(user_ids) - 3
+
+    db.session.expire_all()
+    event = db.session.get(Event, event_id)
+    assert event.num_iscritti == event.max_partecipanti == 4
+    assert _enrolled(event_id) == {creatore.id, *joined}
+    assert sorted(_waiting(event_id)) == sorted(waiting)
+    _assert_no_drift()
+
+
+def test_join_twice_is_idempotent(ctx):
+    event = make_event(make_user(0), max_partecipanti=3)
+    user = make_user(1)
+
+    assert enrollment.join_event(event.id, user.id) == enrollment.ISCRITTO
+    assert enrollment.join_event(event.id, user.id) == enrollment.GIA_ISCRITTO
+    db.session.expire_all()
+    assert event.num_iscritti == 2
+    assert user.num_eventi_iscritti == 1
+
+
+# ==============================================================================
+# LISTA D'ATTESA
+# ==============================================================================
+
+def test_waitlist_promotes_in_arrival_order(ctx):
+    creatore = make_user(0)
+    event = make_event(creatore, max_partecipanti=2)
+    primo, secondo, terzo, quarto = (make_user(n) for n in range(1, 5))
+
+    assert enrollment.join_event(event.id, primo.id) == enrollment.ISCRITTO
+    for user in (secondo, terzo, quarto):
+        assert enrollment.join_event(event.id, user.id) == enrollment.IN_ATTESA
+    assert enrollment.join_event(event.id, terzo.id) == enrollment.GIA_IN_ATTESA
+    assert enrollment.join_event(event.id, quarto.id, waitlist=False) == enrollment.COMPLETO
+    assert enrollment.waitlist_positions([event.id], quarto.id) == {event.id: 3}
+
+    # Esce un iscritto: entra il primo arrivato in lista, gli altri avanzano
+    assert enrollment.leave_event(event.id, primo.id) == (True, [secondo.id])
+    assert _waiting(event.id) == [terzo.id, quarto.id]
+    assert enrollment.waitlist_positions([event.id], quarto.id) == {event.id: 2}
+
+    # Chi esce dalla lista d'attesa non viene più promosso
+    assert enrollment.leave_waitlist(event.id, terzo.id)
+    assert enrollment.leave_event(event.id, secondo.id) == (True, [quarto.id])
+    assert _waiting(event.id) == []
+    assert _enrolled(event.id) == {creatore.id, quarto.id}
+
+    db.session.expire_all()
+    assert event.num_iscritti == 2
+    _assert_no_drift()
+
+
+def test_join_rejects_overlapping_event(ctx):
+    event = make_event(make_user(0))
+    altro = make_event(make_user(1), data_ora=event.data_ora + timedelta(minutes=30), titolo='Altra partita')
+    dopo = make_event(make_user(2), data_ora=event.fine, titolo='Partita dopo')
+    user = make_user(3)
+
+    assert enrollment.join_event(event.id, user.id) == enrollment.ISCRITTO
+    assert enrollment.join_event(altro.id, user.id) == enrollment.SOVRAPPOSTO
+    # Un evento che inizia quando finisce l'altro non si sovrappone
+    assert enrollment.join_event(dopo.id, user.id) == enrollment.ISCRITTO
+    assert _waiting(altro.id) == []
+    _assert_no_drift()
+
+
+def test_leave_skips_waiting_user_with_overlapping_event(ctx):
+    event = make_event(make_user(0), max_partecipanti=2)
+    primo, occupato, libero = (make_user(n) for n in range(1, 4))
+    enrollment.join_event(event.id, primo.id)
+    enrollment.join_event(event.id, occupato.id)
+    enrollment.join_event(event.id, libero.id)
+
+    # Nel frattempo 'occupato' si iscrive a un altro evento alla stessa ora
+    altro = make_event(make_user(4), data_ora=event.data_ora, titolo='Altra partita')
+    assert enrollment.join_event(altro.id, occupato.id) == enrollment.ISCRITTO
+
+    assert enrollment.leave_event(event.id, primo.id) == (True, [libero.id])
+    # Resta in lista: se si libera dall'altro evento potrà ancora entrare
+    assert _waiting(event.id) == [occupato.id]
+    _assert_no_drift()
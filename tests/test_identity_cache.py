@@ -0,0 +1,92 @@
+# tests/test_identity_cache.py
+
+import re
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+from app import db, enrollment
+from app.models import User
+from tests.conftest import login, make_event, make_user
+
+# SELECT sulla tabella degli utenti: load_user o il caricamento di una colonna
+USER_SELECT = re.compile(r'^\s*SELECT\b.*\bFROM user\b', re.S)
+
+
+@contextmanager
+def user_selects():
+    """Raccoglie le SELECT sulla tabella 'user' eseguite nel blocco (da qualsiasi engine)."""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if USER_SELECT.match(statement):
+            seen.append(statement)
+
+    sa.event.listen(sa.engine.Engine, 'before_cursor_execute', record)
+    try:
+        yield seen
+    finally:
+        sa.event.remove(sa.engine.Engine, 'before_cursor_execute', record)
+
+
+def test_cached_hit_on_index_runs_no_user_select(app, client):
+    with app.app_context():
+        make_event(make_user(0))
+    login(client, 'utente0@example.com')
+    assert client.get('/').status_code == 200
+
+    # Utente in cache: né load_user né i contatori della bacheca leggono la tabella
+    with user_selects() as seen:
+        assert client.get('/').status_code == 200
+        assert client.get('/account').status_code == 200
+    assert seen == []
+    assert app.extensions['user_cache'].stats()['hits'] >= 2
+
+
+def test_counters_in_cache_follow_joins_and_leaves(app, client):
+    with app.app_context():
+        event_id = make_event(make_user(0)).id
+        user_id = make_user(1).id
+    login(client, 'utente1@example.com')
+    client.get('/')
+
+    client.post(f'/join_event/{event_id}')
+    assert app.extensions['user_cache'].get(user_id) is None
+    client.get('/')
+    assert app.extensions['user_cache'].get(user_id)['num_eventi_iscritti'] == 1
+
+    client.post(f'/leave_event/{event_id}')
+    client.get('/')
+    assert app.extensions['user_cache'].get(user_id)['num_eventi_iscritti'] == 0
+
+
+def test_direct_counter_updates_invalidate_the_entry(app, ctx):
+    creatore = make_user(0)
+    event = make_event(creatore, max_partecipanti=2)
+    user = make_user(1)
+    cache = app.extensions['user_cache']
+    for u in (creatore, user):
+        cache.put(u.id, {'id': u.id})
+
+    # Iscrizione (UPDATE diretto del contatore) e cancellazione dell'evento
+    enrollment.join_event(event.id, user.id)
+    assert cache.get(user.id) is None
+    cache.put(user.id, {'id': user.id})
+
+    from app.counters import release_event_counters
+    release_event_counters(event)
+    db.session.rollback()
+    assert cache.get(creatore.id) is None
+    assert cache.get(user.id) is None
+
+
+def test_profile_changes_invalidate_the_entry(app, client):
+    with app.app_context():
+        user_id = make_user(0).id
+    login(client, 'utente0@example.com')
+    client.get('/')
+
+    client.post('/account', data={'nome': 'Roger', 'cognome': 'Federer', 'data_di_nascita': ''})
+    with app.app_context():
+        assert db.session.get(User, user_id).nome == 'Roger'
+    assert 'Roger' in client.get('/account').get_data(as_text=True)
@@ -0,0 +1,27 @@
+# tests/test_instrumentation.py
+
+from tests.conftest import make_user
+
+
+def test_metrics_without_token_is_disabled_even_from_localhost(client):
+    # Dietro un proxy sulla stessa macchina tutte le richieste vengono da 127.0.0.1
+    response = client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert response.status_code == 404
+
+
+def test_metrics_requires_the_token(make_app):
+    app = make_app(METRICS_TOKEN='s3')
+    client = app.test_client()
+    with app.app_context():
+        make_user(0)
+    client.get('/login')
+
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer altro'}).status_code == 404
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3'})
+    assert response.status_code == 200
+    assert 'main.login' in response.get_data(as_text=True)
+
+
+def test_responses_have_server_timing(client):
+    assert 'total;dur=' in client.get('/login').headers['Server-Timing']
@@ -0,0 +1,111 @@
+# tests/test_jobs.py
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, jobs
+from app.models import Job
+
+
+@pytest.fixture
+def flaky(ctx):
+    """Un tipo di lavoro che fallisce la prima volta e riesce dalla seconda."""
+    calls, done = [], []
+
+    @jobs.job_handler('test-instabile')
+    def handler(payloads):
+        calls.append(payloads)
+        if len(calls) == 1:
+            raise RuntimeError('servizio non raggiungibile')
+        done.extend(p['n'] for p in payloads)
+
+    yield calls, done
+    jobs._HANDLERS.pop('test-instabile', None)
+
+
+def _job(chiave):
+    db.session.expire_all()
+    return Job.query.filter_by(chiave=chiave).one()
+
+
+def test_failed_job_is_retried_and_runs_once(app, flaky):
+    calls, done = flaky
+    jobs.enqueue('test-instabile', {'n': 1}, chiave='instabile:1')
+    db.session.commit()
+
+    # Primo tentativo: fallisce e torna in coda, con l'errore
+    # (JOBS_RETRY_DELAY è 0: un gruppo alla volta, altrimenti riprova subito)
+    assert jobs.run_pending(max_batches=1) == 1
+    job = _job('instabile:1')
+    assert (job.stato, job.tentativi) == (Job.IN_CODA, 1)
+    assert 'servizio non raggiungibile' in job.errore
+    assert done == []
+
+    # Secondo tentativo: riesce
+    assert jobs.run_pending(max_batches=1) == 1
+    job = _job('instabile:1')
+    assert (job.stato, job.tentativi, job.errore) == (Job.FATTO, 2, None)
+    assert done == [1]
+
+    # Niente altro da fare: il lavoro riuscito non viene più eseguito
+    assert jobs.run_pending() == 0
+    assert len(calls) == 2
+    assert done == [1]
+
+
+def test_retry_waits_for_the_delay(app, flaky):
+    app.config['JOBS_RETRY_DELAY'] = 60
+    calls, done = flaky
+    jobs.enqueue('test-instabile', {'n': 1})
+    db.session.commit()
+
+    assert jobs.run_pending() == 1
+    job = Job.query.one()
+    assert job.stato == Job.IN_CODA
+    assert job.eseguire_dopo > datetime.utcnow() + timedelta(seconds=25)
+    # Prima dell'attesa non si riprova
+    assert jobs.run_pending() == 0
+
+    job.eseguire_dopo = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert jobs.run_pending() == 1
+    assert _job(None).stato == Job.FATTO
+    assert done == [1]
+
+
+def test_job_fails_after_max_attempts(app, ctx):
+    app.config['JOBS_MAX_ATTEMPTS'] = 2
+
+    @jobs.job_handler('test-rotto')
+    def handler(payloads):
+        raise RuntimeError('sempre rotto')
+
+    try:
+        jobs.enqueue('test-rotto', {}, chiave='rotto')
+        db.session.commit()
+        assert jobs.run_pending() == 2
+        job = _job('rotto')
+        assert (job.stato, job.tentativi) == (Job.FALLITO, 2)
+
+        # retry_failed lo rimette in coda da capo
+        assert jobs.retry_failed('test-rotto') == 1
+        assert _job('rotto').stato == Job.IN_CODA
+    finally:
+        jobs._HANDLERS.pop('test-rotto', None)
+
+
+def test_enqueue_with_same_key_is_ignored(app, flaky):
+    calls, done = flaky
+    for _ in range(3):
+        jobs.enqueue('test-instabile', {'n': 7}, chiave='instabile:7')
+        db.session.commit()
+    assert Job.query.count() == 1
+
+    jobs.run_pending()
+    jobs.run_pending()
+    # Anche dopo l'esecuzione la chiave resta: riaccodare non lo ripete
+    jobs.enqueue('test-instabile', {'n': 7}, chiave='instabile:7')
+    db.session.commit()
+    assert jobs.run_pending() == 0
+    assert done == [7]
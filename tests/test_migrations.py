@@ -0,0 +1,26 @@
+# tests/test_migrations.py
+
+import sqlalchemy as sa
+
+from app import db
+from app.migrations import MIGRATIONS, applied_versions, pending, schema_drift, upgrade
+
+VERSIONS = [version for version, *_ in MIGRATIONS]
+
+
+def test_migrations_build_the_schema_of_the_models(ctx):
+    assert sorted(applied_versions(db.engine)) == VERSIONS
+    assert pending(db.engine) == []
+    assert schema_drift(db.engine, db.metadata) == []
+
+
+def test_upgrade_on_a_database_made_with_create_all(ctx, tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'vecchio.db'))
+    try:
+        db.metadata.create_all(engine)
+        # Database senza storico: tutte le migrazioni passano senza errori, una volta sola
+        assert upgrade(engine) == VERSIONS
+        assert upgrade(engine) == []
+        assert schema_drift(engine, db.metadata) == []
+    finally:
+        engine.dispose()
@@ -0,0 +1,106 @@
+# tests/test_pagination.py
+
+import re
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Event
+from app.pagination import decode_cursor, paginate_keyset
+from tests.conftest import login, make_event, make_user
+
+ORE_18 = datetime(2030, 6, 1, 18, 0)
+ORE_20 = datetime(2030, 6, 1, 20, 0)
+ORARI = [ORE_20, ORE_18, ORE_20, ORE_18, ORE_18, ORE_20, ORE_18, ORE_18, ORE_20, ORE_18, ORE_18]
+
+
+@pytest.fixture
+def events(ctx):
+    """11 eventi, quasi tutti alla stessa ora: le pagine si chiudono in mezzo ai pari merito."""
+    creatore = make_user(0)
+    made = [make_event(creatore, data_ora=data_ora, titolo=f'Partita {n:02}') for n, data_ora in enumerate(ORARI)]
+    return sorted(((e.data_ora, e.id) for e in made))
+
+
+def _page(cursor=None, per_page=3, descending=False):
+    return paginate_keyset(Event.query, [Event.data_ora, Event.id], cursor=cursor,
+                           per_page=per_page, descending=descending)
+
+
+def _pages(descending=False, per_page=3):
+    """Scorre tutte le pagine in avanti; restituisce la lista delle pagine."""
+    pages = [_page(per_page=per_page, descending=descending)]
+    while pages[-1].has_next:
+        pages.append(_page(pages[-1].next_cursor, per_page, descending))
+    return pages
+
+
+def _keys(page):
+    return [(e.data_ora, e.id) for e in page]
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_cover_every_row_once_with_ties(events, descending):
+    pages = _pages(descending)
+    expected = events[::-1] if descending else events
+
+    assert [len(page) for page in pages] == [3, 3, 3, 2]
+    assert [key for page in pages for key in _keys(page)] == expected
+    assert not pages[0].has_prev
+    assert all(page.has_prev for page in pages[1:])
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_prev_cursor_returns_the_same_pages(events, descending):
+    pages = _pages(descending)
+
+    # Tornando indietro dall'ultima pagina ritroviamo le stesse pagine, nello stesso ordine
+    cursor = pages[-1].prev_cursor
+    for expected in reversed(pages[:-1]):
+        page = _page(cursor, descending=descending)
+        assert _keys(page) == _keys(expected)
+        assert page.has_next
+        cursor = page.prev_cursor
+    assert cursor is None
+
+
+def test_cursor_survives_new_rows_with_the_same_key(events):
+    first = _page()
+    # Un evento nuovo alla stessa ora dei primi: ha un id più alto, va dopo i pari merito già visti
+    nuovo = make_event(db.session.get(Event, events[0][1]).creatore, data_ora=ORE_18).id
+
+    seen = _keys(first)
+    page = first
+    while page.has_next:
+        page = _page(page.next_cursor)
+        seen += _keys(page)
+    assert len(seen) == len(set(seen)) == len(events) + 1
+    assert (ORE_18, nuovo) in seen
+
+
+def test_invalid_cursor_starts_from_the_first_page(events):
+    first = _page()
+    tampered = first.next_cursor[:-2] + ('AA' if not first.next_cursor.endswith('AA') else 'BB')
+
+    assert decode_cursor(tampered) is None
+    assert _keys(_page(tampered)) == _keys(first)
+
+
+def test_events_page_loads_more_cards(app, client, events):
+    app.config['EVENTS_PER_PAGE'] = 4
+    login(client, 'utente0@example.com')
+
+    html = client.get('/events').get_data(as_text=True)
+    titles = re.findall(r'Partita \d\d', html)
+    assert len(titles) == 4
+    cursor = re.search(r'id="load-more" data-cursor="([^"]+)"', html).group(1)
+    # Lo script della pagina (Select2 e "Carica altri") deve essere JavaScript valido
+    script = html[html.rindex('<script>'):html.rindex('</script>')]
+    assert script.count('{') == script.count('}') and script.count('(') == script.count(')')
+
+    # "Carica altri" riceve solo le card della pagina successiva
+    html = client.post('/events', data={'cursor': cursor, 'partial': '1'}).get_data(as_text=True)
+    more = re.findall(r'Partita \d\d', html)
+    assert len(more) == 4
+    assert not set(titles) & set(more)